@@ -19,6 +19,7 @@
 import argparse
 import logging
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 
 import torch
@@ -28,6 +29,8 @@ from lhotse import (
     KaldifeatFbankConfig,
 )
 
+from icefall.feature_extraction import FeatureShard, compute_features_for_shards
+
 # Torch's multithreaded behavior needs to be disabled or
 # it wastes a lot of CPU and slow things down.
 # Do this outside of main() in case it needs to take effect
@@ -99,37 +102,31 @@ def compute_fbank_gigaspeech_splits(args):
     extractor = KaldifeatFbank(KaldifeatFbankConfig(device=device))
     logging.info(f"device: {device}")
 
+    shards = []
     for i in range(start, stop):
         idx = f"{i + 1}".zfill(num_digits)
-        logging.info(f"Processing {idx}/{num_splits}")
-
-        cuts_path = output_dir / f"cuts_XL.{idx}.jsonl.gz"
-        if cuts_path.is_file():
-            logging.info(f"{cuts_path} exists - skipping")
-            continue
-
         raw_cuts_path = output_dir / f"cuts_XL_raw.{idx}.jsonl.gz"
-
-        logging.info(f"Loading {raw_cuts_path}")
-        cut_set = CutSet.from_file(raw_cuts_path)
-
-        logging.info("Computing features")
-
-        cut_set = cut_set.compute_and_store_features_batch(
-            extractor=extractor,
-            storage_path=f"{output_dir}/feats_XL_{idx}",
-            num_workers=args.num_workers,
-            batch_duration=args.batch_duration,
-        )
-
-        logging.info("About to split cuts into smaller chunks.")
-        cut_set = cut_set.trim_to_supervisions(
-            keep_overlapping=False, min_duration=None
+        shards.append(
+            FeatureShard(
+                cuts=raw_cuts_path,
+                manifest_path=output_dir / f"cuts_XL.{idx}.jsonl.gz",
+                storage_path=output_dir / f"feats_XL_{idx}",
+            )
         )
 
-        logging.info(f"Saving to {cuts_path}")
-        cut_set.to_file(cuts_path)
-        logging.info(f"Saved to {cuts_path}")
+    # The progress file is shared by jobs processing different pieces
+    compute_features_for_shards(
+        shards,
+        extractor=extractor,
+        progress_path=output_dir / "progress.jsonl",
+        batch_duration=args.batch_duration,
+        num_workers=args.num_workers,
+        post_process=partial(
+            CutSet.trim_to_supervisions,
+            keep_overlapping=False,
+            min_duration=None,
+        ),
+    )
 
 
 def main():
@@ -28,6 +28,8 @@ from lhotse import (
 )
 from lhotse.recipes.utils import read_manifests_if_cached
 
+from icefall.feature_extraction import compute_and_store_features
+
 # Torch's multithreaded behavior needs to be disabled or
 # it wastes a lot of CPU and slow things down.
 # Do this outside of main() in case it needs to take effect
@@ -80,14 +82,15 @@ def compute_fbank_musan():
         )
         .cut_into_windows(10.0)
         .filter(lambda c: c.duration > 5)
-        .compute_and_store_features_batch(
-            extractor=extractor,
-            storage_path=f"{output_dir}/feats_musan",
-            num_workers=num_workers,
-            batch_duration=batch_duration,
-        )
     )
-    musan_cuts.to_json(musan_cuts_path)
+    compute_and_store_features(
+        musan_cuts,
+        extractor=extractor,
+        storage_dir=output_dir / "feats_musan",
+        manifest_path=musan_cuts_path,
+        batch_duration=batch_duration,
+        num_workers=num_workers,
+    )
 
 
 def main():
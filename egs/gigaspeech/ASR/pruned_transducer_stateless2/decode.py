@@ -68,6 +68,7 @@ import torch
 import torch.nn as nn
 from asr_datamodule import GigaSpeechAsrDataModule
 from beam_search import (
+    DecoderOutCache,
     beam_search,
     fast_beam_search_one_best,
     greedy_search,
@@ -199,6 +200,16 @@ def get_parser():
         Used only when --decoding_method is greedy_search""",
     )
 
+    parser.add_argument(
+        "--decoder-cache-size",
+        type=int,
+        default=10000,
+        help="""Maximum number of decoder contexts whose projected decoder
+        outputs are cached across batches. Used only when --decoding-method
+        is greedy_search, modified_beam_search or fast_beam_search.
+        """,
+    )
+
     return parser
 
 
@@ -534,6 +545,7 @@ def main():
 
     model.to(device)
     model.eval()
+    model.decoder_cache = DecoderOutCache(max_size=params.decoder_cache_size)
     model.device = device
 
     if params.decoding_method == "fast_beam_search":
@@ -570,6 +582,8 @@ def main():
             results_dict=results_dict,
         )
 
+    logging.info(f"Decoder cache: {model.decoder_cache}")
+
     logging.info("Done!")
 
 
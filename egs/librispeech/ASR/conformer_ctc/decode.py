@@ -18,9 +18,13 @@
 
 import argparse
 import logging
-from collections import defaultdict
+import multiprocessing
+import os
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import k2
 import sentencepiece as spm
@@ -30,8 +34,13 @@ from asr_datamodule import LibriSpeechAsrDataModule
 from conformer import Conformer
 
 from icefall.bpe_graph_compiler import BpeCtcTrainingGraphCompiler
-from icefall.checkpoint import average_checkpoints, load_checkpoint
+from icefall.checkpoint import (
+    average_checkpoints,
+    average_epoch_checkpoints,
+    load_checkpoint,
+)
 from icefall.decode import (
+    WholeLatticeRescoringStats,
     get_lattice,
     nbest_decoding,
     nbest_oracle,
@@ -47,6 +56,7 @@ from icefall.utils import (
     get_texts,
     setup_logger,
     store_transcripts,
+    str2bool,
     write_error_stats,
 )
 
@@ -72,6 +82,19 @@ def get_parser():
         "'--epoch'. ",
     )
 
+    parser.add_argument(
+        "--use-prefix-sums",
+        type=str2bool,
+        default=False,
+        help="""If True, average the epoch checkpoints using prefix sums
+        of the models, which are cached in the directory prefix-sums of
+        --exp-dir. It speeds up trying different --epoch and --avg, but
+        building the cache loads all epochs up to --epoch, and each cached
+        sum takes twice the size of a model.
+        Used only when --avg is larger than 1.
+        """,
+    )
+
     parser.add_argument(
         "--method",
         type=str,
@@ -121,6 +144,19 @@ def get_parser():
         """,
     )
 
+    parser.add_argument(
+        "--whole-lattice-sweep",
+        type=str2bool,
+        default=False,
+        help="""Used only when "method" is whole-lattice-rescoring.
+        If True, sample --num-paths paths from the rescored lattice once
+        and select the best of them for all LM scales, instead of running
+        shortest path on the rescored lattice once for each LM scale.
+        It is faster when tuning LM scales, but only the sampled paths
+        are considered.
+        """,
+    )
+
     parser.add_argument(
         "--exp-dir",
         type=str,
@@ -144,6 +180,35 @@ def get_parser():
         """,
     )
 
+    parser.add_argument(
+        "--num-rescoring-workers",
+        type=int,
+        default=0,
+        help="""If positive, lattice generation and rescoring run in this
+        number of worker processes, while the main process runs the
+        encoder on the next batches. Used only on CPU.
+        If 0, every batch is decoded in the main process.
+        The model and the decoding graphs (including G for
+        whole-lattice-rescoring) are put in shared memory once and
+        are not copied into each worker. Each worker still needs
+        about 300 MB for its own copy of the torch runtime, plus the
+        lattices of the batch it decodes, and takes a few seconds to
+        start. It pays off only if there are more CPU cores than
+        workers; compare the "Decoded ... cuts in ... s" line in the
+        log against a run with 0.
+        """,
+    )
+
+    parser.add_argument(
+        "--rescoring-queue-size",
+        type=int,
+        default=4,
+        help="""Maximum number of batches whose encoder output is waiting for
+        or being processed by the rescoring workers.
+        Used only when --num-rescoring-workers is positive.
+        """,
+    )
+
     return parser
 
 
@@ -243,6 +308,67 @@ def decode_one_batch(
     nnet_output, memory, memory_key_padding_mask = model(feature, supervisions)
     # nnet_output is (N, T, C)
 
+    return decode_nnet_output(
+        params=params,
+        model=model,
+        nnet_output=nnet_output,
+        memory=memory,
+        memory_key_padding_mask=memory_key_padding_mask,
+        supervisions=supervisions,
+        HLG=HLG,
+        H=H,
+        bpe_model=bpe_model,
+        word_table=word_table,
+        sos_id=sos_id,
+        eos_id=eos_id,
+        G=G,
+    )
+
+
+def decode_nnet_output(
+    params: AttributeDict,
+    model: nn.Module,
+    nnet_output: torch.Tensor,
+    memory: Optional[torch.Tensor],
+    memory_key_padding_mask: Optional[torch.Tensor],
+    supervisions: dict,
+    HLG: Optional[k2.Fsa],
+    H: Optional[k2.Fsa],
+    bpe_model: Optional[spm.SentencePieceProcessor],
+    word_table: k2.SymbolTable,
+    sos_id: int,
+    eos_id: int,
+    G: Optional[k2.Fsa] = None,
+) -> Dict[str, List[List[str]]]:
+    """Generate lattices from the output of the encoder and decode them.
+    This is the part of :func:`decode_one_batch` after the forward pass
+    of the encoder.
+
+    Args:
+      params:
+        It's the return value of :func:`get_params`.
+      model:
+        The neural model. Used only when params.method is
+        attention-decoder.
+      nnet_output:
+        The output of the encoder with shape (N, T, C).
+      memory:
+        The memory of the encoder with shape (T, N, C). Used only when
+        params.method is attention-decoder.
+      memory_key_padding_mask:
+        The padding mask of the memory with shape (N, T). Used only when
+        params.method is attention-decoder.
+      supervisions:
+        It contains "sequence_idx", "start_frame", "num_frames" and "text"
+        of the supervisions in the batch.
+
+    The remaining arguments are the same as the ones in
+    :func:`decode_one_batch`.
+
+    Returns:
+      Return the decoding result. See :func:`decode_one_batch` for the
+      format of the returned dict.
+    """
     supervision_segments = torch.stack(
         (
             supervisions["sequence_idx"],
@@ -349,6 +475,11 @@ def decode_one_batch(
             lattice=lattice,
             G_with_epsilon_loops=G,
             lm_scale_list=lm_scale_list,
+            stats=params.rescoring_stats,
+            sweep_num_paths=params.num_paths
+            if params.whole_lattice_sweep
+            else None,
+            nbest_scale=params.nbest_scale,
         )
     elif params.method == "attention-decoder":
         # lattice uses a 3-gram Lm. We rescore it with a 4-gram LM.
@@ -356,6 +487,7 @@ def decode_one_batch(
             lattice=lattice,
             G_with_epsilon_loops=G,
             lm_scale_list=None,
+            stats=params.rescoring_stats,
         )
         # TODO: pass `lattice` instead of `rescored_lattice` to
         # `rescore_with_attention_decoder`
@@ -384,6 +516,148 @@ def decode_one_batch(
     return ans
 
 
+# The arguments of decode_nnet_output() that are the same for all
+# batches. They are set once in each rescoring worker by
+# _init_rescoring_worker(), so that the decoding graphs and the model are
+# not pickled for each batch.
+_RESCORING_CONTEXT = dict()
+
+
+def _init_rescoring_worker(context: dict) -> None:
+    """Set _RESCORING_CONTEXT in a rescoring worker.
+
+    Args:
+      context:
+        The arguments of :func:`decode_nnet_output` that are the same for
+        all batches. Decoding graphs are given as the return value of
+        k2.Fsa.as_dict().
+    """
+    for key in ("HLG", "H", "G"):
+        if context[key] is not None:
+            context[key] = k2.Fsa.from_dict(context[key])
+    _RESCORING_CONTEXT.update(context)
+
+
+@torch.no_grad()
+def _decode_nnet_output_in_worker(
+    nnet_output: torch.Tensor,
+    memory: Optional[torch.Tensor],
+    memory_key_padding_mask: Optional[torch.Tensor],
+    supervisions: dict,
+) -> Tuple[Dict[str, List[List[str]]], int, WholeLatticeRescoringStats]:
+    hyps_dict = decode_nnet_output(
+        nnet_output=nnet_output,
+        memory=memory,
+        memory_key_padding_mask=memory_key_padding_mask,
+        supervisions=supervisions,
+        **_RESCORING_CONTEXT,
+    )
+    # Each worker has its own copy of the statistics
+    return hyps_dict, os.getpid(), _RESCORING_CONTEXT["params"].rescoring_stats
+
+
+def _decode_batches_pipelined(
+    dl: torch.utils.data.DataLoader,
+    params: AttributeDict,
+    model: nn.Module,
+    **kwargs,
+) -> Iterator[Tuple[List[str], Dict[str, List[List[str]]]]]:
+    """Run the encoder in this process and decode its output in
+    params.num_rescoring_workers worker processes.
+
+    At most params.rescoring_queue_size batches are waiting for or being
+    processed by the workers. The results are yielded in the order of
+    the batches in `dl`.
+
+    The context is sent to each worker once, when it starts. Since the
+    workers are started with "spawn", it is pickled with the reductions
+    of torch.multiprocessing, which move CPU tensors to shared memory
+    instead of copying them. The arcs of HLG, H and G and the parameters
+    of the model therefore exist only once, no matter how many workers
+    there are, and k2.Fsa.from_dict() in the worker wraps the shared
+    arcs without copying them. The memory private to each worker is the
+    torch runtime (about 300 MB) and the lattices of its current batch.
+
+    Args:
+      dl:
+        PyTorch's dataloader containing the dataset to decode.
+      params:
+        It is returned by :func:`get_params`.
+      model:
+        The neural model.
+      kwargs:
+        The remaining arguments of :func:`decode_nnet_output`.
+    Yields:
+      A tuple containing the reference texts of a batch and the return
+      value of :func:`decode_nnet_output` for it.
+    """
+    assert params.rescoring_queue_size >= 1, params.rescoring_queue_size
+    context = dict(params=params, model=model, **kwargs)
+    for key in ("HLG", "H", "G"):
+        if context[key] is not None:
+            context[key] = context[key].as_dict()
+
+    forward_time = 0.0
+    wait_time = 0.0
+    worker_stats = dict()
+
+    pending = deque()
+    # Don't fork, as this process has already initialized torch and
+    # possibly CUDA. The context is sent to each worker once.
+    with ProcessPoolExecutor(
+        max_workers=params.num_rescoring_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_rescoring_worker,
+        initargs=(context,),
+    ) as executor:
+        for batch in dl:
+            start = time.time()
+            feature = batch["inputs"]
+            assert feature.ndim == 3
+            supervisions = batch["supervisions"]
+            nnet_output, memory, memory_key_padding_mask = model(
+                feature, supervisions
+            )
+            forward_time += time.time() - start
+
+            if params.method != "attention-decoder":
+                # Don't send what the workers don't need
+                memory = None
+                memory_key_padding_mask = None
+
+            keys = ("sequence_idx", "start_frame", "num_frames", "text")
+            future = executor.submit(
+                _decode_nnet_output_in_worker,
+                nnet_output,
+                memory,
+                memory_key_padding_mask,
+                {k: supervisions[k] for k in keys},
+            )
+            pending.append((supervisions["text"], future))
+
+            while len(pending) >= params.rescoring_queue_size:
+                texts, future = pending.popleft()
+                start = time.time()
+                hyps_dict, pid, worker_stats[pid] = future.result()
+                wait_time += time.time() - start
+                yield texts, hyps_dict
+
+        while len(pending) > 0:
+            texts, future = pending.popleft()
+            start = time.time()
+            hyps_dict, pid, worker_stats[pid] = future.result()
+            wait_time += time.time() - start
+            yield texts, hyps_dict
+
+    logging.info(
+        f"Encoder forward: {forward_time:.2f} s, "
+        f"waiting for rescoring workers: {wait_time:.2f} s"
+    )
+    if params.method in ("whole-lattice-rescoring", "attention-decoder"):
+        for pid, stats in worker_stats.items():
+            logging.info(f"Worker {pid}: {stats}")
+
+
 def decode_dataset(
     dl: torch.utils.data.DataLoader,
     params: AttributeDict,
@@ -435,23 +709,42 @@ def decode_dataset(
     except TypeError:
         num_batches = "?"
 
-    results = defaultdict(list)
-    for batch_idx, batch in enumerate(dl):
-        texts = batch["supervisions"]["text"]
-
-        hyps_dict = decode_one_batch(
+    if params.num_rescoring_workers > 0:
+        decoded_batches = _decode_batches_pipelined(
+            dl=dl,
             params=params,
             model=model,
             HLG=HLG,
             H=H,
             bpe_model=bpe_model,
-            batch=batch,
             word_table=word_table,
             G=G,
             sos_id=sos_id,
             eos_id=eos_id,
         )
+    else:
+        decoded_batches = (
+            (
+                batch["supervisions"]["text"],
+                decode_one_batch(
+                    params=params,
+                    model=model,
+                    HLG=HLG,
+                    H=H,
+                    bpe_model=bpe_model,
+                    batch=batch,
+                    word_table=word_table,
+                    G=G,
+                    sos_id=sos_id,
+                    eos_id=eos_id,
+                ),
+            )
+            for batch in dl
+        )
 
+    start = time.time()
+    results = defaultdict(list)
+    for batch_idx, (texts, hyps_dict) in enumerate(decoded_batches):
         if hyps_dict is not None:
             for lm_scale, hyps in hyps_dict.items():
                 this_batch = []
@@ -482,6 +775,12 @@ def decode_dataset(
             logging.info(
                 f"batch {batch_str}, cuts processed until now is {num_cuts}"
             )
+
+    elapsed = time.time() - start
+    logging.info(
+        f"Decoded {num_cuts} cuts in {elapsed:.2f} s "
+        f"with {params.num_rescoring_workers} rescoring workers"
+    )
     return results
 
 
@@ -557,6 +856,10 @@ def main():
 
     logging.info(f"device: {device}")
 
+    if params.num_rescoring_workers > 0 and device.type != "cpu":
+        logging.warning("--num-rescoring-workers is used only on CPU")
+        params.num_rescoring_workers = 0
+
     graph_compiler = BpeCtcTrainingGraphCompiler(
         params.lang_dir,
         device=device,
@@ -649,13 +952,22 @@ def main():
         load_checkpoint(f"{params.exp_dir}/epoch-{params.epoch}.pt", model)
     else:
         start = params.epoch - params.avg + 1
-        filenames = []
-        for i in range(start, params.epoch + 1):
-            if start >= 0:
-                filenames.append(f"{params.exp_dir}/epoch-{i}.pt")
-        logging.info(f"averaging {filenames}")
+        logging.info(f"averaging epochs {start} to {params.epoch}")
         model.to(device)
-        model.load_state_dict(average_checkpoints(filenames, device=device))
+        if params.use_prefix_sums:
+            state_dict = average_epoch_checkpoints(
+                params.exp_dir,
+                epoch=params.epoch,
+                avg=params.avg,
+                device=device,
+            )
+        else:
+            filenames = [
+                f"{params.exp_dir}/epoch-{i}.pt"
+                for i in range(start, params.epoch + 1)
+            ]
+            state_dict = average_checkpoints(filenames, device=device)
+        model.load_state_dict(state_dict)
 
     model.to(device)
     model.eval()
@@ -674,6 +986,7 @@ def main():
     test_dl = [test_clean_dl, test_other_dl]
 
     for test_set, test_dl in zip(test_sets, test_dl):
+        params.rescoring_stats = WholeLatticeRescoringStats()
         results_dict = decode_dataset(
             dl=test_dl,
             params=params,
@@ -690,6 +1003,11 @@ def main():
         save_results(
             params=params, test_set_name=test_set, results_dict=results_dict
         )
+        if (
+            params.method in ("whole-lattice-rescoring", "attention-decoder")
+            and params.num_rescoring_workers == 0
+        ):
+            logging.info(f"{test_set}: {params.rescoring_stats}")
 
     logging.info("Done!")
 
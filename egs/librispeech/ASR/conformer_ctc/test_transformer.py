@@ -27,6 +27,8 @@ from transformer import (
     generate_square_subsequent_mask,
 )
 
+from icefall.attention_rescoring import attention_decoder_nll, is_supported
+
 
 def test_encoder_padding_mask():
     supervisions = {
@@ -102,3 +104,54 @@ def test_add_eos():
     y = add_eos(x, eos_id=0)
     expected_y = [[1, 2, 0], [3, 0], [2, 5, 8, 0]]
     assert y == expected_y
+
+
+def test_attention_decoder_nll():
+    num_classes = 20
+    sos_id = eos_id = num_classes - 1
+    # Paths of the same utterance share prefixes
+    token_ids = [[1, 2, 3], [1, 2, 4, 5], [1, 6], [], [7, 8], [7, 8, 9], [2]]
+    path_to_utt_map = torch.tensor([0, 0, 0, 0, 1, 1, 2])
+
+    for normalize_before in [True, False]:
+        model = Transformer(
+            num_features=10,
+            num_classes=num_classes,
+            d_model=32,
+            nhead=4,
+            dim_feedforward=64,
+            num_encoder_layers=1,
+            num_decoder_layers=2,
+            normalize_before=normalize_before,
+        )
+        model.eval()
+        assert is_supported(model)
+
+        T, N = 9, 3
+        memory = torch.rand(T, N, 32)
+        memory_key_padding_mask = torch.zeros(N, T, dtype=torch.bool)
+        memory_key_padding_mask[1, 6:] = True
+        memory_key_padding_mask[2, 4:] = True
+
+        with torch.no_grad():
+            nll = attention_decoder_nll(
+                model=model,
+                memory=memory,
+                memory_key_padding_mask=memory_key_padding_mask,
+                token_ids=token_ids,
+                path_to_utt_map=path_to_utt_map,
+                sos_id=sos_id,
+                eos_id=eos_id,
+            )
+            expected = model.decoder_nll(
+                memory=memory.index_select(1, path_to_utt_map),
+                memory_key_padding_mask=memory_key_padding_mask.index_select(
+                    0, path_to_utt_map
+                ),
+                token_ids=token_ids,
+                sos_id=sos_id,
+                eos_id=eos_id,
+            ).sum(dim=1)
+
+        assert nll.shape == (len(token_ids),)
+        assert torch.allclose(nll, expected, atol=1e-4), (nll, expected)
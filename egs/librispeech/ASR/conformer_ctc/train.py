@@ -317,6 +317,8 @@ def save_checkpoint(
         optimizer=optimizer,
         scheduler=scheduler,
         rank=rank,
+        # It makes averaging epoch checkpoints in decode.py faster
+        save_model_copy=True,
     )
 
     if params.best_train_epoch == params.cur_epoch:
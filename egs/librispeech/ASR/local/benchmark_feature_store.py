@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# Copyright      2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script compares the read throughput of features stored with
+ChunkedLilcomHdf5Writer, which local/compute_fbank_*.py use, and with
+MemmapShardsWriter from icefall/dataset/memmap_features.py.
+
+It writes synthetic fbank-like features of random lengths and reads all
+of them back in random order, as a dataloader worker does, using a
+single thread.
+
+Usage:
+
+    python3 ./local/benchmark_feature_store.py
+    python3 ./local/benchmark_feature_store.py --num-utterances 2000
+
+Note:
+  The files are in the page cache after they are written, so the
+  numbers mostly measure decoding cost, not disk I/O.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from lhotse import ChunkedLilcomHdf5Writer
+from lhotse.features.io import get_reader
+
+from icefall.dataset.memmap_features import MemmapShardsWriter
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--num-utterances",
+        type=int,
+        default=500,
+        help="Number of utterances to write and read.",
+    )
+
+    parser.add_argument(
+        "--num-features",
+        type=int,
+        default=80,
+        help="Feature dimension.",
+    )
+
+    parser.add_argument(
+        "--num-epochs",
+        type=int,
+        default=3,
+        help="Number of times to read all utterances.",
+    )
+
+    parser.add_argument(
+        "--tmp-dir",
+        type=str,
+        help="Directory for the files. Defaults to a temporary directory.",
+    )
+
+    return parser.parse_args()
+
+
+def generate_features(num_utterances: int, num_features: int, seed: int):
+    """Return a list of arrays that look like log-mel fbank features,
+    i.e., smooth in time and frequency."""
+    rng = np.random.default_rng(seed)
+    ans = []
+    for _ in range(num_utterances):
+        # 2 to 17 seconds with a 10 ms frame shift
+        num_frames = int(rng.integers(200, 1700))
+        x = rng.standard_normal((num_frames, num_features)).cumsum(axis=0)
+        x = x / np.sqrt(np.arange(1, num_frames + 1))[:, None]
+        x = x - 10 + 3 * np.sin(np.arange(num_features) / 8)[None, :]
+        ans.append(x.astype(np.float32))
+    return ans
+
+
+def benchmark(writer_cls, features, out_dir: Path, num_epochs: int, seed):
+    start = time.time()
+    with writer_cls(out_dir / writer_cls.name) as writer:
+        keys = [writer.write(f"utt-{i}", f) for i, f in enumerate(features)]
+        storage_path = writer.storage_path
+    write_time = time.time() - start
+
+    # ChunkedLilcomHdf5Writer appends .h5 to the storage path
+    size = sum(
+        f.stat().st_size
+        for f in out_dir.rglob("*")
+        if f.is_file()
+        and f.relative_to(out_dir).parts[0].startswith(writer_cls.name)
+    )
+
+    reader_cls = get_reader(writer_cls.name)
+    rng = np.random.default_rng(seed)
+    num_frames = 0
+    max_err = 0.0
+    start = time.time()
+    for _ in range(num_epochs):
+        for i in rng.permutation(len(keys)):
+            # lhotse creates a reader for each load
+            x = reader_cls(storage_path).read(keys[i])
+            num_frames += x.shape[0]
+    read_time = time.time() - start
+
+    for key, f in zip(keys, features):
+        x = reader_cls(storage_path).read(key)
+        max_err = max(max_err, float(np.abs(x - f).max()))
+
+    return {
+        "write_s": write_time,
+        "size_mb": size / 2 ** 20,
+        "frames_per_s": num_frames / read_time,
+        "utts_per_s": num_epochs * len(keys) / read_time,
+        "max_abs_err": max_err,
+    }
+
+
+def main():
+    args = get_args()
+    features = generate_features(
+        args.num_utterances, args.num_features, seed=0
+    )
+    num_frames = sum(f.shape[0] for f in features)
+    print(
+        f"{args.num_utterances} utterances, {num_frames} frames, "
+        f"{num_frames * args.num_features * 4 / 2**20:.1f} MB as float32"
+    )
+
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        results = {}
+        for writer_cls in (ChunkedLilcomHdf5Writer, MemmapShardsWriter):
+            results[writer_cls.name] = benchmark(
+                writer_cls,
+                features,
+                Path(tmp_dir),
+                num_epochs=args.num_epochs,
+                seed=1,
+            )
+
+    for name, r in results.items():
+        print(
+            f"{name:>24}: "
+            f"read {r['frames_per_s']:.3g} frames/s "
+            f"({r['utts_per_s']:.1f} utts/s), "
+            f"write {r['write_s']:.2f} s, "
+            f"size {r['size_mb']:.1f} MB, "
+            f"max abs err {r['max_abs_err']:.2g}"
+        )
+    base, new = results.values()
+    print(f"read speedup: {new['frames_per_s'] / base['frames_per_s']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# Copyright      2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script measures the training steps per second of a small synthetic
+model when the metrics of each batch are put into MetricsTracker
+
+  - as Python floats, i.e., calling `.item()` for each metric, which
+    synchronizes with the device once per metric per batch (before), or
+  - as tensors, which stay on the device until they are logged (after).
+
+Usage:
+
+    python3 ./local/benchmark_metrics_tracker.py
+    python3 ./local/benchmark_metrics_tracker.py --device cuda
+"""
+
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+
+from icefall.utils import MetricsTracker
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cpu",
+        help="Device to run the benchmark on.",
+    )
+
+    parser.add_argument(
+        "--num-steps",
+        type=int,
+        default=500,
+        help="Number of training steps for each setting.",
+    )
+
+    parser.add_argument(
+        "--log-interval",
+        type=int,
+        default=50,
+        help="Print metrics every this number of steps.",
+    )
+
+    parser.add_argument(
+        "--reset-interval",
+        type=int,
+        default=200,
+        help="Used for the decaying average of the metrics.",
+    )
+
+    return parser.parse_args()
+
+
+def compute_loss(model, x, x_lens, use_tensor: bool):
+    y = model(x)
+    simple_loss = y[..., 0].sum()
+    pruned_loss = y[..., 1].sum()
+    loss = 0.5 * simple_loss + pruned_loss
+
+    info = MetricsTracker()
+    if use_tensor:
+        info["frames"] = (x_lens // 4).sum()
+        info["loss"] = loss.detach()
+        info["simple_loss"] = simple_loss.detach()
+        info["pruned_loss"] = pruned_loss.detach()
+    else:
+        info["frames"] = (x_lens // 4).sum().item()
+        info["loss"] = loss.detach().cpu().item()
+        info["simple_loss"] = simple_loss.detach().cpu().item()
+        info["pruned_loss"] = pruned_loss.detach().cpu().item()
+    return loss, info
+
+
+def run(args, use_tensor: bool) -> float:
+    """Return the number of steps per second."""
+    torch.manual_seed(20220611)
+    device = torch.device(args.device)
+    model = nn.Sequential(
+        nn.Linear(80, 256),
+        nn.ReLU(),
+        nn.Linear(256, 256),
+        nn.ReLU(),
+        nn.Linear(256, 2),
+    ).to(device)
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-6)
+
+    x = torch.randn(8, 100, 80, device=device)
+    x_lens = torch.full((8,), 100, device=device)
+
+    tot_loss = MetricsTracker()
+    for step in range(args.num_steps + 10):
+        if step == 10:
+            # The first 10 steps are for warmup
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            start = time.time()
+
+        loss, info = compute_loss(model, x, x_lens, use_tensor=use_tensor)
+        tot_loss = (tot_loss * (1 - 1 / args.reset_interval)) + info
+
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+        if step % args.log_interval == 0:
+            # Formatting the metrics is what the training loop does
+            # at each log interval.
+            str(info), str(tot_loss)
+
+    tot_loss.sync()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return args.num_steps / (time.time() - start)
+
+
+def main():
+    args = get_args()
+    before = run(args, use_tensor=False)
+    after = run(args, use_tensor=True)
+    print(f"device: {args.device}, steps: {args.num_steps}")
+    print(f".item() per metric per batch: {before:.1f} steps/s")
+    print(f"device-resident metrics:      {after:.1f} steps/s")
+    print(f"speedup: {after / before:.3f}")
+
+
+if __name__ == "__main__":
+    torch.set_num_threads(1)
+    torch.set_num_interop_threads(1)
+    main()
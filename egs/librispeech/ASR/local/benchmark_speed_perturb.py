@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# Copyright      2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script measures the CPU time a dataloader worker spends per second
+of audio to create training batches with
+
+  - precomputed features, as in the default setup
+  - features computed on the fly
+  - features computed on the fly after speed perturbation with
+    lhotse.dataset.PerturbSpeed, as with --perturb-speed true
+
+Speed perturbation is applied to every cut, i.e., with p=1.
+The audio is synthetic and is written to a temporary directory.
+
+Usage:
+
+    python3 ./local/benchmark_speed_perturb.py
+    python3 ./local/benchmark_speed_perturb.py --num-cuts 500
+
+Note:
+  The files are in the page cache after they are written, so the
+  numbers do not include disk I/O.
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+import torch
+from lhotse import (
+    ChunkedLilcomHdf5Writer,
+    CutSet,
+    Fbank,
+    FbankConfig,
+    Recording,
+    RecordingSet,
+    SupervisionSegment,
+    SupervisionSet,
+)
+from lhotse.dataset import (
+    K2SpeechRecognitionDataset,
+    PerturbSpeed,
+    PrecomputedFeatures,
+    SimpleCutSampler,
+)
+from lhotse.dataset.input_strategies import OnTheFlyFeatures
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--num-cuts",
+        type=int,
+        default=200,
+        help="Number of cuts.",
+    )
+
+    parser.add_argument(
+        "--max-duration",
+        type=float,
+        default=100.0,
+        help="Maximum number of seconds of audio in a batch.",
+    )
+
+    parser.add_argument(
+        "--tmp-dir",
+        type=str,
+        help="Directory for the files. Defaults to a temporary directory.",
+    )
+
+    return parser.parse_args()
+
+
+def generate_cuts(num_cuts: int, out_dir: Path) -> CutSet:
+    rng = np.random.default_rng(0)
+    recordings = []
+    supervisions = []
+    for i in range(num_cuts):
+        # 2 to 17 seconds
+        num_samples = int(rng.integers(2, 17) * 16000)
+        filename = out_dir / f"{i}.flac"
+        sf.write(filename, rng.standard_normal(num_samples) * 0.1, 16000)
+        recording = Recording.from_file(filename)
+        recordings.append(recording)
+        supervisions.append(
+            SupervisionSegment(
+                id=recording.id,
+                recording_id=recording.id,
+                start=0,
+                duration=recording.duration,
+                text="HELLO WORLD",
+            )
+        )
+    return CutSet.from_manifests(
+        recordings=RecordingSet.from_recordings(recordings),
+        supervisions=SupervisionSet.from_segments(supervisions),
+    )
+
+
+def benchmark(dataset, cuts: CutSet, max_duration: float):
+    """Return the CPU seconds per second of audio."""
+    sampler = SimpleCutSampler(cuts, max_duration=max_duration)
+    num_seconds = 0.0
+    start = time.process_time()
+    for batch_cuts in sampler:
+        batch = dataset[batch_cuts]
+        num_seconds += batch["inputs"].size(1) * batch["inputs"].size(0)
+    elapsed = time.process_time() - start
+    # 10 ms frame shift
+    return elapsed / (num_seconds * 0.01)
+
+
+def main():
+    args = get_args()
+    # Like in a dataloader worker
+    torch.set_num_threads(1)
+
+    extractor = Fbank(FbankConfig(num_mel_bins=80))
+
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        cuts = generate_cuts(args.num_cuts, tmp_dir)
+        print(f"{len(cuts)} cuts, {sum(c.duration for c in cuts):.0f} s")
+
+        cuts_with_feats = cuts.compute_and_store_features(
+            extractor=extractor,
+            storage_path=tmp_dir / "feats",
+            storage_type=ChunkedLilcomHdf5Writer,
+        )
+
+        setups = {
+            "precomputed": (cuts_with_feats, PrecomputedFeatures(), []),
+            "on-the-fly": (cuts, OnTheFlyFeatures(extractor), []),
+            "on-the-fly + speed perturbation": (
+                cuts,
+                OnTheFlyFeatures(extractor),
+                [
+                    PerturbSpeed(
+                        factors=[0.9, 1.1], p=1.0, randgen=random.Random(0)
+                    )
+                ],
+            ),
+        }
+
+        for name, (c, input_strategy, transforms) in setups.items():
+            dataset = K2SpeechRecognitionDataset(
+                cut_transforms=transforms,
+                input_strategy=input_strategy,
+            )
+            # Warm up
+            dataset[c.subset(first=2)]
+            cost = benchmark(dataset, c, args.max_duration)
+            print(
+                f"{name:>31}: {cost * 1000:.2f} ms CPU per second of audio "
+                f"({1 / cost:.0f}x real time per worker)"
+            )
+
+
+if __name__ == "__main__":
+    main()
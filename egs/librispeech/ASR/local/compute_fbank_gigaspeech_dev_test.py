@@ -17,6 +17,7 @@
 # limitations under the License.
 
 import logging
+from functools import partial
 from pathlib import Path
 
 import torch
@@ -26,6 +27,8 @@ from lhotse import (
     KaldifeatFbankConfig,
 )
 
+from icefall.feature_extraction import FeatureShard, compute_features_for_shards
+
 # Torch's multithreaded behavior needs to be disabled or
 # it wastes a lot of CPU and slow things down.
 # Do this outside of main() in case it needs to take effect
@@ -51,32 +54,26 @@ def compute_fbank_gigaspeech_dev_test():
 
     logging.info(f"device: {device}")
 
-    for partition in subsets:
-        cuts_path = in_out_dir / f"cuts_{partition}.jsonl.gz"
-        if cuts_path.is_file():
-            logging.info(f"{cuts_path} exists - skipping")
-            continue
-
-        raw_cuts_path = in_out_dir / f"cuts_{partition}_raw.jsonl.gz"
-
-        logging.info(f"Loading {raw_cuts_path}")
-        cut_set = CutSet.from_file(raw_cuts_path)
-
-        logging.info("Computing features")
-
-        cut_set = cut_set.compute_and_store_features_batch(
-            extractor=extractor,
-            storage_path=f"{in_out_dir}/feats_{partition}",
-            num_workers=num_workers,
-            batch_duration=batch_duration,
-        )
-        cut_set = cut_set.trim_to_supervisions(
-            keep_overlapping=False, min_duration=None
+    shards = [
+        FeatureShard(
+            cuts=in_out_dir / f"cuts_{partition}_raw.jsonl.gz",
+            manifest_path=in_out_dir / f"cuts_{partition}.jsonl.gz",
+            storage_path=in_out_dir / f"feats_{partition}",
         )
-
-        logging.info(f"Saving to {cuts_path}")
-        cut_set.to_file(cuts_path)
-        logging.info(f"Saved to {cuts_path}")
+        for partition in subsets
+    ]
+    compute_features_for_shards(
+        shards,
+        extractor=extractor,
+        progress_path=in_out_dir / "progress.jsonl",
+        batch_duration=batch_duration,
+        num_workers=num_workers,
+        post_process=partial(
+            CutSet.trim_to_supervisions,
+            keep_overlapping=False,
+            min_duration=None,
+        ),
+    )
 
 
 def main():
@@ -18,13 +18,15 @@
 
 import argparse
 import logging
-import os
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 
 import torch
 from lhotse import CutSet, KaldifeatFbank, KaldifeatFbankConfig
 
+from icefall.feature_extraction import FeatureShard, compute_features_for_shards
+
 # Torch's multithreaded behavior needs to be disabled or
 # it wastes a lot of CPU and slow things down.
 # Do this outside of main() in case it needs to take effect
@@ -97,43 +99,34 @@ def compute_fbank_gigaspeech_splits(args):
     logging.info(f"device: {device}")
 
     num_digits = 8  # num_digits is fixed by lhotse split-lazy
+    shards = []
     for i in range(start, stop):
         idx = f"{i + 1}".zfill(num_digits)
-        logging.info(f"Processing {idx}/{num_splits}")
-
-        cuts_path = output_dir / f"cuts_XL.{idx}.jsonl.gz"
-        if cuts_path.is_file():
-            logging.info(f"{cuts_path} exists - skipping")
-            continue
-
         raw_cuts_path = output_dir / f"cuts_XL_raw.{idx}.jsonl.gz"
         if not raw_cuts_path.is_file():
             logging.info(f"{raw_cuts_path} does not exist - skipping it")
             continue
-
-        logging.info(f"Loading {raw_cuts_path}")
-        cut_set = CutSet.from_file(raw_cuts_path)
-
-        logging.info("Computing features")
-        if (output_dir / f"feats_XL_{idx}.lca").exists():
-            logging.info(f"Removing {output_dir}/feats_XL_{idx}.lca")
-            os.remove(output_dir / f"feats_XL_{idx}.lca")
-
-        cut_set = cut_set.compute_and_store_features_batch(
-            extractor=extractor,
-            storage_path=f"{output_dir}/feats_XL_{idx}",
-            num_workers=args.num_workers,
-            batch_duration=args.batch_duration,
+        shards.append(
+            FeatureShard(
+                cuts=raw_cuts_path,
+                manifest_path=output_dir / f"cuts_XL.{idx}.jsonl.gz",
+                storage_path=output_dir / f"feats_XL_{idx}",
+            )
         )
 
-        logging.info("About to split cuts into smaller chunks.")
-        cut_set = cut_set.trim_to_supervisions(
-            keep_overlapping=False, min_duration=None
-        )
-
-        logging.info(f"Saving to {cuts_path}")
-        cut_set.to_file(cuts_path)
-        logging.info(f"Saved to {cuts_path}")
+    # The progress file is shared by jobs processing different pieces
+    compute_features_for_shards(
+        shards,
+        extractor=extractor,
+        progress_path=output_dir / "progress.jsonl",
+        batch_duration=args.batch_duration,
+        num_workers=args.num_workers,
+        post_process=partial(
+            CutSet.trim_to_supervisions,
+            keep_overlapping=False,
+            min_duration=None,
+        ),
+    )
 
 
 def main():
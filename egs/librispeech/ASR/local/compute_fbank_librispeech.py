@@ -21,8 +21,12 @@ This file computes fbank features of the LibriSpeech dataset.
 It looks for manifests in the directory data/manifests.
 
 The generated fbank features are saved in data/fbank.
+
+It is safe to interrupt this script and run it again. Finished shards
+are not computed again. See icefall/feature_extraction.py
 """
 
+import argparse
 import logging
 import os
 from pathlib import Path
@@ -31,7 +35,8 @@ import torch
 from lhotse import ChunkedLilcomHdf5Writer, CutSet, Fbank, FbankConfig
 from lhotse.recipes.utils import read_manifests_if_cached
 
-from icefall.utils import get_executor
+from icefall.feature_extraction import compute_and_store_features
+from icefall.utils import get_executor, str2bool
 
 # Torch's multithreaded behavior needs to be disabled or
 # it wastes a lot of CPU and slow things down.
@@ -41,7 +46,7 @@ torch.set_num_threads(1)
 torch.set_num_interop_threads(1)
 
 
-def compute_fbank_librispeech():
+def compute_fbank_librispeech(perturb_speed: bool = True):
     src_dir = Path("data/manifests")
     output_dir = Path("data/fbank")
     num_jobs = min(15, os.cpu_count())
@@ -73,21 +78,37 @@ def compute_fbank_librispeech():
                 recordings=m["recordings"],
                 supervisions=m["supervisions"],
             )
-            if "train" in partition:
+            if "train" in partition and perturb_speed:
                 cut_set = (
                     cut_set
                     + cut_set.perturb_speed(0.9)
                     + cut_set.perturb_speed(1.1)
                 )
-            cut_set = cut_set.compute_and_store_features(
+            compute_and_store_features(
+                cut_set,
                 extractor=extractor,
-                storage_path=f"{output_dir}/feats_{partition}",
-                # when an executor is specified, make more partitions
-                num_jobs=num_jobs if ex is None else 80,
+                storage_dir=output_dir / f"feats_{partition}",
+                manifest_path=output_dir / f"cuts_{partition}.json.gz",
+                num_jobs=num_jobs,
                 executor=ex,
                 storage_type=ChunkedLilcomHdf5Writer,
             )
-            cut_set.to_json(output_dir / f"cuts_{partition}.json.gz")
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--perturb-speed",
+        type=str2bool,
+        default=True,
+        help="""When enabled, also compute features for the speed perturbed
+        copies of the training cuts. Disable it to perturb the speed
+        on the fly in the dataloader with --perturb-speed true in train.py,
+        which saves 2/3 of the disk space and computation.
+        """,
+    )
+
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
@@ -97,4 +118,5 @@ if __name__ == "__main__":
 
     logging.basicConfig(format=formatter, level=logging.INFO)
 
-    compute_fbank_librispeech()
+    args = get_args()
+    compute_fbank_librispeech(perturb_speed=args.perturb_speed)
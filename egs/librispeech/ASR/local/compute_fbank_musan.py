@@ -21,6 +21,9 @@ This file computes fbank features of the musan dataset.
 It looks for manifests in the directory data/manifests.
 
 The generated fbank features are saved in data/fbank.
+
+It is safe to interrupt this script and run it again. Finished shards
+are not computed again. See icefall/feature_extraction.py
 """
 
 import logging
@@ -31,6 +34,7 @@ import torch
 from lhotse import ChunkedLilcomHdf5Writer, CutSet, Fbank, FbankConfig, combine
 from lhotse.recipes.utils import read_manifests_if_cached
 
+from icefall.feature_extraction import compute_and_store_features
 from icefall.utils import get_executor
 
 # Torch's multithreaded behavior needs to be disabled or
@@ -77,15 +81,16 @@ def compute_fbank_musan():
             )
             .cut_into_windows(10.0)
             .filter(lambda c: c.duration > 5)
-            .compute_and_store_features(
-                extractor=extractor,
-                storage_path=f"{output_dir}/feats_musan",
-                num_jobs=num_jobs if ex is None else 80,
-                executor=ex,
-                storage_type=ChunkedLilcomHdf5Writer,
-            )
         )
-        musan_cuts.to_json(musan_cuts_path)
+        compute_and_store_features(
+            musan_cuts,
+            extractor=extractor,
+            storage_dir=output_dir / "feats_musan",
+            manifest_path=musan_cuts_path,
+            num_jobs=num_jobs,
+            executor=ex,
+            storage_type=ChunkedLilcomHdf5Writer,
+        )
 
 
 if __name__ == "__main__":
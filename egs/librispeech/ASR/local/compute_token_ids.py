@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+This script tokenizes the transcripts of the given cuts with a BPE model
+and saves the token IDs to a file, which is used by the dataloader
+workers of asr_datamodule.py to return the token IDs of each batch,
+so that the training process does not need to call sp.encode().
+
+Usage example:
+
+    python3 ./local/compute_token_ids.py \
+            --bpe-model data/lang_bpe_500/bpe.model \
+            data/fbank/cuts_train-clean-100.json.gz \
+            data/fbank/cuts_train-clean-360.json.gz \
+            data/fbank/cuts_train-other-500.json.gz \
+            data/fbank/cuts_dev-clean.json.gz \
+            data/fbank/cuts_dev-other.json.gz
+
+It writes data/lang_bpe_500/token_ids.npz by default.
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+from lhotse import load_manifest
+
+from icefall.dataset.token_ids import compute_token_id_table
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--bpe-model",
+        required=True,
+        type=Path,
+        help="Path to bpe.model",
+    )
+
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="Path to save the token IDs. If not given, "
+        "it is token_ids.npz in the directory of --bpe-model.",
+    )
+
+    parser.add_argument(
+        "manifests",
+        nargs="+",
+        type=Path,
+        help="Cut manifests whose transcripts are tokenized.",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    assert args.bpe_model.is_file(), args.bpe_model
+
+    output = args.output
+    if output is None:
+        output = args.bpe_model.parent / "token_ids.npz"
+
+    def cuts():
+        for m in args.manifests:
+            logging.info(f"Loading {m}")
+            yield load_manifest(m)
+
+    table = compute_token_id_table(cuts(), bpe_model=args.bpe_model)
+    table.save(output)
+    logging.info(f"Saved token IDs of {len(table)} transcripts to {output}")
+
+
+if __name__ == "__main__":
+    formatter = (
+        "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    )
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+This script copies the features computed by ./local/compute_fbank_*.py
+into memory mapped float16 shards, which are much cheaper to read in
+the dataloader workers than HDF5 archives.
+See icefall/dataset/memmap_features.py
+
+Usage example:
+
+    python3 ./local/convert_fbank_to_memmap.py \
+            --src-dir data/fbank \
+            --dst-dir data/fbank-memmap
+
+Then pass `--manifest-dir data/fbank-memmap` to train.py.
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+from lhotse import load_manifest
+
+from icefall.dataset.memmap_features import copy_features_to_memmap_shards
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--src-dir",
+        type=Path,
+        default=Path("data/fbank"),
+        help="Directory containing cuts_xxx.json.gz",
+    )
+
+    parser.add_argument(
+        "--dst-dir",
+        type=Path,
+        default=Path("data/fbank-memmap"),
+        help="Directory to save the converted cuts and features",
+    )
+
+    parser.add_argument(
+        "--dataset-parts",
+        type=str,
+        nargs="+",
+        default=[
+            "dev-clean",
+            "dev-other",
+            "test-clean",
+            "test-other",
+            "train-clean-100",
+            "train-clean-360",
+            "train-other-500",
+            "musan",
+        ],
+        help="Convert data/fbank/cuts_{part}.json.gz for these parts",
+    )
+
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        default="float16",
+        help="float16 or float32",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    args.dst_dir.mkdir(parents=True, exist_ok=True)
+
+    for part in args.dataset_parts:
+        dst = args.dst_dir / f"cuts_{part}.json.gz"
+        if dst.is_file():
+            logging.info(f"{dst} already exists - skipping.")
+            continue
+
+        logging.info(f"Processing {part}")
+        cuts = load_manifest(args.src_dir / f"cuts_{part}.json.gz")
+        cuts = copy_features_to_memmap_shards(
+            cuts,
+            storage_path=args.dst_dir / f"feats_{part}",
+            dtype=args.dtype,
+        )
+        cuts.to_json(dst)
+
+
+if __name__ == "__main__":
+    formatter = (
+        "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    )
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
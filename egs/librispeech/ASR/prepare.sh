@@ -199,6 +199,17 @@ if [ $stage -le 6 ] && [ $stop_stage -ge 6 ]; then
         --lexicon $lang_dir/lexicon.txt \
         --bpe-model $lang_dir/bpe.model
     fi
+
+    if [ ! -f $lang_dir/token_ids.npz ]; then
+      log "Tokenize transcripts of the train/dev cuts"
+      ./local/compute_token_ids.py \
+        --bpe-model $lang_dir/bpe.model \
+        data/fbank/cuts_train-clean-100.json.gz \
+        data/fbank/cuts_train-clean-360.json.gz \
+        data/fbank/cuts_train-other-500.json.gz \
+        data/fbank/cuts_dev-clean.json.gz \
+        data/fbank/cuts_dev-other.json.gz
+    fi
   done
 fi
 
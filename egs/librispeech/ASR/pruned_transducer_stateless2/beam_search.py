@@ -15,17 +15,206 @@
 # limitations under the License.
 
 import warnings
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import k2
 import torch
+import torch.nn as nn
 from model import Transducer
 
 from icefall.decode import Nbest, one_best_decoding
 from icefall.utils import get_texts
 
 
+class DecoderOutCache(object):
+    """A bounded LRU cache of projected decoder outputs.
+
+    The stateless decoder sees only the last `context_size` tokens, so its
+    output, after `model.joiner.decoder_proj`, depends only on that context.
+    Contexts repeat a lot from frame to frame and across utterances, so we
+    cache the projected outputs in a tensor of shape (max_size, joiner_dim)
+    and keep a mapping from the context tuple to its row in that tensor.
+
+    Caution:
+      The cached values are only valid for the model that produced them.
+      Use a separate cache for each model.
+    """
+
+    def __init__(self, max_size: int = 10000) -> None:
+        """
+        Args:
+          max_size:
+            Maximum number of contexts to cache. The least recently used
+            ones are evicted first.
+        """
+        assert max_size > 0, max_size
+        self.max_size = max_size
+
+        # Map a context to its row in self._data. The order of the entries
+        # is from the least recently used to the most recently used.
+        self._rows: "OrderedDict[Tuple[int, ...], int]" = OrderedDict()
+
+        # Allocated at the first call since we don't know joiner_dim,
+        # dtype and device before that.
+        self._data: Optional[torch.Tensor] = None
+
+        self.num_queries = 0
+        self.num_hits = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def hit_rate(self) -> float:
+        """Return the fraction of queried contexts found in the cache."""
+        return self.num_hits / max(1, self.num_queries)
+
+    def __str__(self) -> str:
+        return (
+            f"DecoderOutCache(size={len(self)}, max_size={self.max_size}, "
+            f"num_queries={self.num_queries}, "
+            f"hit_rate={self.hit_rate:.4f})"
+        )
+
+    def __call__(
+        self, model: Transducer, contexts: torch.Tensor
+    ) -> torch.Tensor:
+        """Return `model.joiner.decoder_proj(model.decoder(contexts))`,
+        computing it only for contexts not in the cache.
+
+        Args:
+          model:
+            The transducer model.
+          contexts:
+            A 2-D tensor of shape (num_contexts, context_size) containing
+            the decoder input.
+        Returns:
+          Return a tensor of shape (num_contexts, joiner_dim).
+        """
+        assert contexts.ndim == 2, contexts.shape
+        keys = [tuple(c) for c in contexts.tolist()]
+        self.num_queries += len(keys)
+
+        hit_positions = []
+        hit_rows = []
+        miss_positions = []
+        miss_ids = []
+        # Map a missing context to its index in new_keys
+        new_keys: Dict[Tuple[int, ...], int] = {}
+        for i, key in enumerate(keys):
+            row = self._rows.get(key)
+            if row is not None:
+                self._rows.move_to_end(key)
+                hit_positions.append(i)
+                hit_rows.append(row)
+            else:
+                if key not in new_keys:
+                    new_keys[key] = len(new_keys)
+                miss_positions.append(i)
+                miss_ids.append(new_keys[key])
+        self.num_hits += len(hit_positions)
+
+        device = contexts.device
+        if new_keys:
+            decoder_input = torch.tensor(
+                list(new_keys.keys()), device=device, dtype=torch.int64
+            )
+            new_out = model.decoder(decoder_input, need_pad=False)
+            new_out = model.joiner.decoder_proj(new_out).squeeze(1)
+            # new_out is of shape (len(new_keys), joiner_dim)
+
+            if self._data is None:
+                self._data = new_out.new_empty(
+                    (self.max_size, new_out.size(-1))
+                )
+
+        ans = self._data.new_empty((len(keys), self._data.size(-1)))
+        if hit_positions:
+            ans[torch.tensor(hit_positions, device=device)] = self._data[
+                torch.tensor(hit_rows, device=device)
+            ]
+
+        if new_keys:
+            ans[torch.tensor(miss_positions, device=device)] = new_out[
+                torch.tensor(miss_ids, device=device)
+            ]
+            self._insert(list(new_keys.keys()), new_out)
+
+        return ans
+
+    def _insert(
+        self, keys: List[Tuple[int, ...]], values: torch.Tensor
+    ) -> None:
+        """Add new entries, evicting the least recently used ones if
+        the cache is full.
+
+        Args:
+          keys:
+            Contexts that are not in the cache.
+          values:
+            A tensor of shape (len(keys), joiner_dim).
+        """
+        # If there are more new entries than the cache can hold, keep
+        # only the last ones.
+        keys = keys[-self.max_size :]  # noqa: E203
+        values = values[-self.max_size :]  # noqa: E203
+
+        rows = []
+        for key in keys:
+            if len(self._rows) < self.max_size:
+                row = len(self._rows)
+            else:
+                _, row = self._rows.popitem(last=False)
+            self._rows[key] = row
+            rows.append(row)
+
+        self._data[torch.tensor(rows, device=values.device)] = values.to(
+            self._data.dtype
+        )
+
+
+def _get_decoder_cache(
+    model: Transducer, decoder_cache: Optional[DecoderOutCache]
+) -> Optional[DecoderOutCache]:
+    """Return the cache to use for a batched search.
+
+    If `decoder_cache` is None, we use `model.decoder_cache` if it exists
+    so that the cache is shared across batches. Otherwise, no cache is
+    used.
+    """
+    if decoder_cache is not None:
+        return decoder_cache
+    return getattr(model, "decoder_cache", None)
+
+
+def get_decoder_out(
+    model: Transducer,
+    contexts: torch.Tensor,
+    decoder_cache: Optional[DecoderOutCache],
+) -> torch.Tensor:
+    """Return `model.joiner.decoder_proj(model.decoder(contexts))`.
+
+    Args:
+      model:
+        The transducer model.
+      contexts:
+        A 2-D tensor of shape (num_contexts, context_size) containing
+        the decoder input.
+      decoder_cache:
+        If not None, look up the contexts in it. The lookup runs on the
+        CPU, so it is worthwhile only when the same contexts are decoded
+        many times.
+    Returns:
+      Return a tensor of shape (num_contexts, joiner_dim).
+    """
+    if decoder_cache is not None:
+        return decoder_cache(model, contexts)
+    decoder_out = model.decoder(contexts, need_pad=False)
+    return model.joiner.decoder_proj(decoder_out).squeeze(1)
+
+
 def fast_beam_search_one_best(
     model: Transducer,
     decoding_graph: k2.Fsa,
@@ -34,6 +223,7 @@ def fast_beam_search_one_best(
     beam: float,
     max_states: int,
     max_contexts: int,
+    decoder_cache: Optional[DecoderOutCache] = None,
 ) -> List[List[int]]:
     """It limits the maximum number of symbols per frame to 1.
 
@@ -56,6 +246,10 @@ def fast_beam_search_one_best(
         Max states per stream per frame.
       max_contexts:
         Max contexts pre stream per frame.
+      decoder_cache:
+        Cache of the projected decoder outputs. If it is None,
+        `model.decoder_cache` is used if it exists; otherwise, the decoder
+        is run for all contexts without a cache.
     Returns:
       Return the decoded result.
     """
@@ -67,6 +261,7 @@ def fast_beam_search_one_best(
         beam=beam,
         max_states=max_states,
         max_contexts=max_contexts,
+        decoder_cache=decoder_cache,
     )
 
     best_path = one_best_decoding(lattice)
@@ -86,6 +281,7 @@ def fast_beam_search_nbest_oracle(
     ref_texts: List[List[int]],
     use_double_scores: bool = True,
     nbest_scale: float = 0.5,
+    decoder_cache: Optional[DecoderOutCache] = None,
 ) -> List[List[int]]:
     """It limits the maximum number of symbols per frame to 1.
 
@@ -125,6 +321,10 @@ def fast_beam_search_nbest_oracle(
       nbest_scale:
         It's the scale applied to the lattice.scores. A smaller value
         yields more unique paths.
+      decoder_cache:
+        Cache of the projected decoder outputs. If it is None,
+        `model.decoder_cache` is used if it exists; otherwise, the decoder
+        is run for all contexts without a cache.
 
     Returns:
       Return the decoded result.
@@ -137,6 +337,7 @@ def fast_beam_search_nbest_oracle(
         beam=beam,
         max_states=max_states,
         max_contexts=max_contexts,
+        decoder_cache=decoder_cache,
     )
 
     nbest = Nbest.from_lattice(
@@ -177,6 +378,7 @@ def fast_beam_search(
     beam: float,
     max_states: int,
     max_contexts: int,
+    decoder_cache: Optional[DecoderOutCache] = None,
 ) -> k2.Fsa:
     """It limits the maximum number of symbols per frame to 1.
 
@@ -196,6 +398,10 @@ def fast_beam_search(
         Max states per stream per frame.
       max_contexts:
         Max contexts pre stream per frame.
+      decoder_cache:
+        Cache of the projected decoder outputs. If it is None,
+        `model.decoder_cache` is used if it exists; otherwise, the decoder
+        is run for all contexts without a cache.
     Returns:
       Return an FsaVec with axes [utt][state][arc] containing the decoded
       lattice. Note: When the input graph is a TrivialGraph, the returned
@@ -221,6 +427,7 @@ def fast_beam_search(
     decoding_streams = k2.RnntDecodingStreams(individual_streams, config)
 
     encoder_out = model.joiner.encoder_proj(encoder_out)
+    decoder_cache = _get_decoder_cache(model, decoder_cache)
 
     for t in range(T):
         # shape is a RaggedShape of shape (B, context)
@@ -228,9 +435,10 @@ def fast_beam_search(
         shape, contexts = decoding_streams.get_contexts()
         # `nn.Embedding()` in torch below v1.7.1 supports only torch.int64
         contexts = contexts.to(torch.int64)
-        # decoder_out is of shape (shape.NumElements(), 1, decoder_out_dim)
-        decoder_out = model.decoder(contexts, need_pad=False)
-        decoder_out = model.joiner.decoder_proj(decoder_out)
+        # decoder_out is of shape (shape.NumElements(), 1, joiner_dim)
+        decoder_out = get_decoder_out(
+            model, contexts, decoder_cache
+        ).unsqueeze(1)
         # current_encoder_out is of shape
         # (shape.NumElements(), 1, joiner_dim)
         # fmt: off
@@ -334,12 +542,94 @@ def greedy_search(
     return hyp
 
 
+def _sort_by_length(
+    encoder_out: torch.Tensor, encoder_out_lens: torch.Tensor
+) -> Tuple[torch.Tensor, List[int], torch.Tensor]:
+    """Sort the utterances by the number of frames in descending order.
+
+    Args:
+      encoder_out:
+        A tensor of shape (N, T, C).
+      encoder_out_lens:
+        A 1-D tensor of shape (N,) containing the number of valid frames.
+    Returns:
+      Return a tuple containing:
+        - The sorted encoder_out.
+        - A list of length max(encoder_out_lens). Entry t is the number
+          of utterances having more than t frames.
+        - A 1-D tensor to restore the original order of the utterances.
+    """
+    sorted_lens, sorted_indices = encoder_out_lens.sort(descending=True)
+    unsorted_indices = torch.empty_like(sorted_indices)
+    unsorted_indices[sorted_indices] = torch.arange(
+        sorted_indices.numel(), device=sorted_indices.device
+    )
+
+    max_len = int(sorted_lens[0].item())
+    frames = torch.arange(max_len, device=sorted_lens.device)
+    batch_sizes: List[int] = (
+        (sorted_lens.unsqueeze(0) > frames.unsqueeze(1)).sum(dim=1).tolist()
+    )
+    return encoder_out[sorted_indices], batch_sizes, unsorted_indices
+
+
+def _append_tokens(
+    hyps: torch.Tensor,
+    hyp_lens: torch.Tensor,
+    y: torch.Tensor,
+    blank_id: int,
+    unk_id: int,
+) -> torch.Tensor:
+    """Append the non-blank tokens in y to the hypotheses in-place.
+
+    Args:
+      hyps:
+        A 2-D tensor of shape (batch_size, max_len) containing the tokens
+        of each hypothesis.
+      hyp_lens:
+        A 1-D tensor of shape (batch_size,) containing the number of tokens
+        of each hypothesis.
+      y:
+        A 1-D tensor of shape (batch_size,) containing the token to append
+        to each hypothesis.
+      blank_id:
+        The ID of the blank symbol. It is not appended.
+      unk_id:
+        The ID of the unknown symbol. It is not appended.
+    Returns:
+      Return a 1-D bool tensor indicating which hypotheses are extended.
+    """
+    emitted = (y != blank_id) & (y != unk_id)
+    # Write y at the end of every hypothesis. It is kept only if the
+    # length is increased, otherwise it is overwritten later.
+    hyps.scatter_(1, hyp_lens.unsqueeze(1), y.unsqueeze(1))
+    hyp_lens += emitted.to(hyp_lens.dtype)
+    return emitted
+
+
+def _get_contexts(
+    hyps: torch.Tensor, hyp_lens: torch.Tensor, context_size: int
+) -> torch.Tensor:
+    """Return the last `context_size` tokens of each hypothesis, i.e.,
+    the decoder input, as a tensor of shape (batch_size, context_size)."""
+    offsets = torch.arange(context_size, device=hyps.device)
+    index = hyp_lens.unsqueeze(1) - context_size + offsets
+    return hyps.gather(1, index)
+
+
 def greedy_search_batch(
     model: Transducer,
     encoder_out: torch.Tensor,
     encoder_out_lens: torch.Tensor,
+    decoder_cache: Optional[DecoderOutCache] = None,
 ) -> List[List[int]]:
     """Greedy search in batch mode. It hardcodes --max-sym-per-frame=1.
+
+    The hypotheses are kept in a preallocated tensor, which is updated
+    in-place for all utterances of a frame at once. See also
+    :class:`GreedySearch` for a version that can be exported with
+    torch.jit.script().
+
     Args:
       model:
         The transducer model.
@@ -348,19 +638,17 @@ def greedy_search_batch(
       encoder_out_lens:
         A 1-D tensor of shape (N,), containing number of valid frames in
         encoder_out before padding.
+      decoder_cache:
+        Cache of the projected decoder outputs. If it is None,
+        `model.decoder_cache` is used if it exists; otherwise, the decoder
+        is run for all contexts without a cache.
     Returns:
       Return a list-of-list of token IDs containing the decoded results.
       len(ans) equals to encoder_out.size(0).
     """
     assert encoder_out.ndim == 3
     assert encoder_out.size(0) >= 1, encoder_out.size(0)
-
-    packed_encoder_out = torch.nn.utils.rnn.pack_padded_sequence(
-        input=encoder_out,
-        lengths=encoder_out_lens.cpu(),
-        batch_first=True,
-        enforce_sorted=False,
-    )
+    assert torch.all(encoder_out_lens > 0), encoder_out_lens
 
     device = next(model.parameters()).device
 
@@ -368,67 +656,158 @@ def greedy_search_batch(
     unk_id = getattr(model, "unk_id", blank_id)
     context_size = model.decoder.context_size
 
-    batch_size_list = packed_encoder_out.batch_sizes.tolist()
+    encoder_out, batch_size_list, unsorted_indices = _sort_by_length(
+        encoder_out, encoder_out_lens.to(device)
+    )
     N = encoder_out.size(0)
-    assert torch.all(encoder_out_lens > 0), encoder_out_lens
-    assert N == batch_size_list[0], (N, batch_size_list)
-
-    hyps = [[blank_id] * context_size for _ in range(N)]
 
-    decoder_input = torch.tensor(
-        hyps,
+    # The first context_size entries of each hypothesis are blanks
+    hyps = torch.full(
+        (N, context_size + len(batch_size_list)),
+        blank_id,
         device=device,
         dtype=torch.int64,
-    )  # (N, context_size)
-
-    decoder_out = model.decoder(decoder_input, need_pad=False)
-    decoder_out = model.joiner.decoder_proj(decoder_out)
-    # decoder_out: (N, 1, decoder_out_dim)
+    )
+    hyp_lens = torch.full((N,), context_size, device=device, dtype=torch.int64)
 
-    encoder_out = model.joiner.encoder_proj(packed_encoder_out.data)
+    decoder_cache = _get_decoder_cache(model, decoder_cache)
+    decoder_out = get_decoder_out(
+        model, hyps[:, :context_size], decoder_cache
+    )
+    # decoder_out: (N, joiner_dim)
 
-    offset = 0
-    for batch_size in batch_size_list:
-        start = offset
-        end = offset + batch_size
-        current_encoder_out = encoder_out.data[start:end]
-        current_encoder_out = current_encoder_out.unsqueeze(1).unsqueeze(1)
-        # current_encoder_out's shape: (batch_size, 1, 1, encoder_out_dim)
-        offset = end
+    encoder_out = model.joiner.encoder_proj(encoder_out)
 
+    for t, batch_size in enumerate(batch_size_list):
+        current_encoder_out = encoder_out[:batch_size, t]
         decoder_out = decoder_out[:batch_size]
 
         logits = model.joiner(
-            current_encoder_out, decoder_out.unsqueeze(1), project_input=False
+            current_encoder_out.unsqueeze(1).unsqueeze(1),
+            decoder_out.unsqueeze(1).unsqueeze(1),
+            project_input=False,
         )
         # logits'shape (batch_size, 1, 1, vocab_size)
+        y = logits.squeeze(1).squeeze(1).argmax(dim=1)
 
-        logits = logits.squeeze(1).squeeze(1)  # (batch_size, vocab_size)
-        assert logits.ndim == 2, logits.shape
-        y = logits.argmax(dim=1).tolist()
-        emitted = False
-        for i, v in enumerate(y):
-            if v not in (blank_id, unk_id):
-                hyps[i].append(v)
-                emitted = True
-        if emitted:
+        emitted = _append_tokens(
+            hyps[:batch_size], hyp_lens[:batch_size], y, blank_id, unk_id
+        )
+        if emitted.any():
             # update decoder output
-            decoder_input = [h[-context_size:] for h in hyps[:batch_size]]
-            decoder_input = torch.tensor(
-                decoder_input,
-                device=device,
-                dtype=torch.int64,
+            decoder_input = _get_contexts(
+                hyps[:batch_size], hyp_lens[:batch_size], context_size
             )
-            decoder_out = model.decoder(decoder_input, need_pad=False)
-            decoder_out = model.joiner.decoder_proj(decoder_out)
+            decoder_out = get_decoder_out(model, decoder_input, decoder_cache)
 
-    sorted_ans = [h[context_size:] for h in hyps]
-    ans = []
-    unsorted_indices = packed_encoder_out.unsorted_indices.tolist()
-    for i in range(N):
-        ans.append(sorted_ans[unsorted_indices[i]])
+    hyps = hyps[unsorted_indices, context_size:].tolist()
+    hyp_lens = (hyp_lens[unsorted_indices] - context_size).tolist()
+    return [h[:n] for h, n in zip(hyps, hyp_lens)]
 
-    return ans
+
+class GreedySearch(nn.Module):
+    """Greedy search in batch mode that can be exported with
+    torch.jit.script(). It hardcodes --max-sym-per-frame=1 and gives
+    the same results as :func:`greedy_search_batch`.
+
+    Usage::
+
+        greedy_search = torch.jit.script(GreedySearch(model))
+        hyps, hyp_lens = greedy_search(encoder_out, encoder_out_lens)
+    """
+
+    def __init__(self, model: Transducer, unk_id: Optional[int] = None):
+        """
+        Args:
+          model:
+            The transducer model. Its decoder and joiner are shared with
+            this module.
+          unk_id:
+            The ID of the unknown symbol, which is never emitted. If None,
+            `model.unk_id` is used if it exists; otherwise, the blank ID.
+        """
+        super().__init__()
+        self.decoder = model.decoder
+        self.joiner = model.joiner
+        self.blank_id: int = model.decoder.blank_id
+        self.context_size: int = model.decoder.context_size
+        if unk_id is None:
+            unk_id = getattr(model, "unk_id", self.blank_id)
+        self.unk_id: int = unk_id
+
+    def get_decoder_out(self, contexts: torch.Tensor) -> torch.Tensor:
+        """Return the projected decoder output of shape
+        (batch_size, joiner_dim) for contexts of shape
+        (batch_size, context_size)."""
+        decoder_out = self.decoder(contexts, need_pad=False)
+        return self.joiner.decoder_proj(decoder_out).squeeze(1)
+
+    def forward(
+        self, encoder_out: torch.Tensor, encoder_out_lens: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Args:
+          encoder_out:
+            Output from the encoder. Its shape is (N, T, C), where N >= 1.
+          encoder_out_lens:
+            A 1-D tensor of shape (N,), containing number of valid frames in
+            encoder_out before padding. All entries have to be positive.
+        Returns:
+          Return a tuple containing:
+            - A 2-D tensor of shape (N, max(encoder_out_lens)) containing
+              the decoded token IDs of each utterance, padded with blanks.
+            - A 1-D tensor of shape (N,) containing the number of decoded
+              tokens of each utterance.
+        """
+        assert encoder_out.dim() == 3, encoder_out.shape
+        device = encoder_out.device
+        context_size = self.context_size
+
+        encoder_out, batch_size_list, unsorted_indices = _sort_by_length(
+            encoder_out, encoder_out_lens.to(device)
+        )
+        N = encoder_out.size(0)
+
+        hyps = torch.full(
+            (N, context_size + len(batch_size_list)),
+            self.blank_id,
+            device=device,
+            dtype=torch.int64,
+        )
+        hyp_lens = torch.full(
+            (N,), context_size, device=device, dtype=torch.int64
+        )
+
+        decoder_out = self.get_decoder_out(hyps[:, :context_size])
+        encoder_out = self.joiner.encoder_proj(encoder_out)
+
+        for t, batch_size in enumerate(batch_size_list):
+            current_encoder_out = encoder_out[:batch_size, t]
+            decoder_out = decoder_out[:batch_size]
+
+            logits = self.joiner(
+                current_encoder_out.unsqueeze(1).unsqueeze(1),
+                decoder_out.unsqueeze(1).unsqueeze(1),
+                project_input=False,
+            )
+            y = logits.squeeze(1).squeeze(1).argmax(dim=1)
+
+            emitted = _append_tokens(
+                hyps[:batch_size],
+                hyp_lens[:batch_size],
+                y,
+                self.blank_id,
+                self.unk_id,
+            )
+            if bool(emitted.any()):
+                decoder_input = _get_contexts(
+                    hyps[:batch_size], hyp_lens[:batch_size], context_size
+                )
+                decoder_out = self.get_decoder_out(decoder_input)
+
+        hyps = hyps[unsorted_indices, context_size:]
+        hyp_lens = hyp_lens[unsorted_indices] - context_size
+        return hyps, hyp_lens
 
 
 @dataclass
@@ -557,29 +936,12 @@ class HypothesisList(object):
         return ", ".join(s)
 
 
-def _get_hyps_shape(hyps: List[HypothesisList]) -> k2.RaggedShape:
-    """Return a ragged shape with axes [utt][num_hyps].
-
-    Args:
-      hyps:
-        len(hyps) == batch_size. It contains the current hypothesis for
-        each utterance in the batch.
-    Returns:
-      Return a ragged shape with 2 axes [utt][num_hyps]. Note that
-      the shape is on CPU.
-    """
-    num_hyps = [len(h) for h in hyps]
-
-    # torch.cumsum() is inclusive sum, so we put a 0 at the beginning
-    # to get exclusive sum later.
-    num_hyps.insert(0, 0)
-
-    num_hyps = torch.tensor(num_hyps)
-    row_splits = torch.cumsum(num_hyps, dim=0, dtype=torch.int32)
-    ans = k2.ragged.create_ragged_shape2(
-        row_splits=row_splits, cached_tot_size=row_splits[-1].item()
-    )
-    return ans
+# Bases and moduli of the two polynomial rolling hashes used by
+# :func:`modified_beam_search` to detect hypotheses with identical
+# token sequences. Both moduli are primes below 2**31 so that
+# `hash * base + token` never overflows int64.
+_HYP_HASH_BASES = (131071, 524287)
+_HYP_HASH_MODULI = (2147483647, 2147483629)
 
 
 def modified_beam_search(
@@ -587,9 +949,18 @@ def modified_beam_search(
     encoder_out: torch.Tensor,
     encoder_out_lens: torch.Tensor,
     beam: int = 4,
+    decoder_cache: Optional[DecoderOutCache] = None,
 ) -> List[List[int]]:
     """Beam search in batch mode with --max-sym-per-frame=1 being hardcoded.
 
+    Hypotheses are kept in padded tensors with `beam` slots per utterance,
+    so each frame needs only one batched top-k and there is no Python loop
+    over utterances. Inactive slots have a score of -inf. Hypotheses with
+    identical token sequences are detected by comparing their lengths and
+    rolling hashes and are merged with `log-sum-exp`, in the same order
+    as :meth:`HypothesisList.add` would merge them. The token sequences are
+    recovered at the end by following the back pointers of each frame.
+
     Args:
       model:
         The transducer model.
@@ -600,6 +971,10 @@ def modified_beam_search(
         encoder_out before padding.
       beam:
         Number of active paths during the beam search.
+      decoder_cache:
+        Cache of the projected decoder outputs. If it is None,
+        `model.decoder_cache` is used if it exists; otherwise, the decoder
+        is run for all contexts without a cache.
     Returns:
       Return a list-of-list of token IDs. ans[i] is the decoding results
       for the i-th utterance.
@@ -624,106 +999,172 @@ def modified_beam_search(
     assert torch.all(encoder_out_lens > 0), encoder_out_lens
     assert N == batch_size_list[0], (N, batch_size_list)
 
-    B = [HypothesisList() for _ in range(N)]
-    for i in range(N):
-        B[i].add(
-            Hypothesis(
-                ys=[blank_id] * context_size,
-                log_prob=torch.zeros(1, dtype=torch.float32, device=device),
-            )
-        )
+    # scores[i, k] is the log_prob of the k-th hypothesis of utterance i.
+    # Only the first slot is active at the beginning.
+    scores = torch.full(
+        (N, beam), float("-inf"), dtype=torch.float32, device=device
+    )
+    scores[:, 0] = 0
+
+    # The last `context_size` tokens of each hypothesis, i.e., the decoder
+    # input.
+    contexts = torch.full(
+        (N, beam, context_size), blank_id, dtype=torch.int64, device=device
+    )
+
+    # Number of tokens in each hypothesis, including the leading blanks.
+    # It is used for length normalization at the end.
+    lengths = torch.full(
+        (N, beam), context_size, dtype=torch.int64, device=device
+    )
+
+    hash_bases = torch.tensor(_HYP_HASH_BASES, device=device)
+    hash_moduli = torch.tensor(_HYP_HASH_MODULI, device=device)
+    hashes = torch.zeros((N, beam, 2), dtype=torch.int64, device=device)
+
+    # back_pointers[t][i, k] is the slot at frame t-1 from which the k-th
+    # hypothesis of utterance i at frame t is expanded, and
+    # emitted_tokens[t][i, k] is the token it emitted, or -1 if it emitted
+    # nothing.
+    back_pointers = []
+    emitted_tokens = []
+
+    beam_range = torch.arange(beam, device=device)
 
     encoder_out = model.joiner.encoder_proj(packed_encoder_out.data)
+    decoder_cache = _get_decoder_cache(model, decoder_cache)
 
     offset = 0
-    finalized_B = []
     for batch_size in batch_size_list:
         start = offset
         end = offset + batch_size
         current_encoder_out = encoder_out.data[start:end]
-        current_encoder_out = current_encoder_out.unsqueeze(1).unsqueeze(1)
-        # current_encoder_out's shape is (batch_size, 1, 1, encoder_out_dim)
         offset = end
 
-        finalized_B = B[batch_size:] + finalized_B
-        B = B[:batch_size]
-
-        hyps_shape = _get_hyps_shape(B).to(device)
-
-        A = [list(b) for b in B]
-        B = [HypothesisList() for _ in range(batch_size)]
-
-        ys_log_probs = torch.cat(
-            [hyp.log_prob.reshape(1, 1) for hyps in A for hyp in hyps]
-        )  # (num_hyps, 1)
-
-        decoder_input = torch.tensor(
-            [hyp.ys[-context_size:] for hyps in A for hyp in hyps],
-            device=device,
-            dtype=torch.int64,
-        )  # (num_hyps, context_size)
-
-        decoder_out = model.decoder(decoder_input, need_pad=False).unsqueeze(1)
-        decoder_out = model.joiner.decoder_proj(decoder_out)
-        # decoder_out is of shape (num_hyps, 1, 1, joiner_dim)
+        current_encoder_out = (
+            current_encoder_out.unsqueeze(1)
+            .expand(batch_size, beam, -1)
+            .reshape(batch_size * beam, 1, 1, -1)
+        )
+        # current_encoder_out is of shape
+        # (batch_size * beam, 1, 1, encoder_out_dim)
 
-        # Note: For torch 1.7.1 and below, it requires a torch.int64 tensor
-        # as index, so we use `to(torch.int64)` below.
-        current_encoder_out = torch.index_select(
-            current_encoder_out,
-            dim=0,
-            index=hyps_shape.row_ids(1).to(torch.int64),
-        )  # (num_hyps, 1, 1, encoder_out_dim)
+        decoder_input = contexts[:batch_size].reshape(-1, context_size)
+        decoder_out = get_decoder_out(model, decoder_input, decoder_cache)
+        decoder_out = decoder_out.unsqueeze(1).unsqueeze(1)
+        # decoder_out is of shape (batch_size * beam, 1, 1, joiner_dim)
 
         logits = model.joiner(
             current_encoder_out,
             decoder_out,
             project_input=False,
-        )  # (num_hyps, 1, 1, vocab_size)
+        )  # (batch_size * beam, 1, 1, vocab_size)
 
-        logits = logits.squeeze(1).squeeze(1)  # (num_hyps, vocab_size)
+        logits = logits.squeeze(1).squeeze(1)
 
-        log_probs = logits.log_softmax(dim=-1)  # (num_hyps, vocab_size)
+        log_probs = logits.log_softmax(dim=-1)
+        vocab_size = log_probs.size(-1)
 
-        log_probs.add_(ys_log_probs)
+        log_probs = log_probs.reshape(batch_size, beam, vocab_size)
+        log_probs.add_(scores[:batch_size].unsqueeze(2))
 
-        vocab_size = log_probs.size(-1)
+        topk_log_probs, topk_indexes = log_probs.reshape(batch_size, -1).topk(
+            beam
+        )  # (batch_size, beam)
 
-        log_probs = log_probs.reshape(-1)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            topk_hyp_indexes = topk_indexes // vocab_size
+            topk_token_indexes = topk_indexes % vocab_size
 
-        row_splits = hyps_shape.row_splits(1) * vocab_size
-        log_probs_shape = k2.ragged.create_ragged_shape2(
-            row_splits=row_splits, cached_tot_size=log_probs.numel()
+        emitted = (topk_token_indexes != blank_id) & (
+            topk_token_indexes != unk_id
         )
-        ragged_log_probs = k2.RaggedTensor(
-            shape=log_probs_shape, value=log_probs
-        )
-
-        for i in range(batch_size):
-            topk_log_probs, topk_indexes = ragged_log_probs[i].topk(beam)
 
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                topk_hyp_indexes = (topk_indexes // vocab_size).tolist()
-                topk_token_indexes = (topk_indexes % vocab_size).tolist()
+        new_contexts = contexts[:batch_size].gather(
+            1, topk_hyp_indexes.unsqueeze(2).expand(-1, -1, context_size)
+        )
+        new_contexts = torch.where(
+            emitted.unsqueeze(2),
+            torch.cat(
+                [new_contexts[:, :, 1:], topk_token_indexes.unsqueeze(2)],
+                dim=2,
+            ),
+            new_contexts,
+        )
 
-            for k in range(len(topk_hyp_indexes)):
-                hyp_idx = topk_hyp_indexes[k]
-                hyp = A[i][hyp_idx]
+        new_lengths = lengths[:batch_size].gather(1, topk_hyp_indexes)
+        new_lengths += emitted
 
-                new_ys = hyp.ys[:]
-                new_token = topk_token_indexes[k]
-                if new_token not in (blank_id, unk_id):
-                    new_ys.append(new_token)
+        new_hashes = hashes[:batch_size].gather(
+            1, topk_hyp_indexes.unsqueeze(2).expand(-1, -1, 2)
+        )
+        new_hashes = torch.where(
+            emitted.unsqueeze(2),
+            (new_hashes * hash_bases + topk_token_indexes.unsqueeze(2) + 1)
+            % hash_moduli,
+            new_hashes,
+        )
 
-                new_log_prob = topk_log_probs[k]
-                new_hyp = Hypothesis(ys=new_ys, log_prob=new_log_prob)
-                B[i].add(new_hyp)
+        # same[i, j, k] is True if the j-th and the k-th new hypotheses of
+        # utterance i have the same token sequence.
+        same = (new_lengths.unsqueeze(2) == new_lengths.unsqueeze(1)) & (
+            new_hashes.unsqueeze(2) == new_hashes.unsqueeze(1)
+        ).all(dim=-1)
+
+        # first[i, k] is the smallest j such that same[i, j, k] is True,
+        # i.e., the slot the k-th hypothesis is merged into.
+        first = (
+            beam_range.reshape(1, beam, 1)
+            .expand_as(same)
+            .masked_fill(~same, beam)
+            .amin(dim=1)
+        )
 
-    B = B + finalized_B
-    best_hyps = [b.get_most_probable(length_norm=True) for b in B]
+        new_scores = torch.where(
+            first == beam_range,
+            topk_log_probs,
+            torch.full_like(topk_log_probs, float("-inf")),
+        )
+        # Merge duplicates in the order of topk_log_probs. It has only
+        # `beam` iterations and each of them processes all utterances.
+        for k in range(1, beam):
+            index = first[:, k : k + 1]  # noqa: E203
+            log_prob = topk_log_probs[:, k : k + 1]  # noqa: E203
+            merged = new_scores.gather(1, index)
+            merged = torch.where(
+                index == k, merged, torch.logaddexp(merged, log_prob)
+            )
+            new_scores.scatter_(1, index, merged)
+
+        scores[:batch_size] = new_scores
+        contexts[:batch_size] = new_contexts
+        lengths[:batch_size] = new_lengths
+        hashes[:batch_size] = new_hashes
+
+        back_pointers.append(topk_hyp_indexes)
+        emitted_tokens.append(
+            torch.where(
+                emitted,
+                topk_token_indexes,
+                torch.full_like(topk_token_indexes, -1),
+            )
+        )
 
-    sorted_ans = [h.ys[context_size:] for h in best_hyps]
+    # Select the best hypothesis of each utterance with length
+    # normalization and trace it back to the first frame.
+    best_slots = (scores / lengths).argmax(dim=1)
+    tokens = torch.full(
+        (N, len(batch_size_list)), -1, dtype=torch.int64, device=device
+    )
+    for t in range(len(batch_size_list) - 1, -1, -1):
+        batch_size = batch_size_list[t]
+        slots = best_slots[:batch_size].unsqueeze(1)
+        tokens[:batch_size, t] = emitted_tokens[t].gather(1, slots).squeeze(1)
+        best_slots[:batch_size] = back_pointers[t].gather(1, slots).squeeze(1)
+
+    tokens = tokens.tolist()
+    sorted_ans = [[i for i in row if i >= 0] for row in tokens]
     ans = []
     unsorted_indices = packed_encoder_out.unsorted_indices.tolist()
     for i in range(N):
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script measures the time of Eve.step() with and without
+the torch._foreach_* functions for conformer encoders of several sizes.
+
+Usage:
+
+    cd icefall/egs/librispeech/ASR
+    python ./pruned_transducer_stateless2/benchmark_optim.py
+    python ./pruned_transducer_stateless2/benchmark_optim.py --device cpu
+
+Note:
+  On the CPU, the torch._foreach_* functions only loop over the tensors,
+  so the foreach implementation is not faster there. Eve uses it only if
+  it is created with foreach=True, i.e., with --optim-foreach true in
+  train.py.
+"""
+
+import argparse
+import time
+
+import torch
+from conformer import Conformer
+from optim import Eve
+
+# (d_model, dim_feedforward, num_encoder_layers)
+MODEL_SIZES = [
+    (144, 576, 6),
+    (256, 1024, 12),
+    (512, 2048, 12),
+    (512, 2048, 24),
+]
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda" if torch.cuda.is_available() else "cpu",
+        help="The device to run on.",
+    )
+
+    parser.add_argument(
+        "--num-steps",
+        type=int,
+        default=20,
+        help="Number of optimizer steps to average over.",
+    )
+
+    return parser.parse_args()
+
+
+def benchmark(
+    model: torch.nn.Module, foreach: bool, num_steps: int
+) -> float:
+    """Return the seconds per optimizer step."""
+    device = next(model.parameters()).device
+    optimizer = Eve(model.parameters(), foreach=foreach)
+    for p in model.parameters():
+        p.grad = torch.randn_like(p) * 1e-3
+
+    # Warm up, which also allocates the state
+    optimizer.step()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        optimizer.step()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) / num_steps
+
+
+def main():
+    args = get_args()
+    device = torch.device(args.device)
+    print(f"device: {device}, torch {torch.__version__}")
+
+    for d_model, dim_feedforward, num_layers in MODEL_SIZES:
+        model = Conformer(
+            num_features=80,
+            d_model=d_model,
+            nhead=4,
+            dim_feedforward=dim_feedforward,
+            num_encoder_layers=num_layers,
+        ).to(device)
+        num_tensors = len(list(model.parameters()))
+        num_params = sum(p.numel() for p in model.parameters())
+
+        loop = benchmark(model, foreach=False, num_steps=args.num_steps)
+        foreach = benchmark(model, foreach=True, num_steps=args.num_steps)
+        print(
+            f"{num_params / 1e6:6.1f}M params in {num_tensors:4d} tensors: "
+            f"loop {loop * 1000:7.2f} ms, foreach {foreach * 1000:7.2f} ms, "
+            f"speedup {loop / foreach:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -16,9 +16,8 @@
 # limitations under the License.
 
 import copy
-import math
 import warnings
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 import torch
 from encoder_interface import EncoderInterface
@@ -32,7 +31,8 @@ from scaling import (
 )
 from torch import Tensor, nn
 
-from icefall.utils import make_pad_mask
+from icefall.rel_pos_emb import compute_rel_pos_emb, get_rel_pos_emb
+from icefall.utils import make_pad_mask, subsequent_chunk_mask
 
 
 class Conformer(EncoderInterface):
@@ -48,6 +48,17 @@ class Conformer(EncoderInterface):
         layer_dropout (float): layer-dropout rate.
         cnn_module_kernel (int): Kernel size of convolution module
         vgg_frontend (bool): whether to use vgg frontend.
+        causal (bool): whether to use causal convolution in the conformer
+            layers. It is required for :meth:`streaming_forward`.
+        dynamic_chunk_training (bool): whether to restrict the attention to
+            chunks of random sizes during training, so that the model can
+            be used for streaming decoding.
+        short_chunk_threshold (float): a random chunk size larger than
+            short_chunk_threshold * T means using the full context.
+        short_chunk_size (int): otherwise, the chunk size is sampled from
+            [1, short_chunk_size].
+        num_left_chunks (int): number of left chunks visible in dynamic chunk
+            training. -1 means all of the left chunks.
     """
 
     def __init__(
@@ -61,11 +72,24 @@ class Conformer(EncoderInterface):
         dropout: float = 0.1,
         layer_dropout: float = 0.075,
         cnn_module_kernel: int = 31,
+        causal: bool = False,
+        dynamic_chunk_training: bool = False,
+        short_chunk_threshold: float = 0.75,
+        short_chunk_size: int = 25,
+        num_left_chunks: int = -1,
     ) -> None:
         super(Conformer, self).__init__()
 
         self.num_features = num_features
         self.subsampling_factor = subsampling_factor
+        self.d_model = d_model
+        self.num_encoder_layers = num_encoder_layers
+        self.cnn_module_kernel = cnn_module_kernel
+        self.causal = causal
+        self.dynamic_chunk_training = dynamic_chunk_training
+        self.short_chunk_threshold = short_chunk_threshold
+        self.short_chunk_size = short_chunk_size
+        self.num_left_chunks = num_left_chunks
         if subsampling_factor != 4:
             raise NotImplementedError("Support only 'subsampling_factor=4'.")
 
@@ -85,6 +109,7 @@ class Conformer(EncoderInterface):
             dropout,
             layer_dropout,
             cnn_module_kernel,
+            causal,
         )
         self.encoder = ConformerEncoder(encoder_layer, num_encoder_layers)
 
@@ -122,14 +147,155 @@ class Conformer(EncoderInterface):
         assert x.size(0) == lengths.max().item()
         mask = make_pad_mask(lengths)
 
+        src_mask: Optional[Tensor] = None
+        if self.dynamic_chunk_training and self.training:
+            max_len = x.size(0)
+            chunk_size = int(torch.randint(1, max_len + 1, (1,)).item())
+            if chunk_size > max_len * self.short_chunk_threshold:
+                chunk_size = max_len
+            else:
+                chunk_size = chunk_size % self.short_chunk_size + 1
+            src_mask = ~subsequent_chunk_mask(
+                size=max_len,
+                chunk_size=chunk_size,
+                num_left_chunks=self.num_left_chunks,
+                device=x.device,
+            )
+
         x = self.encoder(
-            x, pos_emb, src_key_padding_mask=mask, warmup=warmup
+            x, pos_emb, mask=src_mask, src_key_padding_mask=mask, warmup=warmup
         )  # (T, N, C)
 
         x = x.permute(1, 0, 2)  # (T, N, C) ->(N, T, C)
 
         return x, lengths
 
+    def get_init_state(
+        self, left_context: int, device: torch.device = torch.device("cpu")
+    ) -> List[Tensor]:
+        """Return the initial caches of a single stream for
+        :meth:`streaming_forward`.
+
+        Args:
+          left_context:
+            Number of encoder frames (after subsampling) cached for the
+            attention.
+          device:
+            The device of the returned tensors.
+        Returns:
+          Return a list of two tensors:
+            - attention cache, of shape (num_layers, left_context, d_model)
+            - convolution cache, of shape
+              (num_layers, cnn_module_kernel - 1, d_model)
+          Use `torch.stack(..., dim=2)` to batch the states of several
+          streams.
+        """
+        attn_cache = torch.zeros(
+            self.num_encoder_layers, left_context, self.d_model, device=device
+        )
+        conv_cache = torch.zeros(
+            self.num_encoder_layers,
+            self.cnn_module_kernel - 1,
+            self.d_model,
+            device=device,
+        )
+        return [attn_cache, conv_cache]
+
+    def streaming_forward(
+        self,
+        x: torch.Tensor,
+        x_lens: torch.Tensor,
+        states: List[Tensor],
+        processed_lens: torch.Tensor,
+        left_context: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor, List[Tensor]]:
+        """Run the encoder on one chunk of each stream.
+
+        The attention of each layer sees the current chunk and at most
+        `left_context` frames before it, which are taken from `states`
+        together with the left context of the causal convolution.
+        It should be used only with a model trained with
+        --causal-convolution and, preferably, --dynamic-chunk-training.
+
+        Args:
+          x:
+            The input tensor of shape (batch_size, chunk_len, feature_dim).
+            An output frame i of the subsampling module depends on the
+            input frames 4i-1 to 4i+7. To get the `C` output frames of a
+            chunk starting at the input frame 4j, x should contain the
+            input frames 4j-4 to 4j+4C+7, i.e., chunk_len should be
+            `C * subsampling_factor + 8`, and the next chunk should start
+            `C * subsampling_factor` frames after the start of this one.
+            The 4 frames before the first chunk are all zeros, which is the
+            padding of the subsampling module in :meth:`forward`.
+          x_lens:
+            A tensor of shape (batch_size,) containing the number of
+            frames in `x` before padding.
+          states:
+            A list of two tensors, see :meth:`get_init_state`:
+              - attention cache, (num_layers, left_context, batch_size, d_model)
+              - convolution cache,
+                (num_layers, cnn_module_kernel - 1, batch_size, d_model)
+          processed_lens:
+            A tensor of shape (batch_size,) containing the number of encoder
+            frames processed so far by each stream. Cached frames that were
+            never computed are masked out.
+          left_context:
+            Number of cached frames to attend to. It must match the size of
+            the attention cache in `states`.
+        Returns:
+          Return a tuple containing 3 entries:
+            - embeddings: its shape is (batch_size, output_chunk_len, d_model)
+            - lengths, a tensor of shape (batch_size,) containing the number
+              of frames in `embeddings` before padding.
+            - the updated states, with the same shapes as `states`.
+        """
+        assert not self.training
+        assert self.causal, (
+            "Streaming decoding requires a model trained "
+            "with --causal-convolution"
+        )
+        assert states[0].size(1) == left_context, (
+            states[0].shape,
+            left_context,
+        )
+
+        x = self.encoder_embed(x)
+        # The first output frame depends on the padding of the subsampling
+        # module instead of the frame before x. It is the last output frame
+        # of the previous chunk, so it is dropped.
+        x = x[:, 1:]
+        x, pos_emb = self.encoder_pos(x, left_context=left_context)
+        x = x.permute(1, 0, 2)  # (N, T, C) -> (T, N, C)
+
+        lengths = ((((x_lens - 1) >> 1) - 1) >> 1) - 1
+        lengths = lengths.clamp(min=0)
+
+        batch_size = x.size(1)
+        chunk_len = x.size(0)
+        mask = torch.arange(chunk_len, device=x.device).expand(
+            batch_size, chunk_len
+        ) >= lengths.unsqueeze(1)
+
+        # The i-th cached frame is the (left_context - i)-th frame
+        # before the current chunk.
+        cache_mask = torch.arange(left_context, 0, -1, device=x.device).expand(
+            batch_size, left_context
+        ) > processed_lens.unsqueeze(1)
+        mask = torch.cat([cache_mask, mask], dim=1)
+
+        x, states = self.encoder.chunk_forward(
+            x,
+            pos_emb,
+            states=states,
+            src_key_padding_mask=mask,
+            left_context=left_context,
+        )  # (T, N, C)
+
+        x = x.permute(1, 0, 2)  # (T, N, C) ->(N, T, C)
+
+        return x, lengths, states
+
 
 class ConformerEncoderLayer(nn.Module):
     """
@@ -142,6 +308,7 @@ class ConformerEncoderLayer(nn.Module):
         dim_feedforward: the dimension of the feedforward network model (default=2048).
         dropout: the dropout value (default=0.1).
         cnn_module_kernel (int): Kernel size of convolution module.
+        causal (bool): Whether to use causal convolution.
 
     Examples::
         >>> encoder_layer = ConformerEncoderLayer(d_model=512, nhead=8)
@@ -158,6 +325,7 @@ class ConformerEncoderLayer(nn.Module):
         dropout: float = 0.1,
         layer_dropout: float = 0.075,
         cnn_module_kernel: int = 31,
+        causal: bool = False,
     ) -> None:
         super(ConformerEncoderLayer, self).__init__()
 
@@ -185,7 +353,9 @@ class ConformerEncoderLayer(nn.Module):
             ScaledLinear(dim_feedforward, d_model, initial_scale=0.25),
         )
 
-        self.conv_module = ConvolutionModule(d_model, cnn_module_kernel)
+        self.conv_module = ConvolutionModule(
+            d_model, cnn_module_kernel, causal=causal
+        )
 
         self.norm_final = BasicNorm(d_model)
 
@@ -263,6 +433,62 @@ class ConformerEncoderLayer(nn.Module):
 
         return src
 
+    def chunk_forward(
+        self,
+        src: Tensor,
+        pos_emb: Tensor,
+        states: List[Tensor],
+        src_key_padding_mask: Optional[Tensor] = None,
+        left_context: int = 0,
+    ) -> Tuple[Tensor, List[Tensor]]:
+        """
+        Pass one chunk through the encoder layer. Used only in inference.
+
+        Args:
+            src: the chunk to the encoder layer (required).
+            pos_emb: Positional embedding tensor (required).
+            states: the attention cache and the convolution cache of this
+              layer (required).
+            src_key_padding_mask: the mask for the cached frames and the
+              frames of the chunk per batch (optional).
+            left_context: number of cached frames for the attention.
+
+        Shape:
+            src: (S, N, E).
+            pos_emb: (N, 2*S+left_context-1, E)
+            states[0]: (left_context, N, E)
+            states[1]: (cnn_module_kernel - 1, N, E)
+            src_key_padding_mask: (N, left_context+S).
+            S is the chunk length, N is the batch size, E is the feature number
+        """
+        # macaron style feed forward module
+        src = src + self.dropout(self.feed_forward_macaron(src))
+
+        # multi-headed self-attention module
+        key = torch.cat([states[0], src], dim=0)
+        attn_cache = key[key.size(0) - left_context :]  # noqa: E203
+        src_att = self.self_attn(
+            src,
+            key,
+            key,
+            pos_emb=pos_emb,
+            key_padding_mask=src_key_padding_mask,
+        )[0]
+        src = src + self.dropout(src_att)
+
+        # convolution module
+        src_conv, conv_cache = self.conv_module.streaming_forward(
+            src, states[1]
+        )
+        src = src + self.dropout(src_conv)
+
+        # feed forward module
+        src = src + self.dropout(self.feed_forward(src))
+
+        src = self.norm_final(self.balancer(src))
+
+        return src, [attn_cache, conv_cache]
+
 
 class ConformerEncoder(nn.Module):
     r"""ConformerEncoder is a stack of N encoder layers
@@ -323,6 +549,52 @@ class ConformerEncoder(nn.Module):
 
         return output
 
+    def chunk_forward(
+        self,
+        src: Tensor,
+        pos_emb: Tensor,
+        states: List[Tensor],
+        src_key_padding_mask: Optional[Tensor] = None,
+        left_context: int = 0,
+    ) -> Tuple[Tensor, List[Tensor]]:
+        r"""Pass one chunk through the encoder layers in turn.
+
+        Args:
+            src: the chunk to the encoder (required).
+            pos_emb: Positional embedding tensor (required).
+            states: the attention caches and the convolution caches of
+              all layers (required).
+            src_key_padding_mask: the mask for the cached frames and the
+              frames of the chunk per batch (optional).
+            left_context: number of cached frames for the attention.
+
+        Shape:
+            src: (S, N, E).
+            pos_emb: (N, 2*S+left_context-1, E)
+            states[0]: (num_layers, left_context, N, E)
+            states[1]: (num_layers, cnn_module_kernel - 1, N, E)
+            src_key_padding_mask: (N, left_context+S).
+        """
+        assert states[0].size(0) == self.num_layers, states[0].shape
+        assert states[1].size(0) == self.num_layers, states[1].shape
+
+        output = src
+
+        attn_caches = []
+        conv_caches = []
+        for i, mod in enumerate(self.layers):
+            output, layer_states = mod.chunk_forward(
+                output,
+                pos_emb,
+                states=[states[0][i], states[1][i]],
+                src_key_padding_mask=src_key_padding_mask,
+                left_context=left_context,
+            )
+            attn_caches.append(layer_states[0])
+            conv_caches.append(layer_states[1])
+
+        return output, [torch.stack(attn_caches), torch.stack(conv_caches)]
+
 
 class RelPositionalEncoding(torch.nn.Module):
     """Relative positional encoding module.
@@ -347,57 +619,54 @@ class RelPositionalEncoding(torch.nn.Module):
         self.pe = None
         self.extend_pe(torch.tensor(0.0).expand(1, max_len))
 
-    def extend_pe(self, x: Tensor) -> None:
+    def extend_pe(self, x: Tensor, left_context: int = 0) -> None:
         """Reset the positional encodings."""
+        x_size_1 = x.size(1) + left_context
+        if not torch.jit.is_scripting():
+            # The tables are shared by all modules and cached per device
+            # and dtype, see icefall/rel_pos_emb.py
+            self.pe = get_rel_pos_emb(
+                length=x_size_1,
+                d_model=self.d_model,
+                device=x.device,
+                dtype=x.dtype,
+            )
+            return
+
         if self.pe is not None:
             # self.pe contains both positive and negative parts
             # the length of self.pe is 2 * input_len - 1
-            if self.pe.size(1) >= x.size(1) * 2 - 1:
+            if self.pe.size(1) >= x_size_1 * 2 - 1:
                 # Note: TorchScript doesn't implement operator== for torch.Device
                 if self.pe.dtype != x.dtype or str(self.pe.device) != str(
                     x.device
                 ):
                     self.pe = self.pe.to(dtype=x.dtype, device=x.device)
                 return
-        # Suppose `i` means to the position of query vecotr and `j` means the
-        # position of key vector. We use position relative positions when keys
-        # are to the left (i>j) and negative relative positions otherwise (i<j).
-        pe_positive = torch.zeros(x.size(1), self.d_model)
-        pe_negative = torch.zeros(x.size(1), self.d_model)
-        position = torch.arange(0, x.size(1), dtype=torch.float32).unsqueeze(1)
-        div_term = torch.exp(
-            torch.arange(0, self.d_model, 2, dtype=torch.float32)
-            * -(math.log(10000.0) / self.d_model)
-        )
-        pe_positive[:, 0::2] = torch.sin(position * div_term)
-        pe_positive[:, 1::2] = torch.cos(position * div_term)
-        pe_negative[:, 0::2] = torch.sin(-1 * position * div_term)
-        pe_negative[:, 1::2] = torch.cos(-1 * position * div_term)
-
-        # Reserve the order of positive indices and concat both positive and
-        # negative indices. This is used to support the shifting trick
-        # as in "Transformer-XL: Attentive Language Models Beyond a Fixed-Length Context"
-        pe_positive = torch.flip(pe_positive, [0]).unsqueeze(0)
-        pe_negative = pe_negative[1:].unsqueeze(0)
-        pe = torch.cat([pe_positive, pe_negative], dim=1)
+        pe = compute_rel_pos_emb(x_size_1, self.d_model)
         self.pe = pe.to(device=x.device, dtype=x.dtype)
 
-    def forward(self, x: torch.Tensor) -> Tuple[Tensor, Tensor]:
+    def forward(
+        self, x: torch.Tensor, left_context: int = 0
+    ) -> Tuple[Tensor, Tensor]:
         """Add positional encoding.
 
         Args:
             x (torch.Tensor): Input tensor (batch, time, `*`).
+            left_context (int): Number of cached frames before `x`, which
+              are also attended to. Used only in streaming decoding.
 
         Returns:
             torch.Tensor: Encoded tensor (batch, time, `*`).
-            torch.Tensor: Encoded tensor (batch, 2*time-1, `*`).
+            torch.Tensor: Encoded tensor (batch, 2*time+left_context-1, `*`).
 
         """
-        self.extend_pe(x)
+        self.extend_pe(x, left_context)
         pos_emb = self.pe[
             :,
             self.pe.size(1) // 2
             - x.size(1)
+            - left_context
             + 1 : self.pe.size(1) // 2  # noqa E203
             + x.size(1),
         ]
@@ -518,11 +787,7 @@ class RelPositionMultiheadAttention(nn.Module):
             pos_emb,
             self.embed_dim,
             self.num_heads,
-            self.in_proj.get_weight(),
-            self.in_proj.get_bias(),
             self.dropout,
-            self.out_proj.get_weight(),
-            self.out_proj.get_bias(),
             training=self.training,
             key_padding_mask=key_padding_mask,
             need_weights=need_weights,
@@ -533,23 +798,39 @@ class RelPositionMultiheadAttention(nn.Module):
         """Compute relative positional encoding.
 
         Args:
-            x: Input tensor (batch, head, time1, 2*time1-1).
-                time1 means the length of query vector.
+            x: Input tensor (batch, head, time1, time1+time2-1).
+                time1 means the length of query vector and time2 means
+                the length of key vector. time2 is larger than time1
+                only in streaming decoding, where the keys also contain
+                the cached left context.
 
         Returns:
             Tensor: tensor of shape (batch, head, time1, time2)
-          (note: time2 has the same value as time1, but it is for
-          the key, while time1 is for the query).
         """
         (batch_size, num_heads, time1, n) = x.shape
-        assert n == 2 * time1 - 1
+        time2 = n - time1 + 1
+        assert time2 >= time1
+
+        if torch.jit.is_tracing():
+            # as_strided() cannot be exported to ONNX, so we gather
+            # x[..., i, time1 - 1 - i + j] for the j-th key of the i-th query
+            rows = torch.arange(
+                start=time1 - 1, end=-1, step=-1, device=x.device
+            )
+            cols = torch.arange(time2, device=x.device)
+            indexes = (rows.unsqueeze(1) + cols).repeat(
+                batch_size * num_heads, 1
+            )
+            x = torch.gather(x.reshape(-1, n), dim=1, index=indexes)
+            return x.reshape(batch_size, num_heads, time1, time2)
+
         # Note: TorchScript requires explicit arg for stride()
         batch_stride = x.stride(0)
         head_stride = x.stride(1)
         time1_stride = x.stride(2)
         n_stride = x.stride(3)
         return x.as_strided(
-            (batch_size, num_heads, time1, time1),
+            (batch_size, num_heads, time1, time2),
             (batch_stride, head_stride, time1_stride - n_stride, n_stride),
             storage_offset=n_stride * (time1 - 1),
         )
@@ -562,11 +843,7 @@ class RelPositionMultiheadAttention(nn.Module):
         pos_emb: Tensor,
         embed_dim_to_check: int,
         num_heads: int,
-        in_proj_weight: Tensor,
-        in_proj_bias: Tensor,
         dropout_p: float,
-        out_proj_weight: Tensor,
-        out_proj_bias: Tensor,
         training: bool = True,
         key_padding_mask: Optional[Tensor] = None,
         need_weights: bool = True,
@@ -578,9 +855,7 @@ class RelPositionMultiheadAttention(nn.Module):
             pos_emb: Positional embedding tensor
             embed_dim_to_check: total dimension of the model.
             num_heads: parallel attention heads.
-            in_proj_weight, in_proj_bias: input projection weight and bias.
             dropout_p: probability of an element to be zeroed.
-            out_proj_weight, out_proj_bias: the output projection weight and bias.
             training: apply dropout if is ``True``.
             key_padding_mask: if provided, specified padding elements in the key will
                 be ignored by the attention. This is an binary mask. When the value is True,
@@ -631,12 +906,15 @@ class RelPositionMultiheadAttention(nn.Module):
 
         if torch.equal(query, key) and torch.equal(key, value):
             # self-attention
-            q, k, v = nn.functional.linear(
-                query, in_proj_weight, in_proj_bias
-            ).chunk(3, dim=-1)
+            # It calls the module instead of using its weight, so that it
+            # also works after quantize_linears() in scaling.py
+            q, k, v = self.in_proj(query).chunk(3, dim=-1)
 
         elif torch.equal(key, value):
             # encoder-decoder attention
+            in_proj_weight = self.in_proj.get_weight()
+            in_proj_bias = self.in_proj.get_bias()
+
             # This is inline in_proj function with in_proj_weight and in_proj_bias
             _b = in_proj_bias
             _start = 0
@@ -656,6 +934,9 @@ class RelPositionMultiheadAttention(nn.Module):
             k, v = nn.functional.linear(key, _w, _b).chunk(2, dim=-1)
 
         else:
+            in_proj_weight = self.in_proj.get_weight()
+            in_proj_bias = self.in_proj.get_bias()
+
             # This is inline in_proj function with in_proj_weight and in_proj_bias
             _b = in_proj_bias
             _start = 0
@@ -772,7 +1053,7 @@ class RelPositionMultiheadAttention(nn.Module):
         # compute matrix b and matrix d
         matrix_bd = torch.matmul(
             q_with_bias_v, p.transpose(-2, -1)
-        )  # (batch, head, time1, 2*time1-1)
+        )  # (batch, head, time1, time1+time2-1)
         matrix_bd = self.rel_shift(matrix_bd)
 
         attn_output_weights = (
@@ -819,9 +1100,7 @@ class RelPositionMultiheadAttention(nn.Module):
             .contiguous()
             .view(tgt_len, bsz, embed_dim)
         )
-        attn_output = nn.functional.linear(
-            attn_output, out_proj_weight, out_proj_bias
-        )
+        attn_output = self.out_proj(attn_output)
 
         if need_weights:
             # average attention weights over heads
@@ -841,17 +1120,26 @@ class ConvolutionModule(nn.Module):
         channels (int): The number of channels of conv layers.
         kernel_size (int): Kernerl size of conv layers.
         bias (bool): Whether to use bias in conv layers (default=True).
+        causal (bool): Whether to use causal convolution, i.e., to pad
+            only on the left so that no future frames are used.
 
     """
 
     def __init__(
-        self, channels: int, kernel_size: int, bias: bool = True
+        self,
+        channels: int,
+        kernel_size: int,
+        bias: bool = True,
+        causal: bool = False,
     ) -> None:
         """Construct an ConvolutionModule object."""
         super(ConvolutionModule, self).__init__()
         # kernerl_size should be a odd number for 'SAME' padding
         assert (kernel_size - 1) % 2 == 0
 
+        self.kernel_size = kernel_size
+        self.causal = causal
+
         self.pointwise_conv1 = ScaledConv1d(
             channels,
             2 * channels,
@@ -883,7 +1171,7 @@ class ConvolutionModule(nn.Module):
             channels,
             kernel_size,
             stride=1,
-            padding=(kernel_size - 1) // 2,
+            padding=0 if causal else (kernel_size - 1) // 2,
             groups=channels,
             bias=bias,
         )
@@ -924,6 +1212,8 @@ class ConvolutionModule(nn.Module):
         x = nn.functional.glu(x, dim=1)  # (batch, channels, time)
 
         # 1D Depthwise Conv
+        if self.causal:
+            x = nn.functional.pad(x, (self.kernel_size - 1, 0))
         x = self.depthwise_conv(x)
 
         x = self.deriv_balancer2(x)
@@ -933,6 +1223,46 @@ class ConvolutionModule(nn.Module):
 
         return x.permute(2, 0, 1)
 
+    def streaming_forward(
+        self, x: Tensor, cache: Tensor
+    ) -> Tuple[Tensor, Tensor]:
+        """Compute convolution module for one chunk. It requires
+        causal convolution.
+
+        Args:
+            x: Input tensor (#time, batch, channels).
+            cache: Inputs of the depthwise conv for the previous
+              (kernel_size - 1) frames (kernel_size - 1, batch, channels).
+
+        Returns:
+            Tensor: Output tensor (#time, batch, channels).
+            Tensor: Updated cache (kernel_size - 1, batch, channels).
+
+        """
+        assert self.causal
+
+        # exchange the temporal dimension and the feature dimension
+        x = x.permute(1, 2, 0)  # (#batch, channels, time).
+
+        # GLU mechanism
+        x = self.pointwise_conv1(x)  # (batch, 2*channels, time)
+
+        x = self.deriv_balancer1(x)
+        x = nn.functional.glu(x, dim=1)  # (batch, channels, time)
+
+        # 1D Depthwise Conv, with the cache as the left padding
+        x = torch.cat([cache.permute(1, 2, 0), x], dim=2)
+        cache = x[:, :, x.size(2) - (self.kernel_size - 1) :]  # noqa: E203
+        cache = cache.permute(2, 0, 1)
+        x = self.depthwise_conv(x)
+
+        x = self.deriv_balancer2(x)
+        x = self.activation(x)
+
+        x = self.pointwise_conv2(x)  # (batch, channel, time)
+
+        return x.permute(2, 0, 1), cache
+
 
 class Conv2dSubsampling(nn.Module):
     """Convolutional 2D subsampling (to 1/4 length).
@@ -0,0 +1,138 @@
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+from typing import List, Optional, Tuple
+
+import k2
+import torch
+
+from icefall.utils import AttributeDict
+
+LOG_EPS = math.log(1e-10)
+
+
+class DecodeStream(object):
+    """The decoding state of one utterance.
+
+    It contains the samples not yet converted to features, the
+    features not yet fed to the encoder, the encoder caches and
+    the search state.
+    """
+
+    def __init__(
+        self,
+        params: AttributeDict,
+        initial_states: List[torch.Tensor],
+        decoding_graph: Optional[k2.Fsa] = None,
+    ) -> None:
+        """
+        Args:
+          params:
+            It is the return value of :func:`get_params` in train.py with
+            the decoding arguments merged.
+          initial_states:
+            The initial encoder caches of this stream. See
+            :meth:`Conformer.get_init_state`.
+          decoding_graph:
+            The decoding graph. Used only when
+            params.decoding_method is fast_beam_search.
+        """
+        # Samples not yet converted to features. Once the first frame
+        # is computed, the first sample is that of the window of frame
+        # `self.num_frames`.
+        self.waveform = torch.empty(0)
+        self.num_samples = 0
+        self.num_frames = 0
+        # The subsampling module needs 4 frames before each chunk, see
+        # Conformer.streaming_forward(). Before the first chunk, they are
+        # zeros, i.e., the padding of the subsampling module.
+        self.features = torch.zeros(4, params.feature_dim)
+        self.input_finished = False
+
+        self.states = initial_states
+        # Number of encoder output frames processed so far
+        self.processed_frames = 0
+
+        if params.decoding_method == "greedy_search":
+            self.hyp = [params.blank_id] * params.context_size
+        elif params.decoding_method == "fast_beam_search":
+            assert decoding_graph is not None
+            self.hyp = []
+            self.rnnt_decoding_stream = k2.RnntDecodingStream(
+                decoding_graph
+            )
+        else:
+            raise ValueError(
+                f"Unsupported decoding method: {params.decoding_method}"
+            )
+        self.context_size = (
+            params.context_size
+            if params.decoding_method == "greedy_search"
+            else 0
+        )
+
+    @property
+    def done(self) -> bool:
+        """True if all input has been decoded."""
+        return self.input_finished and self.features.size(0) == 0
+
+    @property
+    def result(self) -> List[int]:
+        """The decoded token IDs so far."""
+        return self.hyp[self.context_size :]  # noqa: E203
+
+    def get_feature_chunk(
+        self, chunk_size: int
+    ) -> Optional[Tuple[torch.Tensor, int]]:
+        """Remove a chunk of features from this stream.
+
+        Args:
+          chunk_size:
+            Number of feature frames of the chunk, i.e., the
+            decode chunk size times the subsampling factor. The returned
+            chunk also contains the 4 frames before it and 4 frames after
+            it, which the subsampling module needs. The last 8 frames are
+            kept for the next chunk.
+        Returns:
+          Return None if there are not enough features. Otherwise,
+          return a tuple containing:
+            - A tensor of shape (chunk_size + 8, feature_dim). After
+              the input is finished, the last chunk is padded with
+              zeros, like the padding of the subsampling module.
+            - Number of valid frames in the returned tensor.
+        """
+        T = chunk_size + 8
+        num_frames = self.features.size(0)
+        if num_frames >= T:
+            ans = self.features[:T]
+            self.features = self.features[chunk_size:]
+            return ans, T
+
+        if not self.input_finished:
+            return None
+
+        # Number of encoder frames of the remaining features,
+        # see Conformer.streaming_forward()
+        if ((num_frames - 1) // 2 - 1) // 2 - 1 <= 0:
+            self.features = self.features[num_frames:]
+            return None
+
+        ans = torch.nn.functional.pad(
+            self.features, (0, 0, 0, T - num_frames), value=0
+        )
+        self.features = self.features[num_frames:]
+        return ans, num_frames
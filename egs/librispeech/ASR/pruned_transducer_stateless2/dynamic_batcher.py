@@ -0,0 +1,212 @@
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+
+class LatencyStats(object):
+    """Keep the queue waiting time and the compute time of the most
+    recent requests and compute their percentiles."""
+
+    def __init__(self, max_size: int = 10000):
+        """
+        Args:
+          max_size:
+            Number of the most recent requests to keep.
+        """
+        self.queue_wait = deque(maxlen=max_size)
+        self.compute = deque(maxlen=max_size)
+        self.batch_size = deque(maxlen=max_size)
+        self.num_requests = 0
+        self.num_batches = 0
+
+    def add(self, queue_wait: List[float], compute: float) -> None:
+        """Add the statistics of a batch.
+
+        Args:
+          queue_wait:
+            The queue waiting time of each request in the batch, in seconds.
+          compute:
+            The time to decode the batch, in seconds.
+        """
+        self.queue_wait.extend(queue_wait)
+        self.compute.extend([compute] * len(queue_wait))
+        self.batch_size.append(len(queue_wait))
+        self.num_requests += len(queue_wait)
+        self.num_batches += 1
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the number of requests and batches, the average batch
+        size and the p50/p90/p99 of the queue waiting time and the
+        compute time in milliseconds."""
+        ans = {
+            "num_requests": self.num_requests,
+            "num_batches": self.num_batches,
+            "avg_batch_size": float(np.mean(self.batch_size))
+            if self.batch_size
+            else 0.0,
+        }
+        for name, values in [
+            ("queue_wait_ms", self.queue_wait),
+            ("compute_ms", self.compute),
+        ]:
+            values = np.array(values) * 1000 if values else np.zeros(1)
+            for p in (50, 90, 99):
+                ans[f"{name}_p{p}"] = round(float(np.percentile(values, p)), 3)
+        return ans
+
+    def __str__(self) -> str:
+        return ", ".join(f"{k}: {v}" for k, v in self.summary().items())
+
+
+class DynamicBatcher(object):
+    """Collect concurrent requests into batches.
+
+    A batch is processed once it has `max_batch_size` requests or the first
+    request in it has waited for `max_wait_ms`. Batches are processed one
+    at a time in a worker thread, so that new requests are accepted while
+    a batch is being processed. If a batch fails, its requests are
+    processed one by one, so that a bad request does not fail the other
+    requests of its batch.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[List[Any]], List[Any]],
+        max_batch_size: int,
+        max_wait_ms: float,
+        stats_interval: int = 0,
+    ):
+        """
+        Args:
+          process:
+            A function that takes a list of requests and returns a list of
+            results, one for each request.
+          max_batch_size:
+            Maximum number of requests in a batch.
+          max_wait_ms:
+            Maximum time in milliseconds the first request of a batch
+            waits for more requests.
+          stats_interval:
+            If positive, log the statistics every this number of batches.
+        """
+        assert max_batch_size >= 1, max_batch_size
+        assert max_wait_ms >= 0, max_wait_ms
+
+        self.process = process
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats_interval = stats_interval
+        self.stats = LatencyStats()
+
+        # Created in run() so that they belong to the running event loop
+        self.queue = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, request: Any) -> Tuple[Any, float, float]:
+        """Submit a request and wait for its result.
+
+        Returns:
+          Return a tuple containing the result, the queue waiting time
+          and the compute time of the batch, both in seconds.
+        """
+        assert self.queue is not None, "Please start run() first"
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((request, future, time.time()))
+        return await future
+
+    async def _get_batch(self) -> List[Tuple[Any, asyncio.Future, float]]:
+        batch = [await self.queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+        return batch
+
+    async def _process(self, requests: List[Any]) -> List[Any]:
+        results = await asyncio.get_event_loop().run_in_executor(
+            self.executor, self.process, requests
+        )
+        assert len(results) == len(requests), (len(results), len(requests))
+        return results
+
+    async def _process_one_by_one(
+        self,
+        batch: List[Tuple[Any, asyncio.Future, float]],
+        queue_wait: List[float],
+    ) -> None:
+        """Process the requests of a failed batch one at a time, so that
+        only the failing requests get an exception."""
+        for (request, future, _), wait in zip(batch, queue_wait):
+            start = time.time()
+            try:
+                (result,) = await self._process([request])
+            except Exception as e:
+                logging.exception("Failed to process a request")
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            compute = time.time() - start
+            if not future.done():
+                future.set_result((result, wait, compute))
+            self.stats.add([wait], compute)
+
+    async def run(self) -> None:
+        """Process batches until cancelled."""
+        self.queue = asyncio.Queue()
+        while True:
+            batch = await self._get_batch()
+            requests = [b[0] for b in batch]
+
+            start = time.time()
+            queue_wait = [start - b[2] for b in batch]
+            try:
+                results = await self._process(requests)
+            except Exception:
+                logging.exception(
+                    f"Failed to process a batch of {len(batch)} requests. "
+                    "Processing them one by one"
+                )
+                await self._process_one_by_one(batch, queue_wait)
+                continue
+            compute = time.time() - start
+
+            for (_, future, _), result, wait in zip(batch, results, queue_wait):
+                if not future.done():
+                    future.set_result((result, wait, compute))
+
+            self.stats.add(queue_wait, compute)
+            if (
+                self.stats_interval > 0
+                and self.stats.num_batches % self.stats_interval == 0
+            ):
+                logging.info(f"{self.stats}")
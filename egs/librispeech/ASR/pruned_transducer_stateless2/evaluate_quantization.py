@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script checks the accuracy and the speed of the model quantized
+by export.py --quantize true. It decodes the test sets on the CPU with
+greedy search, once with the float model and once with the model whose
+linear layers are quantized to int8, and reports for both
+
+  - the WER and its difference
+  - the real-time factor (RTF), i.e., the seconds spent in the encoder
+    and the greedy search per second of audio
+  - the size of the state dict
+
+Usage:
+    ./pruned_transducer_stateless2/evaluate_quantization.py \
+        --epoch 28 \
+        --avg 15 \
+        --exp-dir ./pruned_transducer_stateless2/exp \
+        --max-duration 300 \
+        --num-threads 1
+
+Dynamic quantization needs no calibration data: the scales of the
+weights are computed from the weights, and the scales of the inputs
+are computed on the fly for each batch. Use --per-channel false to
+check the accuracy with a single scale per weight matrix.
+"""
+
+
+import argparse
+import copy
+import io
+import logging
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import sentencepiece as spm
+import torch
+import torch.nn as nn
+from asr_datamodule import LibriSpeechAsrDataModule
+from beam_search import DecoderOutCache, greedy_search_batch
+from lhotse import CutSet
+from scaling import fold_scales, quantize_linears
+from train import add_model_arguments, get_params, get_transducer_model
+
+from icefall.checkpoint import (
+    average_checkpoints,
+    average_epoch_checkpoints,
+    find_checkpoints,
+    load_checkpoint,
+)
+from icefall.utils import (
+    AttributeDict,
+    setup_logger,
+    store_transcripts,
+    str2bool,
+    write_error_stats,
+)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--epoch",
+        type=int,
+        default=28,
+        help="""It specifies the checkpoint to use for decoding.
+        Note: Epoch counts from 0.
+        You can specify --avg to use more checkpoints for model averaging.""",
+    )
+
+    parser.add_argument(
+        "--iter",
+        type=int,
+        default=0,
+        help="""If positive, --epoch is ignored and it
+        will use the checkpoint exp_dir/checkpoint-iter.pt.
+        You can specify --avg to use more checkpoints for model averaging.
+        """,
+    )
+
+    parser.add_argument(
+        "--avg",
+        type=int,
+        default=15,
+        help="Number of checkpoints to average. Automatically select "
+        "consecutive checkpoints before the checkpoint specified by "
+        "'--epoch' and '--iter'",
+    )
+
+    parser.add_argument(
+        "--use-prefix-sums",
+        type=str2bool,
+        default=False,
+        help="""If True, average the epoch checkpoints using prefix sums
+        of the models, which are cached in the directory prefix-sums of
+        --exp-dir. It speeds up trying different --epoch and --avg, but
+        building the cache loads all epochs up to --epoch, and each cached
+        sum takes twice the size of a model.
+        Used only when --avg is larger than 1.
+        """,
+    )
+
+    parser.add_argument(
+        "--exp-dir",
+        type=str,
+        default="pruned_transducer_stateless2/exp",
+        help="The experiment dir",
+    )
+
+    parser.add_argument(
+        "--bpe-model",
+        type=str,
+        default="data/lang_bpe_500/bpe.model",
+        help="Path to the BPE model",
+    )
+
+    parser.add_argument(
+        "--context-size",
+        type=int,
+        default=2,
+        help="The context size in the decoder. 1 means bigram; "
+        "2 means tri-gram",
+    )
+
+    parser.add_argument(
+        "--per-channel",
+        type=str2bool,
+        default=True,
+        help="""True to quantize the weights with a scale per output
+        channel; False to use a single scale per weight matrix.""",
+    )
+
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=1,
+        help="Number of threads used by PyTorch on the CPU.",
+    )
+
+    parser.add_argument(
+        "--max-cuts",
+        type=int,
+        default=0,
+        help="""If positive, use only the first so many cuts of each test
+        set.""",
+    )
+
+    add_model_arguments(parser)
+
+    return parser
+
+
+def state_dict_size(model: nn.Module) -> int:
+    """Return the number of bytes of the saved state dict of the model."""
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.tell()
+
+
+def decode_dataset(
+    dl: torch.utils.data.DataLoader,
+    model: nn.Module,
+    sp: spm.SentencePieceProcessor,
+) -> Tuple[List[Tuple[List[str], List[str]]], float]:
+    """Decode a dataset with greedy search.
+
+    Returns:
+      Return a tuple containing:
+        - a list of (reference words, predicted words) pairs
+        - the seconds spent in the encoder and the greedy search
+    """
+    results = []
+    elapsed = 0.0
+    for batch in dl:
+        feature = batch["inputs"]
+        feature_lens = batch["supervisions"]["num_frames"]
+
+        start = time.perf_counter()
+        encoder_out, encoder_out_lens = model.encoder(
+            x=feature, x_lens=feature_lens
+        )
+        hyp_tokens = greedy_search_batch(
+            model=model,
+            encoder_out=encoder_out,
+            encoder_out_lens=encoder_out_lens,
+        )
+        elapsed += time.perf_counter() - start
+
+        hyps = [hyp.split() for hyp in sp.decode(hyp_tokens)]
+        texts = batch["supervisions"]["text"]
+        assert len(hyps) == len(texts)
+        for hyp_words, ref_text in zip(hyps, texts):
+            results.append((ref_text.split(), hyp_words))
+    return results, elapsed
+
+
+def evaluate(
+    params: AttributeDict,
+    test_set_name: str,
+    cuts: CutSet,
+    dl: torch.utils.data.DataLoader,
+    models: List[Tuple[str, nn.Module]],
+    sp: spm.SentencePieceProcessor,
+) -> None:
+    duration = sum(c.duration for c in cuts)
+    wers = {}
+    s = f"\nFor {test_set_name} ({duration / 3600:.2f} hours):\n"
+    for name, model in models:
+        results, elapsed = decode_dataset(dl=dl, model=model, sp=sp)
+
+        suffix = f"{test_set_name}-{name}-{params.suffix}"
+        store_transcripts(
+            filename=params.res_dir / f"recogs-{suffix}.txt", texts=results
+        )
+
+        errs_filename = params.res_dir / f"errs-{suffix}.txt"
+        with open(errs_filename, "w") as f:
+            wers[name] = write_error_stats(
+                f, f"{test_set_name}-{name}", results, enable_log=False
+            )
+        logging.info(f"Wrote detailed error stats to {errs_filename}")
+
+        s += (
+            f"{name}\tWER {wers[name]:.2f}\tRTF {elapsed / duration:.4f}"
+            f"\t{elapsed:.1f} s\n"
+        )
+
+    s += f"WER delta (int8 - float): {wers['int8'] - wers['float']:+.2f}"
+    logging.info(s)
+
+
+@torch.no_grad()
+def main():
+    parser = get_parser()
+    LibriSpeechAsrDataModule.add_arguments(parser)
+    args = parser.parse_args()
+    args.exp_dir = Path(args.exp_dir)
+
+    params = get_params()
+    params.update(vars(args))
+
+    params.res_dir = params.exp_dir / "quantization"
+
+    if params.iter > 0:
+        params.suffix = f"iter-{params.iter}-avg-{params.avg}"
+    else:
+        params.suffix = f"epoch-{params.epoch}-avg-{params.avg}"
+    if not params.per_channel:
+        params.suffix += "-per-tensor"
+
+    setup_logger(f"{params.res_dir}/log-evaluate-{params.suffix}")
+    logging.info("Evaluation started")
+
+    # Dynamic quantization is supported only on the CPU
+    device = torch.device("cpu")
+    torch.set_num_threads(params.num_threads)
+
+    sp = spm.SentencePieceProcessor()
+    sp.load(params.bpe_model)
+
+    # <blk> and <unk> is defined in local/train_bpe_model.py
+    params.blank_id = sp.piece_to_id("<blk>")
+    params.unk_id = sp.piece_to_id("<unk>")
+    params.vocab_size = sp.get_piece_size()
+
+    logging.info(params)
+
+    logging.info("About to create model")
+    model = get_transducer_model(params)
+
+    if params.iter > 0:
+        filenames = find_checkpoints(params.exp_dir, iteration=-params.iter)[
+            : params.avg
+        ]
+        if len(filenames) == 0:
+            raise ValueError(
+                f"No checkpoints found for"
+                f" --iter {params.iter}, --avg {params.avg}"
+            )
+        elif len(filenames) < params.avg:
+            raise ValueError(
+                f"Not enough checkpoints ({len(filenames)}) found for"
+                f" --iter {params.iter}, --avg {params.avg}"
+            )
+        logging.info(f"averaging {filenames}")
+        model.load_state_dict(average_checkpoints(filenames, device=device))
+    elif params.avg == 1:
+        load_checkpoint(f"{params.exp_dir}/epoch-{params.epoch}.pt", model)
+    else:
+        start = params.epoch - params.avg + 1
+        logging.info(f"averaging epochs {start} to {params.epoch}")
+        if params.use_prefix_sums:
+            state_dict = average_epoch_checkpoints(
+                params.exp_dir,
+                epoch=params.epoch,
+                avg=params.avg,
+                device=device,
+            )
+        else:
+            filenames = [
+                f"{params.exp_dir}/epoch-{i}.pt"
+                for i in range(start, params.epoch + 1)
+            ]
+            state_dict = average_checkpoints(filenames, device=device)
+        model.load_state_dict(state_dict)
+
+    model.to(device)
+    model.eval()
+    fold_scales(model)
+
+    quantized_model = copy.deepcopy(model)
+    quantize_linears(quantized_model, per_channel=params.per_channel)
+
+    models = [("float", model), ("int8", quantized_model)]
+    for name, m in models:
+        m.decoder_cache = DecoderOutCache()
+        m.device = device
+        logging.info(
+            f"Size of the {name} model: {state_dict_size(m) / 2**20:.1f} MB"
+        )
+
+    librispeech = LibriSpeechAsrDataModule(args)
+
+    test_sets = {
+        "test-clean": librispeech.test_clean_cuts(),
+        "test-other": librispeech.test_other_cuts(),
+    }
+
+    for test_set, cuts in test_sets.items():
+        if params.max_cuts > 0:
+            cuts = cuts.subset(first=params.max_cuts)
+        evaluate(
+            params=params,
+            test_set_name=test_set,
+            cuts=cuts,
+            dl=librispeech.test_dataloaders(cuts),
+            models=models,
+            sp=sp,
+        )
+
+    logging.info("Done!")
+
+
+if __name__ == "__main__":
+    main()
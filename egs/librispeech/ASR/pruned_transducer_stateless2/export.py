@@ -41,6 +41,34 @@ you can do:
         --avg 1 \
         --max-duration 100 \
         --bpe-model data/lang_bpe_500/bpe.model
+
+With --jit true, it generates exp_dir/cpu_jit.pt instead. The scripted
+model has the scales of its scaled modules folded into the weights (see
+fold_scales() in scaling.py) and carries its own greedy search, which
+you can use with:
+
+    model = torch.jit.load("cpu_jit.pt")
+    encoder_out, encoder_out_lens = model.encoder(x=features, x_lens=lens)
+    hyps, hyp_lens = model.greedy_search(encoder_out, encoder_out_lens)
+
+where hyps[i, :hyp_lens[i]] contains the token IDs of the i-th utterance.
+
+With --quantize true, the linear layers of the model, i.e., the ones in
+the feed forward modules, the attention projections and the joiner, use
+dynamic int8 quantization after the scales are folded (see
+quantize_linears() in scaling.py). It generates exp_dir/pretrained-int8.pt,
+or exp_dir/cpu_jit-int8.pt with --jit true. The quantized model runs only
+on the CPU. You can use pretrained-int8.pt with
+
+    ./pruned_transducer_stateless2/pretrained.py \
+        --checkpoint ./pruned_transducer_stateless2/exp/pretrained-int8.pt \
+        ...
+
+or with ./pruned_transducer_stateless2/decode.py --quantize true after
+linking it to epoch-9999.pt as above.
+
+To compare the WER and the speed of the quantized model with those of
+the float one, use ./pruned_transducer_stateless2/evaluate_quantization.py.
 """
 
 import argparse
@@ -49,7 +77,9 @@ from pathlib import Path
 
 import sentencepiece as spm
 import torch
-from train import get_params, get_transducer_model
+from beam_search import GreedySearch
+from scaling import fold_scales, quantize_linears
+from train import add_model_arguments, get_params, get_transducer_model
 
 from icefall.checkpoint import (
     average_checkpoints,
@@ -113,6 +143,17 @@ def get_parser():
         type=str2bool,
         default=False,
         help="""True to save a model after applying torch.jit.script.
+        The saved model has a method greedy_search() that runs
+        batched greedy search on the encoder output.
+        """,
+    )
+
+    parser.add_argument(
+        "--quantize",
+        type=str2bool,
+        default=False,
+        help="""True to quantize the linear layers of the model to int8
+        with dynamic quantization. The quantized model runs on the CPU.
         """,
     )
 
@@ -124,6 +165,8 @@ def get_parser():
         "2 means tri-gram",
     )
 
+    add_model_arguments(parser)
+
     return parser
 
 
@@ -145,6 +188,7 @@ def main():
 
     # <blk> is defined in local/train_bpe_model.py
     params.blank_id = sp.piece_to_id("<blk>")
+    params.unk_id = sp.piece_to_id("<unk>")
     params.vocab_size = sp.get_piece_size()
 
     logging.info(params)
@@ -188,23 +232,37 @@ def main():
     model.to("cpu")
     model.eval()
 
+    suffix = ""
+    if params.quantize:
+        fold_scales(model)
+        quantize_linears(model)
+        suffix = "-int8"
+
     if params.jit:
         # We won't use the forward() method of the model in C++, so just ignore
         # it here.
         # Otherwise, one of its arguments is a ragged tensor and is not
         # torch scriptabe.
         model.__class__.forward = torch.jit.ignore(model.__class__.forward)
+        # The scripted model is only used for inference, so we multiply
+        # the scales into the weights once instead of in every forward pass
+        fold_scales(model)
+        # It shares the decoder and joiner with the model
+        model.greedy_search = GreedySearch(model, unk_id=params.unk_id)
         logging.info("Using torch.jit.script")
         model = torch.jit.script(model)
-        filename = params.exp_dir / "cpu_jit.pt"
+        filename = params.exp_dir / f"cpu_jit{suffix}.pt"
         model.save(str(filename))
         logging.info(f"Saved to {filename}")
     else:
         logging.info("Not using torch.jit.script")
         # Save it using a format so that it can be loaded
         # by :func:`load_checkpoint`
-        filename = params.exp_dir / "pretrained.pt"
-        torch.save({"model": model.state_dict()}, str(filename))
+        filename = params.exp_dir / f"pretrained{suffix}.pt"
+        torch.save(
+            {"model": model.state_dict(), "quantized": params.quantize},
+            str(filename),
+        )
         logging.info(f"Saved to {filename}")
 
 
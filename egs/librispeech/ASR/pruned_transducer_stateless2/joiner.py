@@ -42,17 +42,21 @@ class Joiner(nn.Module):
         """
         Args:
           encoder_out:
-            Output from the encoder. Its shape is (N, T, s_range, C).
+            Output from the encoder. Its shape is (N, T, s_range, C),
+            or (N, C) for a single frame of each utterance, e.g., in the
+            joiner exported to ONNX.
           decoder_out:
-            Output from the decoder. Its shape is (N, T, s_range, C).
+            Output from the decoder. Its shape is (N, T, s_range, C),
+            or (N, C).
            project_input:
             If true, apply input projections encoder_proj and decoder_proj.
             If this is false, it is the user's responsibility to do this
             manually.
         Returns:
-          Return a tensor of shape (N, T, s_range, C).
+          Return a tensor of shape (N, T, s_range, C), or (N, C).
         """
-        assert encoder_out.ndim == decoder_out.ndim == 4
+        assert encoder_out.ndim == decoder_out.ndim
+        assert encoder_out.ndim in (2, 4), encoder_out.shape
         assert encoder_out.shape[:-1] == decoder_out.shape[:-1]
 
         if project_input:
@@ -15,7 +15,8 @@
 # limitations under the License.
 
 
-from typing import List, Optional, Union
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple, Union
 
 import torch
 from torch.optim import Optimizer
@@ -47,6 +48,13 @@ class Eve(Optimizer):
             is conditional on RMS-value of parameter being > target_rms.
         target_rms (float, optional): target root-mean-square value of
            parameters, if they fall below this we will stop applying weight decay.
+        foreach (bool, optional): if True, update all parameters of a group
+           together with the torch._foreach_* functions, which launch a few
+           kernels per group instead of about ten per parameter.  The results
+           and the state dict are the same.  It is False by default; use
+           benchmark_optim.py to check whether it is faster on your GPU.
+           On the CPU, the torch._foreach_* functions only loop over the
+           tensors.
 
 
     .. _Adam\: A Method for Stochastic Optimization:
@@ -65,6 +73,7 @@ class Eve(Optimizer):
         eps=1e-8,
         weight_decay=1e-3,
         target_rms=0.1,
+        foreach=False,
     ):
 
         if not 0.0 <= lr:
@@ -93,9 +102,16 @@ class Eve(Optimizer):
             target_rms=target_rms,
         )
         super(Eve, self).__init__(params, defaults)
+        # It is not in `defaults`, so that the state dict stays the same
+        self.foreach = foreach
+        # Maps (device, target_rms, numels) to a tensor with the
+        # weight-decay thresholds of the parameters
+        self._rms_thresholds: Dict[Tuple, torch.Tensor] = {}
 
     def __setstate__(self, state):
         super(Eve, self).__setstate__(state)
+        self.__dict__.setdefault("foreach", False)
+        self.__dict__.setdefault("_rms_thresholds", {})
 
     @torch.no_grad()
     def step(self, closure=None):
@@ -111,6 +127,10 @@ class Eve(Optimizer):
                 loss = closure()
 
         for group in self.param_groups:
+            if self.foreach:
+                self._foreach_step(group)
+                continue
+
             for p in group["params"]:
                 if p.grad is None:
                     continue
@@ -166,6 +186,89 @@ class Eve(Optimizer):
 
         return loss
 
+    def _foreach_step(self, group: dict) -> None:
+        """The same as the loop over the parameters of `group` in
+        :meth:`step`, but with the torch._foreach_* functions."""
+        # The parameters are grouped by their number of steps, since it
+        # determines the bias correction; and by device, since
+        # torch._foreach_* functions need the tensors on the same device.
+        params_by_step = defaultdict(list)
+        for p in group["params"]:
+            if p.grad is None:
+                continue
+            if p.grad.is_sparse:
+                raise RuntimeError("AdamW does not support sparse gradients")
+
+            state = self.state[p]
+            if len(state) == 0:
+                state["step"] = 0
+                state["exp_avg"] = torch.zeros_like(
+                    p, memory_format=torch.preserve_format
+                )
+                state["exp_avg_sq"] = torch.zeros_like(
+                    p, memory_format=torch.preserve_format
+                )
+            state["step"] += 1
+            params_by_step[(state["step"], p.device)].append(p)
+
+        beta1, beta2 = group["betas"]
+        for (step, _), params in params_by_step.items():
+            grads = [p.grad for p in params]
+            exp_avgs = [self.state[p]["exp_avg"] for p in params]
+            exp_avg_sqs = [self.state[p]["exp_avg_sq"] for p in params]
+
+            bias_correction1 = 1 - beta1 ** step
+            bias_correction2 = 1 - beta2 ** step
+
+            torch._foreach_mul_(exp_avgs, beta1)
+            torch._foreach_add_(exp_avgs, grads, alpha=1 - beta1)
+            torch._foreach_mul_(exp_avg_sqs, beta2)
+            torch._foreach_addcmul_(
+                exp_avg_sqs, grads, grads, value=1 - beta2
+            )
+            denoms = torch._foreach_sqrt(exp_avg_sqs)
+            torch._foreach_mul_(denoms, bias_correction2 ** -0.5)
+            torch._foreach_add_(denoms, group["eps"])
+
+            # avoid applying this weight-decay on "scaling factors"
+            # (which are scalar).
+            matrices = [p for p in params if p.numel() > 1]
+            if len(matrices) > 0:
+                factors = self._weight_decay_factors(matrices, group)
+                torch._foreach_mul_(matrices, factors)
+
+            step_size = group["lr"] / bias_correction1
+            torch._foreach_addcdiv_(params, exp_avgs, denoms, value=-step_size)
+
+    def _weight_decay_factors(
+        self, params: List[torch.Tensor], group: dict
+    ) -> List[torch.Tensor]:
+        """Return the factors to multiply the parameters with for the
+        weight decay, as 0-dim tensors, without synchronizing with the
+        device."""
+        if hasattr(torch, "_foreach_norm"):
+            norms = torch.stack(torch._foreach_norm(params))
+        else:
+            norms = torch.stack([p.norm() for p in params])
+
+        key = (
+            norms.device,
+            group["target_rms"],
+            tuple(p.numel() for p in params),
+        )
+        thresholds = self._rms_thresholds.get(key)
+        if thresholds is None:
+            thresholds = torch.tensor(
+                [group["target_rms"] * (n ** 0.5) for n in key[2]],
+                dtype=norms.dtype,
+                device=norms.device,
+            )
+            self._rms_thresholds[key] = thresholds
+
+        is_above_target_rms = norms > thresholds
+        factors = 1 - (group["weight_decay"] * is_above_target_rms)
+        return list(factors.unbind())
+
 
 class LRScheduler(object):
     """
@@ -56,6 +56,10 @@ You can also use `./pruned_transducer_stateless2/exp/epoch-xx.pt`.
 
 Note: ./pruned_transducer_stateless2/exp/pretrained.pt is generated by
 ./pruned_transducer_stateless2/export.py
+
+You can also use ./pruned_transducer_stateless2/exp/pretrained-int8.pt,
+which is generated by ./pruned_transducer_stateless2/export.py with
+--quantize true. It runs on the CPU.
 """
 
 
@@ -76,8 +80,9 @@ from beam_search import (
     greedy_search_batch,
     modified_beam_search,
 )
+from scaling import fold_scales, quantize_linears
 from torch.nn.utils.rnn import pad_sequence
-from train import get_params, get_transducer_model
+from train import add_model_arguments, get_params, get_transducer_model
 
 
 def get_parser():
@@ -178,6 +183,8 @@ def get_parser():
         """,
     )
 
+    add_model_arguments(parser)
+
     return parser
 
 
@@ -224,8 +231,12 @@ def main():
 
     logging.info(f"{params}")
 
+    checkpoint = torch.load(args.checkpoint, map_location="cpu")
+    # It is saved by export.py --quantize true
+    quantized = checkpoint.get("quantized", False)
+
     device = torch.device("cpu")
-    if torch.cuda.is_available():
+    if torch.cuda.is_available() and not quantized:
         device = torch.device("cuda", 0)
 
     logging.info(f"device: {device}")
@@ -236,7 +247,10 @@ def main():
     num_param = sum([p.numel() for p in model.parameters()])
     logging.info(f"Number of model parameters: {num_param}")
 
-    checkpoint = torch.load(args.checkpoint, map_location="cpu")
+    if quantized:
+        logging.info("Quantizing the linear layers to int8")
+        model.eval()
+        quantize_linears(fold_scales(model))
     model.load_state_dict(checkpoint["model"], strict=False)
     model.to(device)
     model.eval()
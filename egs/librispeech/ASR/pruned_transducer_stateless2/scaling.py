@@ -21,6 +21,7 @@ from typing import Optional, Tuple
 
 import torch
 import torch.nn as nn
+import torch.nn.quantized.dynamic as nnqd
 from torch import Tensor
 
 
@@ -639,6 +640,157 @@ class ScaledEmbedding(nn.Module):
         return s.format(**self.__dict__)
 
 
+class FoldedLinear(nn.Linear):
+    """A plain nn.Linear with the get_weight() and get_bias() methods of
+    ScaledLinear, for modules like RelPositionMultiheadAttention that pass
+    the weights of a ScaledLinear to functions. See :func:`fold_scales`.
+    """
+
+    def get_weight(self):
+        return self.weight
+
+    def get_bias(self):
+        return self.bias
+
+
+def _fold_scaled_module(m: nn.Module) -> nn.Module:
+    """Return a plain module that computes the same as the given scaled
+    module, with the scales multiplied into its parameters."""
+    if isinstance(m, ScaledEmbedding):
+        return nn.Embedding(
+            m.num_embeddings,
+            m.embedding_dim,
+            padding_idx=m.padding_idx,
+            scale_grad_by_freq=m.scale_grad_by_freq,
+            sparse=m.sparse,
+            _weight=m.weight * m.scale.exp(),
+        )
+
+    weight = m.get_weight()
+    bias = m.get_bias()
+    if isinstance(m, ScaledLinear):
+        ans = FoldedLinear(
+            m.in_features, m.out_features, bias=bias is not None
+        )
+    else:
+        conv = nn.Conv1d if isinstance(m, ScaledConv1d) else nn.Conv2d
+        ans = conv(
+            m.in_channels,
+            m.out_channels,
+            m.kernel_size,
+            stride=m.stride,
+            padding=m.padding,
+            dilation=m.dilation,
+            groups=m.groups,
+            bias=bias is not None,
+            padding_mode=m.padding_mode,
+        )
+
+    # They also move the module to the device of the weights
+    ans.weight = nn.Parameter(weight)
+    if bias is not None:
+        ans.bias = nn.Parameter(bias)
+    return ans
+
+
+_SCALED_MODULES = (ScaledLinear, ScaledConv1d, ScaledConv2d, ScaledEmbedding)
+
+
+@torch.no_grad()
+def fold_scales(model: nn.Module) -> nn.Module:
+    """Prepare a model for inference by replacing in place
+
+      - ScaledLinear with FoldedLinear, i.e., nn.Linear
+      - ScaledConv1d with nn.Conv1d
+      - ScaledConv2d with nn.Conv2d
+      - ScaledEmbedding with nn.Embedding
+
+    whose parameters are the scaled ones, so that the scales are not
+    applied on every forward pass. ActivationBalancer, which only changes
+    the gradients, is removed from nn.Sequential and replaced with
+    nn.Identity elsewhere.
+
+    The outputs of the model stay the same up to rounding. Its parameters
+    are different, so it can be neither trained nor saved as a checkpoint
+    for the original model.
+
+    Args:
+      model:
+        The model to convert.
+    Returns:
+      Return the given model.
+    """
+    for name, child in list(model.named_children()):
+        if isinstance(child, _SCALED_MODULES):
+            setattr(model, name, _fold_scaled_module(child))
+        elif isinstance(child, ActivationBalancer):
+            if isinstance(model, nn.Sequential):
+                delattr(model, name)
+            else:
+                setattr(model, name, nn.Identity())
+        else:
+            fold_scales(child)
+    return model
+
+
+class QuantizedLinear(nnqd.Linear):
+    """An nn.quantized.dynamic.Linear, i.e., a linear layer with int8
+    weights whose inputs are quantized on the fly, with the get_weight()
+    and get_bias() methods of ScaledLinear. See :func:`quantize_linears`.
+    """
+
+    def get_weight(self) -> Tensor:
+        return self.weight().dequantize()
+
+    def get_bias(self) -> Optional[Tensor]:
+        return self.bias()
+
+
+@torch.no_grad()
+def quantize_linears(model: nn.Module, per_channel: bool = True) -> nn.Module:
+    """Replace in place the nn.Linear layers of a model, e.g., the ones
+    in the feed forward modules, the attention projections and the joiner,
+    with QuantizedLinear, which uses dynamic int8 quantization.
+
+    The model has to be on the CPU and converted by :func:`fold_scales`
+    first. The quantized model runs only on the CPU. Its state dict can be
+    loaded only into a model converted in the same way.
+
+    Args:
+      model:
+        The model to convert.
+      per_channel:
+        True to quantize the weights with a scale per output channel;
+        False to use a single scale per weight matrix.
+    Returns:
+      Return the given model.
+    """
+    if per_channel:
+        qconfig = torch.quantization.per_channel_dynamic_qconfig
+    else:
+        qconfig = torch.quantization.default_dynamic_qconfig
+
+    for name, child in list(model.named_children()):
+        if isinstance(child, ScaledLinear):
+            raise ValueError(
+                f"Found a ScaledLinear at {name}. Please call fold_scales()"
+                " before quantize_linears()"
+            )
+        if isinstance(child, nn.Linear):
+            linear = nn.Linear(
+                child.in_features,
+                child.out_features,
+                bias=child.bias is not None,
+            )
+            linear.weight = child.weight
+            linear.bias = child.bias
+            linear.qconfig = qconfig
+            setattr(model, name, QuantizedLinear.from_float(linear))
+        else:
+            quantize_linears(child, per_channel=per_channel)
+    return model
+
+
 def _test_activation_balancer_sign():
     probs = torch.arange(0, 1, 0.01)
     N = 1000
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+A long-running HTTP server that loads a model once and decodes
+requests in dynamic batches.
+
+Requests arriving within --max-wait-ms of the first request of a batch
+are decoded together, up to --max-batch-size requests per batch.
+
+Usage:
+
+./pruned_transducer_stateless2/server.py \
+    --checkpoint ./pruned_transducer_stateless2/exp/pretrained.pt \
+    --bpe-model ./data/lang_bpe_500/bpe.model \
+    --method greedy_search \
+    --port 6006 \
+    --max-batch-size 16 \
+    --max-wait-ms 10
+
+To decode a file, POST a 16-bit PCM wave file sampled at 16kHz:
+
+    curl --data-binary @/path/to/foo.wav http://127.0.0.1:6006/decode
+
+It returns a JSON object, e.g.,
+
+    {"text": "...", "queue_wait_ms": 3.1, "compute_ms": 52.4}
+
+The percentiles of the queue waiting time and the compute time of
+the recent requests are available at:
+
+    curl http://127.0.0.1:6006/stats
+
+Note: ./pruned_transducer_stateless2/exp/pretrained.pt is generated by
+./pruned_transducer_stateless2/export.py
+"""
+
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import math
+import wave
+from typing import List
+
+import kaldifeat
+import numpy as np
+import sentencepiece as spm
+import torch
+from beam_search import greedy_search_batch, modified_beam_search
+from dynamic_batcher import DynamicBatcher
+from scaling import fold_scales, quantize_linears
+from torch.nn.utils.rnn import pad_sequence
+from train import add_model_arguments, get_params, get_transducer_model
+
+from icefall.utils import AttributeDict
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        required=True,
+        help="Path to the checkpoint. "
+        "The checkpoint is assumed to be saved by "
+        "icefall.checkpoint.save_checkpoint() or by export.py. "
+        "A checkpoint saved by export.py --quantize true runs on the CPU.",
+    )
+
+    parser.add_argument(
+        "--bpe-model",
+        type=str,
+        help="""Path to bpe.model.""",
+    )
+
+    parser.add_argument(
+        "--method",
+        type=str,
+        default="greedy_search",
+        help="""Possible values are:
+          - greedy_search
+          - modified_beam_search
+        """,
+    )
+
+    parser.add_argument(
+        "--sample-rate",
+        type=int,
+        default=16000,
+        help="The sample rate of the input sound files",
+    )
+
+    parser.add_argument(
+        "--beam-size",
+        type=int,
+        default=4,
+        help="""An integer indicating how many candidates we will keep for each
+        frame. Used only when --method is modified_beam_search.""",
+    )
+
+    parser.add_argument(
+        "--context-size",
+        type=int,
+        default=2,
+        help="The context size in the decoder. 1 means bigram; "
+        "2 means tri-gram",
+    )
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=6006,
+        help="The port on 127.0.0.1 to listen on.",
+    )
+
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=16,
+        help="Maximum number of requests decoded in a batch.",
+    )
+
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=10,
+        help="""Maximum time in milliseconds that the first request of a
+        batch waits for more requests before the batch is decoded.""",
+    )
+
+    parser.add_argument(
+        "--stats-interval",
+        type=int,
+        default=100,
+        help="Print the latency statistics every this number of batches.",
+    )
+
+    add_model_arguments(parser)
+
+    return parser
+
+
+class Recognizer(object):
+    """Decode a batch of waves with a transducer model."""
+
+    def __init__(self, params: AttributeDict):
+        """
+        Args:
+          params:
+            It is the return value of :func:`get_params` in train.py with
+            the command line arguments merged.
+        """
+        self.params = params
+
+        self.sp = spm.SentencePieceProcessor()
+        self.sp.load(params.bpe_model)
+
+        # <blk> is defined in local/train_bpe_model.py
+        params.blank_id = self.sp.piece_to_id("<blk>")
+        params.unk_id = self.sp.piece_to_id("<unk>")
+        params.vocab_size = self.sp.get_piece_size()
+
+        checkpoint = torch.load(params.checkpoint, map_location="cpu")
+        # It is saved by export.py --quantize true
+        quantized = checkpoint.get("quantized", False)
+
+        device = torch.device("cpu")
+        if torch.cuda.is_available() and not quantized:
+            device = torch.device("cuda", 0)
+        self.device = device
+
+        logging.info(f"device: {device}")
+
+        logging.info("Creating model")
+        model = get_transducer_model(params)
+
+        num_param = sum([p.numel() for p in model.parameters()])
+        logging.info(f"Number of model parameters: {num_param}")
+
+        if quantized:
+            logging.info("Quantizing the linear layers to int8")
+            model.eval()
+            quantize_linears(fold_scales(model))
+        missing_keys, _ = model.load_state_dict(
+            checkpoint["model"], strict=False
+        )
+        if len(missing_keys) > 0:
+            # Otherwise the model would silently use random weights
+            raise ValueError(
+                f"{params.checkpoint} does not match the model. "
+                f"Missing keys: {missing_keys}"
+            )
+        del checkpoint
+        model.to(device)
+        model.eval()
+        model.device = device
+        self.model = model
+
+        logging.info("Constructing Fbank computer")
+        opts = kaldifeat.FbankOptions()
+        opts.device = device
+        opts.frame_opts.dither = 0
+        opts.frame_opts.snip_edges = False
+        opts.frame_opts.samp_freq = params.sample_rate
+        opts.mel_opts.num_bins = params.feature_dim
+
+        self.fbank = kaldifeat.Fbank(opts)
+
+    @torch.no_grad()
+    def __call__(self, waves: List[torch.Tensor]) -> List[str]:
+        """
+        Args:
+          waves:
+            A list of 1-D float32 tensors containing samples in the range
+            [-1, 1].
+        Returns:
+          Return the decoded text of each wave.
+        """
+        waves = [w.to(self.device) for w in waves]
+        features = self.fbank(waves)
+        feature_lengths = [f.size(0) for f in features]
+
+        features = pad_sequence(
+            features, batch_first=True, padding_value=math.log(1e-10)
+        )
+        feature_lengths = torch.tensor(feature_lengths, device=self.device)
+
+        encoder_out, encoder_out_lens = self.model.encoder(
+            x=features, x_lens=feature_lengths
+        )
+
+        if self.params.method == "modified_beam_search":
+            hyp_tokens = modified_beam_search(
+                model=self.model,
+                encoder_out=encoder_out,
+                encoder_out_lens=encoder_out_lens,
+                beam=self.params.beam_size,
+            )
+        else:
+            hyp_tokens = greedy_search_batch(
+                model=self.model,
+                encoder_out=encoder_out,
+                encoder_out_lens=encoder_out_lens,
+            )
+        return self.sp.decode(hyp_tokens)
+
+
+def read_wave(data: bytes, expected_sample_rate: int) -> torch.Tensor:
+    """Read a 16-bit PCM wave file from bytes.
+
+    Args:
+      data:
+        Content of the wave file.
+      expected_sample_rate:
+        The expected sample rate of the wave file.
+    Returns:
+      Return a 1-D float32 tensor containing the samples of the first
+      channel, normalized to the range [-1, 1].
+    Raises:
+      ValueError if the wave file is invalid or too short to be decoded.
+    """
+    try:
+        with wave.open(io.BytesIO(data)) as f:
+            sample_rate = f.getframerate()
+            num_channels = f.getnchannels()
+            sample_width = f.getsampwidth()
+            frames = f.readframes(f.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise ValueError(f"Invalid wave file: {e}")
+
+    if sample_rate != expected_sample_rate:
+        raise ValueError(
+            f"expected sample rate: {expected_sample_rate}. "
+            f"Given: {sample_rate}"
+        )
+    if sample_width != 2:
+        raise ValueError(
+            f"Only 16-bit samples are supported. Given: {sample_width * 8}"
+        )
+
+    samples = np.frombuffer(frames, dtype=np.int16).reshape(-1, num_channels)
+
+    # With snip_edges=False, kaldifeat computes one frame per frame shift
+    # of 10 ms, rounded to the nearest integer. The subsampling module of
+    # the encoder needs at least 7 frames.
+    frame_shift = sample_rate // 100
+    num_frames = (samples.shape[0] + frame_shift // 2) // frame_shift
+    if num_frames < 7:
+        raise ValueError(
+            f"The wave file is too short: {samples.shape[0]} samples. "
+            f"It needs at least {int(6.5 * frame_shift)} samples"
+        )
+
+    # We use only the first channel
+    samples = samples[:, 0].astype(np.float32) / 32768
+    return torch.from_numpy(samples)
+
+
+class Server(object):
+    """A minimal HTTP/1.1 server on top of asyncio.
+
+    POST /decode decodes a wave file; GET /stats returns the latency
+    statistics.
+    """
+
+    def __init__(self, batcher: DynamicBatcher, sample_rate: int):
+        self.batcher = batcher
+        self.sample_rate = sample_rate
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        status = "200 OK"
+        try:
+            method, path, _ = (await reader.readline()).decode().split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, value = line.decode().split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(
+                int(headers.get("content-length", 0))
+            )
+
+            if method == "GET" and path == "/stats":
+                response = self.batcher.stats.summary()
+            elif method == "POST" and path == "/decode":
+                samples = read_wave(body, self.sample_rate)
+                text, queue_wait, compute = await self.batcher.submit(samples)
+                response = {
+                    "text": text,
+                    "queue_wait_ms": round(queue_wait * 1000, 3),
+                    "compute_ms": round(compute * 1000, 3),
+                }
+            else:
+                status = "404 Not Found"
+                response = {"error": f"Unknown request: {method} {path}"}
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status = "400 Bad Request"
+            response = {"error": str(e)}
+        except Exception as e:
+            logging.exception("Failed to handle a request")
+            status = "500 Internal Server Error"
+            response = {"error": str(e)}
+
+        body = json.dumps(response).encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode()
+            + body
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, port: int) -> None:
+        batcher_task = asyncio.ensure_future(self.batcher.run())
+        server = await asyncio.start_server(self.handle, "127.0.0.1", port)
+        logging.info(f"Listening on 127.0.0.1:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher_task.cancel()
+            logging.info(f"{self.batcher.stats}")
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    params = get_params()
+    params.update(vars(args))
+
+    assert params.method in (
+        "greedy_search",
+        "modified_beam_search",
+    ), params.method
+
+    recognizer = Recognizer(params)
+    logging.info(f"{params}")
+
+    batcher = DynamicBatcher(
+        process=recognizer,
+        max_batch_size=params.max_batch_size,
+        max_wait_ms=params.max_wait_ms,
+        stats_interval=params.stats_interval,
+    )
+    server = Server(batcher=batcher, sample_rate=params.sample_rate)
+    try:
+        asyncio.run(server.serve(params.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    formatter = (
+        "%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] %(message)s"
+    )
+
+    logging.basicConfig(format=formatter, level=logging.INFO)
+    main()
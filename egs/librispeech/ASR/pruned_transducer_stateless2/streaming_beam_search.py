@@ -0,0 +1,202 @@
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Search functions for streaming decoding. Different from the ones in
+beam_search.py, they decode one chunk of encoder output for a batch
+of streams and keep the search state in the streams, so that the
+search can continue with the next chunk.
+"""
+
+from typing import List, Optional
+
+import k2
+import torch
+from beam_search import DecoderOutCache, get_decoder_out
+from decode_stream import DecodeStream
+from model import Transducer
+
+from icefall.decode import one_best_decoding
+from icefall.utils import get_texts
+
+
+def greedy_search(
+    model: Transducer,
+    encoder_out: torch.Tensor,
+    encoder_out_lens: torch.Tensor,
+    streams: List[DecodeStream],
+    decoder_cache: Optional[DecoderOutCache] = None,
+) -> None:
+    """Greedy search for one chunk with --max-sym-per-frame=1 hardcoded.
+
+    `stream.hyp` of each stream is updated **in-place**.
+
+    Args:
+      model:
+        The transducer model.
+      encoder_out:
+        Output from the encoder after `model.joiner.encoder_proj`.
+        Its shape is (N, T, joiner_dim), where N == len(streams).
+      encoder_out_lens:
+        A 1-D tensor of shape (N,), containing number of valid frames in
+        encoder_out before padding.
+      streams:
+        The streams being decoded. stream.hyp contains the decoded tokens
+        so far, including `context_size` leading blanks.
+      decoder_cache:
+        Cache of the projected decoder outputs. If it is None, the decoder
+        is run for all contexts without a cache.
+    """
+    assert encoder_out.ndim == 3, encoder_out.shape
+    assert encoder_out.size(0) == len(streams), (
+        encoder_out.size(0),
+        len(streams),
+    )
+
+    blank_id = model.decoder.blank_id
+    unk_id = getattr(model, "unk_id", blank_id)
+    context_size = model.decoder.context_size
+    device = encoder_out.device
+
+    hyps = [stream.hyp for stream in streams]
+    decoder_input = torch.tensor(
+        [h[-context_size:] for h in hyps], device=device, dtype=torch.int64
+    )
+    decoder_out = get_decoder_out(
+        model, decoder_input, decoder_cache
+    ).unsqueeze(1)
+    # decoder_out: (N, 1, joiner_dim)
+
+    encoder_out_lens = encoder_out_lens.tolist()
+    T = encoder_out.size(1)
+    for t in range(T):
+        current_encoder_out = encoder_out[:, t : t + 1, :]  # noqa: E203
+        current_encoder_out = current_encoder_out.unsqueeze(2)
+        # current_encoder_out's shape: (N, 1, 1, joiner_dim)
+
+        logits = model.joiner(
+            current_encoder_out, decoder_out.unsqueeze(1), project_input=False
+        )
+        # logits'shape (N, 1, 1, vocab_size)
+        logits = logits.squeeze(1).squeeze(1)  # (N, vocab_size)
+        y = logits.argmax(dim=1).tolist()
+        emitted = False
+        for i, v in enumerate(y):
+            if v not in (blank_id, unk_id) and t < encoder_out_lens[i]:
+                hyps[i].append(v)
+                emitted = True
+        if emitted:
+            decoder_input = torch.tensor(
+                [h[-context_size:] for h in hyps],
+                device=device,
+                dtype=torch.int64,
+            )
+            decoder_out = get_decoder_out(
+                model, decoder_input, decoder_cache
+            ).unsqueeze(1)
+
+
+def fast_beam_search_one_best(
+    model: Transducer,
+    encoder_out: torch.Tensor,
+    streams: List[DecodeStream],
+    beam: float,
+    max_states: int,
+    max_contexts: int,
+    decoder_cache: Optional[DecoderOutCache] = None,
+) -> None:
+    """Fast beam search for one chunk. It limits the maximum number of
+    symbols per frame to 1.
+
+    The `k2.RnntDecodingStream` of each stream keeps the search state
+    across chunks. After the chunk, the shortest path of the lattice
+    decoded so far is saved in `stream.hyp`.
+
+    Args:
+      model:
+        The transducer model.
+      encoder_out:
+        Output from the encoder after `model.joiner.encoder_proj`.
+        Its shape is (N, T, joiner_dim), where N == len(streams).
+      streams:
+        The streams being decoded. `stream.processed_frames` must already
+        include the frames of this chunk.
+      beam:
+        Beam value, similar to the beam used in Kaldi..
+      max_states:
+        Max states per stream per frame.
+      max_contexts:
+        Max contexts pre stream per frame.
+      decoder_cache:
+        Cache of the projected decoder outputs. If it is None, the decoder
+        is run for all contexts without a cache.
+    """
+    assert encoder_out.ndim == 3, encoder_out.shape
+    assert encoder_out.size(0) == len(streams), (
+        encoder_out.size(0),
+        len(streams),
+    )
+
+    context_size = model.decoder.context_size
+    vocab_size = model.decoder.vocab_size
+
+    config = k2.RnntDecodingConfig(
+        vocab_size=vocab_size,
+        decoder_history_len=context_size,
+        beam=beam,
+        max_contexts=max_contexts,
+        max_states=max_states,
+    )
+    decoding_streams = k2.RnntDecodingStreams(
+        [stream.rnnt_decoding_stream for stream in streams], config
+    )
+
+    T = encoder_out.size(1)
+    for t in range(T):
+        # shape is a RaggedShape of shape (B, context)
+        # contexts is a Tensor of shape (shape.NumElements(), context_size)
+        shape, contexts = decoding_streams.get_contexts()
+        # `nn.Embedding()` in torch below v1.7.1 supports only torch.int64
+        contexts = contexts.to(torch.int64)
+        # decoder_out is of shape (shape.NumElements(), 1, joiner_dim)
+        decoder_out = get_decoder_out(
+            model, contexts, decoder_cache
+        ).unsqueeze(1)
+        # current_encoder_out is of shape
+        # (shape.NumElements(), 1, joiner_dim)
+        current_encoder_out = torch.index_select(
+            encoder_out[:, t : t + 1, :],  # noqa: E203
+            0,
+            shape.row_ids(1).to(torch.int64),
+        )
+        logits = model.joiner(
+            current_encoder_out.unsqueeze(2),
+            decoder_out.unsqueeze(1),
+            project_input=False,
+        )
+        logits = logits.squeeze(1).squeeze(1)
+        log_probs = logits.log_softmax(dim=-1)
+        decoding_streams.advance(log_probs)
+
+    decoding_streams.terminate_and_flush_to_streams()
+
+    lattice = decoding_streams.format_output(
+        [stream.processed_frames for stream in streams]
+    )
+    best_path = one_best_decoding(lattice)
+    hyps = get_texts(best_path)
+    for stream, hyp in zip(streams, hyps):
+        stream.hyp = hyp
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Decode the test sets chunk by chunk with many concurrent streams and
+report the WER, the real time factor and the per-chunk latency.
+
+The model has to be trained with --causal-convolution=True and
+--dynamic-chunk-training=True, e.g.,
+
+./pruned_transducer_stateless2/train.py \
+        --causal-convolution True \
+        --dynamic-chunk-training True \
+        ...
+
+Usage:
+(1) greedy search
+./pruned_transducer_stateless2/streaming_decode.py \
+        --epoch 28 \
+        --avg 15 \
+        --exp-dir ./pruned_transducer_stateless2/exp \
+        --causal-convolution True \
+        --decode-chunk-size 8 \
+        --left-context 32 \
+        --num-decode-streams 100 \
+        --decoding-method greedy_search
+
+(2) fast beam search
+./pruned_transducer_stateless2/streaming_decode.py \
+        --epoch 28 \
+        --avg 15 \
+        --exp-dir ./pruned_transducer_stateless2/exp \
+        --causal-convolution True \
+        --decode-chunk-size 8 \
+        --left-context 32 \
+        --num-decode-streams 100 \
+        --decoding-method fast_beam_search \
+        --beam 4 \
+        --max-contexts 4 \
+        --max-states 8
+"""
+
+import argparse
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import sentencepiece as spm
+import torch
+from asr_datamodule import LibriSpeechAsrDataModule
+from beam_search import DecoderOutCache
+from decode import save_results
+from lhotse import CutSet
+from scaling import fold_scales
+from streaming_decoder import StreamingDecoder
+from train import add_model_arguments, get_params, get_transducer_model
+
+from icefall.checkpoint import (
+    average_checkpoints,
+    find_checkpoints,
+    load_checkpoint,
+)
+from icefall.utils import AttributeDict, setup_logger
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "--epoch",
+        type=int,
+        default=28,
+        help="""It specifies the checkpoint to use for decoding.
+        Note: Epoch counts from 0.
+        You can specify --avg to use more checkpoints for model averaging.""",
+    )
+
+    parser.add_argument(
+        "--iter",
+        type=int,
+        default=0,
+        help="""If positive, --epoch is ignored and it
+        will use the checkpoint exp_dir/checkpoint-iter.pt.
+        You can specify --avg to use more checkpoints for model averaging.
+        """,
+    )
+
+    parser.add_argument(
+        "--avg",
+        type=int,
+        default=15,
+        help="Number of checkpoints to average. Automatically select "
+        "consecutive checkpoints before the checkpoint specified by "
+        "'--epoch' and '--iter'",
+    )
+
+    parser.add_argument(
+        "--exp-dir",
+        type=str,
+        default="pruned_transducer_stateless2/exp",
+        help="The experiment dir",
+    )
+
+    parser.add_argument(
+        "--bpe-model",
+        type=str,
+        default="data/lang_bpe_500/bpe.model",
+        help="Path to the BPE model",
+    )
+
+    parser.add_argument(
+        "--decoding-method",
+        type=str,
+        default="greedy_search",
+        help="""Possible values are:
+          - greedy_search
+          - fast_beam_search
+        """,
+    )
+
+    parser.add_argument(
+        "--beam",
+        type=float,
+        default=4,
+        help="""A floating point value to calculate the cutoff score during beam
+        search (i.e., `cutoff = max-score - beam`), which is the same as the
+        `beam` in Kaldi.
+        Used only when --decoding-method is fast_beam_search""",
+    )
+
+    parser.add_argument(
+        "--max-contexts",
+        type=int,
+        default=4,
+        help="""Used only when --decoding-method is
+        fast_beam_search""",
+    )
+
+    parser.add_argument(
+        "--max-states",
+        type=int,
+        default=8,
+        help="""Used only when --decoding-method is
+        fast_beam_search""",
+    )
+
+    parser.add_argument(
+        "--context-size",
+        type=int,
+        default=2,
+        help="The context size in the decoder. 1 means bigram; "
+        "2 means tri-gram",
+    )
+
+    parser.add_argument(
+        "--decoder-cache-size",
+        type=int,
+        default=0,
+        help="""If positive, cache the projected decoder outputs of at most
+        so many decoder contexts across chunks. 0 disables the cache.
+        Used only when --decoding-method is greedy_search.""",
+    )
+
+    parser.add_argument(
+        "--decode-chunk-size",
+        type=int,
+        default=16,
+        help="""The chunk size for decoding, in frames after subsampling.
+        Each chunk is decode-chunk-size * subsampling-factor feature
+        frames, i.e., 40ms per frame after subsampling.""",
+    )
+
+    parser.add_argument(
+        "--left-context",
+        type=int,
+        default=64,
+        help="""Number of frames after subsampling of the left context
+        that each chunk attends to.""",
+    )
+
+    parser.add_argument(
+        "--num-decode-streams",
+        type=int,
+        default=100,
+        help="The number of streams that are decoded concurrently.",
+    )
+
+    add_model_arguments(parser)
+
+    return parser
+
+
+def decode_dataset(
+    cuts: CutSet,
+    params: AttributeDict,
+    decoder: StreamingDecoder,
+    sp: spm.SentencePieceProcessor,
+) -> Tuple[Dict[str, List[Tuple[List[str], List[str]]]], Dict[str, float]]:
+    """Decode a dataset with params.num_decode_streams concurrent streams.
+
+    The audio of each utterance is fed to its stream one chunk at a time,
+    as if it arrived in real time. Whenever a stream finishes, a new
+    utterance is started on a new stream.
+
+    Args:
+      cuts:
+        The cuts to decode.
+      params:
+        It is returned by :func:`get_params`.
+      decoder:
+        The streaming decoder.
+      sp:
+        The BPE model.
+    Returns:
+      Return a tuple containing:
+        - A dict with a single key params.decoding_method. Its value is a
+          list of tuples. Each tuple contains two elements: The first is
+          the reference transcript, and the second is the predicted result.
+        - A dict containing the real time factor and the percentiles of
+          the per-chunk latency, in milliseconds.
+    """
+    chunk_samples = (
+        params.decode_chunk_size
+        * params.subsampling_factor
+        * int(params.sample_rate * 0.01)
+    )
+
+    results = []
+    latencies = []
+    compute_time = 0.0
+    audio_seconds = 0.0
+
+    # Each entry is [stream, samples, num samples fed, reference text]
+    active = []
+    cut_iter = iter(cuts)
+    num_cuts = 0
+    exhausted = False
+
+    while True:
+        while not exhausted and len(active) < params.num_decode_streams:
+            cut = next(cut_iter, None)
+            if cut is None:
+                exhausted = True
+                break
+            samples = torch.from_numpy(cut.load_audio()[0])
+            audio_seconds += samples.numel() / params.sample_rate
+            text = cut.supervisions[0].text
+            active.append([decoder.create_stream(), samples, 0, text])
+
+        if len(active) == 0:
+            break
+
+        for entry in active:
+            stream, samples, offset, _ = entry
+            if stream.input_finished:
+                continue
+            decoder.accept_waveform(
+                stream,
+                params.sample_rate,
+                samples[offset : offset + chunk_samples],  # noqa: E203
+            )
+            entry[2] = offset + chunk_samples
+            if entry[2] >= samples.numel():
+                decoder.input_finished(stream)
+
+        start = time.time()
+        decoded = decoder.decode_chunk([entry[0] for entry in active])
+        elapsed = time.time() - start
+        compute_time += elapsed
+        # All streams in the batch get their partial results at the end
+        latencies.extend([elapsed] * len(decoded))
+
+        still_active = []
+        for entry in active:
+            stream, _, _, text = entry
+            if not stream.done:
+                still_active.append(entry)
+                continue
+            hyp = sp.decode(decoder.get_partial_result(stream))
+            results.append((text.split(), hyp.split()))
+            num_cuts += 1
+            if num_cuts % 100 == 0:
+                logging.info(f"Cuts processed until now is {num_cuts}")
+        active = still_active
+
+    latencies = np.array(latencies) * 1000
+    stats = {
+        "rtf": compute_time / max(audio_seconds, 1e-6),
+        "latency-p50": float(np.percentile(latencies, 50)),
+        "latency-p90": float(np.percentile(latencies, 90)),
+        "latency-p99": float(np.percentile(latencies, 99)),
+    }
+    return {params.decoding_method: results}, stats
+
+
+@torch.no_grad()
+def main():
+    parser = get_parser()
+    LibriSpeechAsrDataModule.add_arguments(parser)
+    args = parser.parse_args()
+    args.exp_dir = Path(args.exp_dir)
+
+    params = get_params()
+    params.update(vars(args))
+
+    assert params.decoding_method in (
+        "greedy_search",
+        "fast_beam_search",
+    ), params.decoding_method
+    assert params.causal_convolution, "Please use --causal-convolution=True"
+
+    params.res_dir = params.exp_dir / "streaming" / params.decoding_method
+
+    if params.iter > 0:
+        params.suffix = f"iter-{params.iter}-avg-{params.avg}"
+    else:
+        params.suffix = f"epoch-{params.epoch}-avg-{params.avg}"
+
+    params.suffix += f"-streaming-chunk-size-{params.decode_chunk_size}"
+    params.suffix += f"-left-context-{params.left_context}"
+
+    if params.decoding_method == "fast_beam_search":
+        params.suffix += f"-beam-{params.beam}"
+        params.suffix += f"-max-contexts-{params.max_contexts}"
+        params.suffix += f"-max-states-{params.max_states}"
+    else:
+        params.suffix += f"-context-{params.context_size}"
+
+    setup_logger(f"{params.res_dir}/log-decode-{params.suffix}")
+    logging.info("Decoding started")
+
+    device = torch.device("cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", 0)
+
+    logging.info(f"Device: {device}")
+
+    sp = spm.SentencePieceProcessor()
+    sp.load(params.bpe_model)
+
+    # <blk> and <unk> is defined in local/train_bpe_model.py
+    params.blank_id = sp.piece_to_id("<blk>")
+    params.unk_id = sp.piece_to_id("<unk>")
+    params.vocab_size = sp.get_piece_size()
+
+    logging.info(params)
+
+    logging.info("About to create model")
+    model = get_transducer_model(params)
+
+    if params.iter > 0:
+        filenames = find_checkpoints(params.exp_dir, iteration=-params.iter)[
+            : params.avg
+        ]
+        if len(filenames) == 0:
+            raise ValueError(
+                f"No checkpoints found for"
+                f" --iter {params.iter}, --avg {params.avg}"
+            )
+        elif len(filenames) < params.avg:
+            raise ValueError(
+                f"Not enough checkpoints ({len(filenames)}) found for"
+                f" --iter {params.iter}, --avg {params.avg}"
+            )
+        logging.info(f"averaging {filenames}")
+        model.to(device)
+        model.load_state_dict(average_checkpoints(filenames, device=device))
+    elif params.avg == 1:
+        load_checkpoint(f"{params.exp_dir}/epoch-{params.epoch}.pt", model)
+    else:
+        start = params.epoch - params.avg + 1
+        filenames = []
+        for i in range(start, params.epoch + 1):
+            if start >= 0:
+                filenames.append(f"{params.exp_dir}/epoch-{i}.pt")
+        logging.info(f"averaging {filenames}")
+        model.to(device)
+        model.load_state_dict(average_checkpoints(filenames, device=device))
+
+    model.to(device)
+    model.eval()
+    # Multiply the scales into the weights once instead of in every
+    # forward pass
+    fold_scales(model)
+    model.device = device
+
+    num_param = sum([p.numel() for p in model.parameters()])
+    logging.info(f"Number of model parameters: {num_param}")
+
+    if (
+        params.decoder_cache_size > 0
+        and params.decoding_method == "greedy_search"
+    ):
+        decoder_cache = DecoderOutCache(max_size=params.decoder_cache_size)
+    else:
+        decoder_cache = None
+
+    decoder = StreamingDecoder(
+        model=model,
+        params=params,
+        decoder_cache=decoder_cache,
+    )
+
+    librispeech = LibriSpeechAsrDataModule(args)
+
+    test_clean_cuts = librispeech.test_clean_cuts()
+    test_other_cuts = librispeech.test_other_cuts()
+
+    test_sets = ["test-clean", "test-other"]
+    test_cuts = [test_clean_cuts, test_other_cuts]
+
+    for test_set, cuts in zip(test_sets, test_cuts):
+        results_dict, stats = decode_dataset(
+            cuts=cuts,
+            params=params,
+            decoder=decoder,
+            sp=sp,
+        )
+
+        save_results(
+            params=params,
+            test_set_name=test_set,
+            results_dict=results_dict,
+        )
+
+        logging.info(
+            f"{test_set}: RTF {stats['rtf']:.4f}, per-chunk latency (ms) "
+            f"p50 {stats['latency-p50']:.1f}, "
+            f"p90 {stats['latency-p90']:.1f}, "
+            f"p99 {stats['latency-p99']:.1f}"
+        )
+
+    if decoder_cache is not None:
+        logging.info(f"Decoder cache: {decoder_cache}")
+
+    logging.info("Done!")
+
+
+if __name__ == "__main__":
+    main()
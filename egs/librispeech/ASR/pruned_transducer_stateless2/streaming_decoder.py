@@ -0,0 +1,306 @@
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Chunk-wise streaming decoding with a model trained with
+--causal-convolution=True and --dynamic-chunk-training=True.
+
+Usage:
+
+    decoder = StreamingDecoder(model=model, params=params)
+    stream = decoder.create_stream()
+    while there is audio:
+        decoder.accept_waveform(stream, sampling_rate, samples)
+        decoder.decode_chunk([stream, ...])
+        print(sp.decode(decoder.get_partial_result(stream)))
+    decoder.input_finished(stream)
+    while not stream.done:
+        decoder.decode_chunk([stream, ...])
+
+`decode_chunk()` runs the encoder and the search once for all given
+streams that have a full chunk of features, so many streams can be
+decoded concurrently in one batch.
+"""
+
+from typing import List, Optional
+
+import k2
+import kaldifeat
+import torch
+from beam_search import DecoderOutCache
+from decode_stream import LOG_EPS, DecodeStream
+from model import Transducer
+from streaming_beam_search import fast_beam_search_one_best, greedy_search
+from torch.nn.utils.rnn import pad_sequence
+
+from icefall.utils import AttributeDict
+
+
+class StreamingDecoder(object):
+    """Decode many streams chunk by chunk with a streaming model."""
+
+    def __init__(
+        self,
+        model: Transducer,
+        params: AttributeDict,
+        decoding_graph: Optional[k2.Fsa] = None,
+        decoder_cache: Optional[DecoderOutCache] = None,
+    ) -> None:
+        """
+        Args:
+          model:
+            The transducer model. Its encoder has to be a Conformer
+            trained with --causal-convolution=True.
+          params:
+            It is the return value of :func:`get_params` in train.py with
+            the following decoding arguments merged: decoding_method,
+            decode_chunk_size, left_context and, for fast_beam_search,
+            beam, max_contexts and max_states.
+          decoding_graph:
+            The decoding graph for fast_beam_search. If None, a trivial
+            graph is used.
+          decoder_cache:
+            Cache of the projected decoder outputs. If None, the decoder
+            is run for all contexts without a cache.
+        """
+        assert params.decoding_method in (
+            "greedy_search",
+            "fast_beam_search",
+        ), params.decoding_method
+        assert model.encoder.causal, "Please use --causal-convolution=True"
+
+        self.model = model
+        self.params = params
+        self.device = next(model.parameters()).device
+
+        if params.decoding_method == "fast_beam_search":
+            if decoding_graph is None:
+                decoding_graph = k2.trivial_graph(
+                    params.vocab_size - 1, device=self.device
+                )
+        self.decoding_graph = decoding_graph
+
+        self.decoder_cache = decoder_cache
+
+        opts = kaldifeat.FbankOptions()
+        opts.device = torch.device("cpu")
+        opts.frame_opts.dither = 0
+        # Frames are extracted from the buffered samples without looking
+        # at the samples after the buffer, see accept_waveform()
+        opts.frame_opts.snip_edges = True
+        opts.frame_opts.samp_freq = params.sample_rate
+        opts.mel_opts.num_bins = params.feature_dim
+        self.fbank = kaldifeat.Fbank(opts)
+
+        self.window_size = int(
+            params.sample_rate * opts.frame_opts.frame_length_ms / 1000
+        )
+        self.window_shift = int(
+            params.sample_rate * opts.frame_opts.frame_shift_ms / 1000
+        )
+        # Number of samples before the center of the first window when
+        # --snip-edges=False
+        self.left_padding = self.window_size // 2 - self.window_shift // 2
+
+    def create_stream(self) -> DecodeStream:
+        """Create a new stream for an utterance."""
+        return DecodeStream(
+            params=self.params,
+            initial_states=self.model.encoder.get_init_state(
+                left_context=self.params.left_context, device=self.device
+            ),
+            decoding_graph=self.decoding_graph,
+        )
+
+    def accept_waveform(
+        self,
+        stream: DecodeStream,
+        sampling_rate: float,
+        waveform: torch.Tensor,
+    ) -> None:
+        """Append samples to a stream and compute features for all
+        complete frames.
+
+        The features are the same as the ones computed for the whole
+        utterance with --snip-edges=False, which is used in training.
+
+        Args:
+          stream:
+            The stream to append to.
+          sampling_rate:
+            The sampling rate of the samples. It has to match the one of
+            the model.
+          waveform:
+            A 1-D float32 tensor containing samples in the range [-1, 1].
+        """
+        assert sampling_rate == self.params.sample_rate, (
+            sampling_rate,
+            self.params.sample_rate,
+        )
+        assert not stream.input_finished, "Input is already finished"
+        assert waveform.ndim == 1, waveform.shape
+
+        waveform = waveform.to(torch.float32).cpu()
+        stream.waveform = torch.cat([stream.waveform, waveform])
+        stream.num_samples += waveform.numel()
+
+        if (
+            stream.num_frames == 0
+            and stream.num_samples - waveform.numel() < self.left_padding
+            and stream.num_samples >= self.left_padding
+        ):
+            # The first window starts before the first sample. Kaldi
+            # reflects the samples around the start.
+            left = stream.waveform[: self.left_padding].flip(0)
+            stream.waveform = torch.cat([left, stream.waveform])
+            self._compute_features(stream)
+        elif stream.num_samples >= self.left_padding:
+            self._compute_features(stream)
+
+    def input_finished(self, stream: DecodeStream) -> None:
+        """Signal that no more samples will be appended to a stream.
+        The remaining frames are computed with the samples after the
+        end of the utterance reflected.
+        """
+        assert not stream.input_finished, "Input is already finished"
+        stream.input_finished = True
+
+        if stream.num_samples < self.left_padding:
+            left = stream.waveform[: self.left_padding].flip(0)
+            left = torch.nn.functional.pad(
+                left, (self.left_padding - left.numel(), 0)
+            )
+            stream.waveform = torch.cat([left, stream.waveform])
+
+        total_frames = (
+            stream.num_samples + self.window_shift // 2
+        ) // self.window_shift
+        num_frames = total_frames - stream.num_frames
+        if num_frames <= 0:
+            return
+
+        num_samples = (num_frames - 1) * self.window_shift + self.window_size
+        padding = num_samples - stream.waveform.numel()
+        if padding > 0:
+            right = stream.waveform[-padding:].flip(0)
+            right = torch.nn.functional.pad(
+                right, (0, padding - right.numel())
+            )
+            stream.waveform = torch.cat([stream.waveform, right])
+        self._compute_features(stream)
+
+    def _compute_features(self, stream: DecodeStream) -> None:
+        """Compute features for all complete windows of the buffered
+        samples and remove the samples not needed any more."""
+        num_samples = stream.waveform.numel()
+        if num_samples < self.window_size:
+            return
+        num_frames = (
+            num_samples - self.window_size
+        ) // self.window_shift + 1
+        end = (num_frames - 1) * self.window_shift + self.window_size
+        features = self.fbank(stream.waveform[:end])
+        assert features.size(0) == num_frames, (
+            features.size(0),
+            num_frames,
+        )
+
+        stream.features = torch.cat([stream.features, features])
+        stream.num_frames += num_frames
+        offset = num_frames * self.window_shift
+        stream.waveform = stream.waveform[offset:]
+
+    @torch.no_grad()
+    def decode_chunk(self, streams: List[DecodeStream]) -> List[DecodeStream]:
+        """Decode one chunk for each of the given streams that has
+        enough features. The encoder and the search run once for all
+        of them.
+
+        Args:
+          streams:
+            The streams to decode.
+        Returns:
+          Return the streams that were decoded.
+        """
+        chunk_size = self.params.decode_chunk_size
+        subsampling_factor = self.params.subsampling_factor
+
+        ready = []
+        features = []
+        feature_lens = []
+        for stream in streams:
+            chunk = stream.get_feature_chunk(chunk_size * subsampling_factor)
+            if chunk is None:
+                continue
+            ready.append(stream)
+            features.append(chunk[0])
+            feature_lens.append(chunk[1])
+
+        if len(ready) == 0:
+            return ready
+
+        features = pad_sequence(
+            features, batch_first=True, padding_value=LOG_EPS
+        ).to(self.device)
+        feature_lens = torch.tensor(feature_lens, device=self.device)
+        processed_lens = torch.tensor(
+            [s.processed_frames for s in ready], device=self.device
+        )
+        states = [
+            torch.stack([s.states[i] for s in ready], dim=2)
+            for i in range(len(ready[0].states))
+        ]
+
+        (
+            encoder_out,
+            encoder_out_lens,
+            states,
+        ) = self.model.encoder.streaming_forward(
+            x=features,
+            x_lens=feature_lens,
+            states=states,
+            processed_lens=processed_lens,
+            left_context=self.params.left_context,
+        )
+        encoder_out = self.model.joiner.encoder_proj(encoder_out)
+
+        for i, stream in enumerate(ready):
+            stream.states = [s[:, :, i] for s in states]
+            stream.processed_frames += int(encoder_out_lens[i])
+
+        if self.params.decoding_method == "greedy_search":
+            greedy_search(
+                model=self.model,
+                encoder_out=encoder_out,
+                encoder_out_lens=encoder_out_lens,
+                streams=ready,
+                decoder_cache=self.decoder_cache,
+            )
+        else:
+            fast_beam_search_one_best(
+                model=self.model,
+                encoder_out=encoder_out,
+                streams=ready,
+                beam=self.params.beam,
+                max_states=self.params.max_states,
+                max_contexts=self.params.max_contexts,
+                decoder_cache=self.decoder_cache,
+            )
+        return ready
+
+    def get_partial_result(self, stream: DecodeStream) -> List[int]:
+        """Return the token IDs decoded so far for a stream."""
+        return stream.result
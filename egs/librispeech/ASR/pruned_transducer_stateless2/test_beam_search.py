@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+To run this file, do:
+
+    cd icefall/egs/librispeech/ASR
+    python ./pruned_transducer_stateless2/test_beam_search.py
+"""
+
+import torch
+import torch.nn as nn
+from beam_search import (
+    DecoderOutCache,
+    GreedySearch,
+    _deprecated_modified_beam_search,
+    greedy_search,
+    greedy_search_batch,
+    modified_beam_search,
+)
+from decoder import Decoder
+from joiner import Joiner
+
+
+class _Model(nn.Module):
+    """Only the parts of a transducer used by the search functions."""
+
+    def __init__(self, vocab_size: int, context_size: int):
+        super().__init__()
+        self.decoder = Decoder(
+            vocab_size=vocab_size,
+            decoder_dim=16,
+            blank_id=0,
+            context_size=context_size,
+        )
+        self.joiner = Joiner(
+            encoder_dim=8,
+            decoder_dim=16,
+            joiner_dim=12,
+            vocab_size=vocab_size,
+        )
+        self.unk_id = 2
+        # Make the output distribution peaky enough to emit tokens
+        with torch.no_grad():
+            for p in self.parameters():
+                p.mul_(5)
+
+
+def _get_inputs(N: int, T: int):
+    encoder_out = torch.randn(N, T, 8)
+    encoder_out_lens = torch.randint(1, T + 1, (N,))
+    encoder_out_lens[0] = T
+    return encoder_out, encoder_out_lens
+
+
+@torch.no_grad()
+def test_modified_beam_search():
+    torch.manual_seed(20220518)
+    for context_size in [1, 2]:
+        for beam in [1, 4]:
+            model = _Model(vocab_size=10, context_size=context_size).eval()
+            encoder_out, encoder_out_lens = _get_inputs(N=5, T=20)
+
+            hyps = modified_beam_search(
+                model=model,
+                encoder_out=encoder_out,
+                encoder_out_lens=encoder_out_lens,
+                beam=beam,
+            )
+            for i, n in enumerate(encoder_out_lens.tolist()):
+                expected = _deprecated_modified_beam_search(
+                    model=model,
+                    encoder_out=encoder_out[i : i + 1, :n],  # noqa: E203
+                    beam=beam,
+                )
+                assert hyps[i] == expected, (hyps[i], expected)
+
+
+@torch.no_grad()
+def test_decoder_out_cache():
+    torch.manual_seed(20220518)
+    model = _Model(vocab_size=10, context_size=2).eval()
+    encoder_out, encoder_out_lens = _get_inputs(N=5, T=20)
+
+    # A tiny cache so that entries are evicted
+    decoder_cache = DecoderOutCache(max_size=3)
+    hyps = greedy_search_batch(
+        model=model,
+        encoder_out=encoder_out,
+        encoder_out_lens=encoder_out_lens,
+        decoder_cache=decoder_cache,
+    )
+    assert len(decoder_cache) <= 3
+    assert decoder_cache.num_queries > 0
+
+    # Without a cache, the decoder is run for all contexts
+    assert (
+        greedy_search_batch(
+            model=model,
+            encoder_out=encoder_out,
+            encoder_out_lens=encoder_out_lens,
+        )
+        == hyps
+    )
+
+    for i, n in enumerate(encoder_out_lens.tolist()):
+        expected = greedy_search(
+            model=model,
+            encoder_out=encoder_out[i : i + 1, :n],  # noqa: E203
+            max_sym_per_frame=1,
+        )
+        assert hyps[i] == expected, (hyps[i], expected)
+
+    contexts = torch.tensor([[0, 0], [3, 4], [0, 0]])
+    decoder_out = model.decoder(contexts, need_pad=False)
+    expected = model.joiner.decoder_proj(decoder_out).squeeze(1)
+    decoder_cache = DecoderOutCache()
+    for _ in range(2):
+        assert torch.allclose(decoder_cache(model, contexts), expected)
+    assert len(decoder_cache) == 2
+    # Only the second call hits the cache. The repeated [0, 0] in
+    # the first call is computed only once.
+    assert decoder_cache.num_hits == 3, decoder_cache.num_hits
+
+
+@torch.no_grad()
+def test_greedy_search_batch():
+    torch.manual_seed(20220519)
+    for context_size in [1, 2]:
+        model = _Model(vocab_size=10, context_size=context_size).eval()
+        encoder_out, encoder_out_lens = _get_inputs(N=5, T=20)
+
+        hyps = greedy_search_batch(
+            model=model,
+            encoder_out=encoder_out,
+            encoder_out_lens=encoder_out_lens,
+        )
+        expected = [
+            greedy_search(
+                model=model,
+                encoder_out=encoder_out[i : i + 1, :n],  # noqa: E203
+                max_sym_per_frame=1,
+            )
+            for i, n in enumerate(encoder_out_lens.tolist())
+        ]
+        assert hyps == expected, (hyps, expected)
+        assert any(len(h) > 0 for h in hyps)
+
+        greedy_search_module = GreedySearch(model)
+        if context_size > 1:
+            # Decoder has no conv for context_size == 1 and cannot be
+            # scripted
+            greedy_search_module = torch.jit.script(greedy_search_module)
+        hyp_tokens, hyp_lens = greedy_search_module(
+            encoder_out, encoder_out_lens
+        )
+        assert hyp_tokens.shape == (5, 20), hyp_tokens.shape
+        hyp_tokens = hyp_tokens.tolist()
+        hyp_lens = hyp_lens.tolist()
+        assert [h[:n] for h, n in zip(hyp_tokens, hyp_lens)] == expected
+
+
+def main():
+    test_modified_beam_search()
+    test_decoder_out_cache()
+    test_greedy_search_batch()
+
+
+if __name__ == "__main__":
+    main()
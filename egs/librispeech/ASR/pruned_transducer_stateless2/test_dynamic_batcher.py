@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+To run this file, do:
+
+    cd icefall/egs/librispeech/ASR
+    python ./pruned_transducer_stateless2/test_dynamic_batcher.py
+"""
+
+import asyncio
+
+from dynamic_batcher import DynamicBatcher
+
+
+def _process(requests):
+    if -1 in requests:
+        raise ValueError("bad request")
+    return [r * 2 for r in requests]
+
+
+def _run(batcher, coro):
+    async def main():
+        task = asyncio.ensure_future(batcher.run())
+        # Let run() create the queue
+        await asyncio.sleep(0)
+        try:
+            return await coro()
+        finally:
+            task.cancel()
+
+    return asyncio.run(main())
+
+
+def test_dynamic_batcher():
+    batcher = DynamicBatcher(_process, max_batch_size=4, max_wait_ms=200)
+
+    async def submit_all():
+        return await asyncio.gather(
+            *[batcher.submit(i) for i in range(10)]
+        )
+
+    results = _run(batcher, submit_all)
+    assert [r[0] for r in results] == [i * 2 for i in range(10)]
+    assert list(batcher.stats.batch_size) == [4, 4, 2]
+
+    summary = batcher.stats.summary()
+    assert summary["num_requests"] == 10
+    assert summary["num_batches"] == 3
+    # The last batch is not full, so it waits for max_wait_ms
+    assert summary["queue_wait_ms_p99"] >= 150, summary
+
+
+def test_dynamic_batcher_error():
+    batcher = DynamicBatcher(_process, max_batch_size=3, max_wait_ms=200)
+
+    async def submit_with_bad():
+        return await asyncio.gather(
+            batcher.submit(1),
+            batcher.submit(-1),
+            batcher.submit(3),
+            return_exceptions=True,
+        )
+
+    results = _run(batcher, submit_with_bad)
+    # Only the failing request gets the exception
+    assert results[0][0] == 2
+    assert isinstance(results[1], ValueError), results[1]
+    assert results[2][0] == 6
+
+    async def submit_bad():
+        try:
+            await batcher.submit(-1)
+        except ValueError:
+            pass
+        else:
+            assert False, "Expect a ValueError"
+        # The batcher keeps running after a failed batch
+        return await batcher.submit(3)
+
+    assert _run(batcher, submit_bad)[0] == 6
+
+
+def main():
+    test_dynamic_batcher()
+    test_dynamic_batcher_error()
+
+
+if __name__ == "__main__":
+    main()
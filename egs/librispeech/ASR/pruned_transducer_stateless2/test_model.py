@@ -24,8 +24,12 @@ To run this file, do:
 """
 
 import torch
+from conformer import Conformer
+from decode_stream import DecodeStream
 from train import get_params, get_transducer_model
 
+from icefall.utils import AttributeDict, subsequent_chunk_mask
+
 
 def test_model():
     params = get_params()
@@ -33,6 +37,10 @@ def test_model():
     params.blank_id = 0
     params.context_size = 2
     params.unk_id = 2
+    params.dynamic_chunk_training = False
+    params.short_chunk_size = 25
+    params.num_left_chunks = 4
+    params.causal_convolution = False
 
     model = get_transducer_model(params)
 
@@ -42,8 +50,107 @@ def test_model():
     torch.jit.script(model)
 
 
+def test_model_streaming():
+    params = get_params()
+    params.vocab_size = 500
+    params.blank_id = 0
+    params.context_size = 2
+    params.unk_id = 2
+    params.dynamic_chunk_training = True
+    params.short_chunk_size = 25
+    params.num_left_chunks = 4
+    params.causal_convolution = True
+
+    model = get_transducer_model(params)
+    model.__class__.forward = torch.jit.ignore(model.__class__.forward)
+    torch.jit.script(model)
+
+
+def test_streaming_forward():
+    """Check that decoding chunk by chunk with streaming_forward() gives
+    the same output as forward() with the same chunk mask."""
+    torch.manual_seed(20220801)
+    encoder = Conformer(
+        num_features=80,
+        d_model=64,
+        nhead=4,
+        dim_feedforward=128,
+        num_encoder_layers=2,
+        cnn_module_kernel=15,
+        causal=True,
+        dynamic_chunk_training=True,
+    )
+    encoder.eval()
+
+    chunk_size = 4
+    num_left_chunks = 8
+    left_context = chunk_size * num_left_chunks
+    params = AttributeDict(
+        {
+            "feature_dim": 80,
+            "decoding_method": "greedy_search",
+            "blank_id": 0,
+            "context_size": 2,
+        }
+    )
+
+    # T % 4 == 3 means the last output frame uses the padding
+    for T in [200, 211]:
+        x = torch.randn(1, T, 80)
+        with torch.no_grad():
+            embed = encoder.encoder_embed(x)
+            embed, pos_emb = encoder.encoder_pos(embed)
+            src_mask = ~subsequent_chunk_mask(
+                size=embed.size(1),
+                chunk_size=chunk_size,
+                num_left_chunks=num_left_chunks,
+            )
+            expected = encoder.encoder(
+                embed.permute(1, 0, 2), pos_emb, mask=src_mask
+            ).permute(1, 0, 2)
+
+        stream = DecodeStream(
+            params=params,
+            initial_states=encoder.get_init_state(left_context),
+        )
+        stream.features = torch.cat([stream.features, x[0]])
+        stream.input_finished = True
+
+        outputs = []
+        while not stream.done:
+            chunk = stream.get_feature_chunk(chunk_size * 4)
+            if chunk is None:
+                continue
+            with torch.no_grad():
+                (
+                    encoder_out,
+                    encoder_out_lens,
+                    states,
+                ) = encoder.streaming_forward(
+                    x=chunk[0].unsqueeze(0),
+                    x_lens=torch.tensor([chunk[1]]),
+                    states=[s.unsqueeze(2) for s in stream.states],
+                    processed_lens=torch.tensor([stream.processed_frames]),
+                    left_context=left_context,
+                )
+            stream.states = [s.squeeze(2) for s in states]
+            stream.processed_frames += int(encoder_out_lens[0])
+            outputs.append(encoder_out[0, : encoder_out_lens[0]])
+
+        encoder_out = torch.cat(outputs).unsqueeze(0)
+        assert encoder_out.shape == expected.shape, (
+            encoder_out.shape,
+            expected.shape,
+        )
+        assert torch.allclose(encoder_out, expected, atol=1e-5), (
+            (encoder_out - expected).abs().max()
+        )
+
+
 def main():
     test_model()
+    test_model_streaming()
+    test_streaming_forward()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+To run this file, do:
+
+    cd icefall/egs/librispeech/ASR
+    python ./pruned_transducer_stateless2/test_optim.py
+"""
+
+import copy
+
+import torch
+import torch.nn as nn
+from optim import Eve
+from scaling import ScaledConv1d, ScaledEmbedding, ScaledLinear
+
+
+class Model(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.embedding = ScaledEmbedding(10, 16)
+        self.conv = ScaledConv1d(16, 16, kernel_size=3, padding=1)
+        self.linear = ScaledLinear(16, 8)
+        # It gets no gradient in some steps
+        self.extra = ScaledLinear(8, 8)
+
+    def forward(self, x: torch.Tensor, use_extra: bool) -> torch.Tensor:
+        y = self.embedding(x).permute(0, 2, 1)
+        y = self.conv(y).permute(0, 2, 1)
+        y = self.linear(y)
+        if use_extra:
+            y = self.extra(y)
+        return (y ** 2).mean()
+
+
+def train(model: nn.Module, optimizer: Eve, num_steps: int, seed: int):
+    torch.manual_seed(seed)
+    for i in range(num_steps):
+        x = torch.randint(0, 10, (4, 20))
+        loss = model(x, use_extra=i % 3 == 0)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+
+def assert_same(model_a: nn.Module, model_b: nn.Module):
+    for (name, a), b in zip(
+        model_a.named_parameters(), model_b.parameters()
+    ):
+        assert torch.allclose(a, b, rtol=0, atol=1e-7), name
+
+
+def test_eve_foreach():
+    torch.manual_seed(0)
+    model = Model()
+    foreach_model = copy.deepcopy(model)
+
+    # A large weight decay so that it is applied to some of the parameters
+    optimizer = Eve(
+        model.parameters(), lr=0.05, weight_decay=0.05, foreach=False
+    )
+    foreach_optimizer = Eve(
+        foreach_model.parameters(), lr=0.05, weight_decay=0.05, foreach=True
+    )
+
+    train(model, optimizer, num_steps=10, seed=1)
+    train(foreach_model, foreach_optimizer, num_steps=10, seed=1)
+    assert_same(model, foreach_model)
+
+    # Like saving it to a checkpoint, since it shares the tensors with the
+    # optimizer
+    state_dict = copy.deepcopy(optimizer.state_dict())
+    foreach_state_dict = foreach_optimizer.state_dict()
+    assert state_dict["param_groups"] == foreach_state_dict["param_groups"]
+    for i, state in state_dict["state"].items():
+        foreach_state = foreach_state_dict["state"][i]
+        assert state.keys() == foreach_state.keys()
+        assert state["step"] == foreach_state["step"]
+
+    # Resume from the state dict of the other implementation
+    resumed_model = copy.deepcopy(model)
+    resumed_optimizer = Eve(resumed_model.parameters(), foreach=True)
+    resumed_optimizer.load_state_dict(state_dict)
+
+    train(model, optimizer, num_steps=5, seed=2)
+    train(resumed_model, resumed_optimizer, num_steps=5, seed=2)
+    assert_same(model, resumed_model)
+
+
+def main():
+    test_eve_foreach()
+
+
+if __name__ == "__main__":
+    main()
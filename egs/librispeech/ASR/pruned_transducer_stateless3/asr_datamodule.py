@@ -18,22 +18,28 @@
 import argparse
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Optional
 
+import torch
 from lhotse import CutSet, Fbank, FbankConfig
 from lhotse.dataset import (
     BucketingSampler,
     CutMix,
     DynamicBucketingSampler,
     K2SpeechRecognitionDataset,
+    PerturbSpeed,
     SpecAugment,
 )
 from lhotse.dataset.input_strategies import (
     OnTheFlyFeatures,
     PrecomputedFeatures,
 )
+from lhotse.dataset.sampling.base import CutSampler
 from torch.utils.data import DataLoader
 
+from icefall.batch_planner import BatchPlan
+from icefall.dataset.mixing import SourceTaggedDataset, WeightedMixingSampler
+from icefall.dataset.token_ids import TokenizedDataset
 from icefall.utils import str2bool
 
 
@@ -101,6 +107,47 @@ class AsrDataModule:
             "collect the batches.",
         )
 
+        group.add_argument(
+            "--valid-num-workers",
+            type=int,
+            default=2,
+            help="The number of validation dataloader workers.",
+        )
+
+        group.add_argument(
+            "--persistent-workers",
+            type=str2bool,
+            default=True,
+            help="When enabled, the dataloader workers are kept alive "
+            "between epochs and validation runs instead of being started "
+            "again each time.",
+        )
+
+        group.add_argument(
+            "--prefetch-factor",
+            type=int,
+            default=2,
+            help="The number of batches loaded in advance by each "
+            "dataloader worker.",
+        )
+
+        group.add_argument(
+            "--pin-memory",
+            type=str2bool,
+            default=True,
+            help="When enabled, the batches are put in pinned memory, "
+            "so that they can be copied to the GPU asynchronously.",
+        )
+
+        group.add_argument(
+            "--prefetch-to-device",
+            type=str2bool,
+            default=True,
+            help="When enabled, the next batch is moved to the device "
+            "in the background while the current one is trained on. "
+            "See icefall/dataset/prefetch.py.",
+        )
+
         group.add_argument(
             "--on-the-fly-num-workers",
             type=int,
@@ -149,12 +196,80 @@ class AsrDataModule:
             "if available. Used only in dev/test CutSet",
         )
 
+        group.add_argument(
+            "--perturb-speed",
+            type=str2bool,
+            default=False,
+            help="When enabled, perturb the speed of the training cuts "
+            "by a factor of 0.9 or 1.1 with probability 2/3 in the "
+            "dataloader workers and compute their features on the fly. "
+            "Use it with cuts whose features were computed without speed "
+            "perturbation, e.g., by ./local/compute_fbank_librispeech.py "
+            "--perturb-speed false.",
+        )
+
+        group.add_argument(
+            "--tokenize-in-workers",
+            type=str2bool,
+            default=True,
+            help="When enabled and --bpe-model is given, the train/valid "
+            "dataloader workers also return the token IDs of the "
+            "transcripts in batch['supervisions']['token_ids'], so that "
+            "they need not be computed in the training process.",
+        )
+
+        group.add_argument(
+            "--token-ids",
+            type=Path,
+            help="Path to the token IDs computed by "
+            "local/compute_token_ids.py. If not given, use token_ids.npz "
+            "from the directory of --bpe-model if it exists. "
+            "Used only when --tokenize-in-workers is True.",
+        )
+
+    def _tokenize(self, dataset: K2SpeechRecognitionDataset):
+        """Wrap the dataset so that it also returns the token IDs.
+        See :class:`icefall.dataset.token_ids.TokenizedDataset`."""
+        bpe_model = getattr(self.args, "bpe_model", None)
+        if not self.args.tokenize_in_workers or bpe_model is None:
+            return dataset
+
+        token_ids = self.args.token_ids
+        if token_ids is None:
+            token_ids = Path(bpe_model).parent / "token_ids.npz"
+            if not token_ids.is_file():
+                logging.info(
+                    f"{token_ids} does not exist. Tokenize transcripts in "
+                    "the dataloader workers on the fly."
+                )
+                token_ids = None
+
+        return TokenizedDataset(
+            dataset, bpe_model=bpe_model, token_ids=token_ids
+        )
+
+    def _dataloader_kwargs(self, num_workers: int) -> Dict[str, Any]:
+        """Return the keyword arguments of the DataLoader for the given
+        number of workers."""
+        kwargs = dict(
+            num_workers=num_workers,
+            pin_memory=self.args.pin_memory and torch.cuda.is_available(),
+        )
+        if num_workers > 0:
+            # DataLoader does not accept them without workers
+            kwargs.update(
+                persistent_workers=self.args.persistent_workers,
+                prefetch_factor=self.args.prefetch_factor,
+            )
+        return kwargs
+
     def train_dataloaders(
         self,
         cuts_train: CutSet,
         dynamic_bucketing: bool,
         on_the_fly_feats: bool,
         cuts_musan: Optional[CutSet] = None,
+        batch_plan: Optional[BatchPlan] = None,
     ) -> DataLoader:
         """
         Args:
@@ -168,7 +283,100 @@ class AsrDataModule:
           on_the_fly_feats:
             True to use OnTheFlyFeatures;
             False to use PrecomputedFeatures.
+          batch_plan:
+            If not None, the maximum duration of a batch depends on the
+            duration bucket of its cuts as given by the plan.
+            See icefall/batch_planner.py.
+        """
+        train = self._train_dataset(
+            on_the_fly_feats=on_the_fly_feats, cuts_musan=cuts_musan
+        )
+        train_sampler = self._train_sampler(
+            cuts_train,
+            dynamic_bucketing=dynamic_bucketing,
+            batch_plan=batch_plan,
+        )
+
+        logging.info("About to create train dataloader")
+        train_dl = DataLoader(
+            train,
+            sampler=train_sampler,
+            batch_size=None,
+            **self._dataloader_kwargs(self.args.num_workers),
+        )
+        return train_dl
+
+    def mixed_train_dataloaders(
+        self,
+        cuts_train: Dict[str, CutSet],
+        weights: Dict[str, float],
+        dynamic_bucketing: Dict[str, bool],
+        on_the_fly_feats: bool,
+        cuts_musan: Optional[CutSet] = None,
+        seed: int = 0,
+        sampler_state_dict: Optional[Dict[str, Any]] = None,
+        batch_plan: Optional[BatchPlan] = None,
+    ) -> DataLoader:
+        """Create a single dataloader interleaving several datasets.
+        Each batch contains cuts from only one dataset, whose name is
+        saved in batch["source"].
+
+        Args:
+          cuts_train:
+            A dict mapping the name of a dataset to its cuts for training.
+          weights:
+            A dict mapping the name of a dataset to the probability
+            to select a batch from it.
+          dynamic_bucketing:
+            A dict mapping the name of a dataset to a bool.
+            True to use DynamicBucketingSampler for it;
+            False to use BucketingSampler.
+          on_the_fly_feats:
+            True to use OnTheFlyFeatures;
+            False to use PrecomputedFeatures.
+          cuts_musan:
+            If not None, it is the cuts for mixing.
+          seed:
+            The seed for selecting the datasets.
+          sampler_state_dict:
+            If not None, it is the state dict of the sampler to resume from.
+          batch_plan:
+            If not None, it is used by the samplers of all datasets.
+            See :meth:`train_dataloaders`.
         """
+        train = self._train_dataset(
+            on_the_fly_feats=on_the_fly_feats, cuts_musan=cuts_musan
+        )
+        samplers = {
+            name: self._train_sampler(
+                cuts,
+                dynamic_bucketing=dynamic_bucketing[name],
+                batch_plan=batch_plan,
+            )
+            for name, cuts in cuts_train.items()
+        }
+        train_sampler = WeightedMixingSampler(
+            samplers=samplers, weights=weights, seed=seed
+        )
+
+        if sampler_state_dict is not None:
+            logging.info("Loading sampler state dict")
+            train_sampler.load_state_dict(sampler_state_dict)
+
+        logging.info("About to create train dataloader")
+        train_dl = DataLoader(
+            SourceTaggedDataset(train),
+            sampler=train_sampler,
+            batch_size=None,
+            **self._dataloader_kwargs(self.args.num_workers),
+        )
+        return train_dl
+
+    def _train_dataset(
+        self,
+        on_the_fly_feats: bool,
+        cuts_musan: Optional[CutSet] = None,
+    ) -> torch.utils.data.Dataset:
         transforms = []
         if cuts_musan is not None:
             logging.info("Enable MUSAN")
@@ -180,6 +388,16 @@ class AsrDataModule:
         else:
             logging.info("Disable MUSAN")
 
+        if self.args.perturb_speed:
+            logging.info("Enable speed perturbation")
+            # Perturb the original cuts, i.e., before concatenating them.
+            # Storing features of the perturbed copies triples the epoch
+            # size, so we apply it with prob 2/3 and use 3x more epochs.
+            transforms = [
+                PerturbSpeed(factors=[0.9, 1.1], p=2 / 3)
+            ] + transforms
+            on_the_fly_feats = True
+
         input_transforms = []
 
         if self.args.enable_spec_aug:
@@ -206,16 +424,6 @@ class AsrDataModule:
             return_cuts=self.args.return_cuts,
         )
 
-        # NOTE: the PerturbSpeed transform should be added only if we
-        # remove it from data prep stage.
-        # Add on-the-fly speed perturbation; since originally it would
-        # have increased epoch size by 3, we will apply prob 2/3 and use
-        # 3x more epochs.
-        # Speed perturbation probably should come first before
-        # concatenation, but in principle the transforms order doesn't have
-        # to be strict (e.g. could be randomized)
-        # transforms = [PerturbSpeed(factors=[0.9, 1.1], p=2/3)] + transforms   # noqa
-        # Drop feats to be on the safe side.
         train = K2SpeechRecognitionDataset(
             cut_transforms=transforms,
             input_strategy=(
@@ -229,8 +437,24 @@ class AsrDataModule:
             input_transforms=input_transforms,
             return_cuts=self.args.return_cuts,
         )
+        return self._tokenize(train)
 
-        if dynamic_bucketing:
+    def _train_sampler(
+        self,
+        cuts_train: CutSet,
+        dynamic_bucketing: bool,
+        batch_plan: Optional[BatchPlan] = None,
+    ) -> CutSampler:
+        if batch_plan is not None:
+            logging.info(f"Using DynamicBucketingSampler with {batch_plan}")
+            train_sampler = DynamicBucketingSampler(
+                cuts_train,
+                constraint=batch_plan.constraint(),
+                duration_bins=batch_plan.duration_bins,
+                shuffle=self.args.shuffle,
+                drop_last=True,
+            )
+        elif dynamic_bucketing:
             logging.info("Using DynamicBucketingSampler.")
             train_sampler = DynamicBucketingSampler(
                 cuts_train,
@@ -250,15 +474,7 @@ class AsrDataModule:
                 drop_last=True,
             )
 
-        logging.info("About to create train dataloader")
-        train_dl = DataLoader(
-            train,
-            sampler=train_sampler,
-            batch_size=None,
-            num_workers=self.args.num_workers,
-            persistent_workers=False,
-        )
-        return train_dl
+        return train_sampler
 
     def valid_dataloaders(self, cuts_valid: CutSet) -> DataLoader:
         transforms = []
@@ -277,6 +493,8 @@ class AsrDataModule:
                 cut_transforms=transforms,
                 return_cuts=self.args.return_cuts,
             )
+        validate = self._tokenize(validate)
+
         valid_sampler = BucketingSampler(
             cuts_valid,
             max_duration=self.args.max_duration,
@@ -287,8 +505,7 @@ class AsrDataModule:
             validate,
             sampler=valid_sampler,
             batch_size=None,
-            num_workers=2,
-            persistent_workers=False,
+            **self._dataloader_kwargs(self.args.valid_num_workers),
         )
 
         return valid_dl
@@ -68,6 +68,7 @@ import torch
 import torch.nn as nn
 from asr_datamodule import AsrDataModule
 from beam_search import (
+    DecoderOutCache,
     beam_search,
     fast_beam_search_nbest_oracle,
     fast_beam_search_one_best,
@@ -220,6 +221,18 @@ def get_parser():
         Used only when the decoding_method is fast_beam_search_nbest_oracle.
         """,
     )
+
+    parser.add_argument(
+        "--decoder-cache-size",
+        type=int,
+        default=0,
+        help="""If positive, cache the projected decoder outputs of at most
+        so many decoder contexts across batches. 0 disables the cache.
+        Used only when --decoding-method is greedy_search or
+        modified_beam_search, whose contexts repeat a lot. The lookup runs
+        on the CPU, so it does not pay off for fast_beam_search.
+        """,
+    )
     return parser
 
 
@@ -591,6 +604,15 @@ def main():
 
     model.to(device)
     model.eval()
+    if params.decoder_cache_size > 0 and params.decoding_method in (
+        "greedy_search",
+        "modified_beam_search",
+    ):
+        model.decoder_cache = DecoderOutCache(
+            max_size=params.decoder_cache_size
+        )
+    else:
+        model.decoder_cache = None
     model.device = device
     model.unk_id = params.unk_id
 
@@ -637,6 +659,9 @@ def main():
             results_dict=results_dict,
         )
 
+    if model.decoder_cache is not None:
+        logging.info(f"Decoder cache: {model.decoder_cache}")
+
     logging.info("Done!")
 
 
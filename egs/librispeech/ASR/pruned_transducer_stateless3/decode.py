@@ -68,6 +68,7 @@ import torch
 import torch.nn as nn
 from asr_datamodule import AsrDataModule
 from beam_search import (
+    DecoderOutCache,
     beam_search,
     fast_beam_search_nbest_oracle,
     fast_beam_search_one_best,
@@ -76,10 +77,12 @@ from beam_search import (
     modified_beam_search,
 )
 from librispeech import LibriSpeech
+from scaling import fold_scales, quantize_linears
 from train import get_params, get_transducer_model
 
 from icefall.checkpoint import (
     average_checkpoints,
+    average_epoch_checkpoints,
     find_checkpoints,
     load_checkpoint,
 )
@@ -87,6 +90,7 @@ from icefall.utils import (
     AttributeDict,
     setup_logger,
     store_transcripts,
+    str2bool,
     write_error_stats,
 )
 
@@ -124,6 +128,19 @@ def get_parser():
         "'--epoch' and '--iter'",
     )
 
+    parser.add_argument(
+        "--use-prefix-sums",
+        type=str2bool,
+        default=False,
+        help="""If True, average the epoch checkpoints using prefix sums
+        of the models, which are cached in the directory prefix-sums of
+        --exp-dir. It speeds up trying different --epoch and --avg, but
+        building the cache loads all epochs up to --epoch, and each cached
+        sum takes twice the size of a model.
+        Used only when --avg is larger than 1.
+        """,
+    )
+
     parser.add_argument(
         "--exp-dir",
         type=str,
@@ -219,6 +236,29 @@ def get_parser():
         Used only when the decoding_method is fast_beam_search_nbest_oracle.
         """,
     )
+
+    parser.add_argument(
+        "--quantize",
+        type=str2bool,
+        default=False,
+        help="""True to decode on the CPU with the linear layers of the
+        model quantized to int8 (see quantize_linears() in scaling.py).
+        With --avg 1, the checkpoint can also be the one saved by
+        export.py --quantize true.
+        """,
+    )
+
+    parser.add_argument(
+        "--decoder-cache-size",
+        type=int,
+        default=0,
+        help="""If positive, cache the projected decoder outputs of at most
+        so many decoder contexts across batches. 0 disables the cache.
+        Used only when --decoding-method is greedy_search or
+        modified_beam_search, whose contexts repeat a lot. The lookup runs
+        on the CPU, so it does not pay off for fast_beam_search.
+        """,
+    )
     return parser
 
 
@@ -527,11 +567,14 @@ def main():
         params.suffix += f"-context-{params.context_size}"
         params.suffix += f"-max-sym-per-frame-{params.max_sym_per_frame}"
 
+    if params.quantize:
+        params.suffix += "-int8"
+
     setup_logger(f"{params.res_dir}/log-decode-{params.suffix}")
     logging.info("Decoding started")
 
     device = torch.device("cpu")
-    if torch.cuda.is_available():
+    if torch.cuda.is_available() and not params.quantize:
         device = torch.device("cuda", 0)
 
     logging.info(f"Device: {device}")
@@ -548,6 +591,8 @@ def main():
 
     logging.info("About to create model")
     model = get_transducer_model(params)
+    # True if the checkpoint has been quantized by export.py
+    quantized = False
 
     if params.iter > 0:
         filenames = find_checkpoints(params.exp_dir, iteration=-params.iter)[
@@ -567,19 +612,57 @@ def main():
         model.to(device)
         model.load_state_dict(average_checkpoints(filenames, device=device))
     elif params.avg == 1:
-        load_checkpoint(f"{params.exp_dir}/epoch-{params.epoch}.pt", model)
+        filename = f"{params.exp_dir}/epoch-{params.epoch}.pt"
+        if params.quantize:
+            checkpoint = torch.load(filename, map_location="cpu")
+            if checkpoint.get("quantized", False):
+                # It is saved by export.py --quantize true
+                model.eval()
+                quantize_linears(fold_scales(model))
+                quantized = True
+                model.load_state_dict(checkpoint["model"])
+            else:
+                # Don't load the file again with load_checkpoint()
+                model.load_state_dict(checkpoint["model"], strict=False)
+            del checkpoint
+        else:
+            load_checkpoint(filename, model)
     else:
         start = params.epoch - params.avg + 1
-        filenames = []
-        for i in range(start, params.epoch + 1):
-            if start >= 0:
-                filenames.append(f"{params.exp_dir}/epoch-{i}.pt")
-        logging.info(f"averaging {filenames}")
+        logging.info(f"averaging epochs {start} to {params.epoch}")
         model.to(device)
-        model.load_state_dict(average_checkpoints(filenames, device=device))
+        if params.use_prefix_sums:
+            state_dict = average_epoch_checkpoints(
+                params.exp_dir,
+                epoch=params.epoch,
+                avg=params.avg,
+                device=device,
+            )
+        else:
+            filenames = [
+                f"{params.exp_dir}/epoch-{i}.pt"
+                for i in range(start, params.epoch + 1)
+            ]
+            state_dict = average_checkpoints(filenames, device=device)
+        model.load_state_dict(state_dict)
 
     model.to(device)
     model.eval()
+    if not quantized:
+        # Multiply the scales into the weights once instead of in every
+        # forward pass
+        fold_scales(model)
+        if params.quantize:
+            quantize_linears(model)
+    if params.decoder_cache_size > 0 and params.decoding_method in (
+        "greedy_search",
+        "modified_beam_search",
+    ):
+        model.decoder_cache = DecoderOutCache(
+            max_size=params.decoder_cache_size
+        )
+    else:
+        model.decoder_cache = None
     model.device = device
     model.unk_id = params.unk_id
 
@@ -621,6 +704,9 @@ def main():
             results_dict=results_dict,
         )
 
+    if model.decoder_cache is not None:
+        logging.info(f"Decoder cache: {model.decoder_cache}")
+
     logging.info("Done!")
 
 
@@ -42,14 +42,58 @@ you can do:
         --max-duration 600 \
         --decoding-method greedy_search \
         --bpe-model data/lang_bpe_500/bpe.model
+
+With --jit true, it generates exp_dir/cpu_jit.pt instead. The scripted
+model has the scales of its scaled modules folded into the weights (see
+fold_scales() in scaling.py) and carries its own greedy search, which
+you can use with:
+
+    model = torch.jit.load("cpu_jit.pt")
+    encoder_out, encoder_out_lens = model.encoder(x=features, x_lens=lens)
+    hyps, hyp_lens = model.greedy_search(encoder_out, encoder_out_lens)
+
+where hyps[i, :hyp_lens[i]] contains the token IDs of the i-th utterance.
+
+With --quantize true, the linear layers of the model, i.e., the ones in
+the feed forward modules, the attention projections and the joiner, use
+dynamic int8 quantization after the scales are folded (see
+quantize_linears() in scaling.py). It generates exp_dir/pretrained-int8.pt,
+or exp_dir/cpu_jit-int8.pt with --jit true. The quantized model runs only
+on the CPU. You can use pretrained-int8.pt with
+
+    ./pruned_transducer_stateless3/pretrained.py \
+        --checkpoint ./pruned_transducer_stateless3/exp/pretrained-int8.pt \
+        ...
+
+or with ./pruned_transducer_stateless3/decode.py --quantize true after
+linking it to epoch-9999.pt as above.
+
+With --onnx true, it exports the encoder, the decoder and the joiner
+to exp_dir/encoder.onnx, exp_dir/decoder.onnx and exp_dir/joiner.onnx,
+with dynamic batch and time axes. See the export_*_model_onnx()
+functions below for their inputs and outputs. They are run with
+onnxruntime and the search is done with NumPy, e.g., by
+
+    exp_dir=./pruned_transducer_stateless3/exp
+    ./pruned_transducer_stateless3/onnx_pretrained.py \
+        --encoder-model-filename $exp_dir/encoder.onnx \
+        --decoder-model-filename $exp_dir/decoder.onnx \
+        --joiner-model-filename $exp_dir/joiner.onnx \
+        --bpe-model ./data/lang_bpe_500/bpe.model \
+        /path/to/foo.wav \
+        /path/to/bar.wav
 """
 
 import argparse
+import inspect
 import logging
 from pathlib import Path
 
 import sentencepiece as spm
 import torch
+import torch.nn as nn
+from beam_search import GreedySearch
+from scaling import fold_scales, quantize_linears
 from train import get_params, get_transducer_model
 
 from icefall.checkpoint import (
@@ -114,6 +158,33 @@ def get_parser():
         type=str2bool,
         default=False,
         help="""True to save a model after applying torch.jit.script.
+        The saved model has a method greedy_search() that runs
+        batched greedy search on the encoder output.
+        """,
+    )
+
+    parser.add_argument(
+        "--onnx",
+        type=str2bool,
+        default=False,
+        help="""True to export the encoder, the decoder and the joiner
+        to ONNX, as three separate models.
+        """,
+    )
+
+    parser.add_argument(
+        "--onnx-opset-version",
+        type=int,
+        default=11,
+        help="The ONNX opset version to use with --onnx true.",
+    )
+
+    parser.add_argument(
+        "--quantize",
+        type=str2bool,
+        default=False,
+        help="""True to quantize the linear layers of the model to int8
+        with dynamic quantization. The quantized model runs on the CPU.
         """,
     )
 
@@ -128,6 +199,155 @@ def get_parser():
     return parser
 
 
+def _onnx_export(*args, **kwargs) -> None:
+    """Call torch.onnx.export() with the TorchScript-based exporter.
+
+    Newer versions of PyTorch default to an exporter based on
+    torch.export, which does not support the data-dependent branches in
+    the model, e.g., the torch.equal() in RelPositionMultiheadAttention.
+    """
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+    torch.onnx.export(*args, **kwargs)
+
+
+def export_encoder_model_onnx(
+    encoder_model: nn.Module,
+    encoder_filename: str,
+    opset_version: int = 11,
+) -> None:
+    """Export the given encoder model to ONNX format.
+    The exported model has two inputs:
+
+        - x, a tensor of shape (N, T, C); dtype is torch.float32
+        - x_lens, a tensor of shape (N,); dtype is torch.int64
+
+    and it has two outputs:
+
+        - encoder_out, a tensor of shape (N, T', encoder_dim)
+        - encoder_out_lens, a tensor of shape (N,)
+
+    Args:
+      encoder_model:
+        The input encoder model.
+      encoder_filename:
+        The filename to save the exported ONNX model.
+      opset_version:
+        The opset version to use.
+    """
+    x = torch.zeros(1, 100, encoder_model.num_features, dtype=torch.float32)
+    x_lens = torch.tensor([100], dtype=torch.int64)
+
+    _onnx_export(
+        encoder_model,
+        (x, x_lens),
+        encoder_filename,
+        verbose=False,
+        opset_version=opset_version,
+        input_names=["x", "x_lens"],
+        output_names=["encoder_out", "encoder_out_lens"],
+        dynamic_axes={
+            "x": {0: "N", 1: "T"},
+            "x_lens": {0: "N"},
+            "encoder_out": {0: "N", 1: "T"},
+            "encoder_out_lens": {0: "N"},
+        },
+    )
+    logging.info(f"Saved to {encoder_filename}")
+
+
+def export_decoder_model_onnx(
+    decoder_model: nn.Module,
+    decoder_filename: str,
+    opset_version: int = 11,
+) -> None:
+    """Export the given decoder model to ONNX format.
+    The exported model has one input:
+
+        - y, a tensor of shape (N, context_size); dtype is torch.int64
+
+    and it has one output:
+
+        - decoder_out, a tensor of shape (N, 1, decoder_dim)
+
+    Args:
+      decoder_model:
+        The input decoder model.
+      decoder_filename:
+        The filename to save the exported ONNX model.
+      opset_version:
+        The opset version to use.
+    """
+    y = torch.zeros(10, decoder_model.context_size, dtype=torch.int64)
+    need_pad = False  # Always False during inference
+
+    _onnx_export(
+        decoder_model,
+        (y, need_pad),
+        decoder_filename,
+        verbose=False,
+        opset_version=opset_version,
+        input_names=["y"],
+        output_names=["decoder_out"],
+        dynamic_axes={
+            "y": {0: "N"},
+            "decoder_out": {0: "N"},
+        },
+    )
+    logging.info(f"Saved to {decoder_filename}")
+
+
+def export_joiner_model_onnx(
+    joiner_model: nn.Module,
+    joiner_filename: str,
+    opset_version: int = 11,
+) -> None:
+    """Export the given joiner model to ONNX format.
+    The exported model has two inputs:
+
+        - encoder_out, a tensor of shape (N, encoder_dim)
+        - decoder_out, a tensor of shape (N, decoder_dim)
+
+    and it has one output:
+
+        - logit, a tensor of shape (N, vocab_size)
+
+    The input projections encoder_proj and decoder_proj are included
+    in the exported model.
+
+    Args:
+      joiner_model:
+        The input joiner model.
+      joiner_filename:
+        The filename to save the exported ONNX model.
+      opset_version:
+        The opset version to use.
+    """
+    encoder_out = torch.rand(
+        1, joiner_model.encoder_proj.in_features, dtype=torch.float32
+    )
+    decoder_out = torch.rand(
+        1, joiner_model.decoder_proj.in_features, dtype=torch.float32
+    )
+    project_input = True
+
+    _onnx_export(
+        joiner_model,
+        (encoder_out, decoder_out, project_input),
+        joiner_filename,
+        verbose=False,
+        opset_version=opset_version,
+        input_names=["encoder_out", "decoder_out"],
+        output_names=["logit"],
+        dynamic_axes={
+            "encoder_out": {0: "N"},
+            "decoder_out": {0: "N"},
+            "logit": {0: "N"},
+        },
+    )
+    logging.info(f"Saved to {joiner_filename}")
+
+
 def main():
     args = get_parser().parse_args()
     args.exp_dir = Path(args.exp_dir)
@@ -146,6 +366,7 @@ def main():
 
     # <blk> is defined in local/train_bpe_model.py
     params.blank_id = sp.piece_to_id("<blk>")
+    params.unk_id = sp.piece_to_id("<unk>")
     params.vocab_size = sp.get_piece_size()
 
     logging.info(params)
@@ -189,23 +410,61 @@ def main():
     model.to("cpu")
     model.eval()
 
+    if params.onnx:
+        if params.quantize:
+            raise ValueError("--onnx true does not support --quantize true")
+        # ActivationBalancer and the scales of the scaled modules would
+        # otherwise be in the exported graphs
+        fold_scales(model)
+        opset_version = params.onnx_opset_version
+        export_encoder_model_onnx(
+            model.encoder,
+            str(params.exp_dir / "encoder.onnx"),
+            opset_version=opset_version,
+        )
+        export_decoder_model_onnx(
+            model.decoder,
+            str(params.exp_dir / "decoder.onnx"),
+            opset_version=opset_version,
+        )
+        export_joiner_model_onnx(
+            model.joiner,
+            str(params.exp_dir / "joiner.onnx"),
+            opset_version=opset_version,
+        )
+        return
+
+    suffix = ""
+    if params.quantize:
+        fold_scales(model)
+        quantize_linears(model)
+        suffix = "-int8"
+
     if params.jit:
         # We won't use the forward() method of the model in C++, so just ignore
         # it here.
         # Otherwise, one of its arguments is a ragged tensor and is not
         # torch scriptabe.
         model.__class__.forward = torch.jit.ignore(model.__class__.forward)
+        # The scripted model is only used for inference, so we multiply
+        # the scales into the weights once instead of in every forward pass
+        fold_scales(model)
+        # It shares the decoder and joiner with the model
+        model.greedy_search = GreedySearch(model, unk_id=params.unk_id)
         logging.info("Using torch.jit.script")
         model = torch.jit.script(model)
-        filename = params.exp_dir / "cpu_jit.pt"
+        filename = params.exp_dir / f"cpu_jit{suffix}.pt"
         model.save(str(filename))
         logging.info(f"Saved to {filename}")
     else:
         logging.info("Not using torch.jit.script")
         # Save it using a format so that it can be loaded
         # by :func:`load_checkpoint`
-        filename = params.exp_dir / "pretrained.pt"
-        torch.save({"model": model.state_dict()}, str(filename))
+        filename = params.exp_dir / f"pretrained{suffix}.pt"
+        torch.save(
+            {"model": model.state_dict(), "quantized": params.quantize},
+            str(filename),
+        )
         logging.info(f"Saved to {filename}")
 
 
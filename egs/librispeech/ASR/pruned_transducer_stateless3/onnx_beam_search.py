@@ -0,0 +1,283 @@
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Greedy search and modified beam search for the models exported by
+export.py --onnx true, using only NumPy and onnxruntime.
+
+They give the same results as greedy_search_batch() and
+modified_beam_search() in beam_search.py, and are meant as a reference
+for decoding the exported models in other runtimes.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import onnxruntime as ort
+
+
+class OnnxTransducer(object):
+    def __init__(
+        self,
+        encoder_filename: str,
+        decoder_filename: str,
+        joiner_filename: str,
+        blank_id: int = 0,
+        unk_id: Optional[int] = None,
+        num_threads: int = 1,
+    ):
+        """
+        Args:
+          encoder_filename:
+            Path to encoder.onnx.
+          decoder_filename:
+            Path to decoder.onnx.
+          joiner_filename:
+            Path to joiner.onnx.
+          blank_id:
+            The ID of the blank symbol.
+          unk_id:
+            The ID of the unknown symbol, which is never emitted. If None,
+            the blank ID is used.
+          num_threads:
+            Number of threads used by onnxruntime.
+        """
+        session_opts = ort.SessionOptions()
+        session_opts.inter_op_num_threads = 1
+        session_opts.intra_op_num_threads = num_threads
+
+        def load(filename: str) -> ort.InferenceSession:
+            return ort.InferenceSession(
+                filename,
+                sess_options=session_opts,
+                providers=["CPUExecutionProvider"],
+            )
+
+        self.encoder = load(encoder_filename)
+        self.decoder = load(decoder_filename)
+        self.joiner = load(joiner_filename)
+
+        self.blank_id = blank_id
+        self.unk_id = blank_id if unk_id is None else unk_id
+        # The input y of the decoder has the shape (N, context_size)
+        self.context_size = self.decoder.get_inputs()[0].shape[1]
+
+    def run_encoder(
+        self, x: np.ndarray, x_lens: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Args:
+          x:
+            A float32 array of shape (N, T, C).
+          x_lens:
+            An int64 array of shape (N,).
+        Returns:
+          Return a tuple containing:
+            - encoder_out, a float32 array of shape (N, T', encoder_dim)
+            - encoder_out_lens, an int64 array of shape (N,)
+        """
+        encoder_out, encoder_out_lens = self.encoder.run(
+            ["encoder_out", "encoder_out_lens"],
+            {"x": x, "x_lens": x_lens},
+        )
+        return encoder_out, encoder_out_lens
+
+    def run_decoder(self, y: np.ndarray) -> np.ndarray:
+        """
+        Args:
+          y:
+            An int64 array of shape (N, context_size).
+        Returns:
+          Return a float32 array of shape (N, decoder_dim).
+        """
+        (decoder_out,) = self.decoder.run(["decoder_out"], {"y": y})
+        return decoder_out.squeeze(1)
+
+    def run_joiner(
+        self, encoder_out: np.ndarray, decoder_out: np.ndarray
+    ) -> np.ndarray:
+        """
+        Args:
+          encoder_out:
+            A float32 array of shape (N, encoder_dim).
+          decoder_out:
+            A float32 array of shape (N, decoder_dim).
+        Returns:
+          Return a float32 array of shape (N, vocab_size).
+        """
+        (logit,) = self.joiner.run(
+            ["logit"],
+            {"encoder_out": encoder_out, "decoder_out": decoder_out},
+        )
+        return logit
+
+
+def _log_softmax(x: np.ndarray) -> np.ndarray:
+    x = x - x.max(axis=-1, keepdims=True)
+    return x - np.log(np.exp(x).sum(axis=-1, keepdims=True))
+
+
+def greedy_search_batch(
+    model: OnnxTransducer,
+    encoder_out: np.ndarray,
+    encoder_out_lens: np.ndarray,
+) -> List[List[int]]:
+    """Greedy search in batch mode. It hardcodes --max-sym-per-frame=1.
+
+    Args:
+      model:
+        The exported transducer model.
+      encoder_out:
+        Output from the encoder. Its shape is (N, T, C), where N >= 1.
+      encoder_out_lens:
+        A 1-D array of shape (N,), containing number of valid frames in
+        encoder_out before padding.
+    Returns:
+      Return a list-of-list of token IDs containing the decoded results.
+      len(ans) equals to encoder_out.shape[0].
+    """
+    assert encoder_out.ndim == 3, encoder_out.shape
+    assert encoder_out.shape[0] >= 1, encoder_out.shape
+    assert np.all(encoder_out_lens > 0), encoder_out_lens
+
+    blank_id = model.blank_id
+    unk_id = model.unk_id
+    context_size = model.context_size
+
+    # Process the utterances from the longest to the shortest, so that
+    # the active ones are always the first batch_size ones
+    sorted_indices = np.argsort(-encoder_out_lens, kind="stable")
+    encoder_out = encoder_out[sorted_indices]
+    encoder_out_lens = encoder_out_lens[sorted_indices]
+    N = encoder_out.shape[0]
+
+    hyps = [[blank_id] * context_size for _ in range(N)]
+    decoder_out = model.run_decoder(
+        np.array([h[-context_size:] for h in hyps], dtype=np.int64)
+    )
+
+    for t in range(int(encoder_out_lens[0])):
+        batch_size = int((encoder_out_lens > t).sum())
+        decoder_out = decoder_out[:batch_size]
+
+        logits = model.run_joiner(encoder_out[:batch_size, t], decoder_out)
+        y = logits.argmax(axis=1)
+
+        emitted = np.nonzero((y != blank_id) & (y != unk_id))[0]
+        if emitted.size > 0:
+            for i in emitted:
+                hyps[i].append(int(y[i]))
+            # Update the decoder output of the extended hypotheses only
+            decoder_input = np.array(
+                [hyps[i][-context_size:] for i in emitted], dtype=np.int64
+            )
+            decoder_out[emitted] = model.run_decoder(decoder_input)
+
+    ans = [None] * N
+    for i, h in zip(sorted_indices, hyps):
+        ans[i] = h[context_size:]
+    return ans
+
+
+def modified_beam_search(
+    model: OnnxTransducer,
+    encoder_out: np.ndarray,
+    encoder_out_lens: np.ndarray,
+    beam: int = 4,
+) -> List[List[int]]:
+    """Beam search in batch mode with --max-sym-per-frame=1 being hardcoded.
+
+    The hypotheses of each utterance are kept in a dict from their token
+    sequences to their log probs. Hypotheses with identical token
+    sequences are merged with `log-sum-exp`. The decoder and the joiner
+    are run once per frame for the hypotheses of all utterances.
+
+    Args:
+      model:
+        The exported transducer model.
+      encoder_out:
+        Output from the encoder. Its shape is (N, T, C).
+      encoder_out_lens:
+        A 1-D array of shape (N,), containing number of valid frames in
+        encoder_out before padding.
+      beam:
+        Number of active paths during the beam search.
+    Returns:
+      Return a list-of-list of token IDs. ans[i] is the decoding results
+      for the i-th utterance.
+    """
+    assert encoder_out.ndim == 3, encoder_out.shape
+    assert encoder_out.shape[0] >= 1, encoder_out.shape
+    assert np.all(encoder_out_lens > 0), encoder_out_lens
+
+    blank_id = model.blank_id
+    unk_id = model.unk_id
+    context_size = model.context_size
+    N = encoder_out.shape[0]
+
+    # B[i] contains the hypotheses of the i-th utterance. The tokens of a
+    # hypothesis start with context_size blanks.
+    B: List[Dict[Tuple[int, ...], np.float32]] = [
+        {(blank_id,) * context_size: np.float32(0)} for _ in range(N)
+    ]
+
+    for t in range(int(encoder_out_lens.max())):
+        active = [i for i in range(N) if encoder_out_lens[i] > t]
+        A = [list(B[i].items()) for i in active]
+        num_hyps = [len(hyps) for hyps in A]
+
+        decoder_input = np.array(
+            [ys[-context_size:] for hyps in A for ys, _ in hyps],
+            dtype=np.int64,
+        )
+        decoder_out = model.run_decoder(decoder_input)
+        # decoder_out is of shape (sum(num_hyps), decoder_dim)
+
+        current_encoder_out = np.repeat(
+            encoder_out[active, t], num_hyps, axis=0
+        )
+        logits = model.run_joiner(current_encoder_out, decoder_out)
+        log_probs = _log_softmax(logits)
+        vocab_size = log_probs.shape[-1]
+
+        offset = 0
+        for i, hyps in zip(active, A):
+            scores = np.array([log_prob for _, log_prob in hyps])
+            end = offset + len(hyps)
+            this_log_probs = log_probs[offset:end]
+            offset = end
+
+            this_log_probs = (this_log_probs + scores[:, None]).reshape(-1)
+            topk_indexes = np.argsort(-this_log_probs, kind="stable")[:beam]
+
+            new_hyps = {}
+            for index in topk_indexes:
+                ys, _ = hyps[index // vocab_size]
+                token = int(index % vocab_size)
+                if token not in (blank_id, unk_id):
+                    ys = ys + (token,)
+                log_prob = this_log_probs[index]
+                if ys in new_hyps:
+                    log_prob = np.logaddexp(new_hyps[ys], log_prob)
+                new_hyps[ys] = log_prob
+            B[i] = new_hyps
+
+    ans = []
+    for hyps in B:
+        # The most probable hypothesis with length normalization
+        ys = max(hyps, key=lambda ys: hyps[ys] / len(ys))
+        ans.append(list(ys[context_size:]))
+    return ans
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# Copyright    2026                      (authors: agent)
+#
+# See ../../../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+To run this file, do:
+
+    cd icefall/egs/librispeech/ASR
+    python ./pruned_transducer_stateless3/test_onnx.py
+"""
+
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+from beam_search import greedy_search_batch, modified_beam_search
+from conformer import Conformer
+from decoder import Decoder
+from export import (
+    export_decoder_model_onnx,
+    export_encoder_model_onnx,
+    export_joiner_model_onnx,
+)
+from joiner import Joiner
+from model import Transducer
+from onnx_beam_search import OnnxTransducer
+from onnx_beam_search import greedy_search_batch as onnx_greedy_search_batch
+from onnx_beam_search import modified_beam_search as onnx_modified_beam_search
+from scaling import fold_scales
+
+
+def get_model() -> Transducer:
+    encoder = Conformer(
+        num_features=80,
+        d_model=64,
+        nhead=4,
+        dim_feedforward=128,
+        num_encoder_layers=2,
+    )
+    decoder = Decoder(vocab_size=20, decoder_dim=32, blank_id=0, context_size=2)
+    joiner = Joiner(
+        encoder_dim=64, decoder_dim=32, joiner_dim=48, vocab_size=20
+    )
+    model = Transducer(
+        encoder=encoder,
+        decoder=decoder,
+        joiner=joiner,
+        encoder_dim=64,
+        decoder_dim=32,
+        joiner_dim=48,
+        vocab_size=20,
+    )
+    model.eval()
+    model.unk_id = 2
+    return fold_scales(model)
+
+
+def test_onnx():
+    torch.manual_seed(20220727)
+    model = get_model()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        export_encoder_model_onnx(model.encoder, str(tmp_dir / "encoder.onnx"))
+        export_decoder_model_onnx(model.decoder, str(tmp_dir / "decoder.onnx"))
+        export_joiner_model_onnx(model.joiner, str(tmp_dir / "joiner.onnx"))
+
+        onnx_model = OnnxTransducer(
+            encoder_filename=str(tmp_dir / "encoder.onnx"),
+            decoder_filename=str(tmp_dir / "decoder.onnx"),
+            joiner_filename=str(tmp_dir / "joiner.onnx"),
+            blank_id=0,
+            unk_id=2,
+        )
+    assert onnx_model.context_size == 2
+
+    # Other batch sizes and lengths than the ones used in the export
+    x = torch.randn(3, 150, 80)
+    x_lens = torch.tensor([150, 97, 120])
+
+    with torch.no_grad():
+        encoder_out, encoder_out_lens = model.encoder(x, x_lens)
+    onnx_encoder_out, onnx_encoder_out_lens = onnx_model.run_encoder(
+        x.numpy(), x_lens.numpy()
+    )
+    np.testing.assert_array_equal(
+        onnx_encoder_out_lens, encoder_out_lens.numpy()
+    )
+    np.testing.assert_allclose(
+        onnx_encoder_out, encoder_out.numpy(), rtol=1e-4, atol=1e-4
+    )
+
+    y = torch.randint(0, 20, (5, 2))
+    with torch.no_grad():
+        decoder_out = model.decoder(y, need_pad=False).squeeze(1)
+    onnx_decoder_out = onnx_model.run_decoder(y.numpy())
+    np.testing.assert_allclose(
+        onnx_decoder_out, decoder_out.numpy(), rtol=1e-5, atol=1e-5
+    )
+
+    with torch.no_grad():
+        logit = model.joiner(encoder_out[:, 0], decoder_out[:3])
+    onnx_logit = onnx_model.run_joiner(
+        encoder_out[:, 0].numpy(), decoder_out[:3].numpy()
+    )
+    np.testing.assert_allclose(onnx_logit, logit.numpy(), rtol=1e-4, atol=1e-4)
+
+    # Decode the same encoder output, so that the results do not depend
+    # on the rounding errors of the encoder
+    with torch.no_grad():
+        hyps = greedy_search_batch(model, encoder_out, encoder_out_lens)
+    onnx_hyps = onnx_greedy_search_batch(
+        onnx_model, encoder_out.numpy(), encoder_out_lens.numpy()
+    )
+    assert any(len(h) > 0 for h in hyps), hyps
+    assert onnx_hyps == hyps, (onnx_hyps, hyps)
+
+    for beam in [1, 4]:
+        with torch.no_grad():
+            hyps = modified_beam_search(
+                model, encoder_out, encoder_out_lens, beam=beam
+            )
+        onnx_hyps = onnx_modified_beam_search(
+            onnx_model,
+            encoder_out.numpy(),
+            encoder_out_lens.numpy(),
+            beam=beam,
+        )
+        assert onnx_hyps == hyps, (beam, onnx_hyps, hyps)
+
+
+def main():
+    test_onnx()
+
+
+if __name__ == "__main__":
+    main()
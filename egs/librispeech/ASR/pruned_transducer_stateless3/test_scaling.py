@@ -24,7 +24,20 @@ To run this file, do:
 """
 
 import torch
-from scaling import ActivationBalancer, ScaledConv1d, ScaledConv2d
+import torch.nn as nn
+from conformer import Conformer
+from decoder import Decoder
+from joiner import Joiner
+from scaling import (
+    ActivationBalancer,
+    QuantizedLinear,
+    ScaledConv1d,
+    ScaledConv2d,
+    ScaledEmbedding,
+    ScaledLinear,
+    fold_scales,
+    quantize_linears,
+)
 
 
 def test_scaled_conv1d():
@@ -59,10 +72,137 @@ def test_activation_balancer():
     torch.jit.script(act)
 
 
+def test_fold_scales():
+    encoder = Conformer(
+        num_features=80,
+        d_model=64,
+        nhead=4,
+        dim_feedforward=128,
+        num_encoder_layers=2,
+    )
+    decoder = Decoder(vocab_size=10, decoder_dim=32, blank_id=0, context_size=2)
+    joiner = Joiner(
+        encoder_dim=64, decoder_dim=32, joiner_dim=48, vocab_size=10
+    )
+    x = torch.randn(2, 100, 80)
+    x_lens = torch.tensor([100, 80])
+    y = torch.tensor([[0, 3], [4, 5]])
+
+    with torch.no_grad():
+        for m in (encoder, decoder, joiner):
+            m.eval()
+            # Make the scales differ from their initial values
+            for name, p in m.named_parameters():
+                if name.endswith("scale"):
+                    p.add_(torch.randn_like(p) * 0.1)
+
+        encoder_out, _ = encoder(x, x_lens)
+        decoder_out = decoder(y, need_pad=False)
+        logits = joiner(
+            encoder_out[:, :1].unsqueeze(2), decoder_out.unsqueeze(1)
+        )
+
+        for m in (encoder, decoder, joiner):
+            fold_scales(m)
+            for module in m.modules():
+                assert not isinstance(
+                    module,
+                    (
+                        ActivationBalancer,
+                        ScaledConv1d,
+                        ScaledConv2d,
+                        ScaledEmbedding,
+                    ),
+                ), type(module)
+                assert type(module) is not ScaledLinear
+        assert isinstance(joiner.output_linear, nn.Linear)
+
+        folded_encoder_out, _ = encoder(x, x_lens)
+        folded_decoder_out = decoder(y, need_pad=False)
+        folded_logits = joiner(
+            folded_encoder_out[:, :1].unsqueeze(2),
+            folded_decoder_out.unsqueeze(1),
+        )
+
+    assert torch.allclose(encoder_out, folded_encoder_out, atol=1e-5)
+    assert torch.allclose(decoder_out, folded_decoder_out, atol=1e-5)
+    assert torch.allclose(logits, folded_logits, atol=1e-5)
+
+    torch.jit.script(encoder)
+    torch.jit.script(decoder)
+    torch.jit.script(joiner)
+
+
+def test_quantize_linears():
+    torch.manual_seed(20220727)
+    encoder = Conformer(
+        num_features=80,
+        d_model=64,
+        nhead=4,
+        dim_feedforward=128,
+        num_encoder_layers=2,
+    )
+    joiner = Joiner(
+        encoder_dim=64, decoder_dim=32, joiner_dim=48, vocab_size=10
+    )
+    x = torch.randn(2, 100, 80)
+    x_lens = torch.tensor([100, 80])
+
+    with torch.no_grad():
+        for m in (encoder, joiner):
+            m.eval()
+            fold_scales(m)
+
+        encoder_out, _ = encoder(x, x_lens)
+        encoder_out = encoder_out.unsqueeze(2)
+        decoder_out = torch.randn(*encoder_out.shape[:-1], 32)
+        logits = joiner(encoder_out, decoder_out)
+
+        for m in (encoder, joiner):
+            quantize_linears(m)
+            for module in m.modules():
+                assert type(module) is not nn.Linear
+        assert isinstance(
+            encoder.encoder.layers[0].self_attn.in_proj, QuantizedLinear
+        )
+        assert isinstance(joiner.output_linear, QuantizedLinear)
+
+        quantized_encoder_out, _ = encoder(x, x_lens)
+        quantized_encoder_out = quantized_encoder_out.unsqueeze(2)
+        quantized_logits = joiner(quantized_encoder_out, decoder_out)
+
+    def relative_error(a, b):
+        return ((a - b).norm() / a.norm()).item()
+
+    assert relative_error(encoder_out, quantized_encoder_out) < 0.05
+    assert relative_error(logits, quantized_logits) < 0.05
+
+    # The state dict can be loaded into a model converted in the same way
+    state_dict = encoder.state_dict()
+    encoder2 = Conformer(
+        num_features=80,
+        d_model=64,
+        nhead=4,
+        dim_feedforward=128,
+        num_encoder_layers=2,
+    )
+    encoder2.eval()
+    quantize_linears(fold_scales(encoder2))
+    encoder2.load_state_dict(state_dict)
+    with torch.no_grad():
+        encoder2_out, _ = encoder2(x, x_lens)
+    assert torch.equal(encoder2_out.unsqueeze(2), quantized_encoder_out)
+
+    torch.jit.script(encoder)
+    torch.jit.script(joiner)
+
+
 def main():
     test_scaled_conv1d()
     test_scaled_conv2d()
     test_activation_balancer()
+    test_fold_scales()
+    test_quantize_linears()
 
 
 if __name__ == "__main__":
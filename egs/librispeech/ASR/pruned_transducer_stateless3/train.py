@@ -49,7 +49,6 @@ cd egs/librispeech/ASR/
 
 import argparse
 import logging
-import random
 import warnings
 from pathlib import Path
 from shutil import copyfile
@@ -69,6 +68,7 @@ from joiner import Joiner
 from lhotse import CutSet, load_manifest
 from lhotse.cut import Cut
 from lhotse.dataset.sampling.base import CutSampler
+from lhotse.dataset.sampling.dynamic_bucketing import estimate_duration_buckets
 from lhotse.utils import fix_random_seed
 from librispeech import LibriSpeech
 from model import Transducer
@@ -79,9 +79,19 @@ from torch.nn.parallel import DistributedDataParallel as DDP
 from torch.utils.tensorboard import SummaryWriter
 
 from icefall import diagnostics
+from icefall.batch_planner import (
+    BatchPlan,
+    BatchPlanner,
+    BatchShape,
+    default_probe_shapes,
+    make_synthetic_batch,
+    measure_peak_memory,
+)
 from icefall.checkpoint import load_checkpoint, remove_checkpoints
 from icefall.checkpoint import save_checkpoint as save_checkpoint_impl
 from icefall.checkpoint import save_checkpoint_with_global_batch_idx
+from icefall.dataset.prefetch import DevicePrefetcher
+from icefall.dataset.token_ids import get_token_ids
 from icefall.dist import cleanup_dist, setup_dist
 from icefall.env import get_env_info
 from icefall.utils import AttributeDict, MetricsTracker, setup_logger, str2bool
@@ -279,6 +289,16 @@ def get_parser():
         help="Whether to use half precision training.",
     )
 
+    parser.add_argument(
+        "--optim-foreach",
+        type=str2bool,
+        default=False,
+        help="""Whether to update the parameters in Eve with the
+        torch._foreach_* functions. The results are the same. See
+        pruned_transducer_stateless2/benchmark_optim.py for its speed.
+        """,
+    )
+
     parser.add_argument(
         "--giga-prob",
         type=float,
@@ -286,6 +306,27 @@ def get_parser():
         help="The probability to select a batch from the GigaSpeech dataset",
     )
 
+    parser.add_argument(
+        "--plan-batches",
+        type=str2bool,
+        default=False,
+        help="""If True, measure the peak memory of training steps with
+        synthetic batches before training and choose the maximum duration
+        of the batches of each duration bucket so that they fit into
+        --memory-budget. --max-duration is then ignored.
+        It requires a GPU.
+        """,
+    )
+
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        default=0,
+        help="""The GPU memory in GB that a training step may use with
+        --plan-batches. If 0, it uses 90%% of the memory of the GPU.
+        """,
+    )
+
     return parser
 
 
@@ -515,6 +556,8 @@ def save_checkpoint(
         sampler=sampler,
         scaler=scaler,
         rank=rank,
+        # It makes averaging epoch checkpoints in decode.py faster
+        save_model_copy=True,
     )
 
     if params.best_train_epoch == params.cur_epoch:
@@ -572,11 +615,20 @@ def compute_loss(
     supervisions = batch["supervisions"]
     feature_lens = supervisions["num_frames"].to(device)
 
-    libri = is_libri(supervisions["cut"][0])
+    if "source" in batch:
+        # Set by the mixing sampler. See mixed_train_dataloaders()
+        # in ./asr_datamodule.py
+        libri = batch["source"] == "libri"
+    else:
+        libri = is_libri(supervisions["cut"][0])
 
-    texts = batch["supervisions"]["text"]
-    y = sp.encode(texts, out_type=int)
-    y = k2.RaggedTensor(y).to(device)
+    if "token_ids" in supervisions:
+        # Already tokenized by the dataloader workers
+        y = get_token_ids(supervisions, device=device)
+    else:
+        texts = batch["supervisions"]["text"]
+        y = sp.encode(texts, out_type=int)
+        y = k2.RaggedTensor(y).to(device)
 
     with torch.set_grad_enabled(is_training):
         simple_loss, pruned_loss = model(
@@ -608,14 +660,14 @@ def compute_loss(
     info = MetricsTracker()
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        info["frames"] = (
-            (feature_lens // params.subsampling_factor).sum().item()
-        )
+        info["frames"] = (feature_lens // params.subsampling_factor).sum()
 
     # Note: We use reduction=sum while computing the loss.
-    info["loss"] = loss.detach().cpu().item()
-    info["simple_loss"] = simple_loss.detach().cpu().item()
-    info["pruned_loss"] = pruned_loss.detach().cpu().item()
+    # The values stay on the device. MetricsTracker transfers them to
+    # the CPU only when they are logged, so there is no sync per batch.
+    info["loss"] = loss.detach()
+    info["simple_loss"] = simple_loss.detach()
+    info["pruned_loss"] = pruned_loss.detach()
 
     return loss, info
 
@@ -645,6 +697,8 @@ def compute_validation_loss(
 
     if world_size > 1:
         tot_loss.reduce(loss.device)
+    else:
+        tot_loss.sync()
 
     loss_value = tot_loss["loss"] / tot_loss["frames"]
     if loss_value < params.best_valid_loss:
@@ -661,9 +715,7 @@ def train_one_epoch(
     scheduler: LRSchedulerType,
     sp: spm.SentencePieceProcessor,
     train_dl: torch.utils.data.DataLoader,
-    giga_train_dl: torch.utils.data.DataLoader,
     valid_dl: torch.utils.data.DataLoader,
-    rng: random.Random,
     scaler: GradScaler,
     tb_writer: Optional[SummaryWriter] = None,
     world_size: int = 1,
@@ -685,13 +737,11 @@ def train_one_epoch(
       scheduler:
         The learning rate scheduler, we call step() every step.
       train_dl:
-        Dataloader for the training dataset.
-      giga_train_dl:
-        Dataloader for the GigaSpeech training dataset.
+        Dataloader for the training dataset. It mixes batches from
+        LibriSpeech and GigaSpeech. See mixed_train_dataloaders() in
+        ./asr_datamodule.py
       valid_dl:
         Dataloader for the validation dataset.
-      rng:
-        For selecting which dataset to use.
       scaler:
         The scaler used for mix precision training.
       tb_writer:
@@ -708,33 +758,15 @@ def train_one_epoch(
     giga_tot_loss = MetricsTracker()
     tot_loss = MetricsTracker()
 
-    # index 0: for LibriSpeech
-    # index 1: for GigaSpeech
-    # This sets the probabilities for choosing which datasets
-    dl_weights = [1 - params.giga_prob, params.giga_prob]
-
-    iter_libri = iter(train_dl)
-    iter_giga = iter(giga_train_dl)
-
-    batch_idx = 0
-
-    while True:
-        idx = rng.choices((0, 1), weights=dl_weights, k=1)[0]
-        dl = iter_libri if idx == 0 else iter_giga
-
-        try:
-            batch = next(dl)
-        except StopIteration:
-            name = "libri" if idx == 0 else "giga"
-            logging.info(f"{name} reaches end of dataloader")
-            break
-
-        batch_idx += 1
-
+    prefetcher = DevicePrefetcher(
+        train_dl,
+        device=model.device if params.prefetch_to_device else None,
+    )
+    for batch_idx, batch in enumerate(prefetcher, 1):
         params.batch_idx_train += 1
         batch_size = len(batch["supervisions"]["text"])
 
-        libri = is_libri(batch["supervisions"]["cut"][0])
+        libri = batch["source"] == "libri"
 
         with torch.cuda.amp.autocast(enabled=params.use_fp16):
             loss, loss_info = compute_loss(
@@ -800,13 +832,19 @@ def train_one_epoch(
                 f"libri_tot_loss[{libri_tot_loss}], "
                 f"giga_tot_loss[{giga_tot_loss}], "
                 f"batch size: {batch_size}"
-                f"lr: {cur_lr:.2e}"
+                f"lr: {cur_lr:.2e}, "
+                f"data wait: {prefetcher.data_wait_time:.1f}s"
             )
 
             if tb_writer is not None:
                 tb_writer.add_scalar(
                     "train/learning_rate", cur_lr, params.batch_idx_train
                 )
+                tb_writer.add_scalar(
+                    "train/data_wait_time",
+                    prefetcher.data_wait_time,
+                    params.batch_idx_train,
+                )
 
                 loss_info.write_summary(
                     tb_writer,
@@ -839,6 +877,14 @@ def train_one_epoch(
                     tb_writer, "train/valid_", params.batch_idx_train
                 )
 
+    logging.info(
+        f"Epoch {params.cur_epoch}: waited "
+        f"{prefetcher.epoch_start_latency:.1f}s for the first batch and "
+        f"{prefetcher.data_wait_time:.1f}s for the other "
+        f"{max(prefetcher.num_batches - 1, 0)} batches"
+    )
+
+    tot_loss.sync()
     loss_value = tot_loss["loss"] / tot_loss["frames"]
     params.train_loss = loss_value
     if params.train_loss < params.best_train_loss:
@@ -881,7 +927,6 @@ def run(rank, world_size, args):
         params.valid_interval = 1600
 
     fix_random_seed(params.seed)
-    rng = random.Random(params.seed)
     if world_size > 1:
         setup_dist(rank, world_size, params.master_port)
 
@@ -921,7 +966,11 @@ def run(rank, world_size, args):
         model = DDP(model, device_ids=[rank], find_unused_parameters=True)
     model.device = device
 
-    optimizer = Eve(model.parameters(), lr=params.initial_lr)
+    optimizer = Eve(
+        model.parameters(),
+        lr=params.initial_lr,
+        foreach=params.optim_foreach,
+    )
 
     scheduler = Eden(optimizer, params.lr_batches, params.lr_epochs)
 
@@ -977,32 +1026,58 @@ def run(rank, world_size, args):
     else:
         cuts_musan = None
 
-    asr_datamodule = AsrDataModule(args)
+    if (
+        params.start_batch > 0
+        and checkpoints
+        and checkpoints.get("sampler") is not None
+        and "samplers" in checkpoints["sampler"]
+    ):
+        sampler_state_dict = checkpoints["sampler"]
+    else:
+        sampler_state_dict = None
 
-    train_dl = asr_datamodule.train_dataloaders(
-        train_cuts,
-        dynamic_bucketing=False,
-        on_the_fly_feats=False,
-        cuts_musan=cuts_musan,
-    )
+    if params.plan_batches:
+        # The memory of both datasets is the same, except for the
+        # decoder and joiner, which are small
+        batch_plan = plan_batches(
+            model=model,
+            train_cuts=train_cuts,
+            max_cut_duration=20.0,
+            optimizer=optimizer,
+            sp=sp,
+            params=params,
+            world_size=world_size,
+        )
+    else:
+        batch_plan = None
 
-    giga_train_dl = asr_datamodule.train_dataloaders(
-        train_giga_cuts,
-        dynamic_bucketing=True,
+    asr_datamodule = AsrDataModule(args)
+
+    # A single dataloader, i.e., a single pool of workers, for both
+    # datasets. The dataset of each batch is in batch["source"].
+    train_dl = asr_datamodule.mixed_train_dataloaders(
+        cuts_train={"libri": train_cuts, "giga": train_giga_cuts},
+        weights={"libri": 1 - params.giga_prob, "giga": params.giga_prob},
+        dynamic_bucketing={"libri": False, "giga": True},
         on_the_fly_feats=False,
         cuts_musan=cuts_musan,
+        seed=params.seed,
+        sampler_state_dict=sampler_state_dict,
+        batch_plan=batch_plan,
     )
 
     valid_cuts = librispeech.dev_clean_cuts()
     valid_cuts += librispeech.dev_other_cuts()
     valid_dl = asr_datamodule.valid_dataloaders(valid_cuts)
 
-    # It's time consuming to include `giga_train_dl` here
-    #  for dl in [train_dl, giga_train_dl]:
-    for dl in [train_dl]:
+    # It's time consuming to scan GigaSpeech here, so we
+    # use only the LibriSpeech sampler.
+    # The batch plan has already run the largest batch of each bucket.
+    if batch_plan is None:
         scan_pessimistic_batches_for_oom(
             model=model,
-            train_dl=dl,
+            train_dl=train_dl,
+            sampler=train_dl.sampler.samplers["libri"],
             optimizer=optimizer,
             sp=sp,
             params=params,
@@ -1030,9 +1105,7 @@ def run(rank, world_size, args):
             scheduler=scheduler,
             sp=sp,
             train_dl=train_dl,
-            giga_train_dl=giga_train_dl,
             valid_dl=valid_dl,
-            rng=rng,
             scaler=scaler,
             tb_writer=tb_writer,
             world_size=world_size,
@@ -1063,6 +1136,7 @@ def run(rank, world_size, args):
 def scan_pessimistic_batches_for_oom(
     model: nn.Module,
     train_dl: torch.utils.data.DataLoader,
+    sampler: CutSampler,
     optimizer: torch.optim.Optimizer,
     sp: spm.SentencePieceProcessor,
     params: AttributeDict,
@@ -1072,7 +1146,7 @@ def scan_pessimistic_batches_for_oom(
     logging.info(
         "Sanity check -- see if any of the batches in epoch 0 would cause OOM."
     )
-    batches, crit_values = find_pessimistic_batches(train_dl.sampler)
+    batches, crit_values = find_pessimistic_batches(sampler)
     for criterion, cuts in batches.items():
         batch = train_dl.dataset[cuts]
         try:
@@ -1103,6 +1177,118 @@ def scan_pessimistic_batches_for_oom(
             raise
 
 
+def plan_batches(
+    model: nn.Module,
+    train_cuts: CutSet,
+    max_cut_duration: float,
+    optimizer: torch.optim.Optimizer,
+    sp: spm.SentencePieceProcessor,
+    params: AttributeDict,
+    world_size: int,
+    num_cuts: int = 5000,
+) -> BatchPlan:
+    """Choose the maximum duration of the batches of each duration bucket
+    from the peak memory of training steps with synthetic batches.
+    See icefall/batch_planner.py.
+
+    Args:
+      model:
+        The model to train.
+      train_cuts:
+        The LibriSpeech training cuts.
+      max_cut_duration:
+        The duration of the longest training cut.
+      optimizer:
+        The optimizer. If it has no state yet, the memory of its state
+        is added to the measured peak memory.
+      sp:
+        The BPE model.
+      params:
+        Parameters for training. See :func:`get_params`.
+      world_size:
+        Number of GPUs for DDP training.
+      num_cuts:
+        Number of cuts to estimate the duration buckets and the number
+        of tokens per second from.
+    """
+    device = model.device
+    assert device.type == "cuda", "--plan-batches requires a GPU"
+    if isinstance(model, DDP):
+        # Do not synchronize the gradients of the synthetic batches
+        model = model.module
+        model.device = device
+
+    cuts = CutSet.from_cuts(train_cuts.subset(first=num_cuts))
+    duration_bins = estimate_duration_buckets(
+        cuts, num_buckets=params.num_buckets
+    )
+    tokens_per_second = max(
+        len(sp.encode(s.text)) / c.duration
+        for c in cuts
+        for s in c.supervisions
+    )
+    logging.info(f"Tokens per second: {tokens_per_second:.2f}")
+
+    if optimizer.state:
+        reserved = 0
+    else:
+        # Eve keeps two tensors of the size of each parameter
+        reserved = 2 * sum(
+            p.numel() * p.element_size() for p in model.parameters()
+        )
+
+    def measure(shape: BatchShape) -> Optional[float]:
+        batch = make_synthetic_batch(
+            shape,
+            feature_dim=params.feature_dim,
+            vocab_size=params.vocab_size,
+        )
+        batch["source"] = "libri"
+
+        def step():
+            with torch.cuda.amp.autocast(enabled=params.use_fp16):
+                loss, _ = compute_loss(
+                    params=params,
+                    model=model,
+                    sp=sp,
+                    batch=batch,
+                    is_training=True,
+                    warmup=0.0,
+                )
+            loss.backward()
+
+        try:
+            peak = measure_peak_memory(step, device)
+        finally:
+            model.zero_grad()
+        return None if peak is None else peak + reserved
+
+    if params.memory_budget > 0:
+        memory_budget = params.memory_budget * 2 ** 30
+    else:
+        total = torch.cuda.get_device_properties(device).total_memory
+        memory_budget = 0.9 * total
+
+    planner = BatchPlanner(measure=measure, memory_budget=memory_budget)
+    planner.probe(default_probe_shapes(max_cut_duration, tokens_per_second))
+    batch_plan = planner.plan(
+        duration_bins=duration_bins,
+        max_cut_duration=max_cut_duration,
+        tokens_per_second=tokens_per_second,
+    )
+
+    if world_size > 1:
+        # Use the same plan on all ranks
+        max_durations = torch.tensor(batch_plan.max_durations, device=device)
+        torch.distributed.all_reduce(
+            max_durations, op=torch.distributed.ReduceOp.MIN
+        )
+        batch_plan.max_durations = max_durations.tolist()
+
+    logging.info(f"Batch plan:\n{batch_plan}")
+    return batch_plan
+
+
 def main():
     parser = get_parser()
     AsrDataModule.add_arguments(parser)
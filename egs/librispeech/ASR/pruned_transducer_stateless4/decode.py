@@ -69,13 +69,15 @@ import torch
 import torch.nn as nn
 from asr_datamodule import LibriSpeechAsrDataModule
 from beam_search import (
+    DecoderOutCache,
     beam_search,
     fast_beam_search_one_best,
     greedy_search,
     greedy_search_batch,
     modified_beam_search,
 )
-from train import get_params, get_transducer_model
+from scaling import fold_scales, quantize_linears
+from train import add_model_arguments, get_params, get_transducer_model
 
 from icefall.checkpoint import (
     average_checkpoints,
@@ -212,6 +214,31 @@ def get_parser():
         Used only when --decoding_method is greedy_search""",
     )
 
+    parser.add_argument(
+        "--quantize",
+        type=str2bool,
+        default=False,
+        help="""True to decode on the CPU with the linear layers of the
+        model quantized to int8 (see quantize_linears() in scaling.py).
+        With --avg 1, the checkpoint can also be the one saved by
+        export.py --quantize true.
+        """,
+    )
+
+    parser.add_argument(
+        "--decoder-cache-size",
+        type=int,
+        default=0,
+        help="""If positive, cache the projected decoder outputs of at most
+        so many decoder contexts across batches. 0 disables the cache.
+        Used only when --decoding-method is greedy_search or
+        modified_beam_search, whose contexts repeat a lot. The lookup runs
+        on the CPU, so it does not pay off for fast_beam_search.
+        """,
+    )
+
+    add_model_arguments(parser)
+
     return parser
 
 
@@ -490,11 +517,14 @@ def main():
     if params.use_averaged_model:
         params.suffix += "-use-averaged-model"
 
+    if params.quantize:
+        params.suffix += "-int8"
+
     setup_logger(f"{params.res_dir}/log-decode-{params.suffix}")
     logging.info("Decoding started")
 
     device = torch.device("cpu")
-    if torch.cuda.is_available():
+    if torch.cuda.is_available() and not params.quantize:
         device = torch.device("cuda", 0)
 
     logging.info(f"Device: {device}")
@@ -511,6 +541,8 @@ def main():
 
     logging.info("About to create model")
     model = get_transducer_model(params)
+    # True if the checkpoint has been quantized by export.py
+    quantized = False
 
     if not params.use_averaged_model:
         if params.iter > 0:
@@ -531,7 +563,21 @@ def main():
             model.to(device)
             model.load_state_dict(average_checkpoints(filenames, device=device))
         elif params.avg == 1:
-            load_checkpoint(f"{params.exp_dir}/epoch-{params.epoch}.pt", model)
+            filename = f"{params.exp_dir}/epoch-{params.epoch}.pt"
+            if params.quantize:
+                checkpoint = torch.load(filename, map_location="cpu")
+                if checkpoint.get("quantized", False):
+                    # It is saved by export.py --quantize true
+                    model.eval()
+                    quantize_linears(fold_scales(model))
+                    quantized = True
+                    model.load_state_dict(checkpoint["model"])
+                else:
+                    # Don't load the file again with load_checkpoint()
+                    model.load_state_dict(checkpoint["model"], strict=False)
+                del checkpoint
+            else:
+                load_checkpoint(filename, model)
         else:
             start = params.epoch - params.avg + 1
             filenames = []
@@ -591,6 +637,21 @@ def main():
 
     model.to(device)
     model.eval()
+    if not quantized:
+        # Multiply the scales into the weights once instead of in every
+        # forward pass
+        fold_scales(model)
+        if params.quantize:
+            quantize_linears(model)
+    if params.decoder_cache_size > 0 and params.decoding_method in (
+        "greedy_search",
+        "modified_beam_search",
+    ):
+        model.decoder_cache = DecoderOutCache(
+            max_size=params.decoder_cache_size
+        )
+    else:
+        model.decoder_cache = None
 
     if params.decoding_method == "fast_beam_search":
         decoding_graph = k2.trivial_graph(params.vocab_size - 1, device=device)
@@ -626,6 +687,9 @@ def main():
             results_dict=results_dict,
         )
 
+    if model.decoder_cache is not None:
+        logging.info(f"Decoder cache: {model.decoder_cache}")
+
     logging.info("Done!")
 
 
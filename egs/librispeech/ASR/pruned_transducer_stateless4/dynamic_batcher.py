@@ -0,0 +1 @@
+../pruned_transducer_stateless2/dynamic_batcher.py
\ No newline at end of file
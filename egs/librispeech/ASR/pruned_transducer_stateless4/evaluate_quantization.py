@@ -0,0 +1 @@
+../pruned_transducer_stateless2/evaluate_quantization.py
\ No newline at end of file
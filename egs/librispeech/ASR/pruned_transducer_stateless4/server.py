@@ -0,0 +1 @@
+../pruned_transducer_stateless2/server.py
\ No newline at end of file
@@ -62,8 +62,10 @@ from asr_datamodule import LibriSpeechAsrDataModule
 from conformer import Conformer
 from decoder import Decoder
 from joiner import Joiner
+from lhotse import CutSet
 from lhotse.cut import Cut
 from lhotse.dataset.sampling.base import CutSampler
+from lhotse.dataset.sampling.dynamic_bucketing import estimate_duration_buckets
 from lhotse.utils import fix_random_seed
 from model import Transducer
 from optim import Eden, Eve
@@ -73,12 +75,22 @@ from torch.nn.parallel import DistributedDataParallel as DDP
 from torch.utils.tensorboard import SummaryWriter
 
 from icefall import diagnostics
+from icefall.batch_planner import (
+    BatchPlan,
+    BatchPlanner,
+    BatchShape,
+    default_probe_shapes,
+    make_synthetic_batch,
+    measure_peak_memory,
+)
 from icefall.checkpoint import load_checkpoint, remove_checkpoints
 from icefall.checkpoint import save_checkpoint as save_checkpoint_impl
 from icefall.checkpoint import (
     save_checkpoint_with_global_batch_idx,
     update_averaged_model,
 )
+from icefall.dataset.prefetch import DevicePrefetcher
+from icefall.dataset.token_ids import get_token_ids
 from icefall.dist import cleanup_dist, setup_dist
 from icefall.env import get_env_info
 from icefall.utils import AttributeDict, MetricsTracker, setup_logger, str2bool
@@ -88,6 +100,42 @@ LRSchedulerType = Union[
 ]
 
 
+def add_model_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--dynamic-chunk-training",
+        type=str2bool,
+        default=False,
+        help="""Whether to restrict the attention of the encoder to chunks
+        of random sizes during training. Set it to true, together with
+        --causal-convolution, to train a model for streaming decoding.
+        """,
+    )
+
+    parser.add_argument(
+        "--causal-convolution",
+        type=str2bool,
+        default=False,
+        help="""Whether to use causal convolution in the encoder. It is
+        required for streaming decoding.""",
+    )
+
+    parser.add_argument(
+        "--short-chunk-size",
+        type=int,
+        default=25,
+        help="""Maximum chunk size (in frames after subsampling) when a
+        short chunk is sampled in dynamic chunk training.""",
+    )
+
+    parser.add_argument(
+        "--num-left-chunks",
+        type=int,
+        default=4,
+        help="""Number of left chunks visible in dynamic chunk training.
+        -1 means all of them.""",
+    )
+
+
 def get_parser():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
@@ -281,6 +329,39 @@ def get_parser():
         help="Whether to use half precision training.",
     )
 
+    parser.add_argument(
+        "--optim-foreach",
+        type=str2bool,
+        default=False,
+        help="""Whether to update the parameters in Eve with the
+        torch._foreach_* functions. The results are the same. See
+        pruned_transducer_stateless2/benchmark_optim.py for its speed.
+        """,
+    )
+
+    parser.add_argument(
+        "--plan-batches",
+        type=str2bool,
+        default=False,
+        help="""If True, measure the peak memory of training steps with
+        synthetic batches before training and choose the maximum duration
+        of the batches of each duration bucket so that they fit into
+        --memory-budget. --max-duration is then ignored.
+        It requires a GPU.
+        """,
+    )
+
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        default=0,
+        help="""The GPU memory in GB that a training step may use with
+        --plan-batches. If 0, it uses 90%% of the memory of the GPU.
+        """,
+    )
+
+    add_model_arguments(parser)
+
     return parser
 
 
@@ -367,6 +448,10 @@ def get_encoder_model(params: AttributeDict) -> nn.Module:
         nhead=params.nhead,
         dim_feedforward=params.dim_feedforward,
         num_encoder_layers=params.num_encoder_layers,
+        causal=params.causal_convolution,
+        dynamic_chunk_training=params.dynamic_chunk_training,
+        short_chunk_size=params.short_chunk_size,
+        num_left_chunks=params.num_left_chunks,
     )
     return encoder
 
@@ -566,9 +651,13 @@ def compute_loss(
     supervisions = batch["supervisions"]
     feature_lens = supervisions["num_frames"].to(device)
 
-    texts = batch["supervisions"]["text"]
-    y = sp.encode(texts, out_type=int)
-    y = k2.RaggedTensor(y).to(device)
+    if "token_ids" in supervisions:
+        # Already tokenized by the dataloader workers
+        y = get_token_ids(supervisions, device=device)
+    else:
+        texts = batch["supervisions"]["text"]
+        y = sp.encode(texts, out_type=int)
+        y = k2.RaggedTensor(y).to(device)
 
     with torch.set_grad_enabled(is_training):
         simple_loss, pruned_loss = model(
@@ -599,14 +688,14 @@ def compute_loss(
     info = MetricsTracker()
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        info["frames"] = (
-            (feature_lens // params.subsampling_factor).sum().item()
-        )
+        info["frames"] = (feature_lens // params.subsampling_factor).sum()
 
     # Note: We use reduction=sum while computing the loss.
-    info["loss"] = loss.detach().cpu().item()
-    info["simple_loss"] = simple_loss.detach().cpu().item()
-    info["pruned_loss"] = pruned_loss.detach().cpu().item()
+    # The values stay on the device. MetricsTracker transfers them to
+    # the CPU only when they are logged, so there is no sync per batch.
+    info["loss"] = loss.detach()
+    info["simple_loss"] = simple_loss.detach()
+    info["pruned_loss"] = pruned_loss.detach()
 
     return loss, info
 
@@ -636,6 +725,8 @@ def compute_validation_loss(
 
     if world_size > 1:
         tot_loss.reduce(loss.device)
+    else:
+        tot_loss.sync()
 
     loss_value = tot_loss["loss"] / tot_loss["frames"]
     if loss_value < params.best_valid_loss:
@@ -696,7 +787,12 @@ def train_one_epoch(
 
     cur_batch_idx = params.get("cur_batch_idx", 0)
 
-    for batch_idx, batch in enumerate(train_dl):
+    if params.prefetch_to_device:
+        device = next(model.parameters()).device
+    else:
+        device = None
+    prefetcher = DevicePrefetcher(train_dl, device=device)
+    for batch_idx, batch in enumerate(prefetcher):
         if batch_idx < cur_batch_idx:
             continue
         cur_batch_idx = batch_idx
@@ -768,13 +864,19 @@ def train_one_epoch(
                 f"Epoch {params.cur_epoch}, "
                 f"batch {batch_idx}, loss[{loss_info}], "
                 f"tot_loss[{tot_loss}], batch size: {batch_size}, "
-                f"lr: {cur_lr:.2e}"
+                f"lr: {cur_lr:.2e}, "
+                f"data wait: {prefetcher.data_wait_time:.1f}s"
             )
 
             if tb_writer is not None:
                 tb_writer.add_scalar(
                     "train/learning_rate", cur_lr, params.batch_idx_train
                 )
+                tb_writer.add_scalar(
+                    "train/data_wait_time",
+                    prefetcher.data_wait_time,
+                    params.batch_idx_train,
+                )
 
                 loss_info.write_summary(
                     tb_writer, "train/current_", params.batch_idx_train
@@ -799,6 +901,14 @@ def train_one_epoch(
                     tb_writer, "train/valid_", params.batch_idx_train
                 )
 
+    logging.info(
+        f"Epoch {params.cur_epoch}: waited "
+        f"{prefetcher.epoch_start_latency:.1f}s for the first batch and "
+        f"{prefetcher.data_wait_time:.1f}s for the other "
+        f"{max(prefetcher.num_batches - 1, 0)} batches"
+    )
+
+    tot_loss.sync()
     loss_value = tot_loss["loss"] / tot_loss["frames"]
     params.train_loss = loss_value
     if params.train_loss < params.best_train_loss:
@@ -871,7 +981,11 @@ def run(rank, world_size, args):
         logging.info("Using DDP")
         model = DDP(model, device_ids=[rank])
 
-    optimizer = Eve(model.parameters(), lr=params.initial_lr)
+    optimizer = Eve(
+        model.parameters(),
+        lr=params.initial_lr,
+        foreach=params.optim_foreach,
+    )
 
     scheduler = Eden(optimizer, params.lr_batches, params.lr_epochs)
 
@@ -920,15 +1034,31 @@ def run(rank, world_size, args):
     else:
         sampler_state_dict = None
 
+    if params.plan_batches:
+        batch_plan = plan_batches(
+            model=model,
+            train_cuts=train_cuts,
+            max_cut_duration=20.0,
+            optimizer=optimizer,
+            sp=sp,
+            params=params,
+            world_size=world_size,
+        )
+    else:
+        batch_plan = None
+
     train_dl = librispeech.train_dataloaders(
-        train_cuts, sampler_state_dict=sampler_state_dict
+        train_cuts,
+        sampler_state_dict=sampler_state_dict,
+        batch_plan=batch_plan,
     )
 
     valid_cuts = librispeech.dev_clean_cuts()
     valid_cuts += librispeech.dev_other_cuts()
     valid_dl = librispeech.valid_dataloaders(valid_cuts)
 
-    if not params.print_diagnostics:
+    # The batch plan has already run the largest batch of each bucket
+    if not params.print_diagnostics and batch_plan is None:
         scan_pessimistic_batches_for_oom(
             model=model,
             train_dl=train_dl,
@@ -1032,6 +1162,116 @@ def scan_pessimistic_batches_for_oom(
             raise
 
 
+def plan_batches(
+    model: nn.Module,
+    train_cuts: CutSet,
+    max_cut_duration: float,
+    optimizer: torch.optim.Optimizer,
+    sp: spm.SentencePieceProcessor,
+    params: AttributeDict,
+    world_size: int,
+    num_cuts: int = 5000,
+) -> BatchPlan:
+    """Choose the maximum duration of the batches of each duration bucket
+    from the peak memory of training steps with synthetic batches.
+    See icefall/batch_planner.py.
+
+    Args:
+      model:
+        The model to train.
+      train_cuts:
+        The training cuts.
+      max_cut_duration:
+        The duration of the longest training cut.
+      optimizer:
+        The optimizer. If it has no state yet, the memory of its state
+        is added to the measured peak memory.
+      sp:
+        The BPE model.
+      params:
+        Parameters for training. See :func:`get_params`.
+      world_size:
+        Number of GPUs for DDP training.
+      num_cuts:
+        Number of cuts to estimate the duration buckets and the number
+        of tokens per second from.
+    """
+    device = next(model.parameters()).device
+    assert device.type == "cuda", "--plan-batches requires a GPU"
+    if isinstance(model, DDP):
+        # Do not synchronize the gradients of the synthetic batches
+        model = model.module
+
+    cuts = CutSet.from_cuts(train_cuts.subset(first=num_cuts))
+    duration_bins = estimate_duration_buckets(
+        cuts, num_buckets=params.num_buckets
+    )
+    tokens_per_second = max(
+        len(sp.encode(s.text)) / c.duration
+        for c in cuts
+        for s in c.supervisions
+    )
+    logging.info(f"Tokens per second: {tokens_per_second:.2f}")
+
+    if optimizer.state:
+        reserved = 0
+    else:
+        # Eve keeps two tensors of the size of each parameter
+        reserved = 2 * sum(
+            p.numel() * p.element_size() for p in model.parameters()
+        )
+
+    def measure(shape: BatchShape) -> Optional[float]:
+        batch = make_synthetic_batch(
+            shape,
+            feature_dim=params.feature_dim,
+            vocab_size=params.vocab_size,
+        )
+
+        def step():
+            with torch.cuda.amp.autocast(enabled=params.use_fp16):
+                loss, _ = compute_loss(
+                    params=params,
+                    model=model,
+                    sp=sp,
+                    batch=batch,
+                    is_training=True,
+                    warmup=0.0,
+                )
+            loss.backward()
+
+        try:
+            peak = measure_peak_memory(step, device)
+        finally:
+            model.zero_grad()
+        return None if peak is None else peak + reserved
+
+    if params.memory_budget > 0:
+        memory_budget = params.memory_budget * 2 ** 30
+    else:
+        total = torch.cuda.get_device_properties(device).total_memory
+        memory_budget = 0.9 * total
+
+    planner = BatchPlanner(measure=measure, memory_budget=memory_budget)
+    planner.probe(default_probe_shapes(max_cut_duration, tokens_per_second))
+    batch_plan = planner.plan(
+        duration_bins=duration_bins,
+        max_cut_duration=max_cut_duration,
+        tokens_per_second=tokens_per_second,
+    )
+
+    if world_size > 1:
+        # Use the same plan on all ranks
+        max_durations = torch.tensor(batch_plan.max_durations, device=device)
+        torch.distributed.all_reduce(
+            max_durations, op=torch.distributed.ReduceOp.MIN
+        )
+        batch_plan.max_durations = max_durations.tolist()
+
+    logging.info(f"Batch plan:\n{batch_plan}")
+    return batch_plan
+
+
 def main():
     parser = get_parser()
     LibriSpeechAsrDataModule.add_arguments(parser)
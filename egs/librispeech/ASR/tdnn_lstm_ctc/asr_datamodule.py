@@ -29,7 +29,9 @@ from lhotse.dataset import (
     BucketingSampler,
     CutConcatenate,
     CutMix,
+    DynamicBucketingSampler,
     K2SpeechRecognitionDataset,
+    PerturbSpeed,
     PrecomputedFeatures,
     SingleCutSampler,
     SpecAugment,
@@ -38,6 +40,8 @@ from lhotse.dataset.input_strategies import OnTheFlyFeatures
 from lhotse.utils import fix_random_seed
 from torch.utils.data import DataLoader
 
+from icefall.batch_planner import BatchPlan
+from icefall.dataset.token_ids import TokenizedDataset
 from icefall.utils import str2bool
 
 
@@ -143,6 +147,17 @@ class LibriSpeechAsrDataModule:
             "extraction. Will drop existing precomputed feature manifests "
             "if available.",
         )
+        group.add_argument(
+            "--perturb-speed",
+            type=str2bool,
+            default=False,
+            help="When enabled, perturb the speed of the training cuts "
+            "by a factor of 0.9 or 1.1 with probability 2/3 in the "
+            "dataloader workers and compute their features on the fly. "
+            "Use it with cuts whose features were computed without speed "
+            "perturbation, e.g., by ./local/compute_fbank_librispeech.py "
+            "--perturb-speed false.",
+        )
         group.add_argument(
             "--shuffle",
             type=str2bool,
@@ -167,6 +182,47 @@ class LibriSpeechAsrDataModule:
             "collect the batches.",
         )
 
+        group.add_argument(
+            "--valid-num-workers",
+            type=int,
+            default=2,
+            help="The number of validation dataloader workers.",
+        )
+
+        group.add_argument(
+            "--persistent-workers",
+            type=str2bool,
+            default=True,
+            help="When enabled, the dataloader workers are kept alive "
+            "between epochs and validation runs instead of being started "
+            "again each time.",
+        )
+
+        group.add_argument(
+            "--prefetch-factor",
+            type=int,
+            default=2,
+            help="The number of batches loaded in advance by each "
+            "dataloader worker.",
+        )
+
+        group.add_argument(
+            "--pin-memory",
+            type=str2bool,
+            default=True,
+            help="When enabled, the batches are put in pinned memory, "
+            "so that they can be copied to the GPU asynchronously.",
+        )
+
+        group.add_argument(
+            "--prefetch-to-device",
+            type=str2bool,
+            default=True,
+            help="When enabled, the next batch is moved to the device "
+            "in the background while the current one is trained on. "
+            "See icefall/dataset/prefetch.py.",
+        )
+
         group.add_argument(
             "--enable-spec-aug",
             type=str2bool,
@@ -192,10 +248,66 @@ class LibriSpeechAsrDataModule:
             "with training dataset. ",
         )
 
+        group.add_argument(
+            "--tokenize-in-workers",
+            type=str2bool,
+            default=True,
+            help="When enabled and --bpe-model is given, the train/valid "
+            "dataloader workers also return the token IDs of the "
+            "transcripts in batch['supervisions']['token_ids'], so that "
+            "they need not be computed in the training process.",
+        )
+
+        group.add_argument(
+            "--token-ids",
+            type=Path,
+            help="Path to the token IDs computed by "
+            "local/compute_token_ids.py. If not given, use token_ids.npz "
+            "from the directory of --bpe-model if it exists. "
+            "Used only when --tokenize-in-workers is True.",
+        )
+
+    def _tokenize(self, dataset: K2SpeechRecognitionDataset):
+        """Wrap the dataset so that it also returns the token IDs.
+        See :class:`icefall.dataset.token_ids.TokenizedDataset`."""
+        bpe_model = getattr(self.args, "bpe_model", None)
+        if not self.args.tokenize_in_workers or bpe_model is None:
+            return dataset
+
+        token_ids = self.args.token_ids
+        if token_ids is None:
+            token_ids = Path(bpe_model).parent / "token_ids.npz"
+            if not token_ids.is_file():
+                logging.info(
+                    f"{token_ids} does not exist. Tokenize transcripts in "
+                    "the dataloader workers on the fly."
+                )
+                token_ids = None
+
+        return TokenizedDataset(
+            dataset, bpe_model=bpe_model, token_ids=token_ids
+        )
+
+    def _dataloader_kwargs(self, num_workers: int) -> Dict[str, Any]:
+        """Return the keyword arguments of the DataLoader for the given
+        number of workers."""
+        kwargs = dict(
+            num_workers=num_workers,
+            pin_memory=self.args.pin_memory and torch.cuda.is_available(),
+        )
+        if num_workers > 0:
+            # DataLoader does not accept them without workers
+            kwargs.update(
+                persistent_workers=self.args.persistent_workers,
+                prefetch_factor=self.args.prefetch_factor,
+            )
+        return kwargs
+
     def train_dataloaders(
         self,
         cuts_train: CutSet,
         sampler_state_dict: Optional[Dict[str, Any]] = None,
+        batch_plan: Optional[BatchPlan] = None,
     ) -> DataLoader:
         """
         Args:
@@ -203,6 +315,10 @@ class LibriSpeechAsrDataModule:
             CutSet for training.
           sampler_state_dict:
             The state dict for the training sampler.
+          batch_plan:
+            If not None, the maximum duration of a batch depends on the
+            duration bucket of its cuts as given by the plan, instead of
+            being --max-duration. See icefall/batch_planner.py.
         """
         transforms = []
         if self.args.enable_musan:
@@ -233,6 +349,15 @@ class LibriSpeechAsrDataModule:
                 )
             ] + transforms
 
+        if self.args.perturb_speed:
+            logging.info("Enable speed perturbation")
+            # Perturb the original cuts, i.e., before concatenating them.
+            # Storing features of the perturbed copies triples the epoch
+            # size, so we apply it with prob 2/3 and use 3x more epochs.
+            transforms = [
+                PerturbSpeed(factors=[0.9, 1.1], p=2 / 3)
+            ] + transforms
+
         input_transforms = []
         if self.args.enable_spec_aug:
             logging.info("Enable SpecAugment")
@@ -268,17 +393,7 @@ class LibriSpeechAsrDataModule:
             return_cuts=self.args.return_cuts,
         )
 
-        if self.args.on_the_fly_feats:
-            # NOTE: the PerturbSpeed transform should be added only if we
-            # remove it from data prep stage.
-            # Add on-the-fly speed perturbation; since originally it would
-            # have increased epoch size by 3, we will apply prob 2/3 and use
-            # 3x more epochs.
-            # Speed perturbation probably should come first before
-            # concatenation, but in principle the transforms order doesn't have
-            # to be strict (e.g. could be randomized)
-            # transforms = [PerturbSpeed(factors=[0.9, 1.1], p=2/3)] + transforms   # noqa
-            # Drop feats to be on the safe side.
+        if self.args.on_the_fly_feats or self.args.perturb_speed:
             train = K2SpeechRecognitionDataset(
                 cut_transforms=transforms,
                 input_strategy=OnTheFlyFeatures(
@@ -288,7 +403,18 @@ class LibriSpeechAsrDataModule:
                 return_cuts=self.args.return_cuts,
             )
 
-        if self.args.bucketing_sampler:
+        train = self._tokenize(train)
+
+        if batch_plan is not None:
+            logging.info(f"Using DynamicBucketingSampler with {batch_plan}")
+            train_sampler = DynamicBucketingSampler(
+                cuts_train,
+                constraint=batch_plan.constraint(),
+                duration_bins=batch_plan.duration_bins,
+                shuffle=self.args.shuffle,
+                drop_last=True,
+            )
+        elif self.args.bucketing_sampler:
             logging.info("Using BucketingSampler.")
             train_sampler = BucketingSampler(
                 cuts_train,
@@ -320,8 +446,7 @@ class LibriSpeechAsrDataModule:
             train,
             sampler=train_sampler,
             batch_size=None,
-            num_workers=self.args.num_workers,
-            persistent_workers=False,
+            **self._dataloader_kwargs(self.args.num_workers),
             worker_init_fn=worker_init_fn,
         )
 
@@ -350,6 +475,8 @@ class LibriSpeechAsrDataModule:
                 cut_transforms=transforms,
                 return_cuts=self.args.return_cuts,
             )
+        validate = self._tokenize(validate)
+
         valid_sampler = BucketingSampler(
             cuts_valid,
             max_duration=self.args.max_duration,
@@ -360,8 +487,7 @@ class LibriSpeechAsrDataModule:
             validate,
             sampler=valid_sampler,
             batch_size=None,
-            num_workers=2,
-            persistent_workers=False,
+            **self._dataloader_kwargs(self.args.valid_num_workers),
         )
 
         return valid_dl
@@ -24,6 +24,7 @@ import torch
 from torch import Tensor, nn
 from transformer import Transformer
 
+from icefall.rel_pos_emb import compute_rel_pos_emb, get_rel_pos_emb
 from icefall.utils import make_pad_mask
 
 
@@ -353,6 +354,17 @@ class RelPositionalEncoding(torch.nn.Module):
 
     def extend_pe(self, x: Tensor) -> None:
         """Reset the positional encodings."""
+        if not torch.jit.is_scripting():
+            # The tables are shared by all modules and cached per device
+            # and dtype, see icefall/rel_pos_emb.py
+            self.pe = get_rel_pos_emb(
+                length=x.size(1),
+                d_model=self.d_model,
+                device=x.device,
+                dtype=x.dtype,
+            )
+            return
+
         if self.pe is not None:
             # self.pe contains both positive and negative parts
             # the length of self.pe is 2 * input_len - 1
@@ -363,27 +375,7 @@ class RelPositionalEncoding(torch.nn.Module):
                 ):
                     self.pe = self.pe.to(dtype=x.dtype, device=x.device)
                 return
-        # Suppose `i` means to the position of query vecotr and `j` means the
-        # position of key vector. We use position relative positions when keys
-        # are to the left (i>j) and negative relative positions otherwise (i<j).
-        pe_positive = torch.zeros(x.size(1), self.d_model)
-        pe_negative = torch.zeros(x.size(1), self.d_model)
-        position = torch.arange(0, x.size(1), dtype=torch.float32).unsqueeze(1)
-        div_term = torch.exp(
-            torch.arange(0, self.d_model, 2, dtype=torch.float32)
-            * -(math.log(10000.0) / self.d_model)
-        )
-        pe_positive[:, 0::2] = torch.sin(position * div_term)
-        pe_positive[:, 1::2] = torch.cos(position * div_term)
-        pe_negative[:, 0::2] = torch.sin(-1 * position * div_term)
-        pe_negative[:, 1::2] = torch.cos(-1 * position * div_term)
-
-        # Reserve the order of positive indices and concat both positive and
-        # negative indices. This is used to support the shifting trick
-        # as in "Transformer-XL: Attentive Language Models Beyond a Fixed-Length Context"
-        pe_positive = torch.flip(pe_positive, [0]).unsqueeze(0)
-        pe_negative = pe_negative[1:].unsqueeze(0)
-        pe = torch.cat([pe_positive, pe_negative], dim=1)
+        pe = compute_rel_pos_emb(x.size(1), self.d_model)
         self.pe = pe.to(device=x.device, dtype=x.dtype)
 
     def forward(self, x: torch.Tensor) -> Tuple[Tensor, Tensor]:
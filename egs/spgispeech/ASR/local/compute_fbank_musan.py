@@ -36,6 +36,7 @@ from lhotse.features.kaldifeat import (
 )
 from lhotse.recipes.utils import read_manifests_if_cached
 
+from icefall.feature_extraction import compute_and_store_features
 from icefall.utils import get_executor
 
 # Torch's multithreaded behavior needs to be disabled or
@@ -86,14 +87,15 @@ def compute_fbank_musan():
         )
         .cut_into_windows(10.0)
         .filter(lambda c: c.duration > 5)
-        .compute_and_store_features_batch(
-            extractor=extractor,
-            storage_path=output_dir / f"feats_musan",
-            manifest_path=src_dir / f"cuts_musan.jsonl.gz",
-            batch_duration=500,
-            num_workers=4,
-            storage_type=LilcomChunkyWriter,
-        )
+    )
+    compute_and_store_features(
+        musan_cuts,
+        extractor=extractor,
+        storage_dir=output_dir / "feats_musan",
+        manifest_path=musan_cuts_path,
+        batch_duration=500,
+        num_workers=4,
+        storage_type=LilcomChunkyWriter,
     )
 
 
@@ -37,6 +37,8 @@ from lhotse.features.kaldifeat import (
 )
 from lhotse.manipulation import combine
 
+from icefall.feature_extraction import FeatureShard, compute_features_for_shards
+
 # Torch's multithreaded behavior needs to be disabled or
 # it wastes a lot of CPU and slow things down.
 # Do this outside of main() in case it needs to take effect
@@ -107,33 +109,42 @@ def compute_fbank_spgispeech(args):
         start = args.start
         stop = min(args.stop, args.num_splits) if args.stop > 0 else args.num_splits
         num_digits = len(str(args.num_splits))
+        shards = []
         for i in range(start, stop):
             idx = f"{i + 1}".zfill(num_digits)
-            logging.info(f"Processing train split {i}")
-            cs = cut_sets[i].compute_and_store_features_batch(
-                extractor=extractor,
-                storage_path=output_dir / f"feats_train_{idx}",
-                manifest_path=src_dir / f"cuts_train_{idx}.jsonl.gz",
-                batch_duration=500,
-                num_workers=4,
-                storage_type=LilcomChunkyWriter,
+            shards.append(
+                FeatureShard(
+                    cuts=cut_sets[i],
+                    manifest_path=src_dir / f"cuts_train_{idx}.jsonl.gz",
+                    storage_path=output_dir / f"feats_train_{idx}",
+                )
             )
+        compute_features_for_shards(
+            shards,
+            extractor=extractor,
+            progress_path=output_dir / "progress.jsonl",
+            batch_duration=500,
+            num_workers=4,
+            storage_type=LilcomChunkyWriter,
+        )
 
     if args.test:
-        for partition in ["dev", "val"]:
-            if (output_dir / f"cuts_{partition}.jsonl.gz").is_file():
-                logging.info(f"{partition} already exists - skipping.")
-                continue
-            logging.info(f"Processing {partition}")
-            cut_set = load_manifest_lazy(src_dir / f"cuts_{partition}_raw.jsonl.gz")
-            cut_set = cut_set.compute_and_store_features_batch(
-                extractor=extractor,
-                storage_path=output_dir / f"feats_{partition}",
+        shards = [
+            FeatureShard(
+                cuts=src_dir / f"cuts_{partition}_raw.jsonl.gz",
                 manifest_path=src_dir / f"cuts_{partition}.jsonl.gz",
-                batch_duration=500,
-                num_workers=4,
-                storage_type=LilcomChunkyWriter,
+                storage_path=output_dir / f"feats_{partition}",
             )
+            for partition in ["dev", "val"]
+        ]
+        compute_features_for_shards(
+            shards,
+            extractor=extractor,
+            progress_path=output_dir / "progress.jsonl",
+            batch_duration=500,
+            num_workers=4,
+            storage_type=LilcomChunkyWriter,
+        )
 
 
 if __name__ == "__main__":
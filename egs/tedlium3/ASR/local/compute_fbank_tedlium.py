@@ -20,16 +20,21 @@ This file computes fbank features of the TedLium3 dataset.
 It looks for manifests in the directory data/manifests.
 
 The generated fbank features are saved in data/fbank.
+
+It is safe to interrupt this script and run it again. Finished shards
+are not computed again. See icefall/feature_extraction.py
 """
 
 import logging
 import os
+from functools import partial
 from pathlib import Path
 
 import torch
 from lhotse import ChunkedLilcomHdf5Writer, CutSet, Fbank, FbankConfig
 from lhotse.recipes.utils import read_manifests_if_cached
 
+from icefall.feature_extraction import compute_and_store_features
 from icefall.utils import get_executor
 
 # Torch's multithreaded behavior needs to be disabled or
@@ -75,20 +80,21 @@ def compute_fbank_tedlium():
                     + cut_set.perturb_speed(0.9)
                     + cut_set.perturb_speed(1.1)
                 )
-            cur_num_jobs = num_jobs if ex is None else 80
-            cur_num_jobs = min(cur_num_jobs, len(cut_set))
-
-            cut_set = cut_set.compute_and_store_features(
+            compute_and_store_features(
+                cut_set,
                 extractor=extractor,
-                storage_path=f"{output_dir}/feats_{partition}",
-                # when an executor is specified, make more partitions
-                num_jobs=cur_num_jobs,
+                storage_dir=output_dir / f"feats_{partition}",
+                manifest_path=output_dir / f"cuts_{partition}.json.gz",
+                num_jobs=num_jobs,
                 executor=ex,
                 storage_type=ChunkedLilcomHdf5Writer,
+                # Split long cuts into many short and un-overlapping cuts
+                post_process=partial(
+                    CutSet.trim_to_supervisions, keep_overlapping=False
+                ),
+                # A cut is a whole talk
+                shard_size=10,
             )
-            # Split long cuts into many short and un-overlapping cuts
-            cut_set = cut_set.trim_to_supervisions(keep_overlapping=False)
-            cut_set.to_json(output_dir / f"cuts_{partition}.json.gz")
 
 
 if __name__ == "__main__":
@@ -5,6 +5,9 @@ This file computes fbank features of the yesno dataset.
 It looks for manifests in the directory data/manifests.
 
 The generated fbank features are saved in data/fbank.
+
+It is safe to interrupt this script and run it again. Finished shards
+are not computed again. See icefall/feature_extraction.py
 """
 
 import logging
@@ -15,6 +18,7 @@ import torch
 from lhotse import CutSet, Fbank, FbankConfig, LilcomHdf5Writer
 from lhotse.recipes.utils import read_manifests_if_cached
 
+from icefall.feature_extraction import compute_and_store_features
 from icefall.utils import get_executor
 
 # Torch's multithreaded behavior needs to be disabled or it wastes a
@@ -62,15 +66,15 @@ def compute_fbank_yesno():
                     + cut_set.perturb_speed(0.9)
                     + cut_set.perturb_speed(1.1)
                 )
-            cut_set = cut_set.compute_and_store_features(
+            compute_and_store_features(
+                cut_set,
                 extractor=extractor,
-                storage_path=f"{output_dir}/feats_{partition}",
-                # when an executor is specified, make more partitions
-                num_jobs=num_jobs if ex is None else 1,  # use one job
+                storage_dir=output_dir / f"feats_{partition}",
+                manifest_path=output_dir / f"cuts_{partition}.json.gz",
+                num_jobs=num_jobs,
                 executor=ex,
                 storage_type=LilcomHdf5Writer,
             )
-            cut_set.to_json(output_dir / f"cuts_{partition}.json.gz")
 
 
 if __name__ == "__main__":
@@ -1,17 +1,24 @@
 # isort:skip_file
 
 from . import (
+    attention_rescoring,
     checkpoint,
+    dataset,
     decode,
     dist,
     env,
+    feature_extraction,
     utils
 )
 
 from .checkpoint import (
+    AsyncCheckpointWriter,
     average_checkpoints,
+    average_epoch_checkpoints,
     find_checkpoints,
+    get_model_filename,
     load_checkpoint,
+    load_model_state_dict,
     remove_checkpoints,
     save_checkpoint,
     save_checkpoint_with_global_batch_idx,
@@ -25,6 +32,7 @@ from .decode import (
     rescore_with_attention_decoder,
     rescore_with_n_best_list,
     rescore_with_whole_lattice,
+    sweep_scales,
 )
 
 from .dist import (
@@ -39,6 +47,12 @@ from .env import (
     get_git_sha1,
 )
 
+from .feature_extraction import (
+    FeatureShard,
+    compute_and_store_features,
+    compute_features_for_shards,
+)
+
 from .utils import (
     AttributeDict,
     MetricsTracker,
@@ -0,0 +1,388 @@
+# Copyright      2026                      (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Score the paths of an n-best list with an attention decoder, sharing the
+computation of common prefixes.
+
+Paths sampled from the same lattice usually share long prefixes. Instead
+of running the decoder on each padded path, the paths of each utterance
+are put into a prefix trie. The decoder is run incrementally, one trie
+level at a time, so every distinct prefix is computed once. The keys and
+values of the self attention of every trie node are cached, and the
+encoder memory is attended to per utterance, so it is never copied for
+each path.
+"""
+
+from typing import List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+
+class PrefixTrie(object):
+    """A prefix trie over the token sequences of an n-best list.
+
+    Each utterance has its own root, which represents the SOS symbol.
+    Nodes are numbered in the order they are created, so the nodes of
+    each level are sorted by utterance.
+    """
+
+    def __init__(self, token_ids: List[List[int]], path_to_utt: List[int]):
+        """
+        Args:
+          token_ids:
+            The token IDs of each path.
+          path_to_utt:
+            The utterance index of each path. It has to be non-decreasing.
+        """
+        assert len(token_ids) == len(path_to_utt), (
+            len(token_ids),
+            len(path_to_utt),
+        )
+        # The attributes of each node
+        self.parent: List[int] = []
+        self.token: List[int] = []
+        self.depth: List[int] = []
+        self.utt: List[int] = []
+        # The last node of each path
+        self.path_end: List[int] = []
+
+        children = []
+        roots = dict()
+        for tokens, utt in zip(token_ids, path_to_utt):
+            if utt not in roots:
+                assert len(roots) == 0 or utt > max(roots), (
+                    "path_to_utt has to be non-decreasing"
+                )
+                roots[utt] = self._add_node(-1, -1, 0, utt)
+                children.append(dict())
+            node = roots[utt]
+            for depth, t in enumerate(tokens, 1):
+                child = children[node].get(t)
+                if child is None:
+                    child = self._add_node(node, t, depth, utt)
+                    children[node][t] = child
+                    children.append(dict())
+                node = child
+            self.path_end.append(node)
+
+    def _add_node(self, parent: int, token: int, depth: int, utt: int) -> int:
+        self.parent.append(parent)
+        self.token.append(token)
+        self.depth.append(depth)
+        self.utt.append(utt)
+        return len(self.parent) - 1
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.parent)
+
+    def levels(self) -> List[List[int]]:
+        """Return the nodes of each level. Level 0 contains the roots."""
+        ans = [[] for _ in range(max(self.depth) + 1)]
+        for node, depth in enumerate(self.depth):
+            ans[depth].append(node)
+        return ans
+
+
+def _in_proj(
+    attn: nn.MultiheadAttention, x: torch.Tensor, i: int
+) -> torch.Tensor:
+    """Apply the query (i == 0), key (i == 1) or value (i == 2) projection
+    of a torch.nn.MultiheadAttention to x."""
+    E = attn.embed_dim
+    weight = attn.in_proj_weight[i * E : (i + 1) * E]  # noqa: E203
+    bias = None
+    if attn.in_proj_bias is not None:
+        bias = attn.in_proj_bias[i * E : (i + 1) * E]  # noqa: E203
+    return nn.functional.linear(x, weight, bias)
+
+
+def _attend(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    num_heads: int,
+    key_padding_mask: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
+    """Scaled dot product attention.
+
+    Args:
+      q:
+        A tensor of shape (B, Q, E), already scaled.
+      k:
+        A tensor of shape (B, K, E).
+      v:
+        A tensor of shape (B, K, E).
+      num_heads:
+        Number of attention heads.
+      key_padding_mask:
+        Optional. A bool tensor of shape (B, K). True means padding.
+    Returns:
+      Return a tensor of shape (B, Q, E).
+    """
+    B, Q, E = q.shape
+    K = k.size(1)
+    head_dim = E // num_heads
+    q = q.view(B, Q, num_heads, head_dim).transpose(1, 2)
+    k = k.view(B, K, num_heads, head_dim).transpose(1, 2)
+    v = v.view(B, K, num_heads, head_dim).transpose(1, 2)
+
+    scores = torch.matmul(q, k.transpose(2, 3))  # (B, H, Q, K)
+    if key_padding_mask is not None:
+        scores = scores.masked_fill(
+            key_padding_mask.unsqueeze(1).unsqueeze(2), float("-inf")
+        )
+    out = torch.matmul(scores.softmax(dim=-1), v)  # (B, H, Q, head_dim)
+    return out.transpose(1, 2).reshape(B, Q, E)
+
+
+def _level_index(
+    utt: torch.Tensor, num_utts: int
+) -> Tuple[torch.Tensor, int]:
+    """Return the position of each node among the nodes of its utterance
+    in a level, and the largest number of nodes of an utterance.
+
+    Args:
+      utt:
+        The utterance index of each node in a level. It is non-decreasing.
+      num_utts:
+        Number of utterances.
+    """
+    counts = torch.bincount(utt, minlength=num_utts)
+    offsets = torch.cumsum(counts, dim=0) - counts
+    slot = torch.arange(utt.numel(), device=utt.device) - offsets[utt]
+    return slot, int(counts.max().item())
+
+
+def is_supported(model: nn.Module) -> bool:
+    """Return True if the attention decoder of the model can be run by
+    :func:`attention_decoder_nll`.
+
+    The model has to contain the attention decoder of the `Transformer`
+    class in conformer_ctc/transformer.py, i.e., `decoder_embed`,
+    `decoder_pos`, `decoder` and `decoder_output_layer`, where
+    the layers of `decoder` have the attributes `self_attn`, `src_attn`,
+    `norm1`, `norm2`, `norm3`, `linear1`, `linear2`, `activation` and
+    `normalize_before`.
+    """
+    for name in (
+        "decoder_embed",
+        "decoder_pos",
+        "decoder",
+        "decoder_output_layer",
+    ):
+        if not hasattr(model, name):
+            return False
+    layers = getattr(model.decoder, "layers", None)
+    if layers is None or len(layers) == 0:
+        return False
+    for layer in layers:
+        for name in (
+            "self_attn",
+            "src_attn",
+            "norm1",
+            "norm2",
+            "norm3",
+            "linear1",
+            "linear2",
+            "activation",
+            "normalize_before",
+        ):
+            if not hasattr(layer, name):
+                return False
+        for attn in (layer.self_attn, layer.src_attn):
+            if not isinstance(attn, nn.MultiheadAttention):
+                return False
+            if not attn._qkv_same_embed_dim or getattr(
+                attn, "batch_first", False
+            ):
+                return False
+    return True
+
+
+def attention_decoder_nll(
+    model: nn.Module,
+    memory: torch.Tensor,
+    memory_key_padding_mask: Optional[torch.Tensor],
+    token_ids: List[List[int]],
+    path_to_utt_map: torch.Tensor,
+    sos_id: int,
+    eos_id: int,
+) -> torch.Tensor:
+    """Compute the negative log-likelihood of each path with the attention
+    decoder of the model. It gives the same result as
+    `model.decoder_nll(...).sum(dim=1)` with the memory expanded to each
+    path, but each distinct prefix is computed only once.
+
+    The model has to be in eval mode. See :func:`is_supported` for the
+    requirements of the model.
+
+    Args:
+      model:
+        The model containing the attention decoder.
+      memory:
+        The output of the encoder with shape (T, N, C). It is not expanded
+        to the paths.
+      memory_key_padding_mask:
+        The padding mask of `memory` with shape (N, T).
+      token_ids:
+        A list-of-list of token IDs, one sublist per path. It does not
+        contain SOS or EOS.
+      path_to_utt_map:
+        A 1-D tensor containing the utterance index of each path. It has to
+        be non-decreasing.
+      sos_id:
+        The token ID for SOS.
+      eos_id:
+        The token ID for EOS.
+    Returns:
+      Return a 1-D tensor of shape (len(token_ids),) containing the sum of
+      the negative log-likelihood of the tokens and EOS of each path.
+    """
+    assert not model.training
+    device = memory.device
+    num_utts = memory.size(1)
+
+    trie = PrefixTrie(token_ids, path_to_utt_map.tolist())
+    levels = trie.levels()
+
+    parent = torch.tensor(trie.parent, device=device)
+    token = torch.tensor(trie.token, device=device)
+    node_utt = torch.tensor(trie.utt, device=device)
+    token[parent < 0] = sos_id
+
+    layers = model.decoder.layers
+    final_norm = getattr(model.decoder, "norm", None)
+    pos = model.decoder_pos
+    E = memory.size(2)
+
+    # Make sure the positional encoding covers the longest path
+    pos.extend_pe(memory.new_empty(1, len(levels), E))
+    pe = pos.pe[0]
+
+    # memory: (T, N, E) -> (N, T, E). Keys and values of the cross attention
+    # are computed once per utterance.
+    memory = memory.permute(1, 0, 2)
+    mem_k = [_in_proj(layer.src_attn, memory, 1) for layer in layers]
+    mem_v = [_in_proj(layer.src_attn, memory, 2) for layer in layers]
+
+    # Keys and values of the self attention of each node
+    self_k = [memory.new_empty(trie.num_nodes, E) for _ in layers]
+    self_v = [memory.new_empty(trie.num_nodes, E) for _ in layers]
+
+    # log_prob[i] is the log-probability of the token of node i given
+    # its parent. eos_log_prob[i] is that of EOS given node i.
+    log_prob = memory.new_zeros(trie.num_nodes)
+    eos_log_prob = memory.new_zeros(trie.num_nodes)
+
+    ancestors = None
+    prev_nodes = None
+    for depth, nodes in enumerate(levels):
+        nodes = torch.tensor(nodes, device=device)
+        # ancestors: (M, depth + 1), the nodes from the root to each node
+        if depth == 0:
+            ancestors = nodes.unsqueeze(1)
+        else:
+            # Position of each node in the previous level
+            prev_pos = torch.empty(
+                trie.num_nodes, dtype=torch.int64, device=device
+            )
+            prev_pos[prev_nodes] = torch.arange(
+                prev_nodes.numel(), device=device
+            )
+            ancestors = torch.cat(
+                [ancestors[prev_pos[parent[nodes]]], nodes.unsqueeze(1)],
+                dim=1,
+            )
+
+        utt = node_utt[nodes]
+        slot, max_slots = _level_index(utt, num_utts)
+
+        x = model.decoder_embed(token[nodes]) * pos.xscale + pe[depth]
+        for i, layer in enumerate(layers):
+            self_attn = layer.self_attn
+            src_attn = layer.src_attn
+            scaling = float(self_attn.head_dim) ** -0.5
+
+            residual = x
+            if layer.normalize_before:
+                x = layer.norm1(x)
+            self_k[i][nodes] = _in_proj(self_attn, x, 1)
+            self_v[i][nodes] = _in_proj(self_attn, x, 2)
+            q = _in_proj(self_attn, x, 0) * scaling
+            x = _attend(
+                q.unsqueeze(1),
+                self_k[i][ancestors],
+                self_v[i][ancestors],
+                num_heads=self_attn.num_heads,
+            ).squeeze(1)
+            x = residual + self_attn.out_proj(x)
+            if not layer.normalize_before:
+                x = layer.norm1(x)
+
+            residual = x
+            if layer.normalize_before:
+                x = layer.norm2(x)
+            q = _in_proj(src_attn, x, 0) * scaling
+            # Put the queries of each utterance into a row
+            padded_q = q.new_zeros(num_utts, max_slots, E)
+            padded_q[utt, slot] = q
+            x = _attend(
+                padded_q,
+                mem_k[i],
+                mem_v[i],
+                num_heads=src_attn.num_heads,
+                key_padding_mask=memory_key_padding_mask,
+            )[utt, slot]
+            x = residual + src_attn.out_proj(x)
+            if not layer.normalize_before:
+                x = layer.norm2(x)
+
+            residual = x
+            if layer.normalize_before:
+                x = layer.norm3(x)
+            x = layer.linear2(layer.activation(layer.linear1(x)))
+            x = residual + x
+            if not layer.normalize_before:
+                x = layer.norm3(x)
+
+        if final_norm is not None:
+            x = final_norm(x)
+        level_log_prob = model.decoder_output_layer(x).log_softmax(dim=-1)
+        # level_log_prob: (M, vocab_size)
+
+        eos_log_prob[nodes] = level_log_prob[:, eos_id]
+        if depth + 1 < len(levels):
+            children = torch.tensor(levels[depth + 1], device=device)
+            cur_pos = torch.empty(
+                trie.num_nodes, dtype=torch.int64, device=device
+            )
+            cur_pos[nodes] = torch.arange(nodes.numel(), device=device)
+            log_prob[children] = level_log_prob[
+                cur_pos[parent[children]], token[children]
+            ]
+        prev_nodes = nodes
+
+    # Accumulate the log-probabilities from the roots to each node
+    tot_log_prob = log_prob.clone()
+    for nodes in levels[1:]:
+        nodes = torch.tensor(nodes, device=device)
+        tot_log_prob[nodes] += tot_log_prob[parent[nodes]]
+
+    path_end = torch.tensor(trie.path_end, device=device)
+    return -(tot_log_prob[path_end] + eos_log_prob[path_end])
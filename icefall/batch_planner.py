@@ -0,0 +1,423 @@
+# Copyright      2026                      (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Choose the batch size of each duration bucket from measured peak memory.
+
+A single `--max-duration` has to be small enough for the batches of the
+longest utterances, for which the quadratic cost of self-attention and
+the cost of the transducer loss dominate. The batches of short
+utterances then use only part of the GPU memory.
+
+:class:`BatchPlanner` runs training steps for a few (batch size,
+duration, number of tokens) shapes and fits the peak memory with
+:class:`MemoryCostModel`. From the model, it computes the largest total
+duration of a batch for each duration bucket that fits into the memory
+budget, and checks the worst case of each bucket by running it.
+The resulting :class:`BatchPlan` is given to `DynamicBucketingSampler`
+through :class:`BucketedTimeConstraint`.
+
+The function measuring a shape is passed in by the caller, so the
+planner can be tested on CPU with a function that computes the memory.
+"""
+
+import copy
+import logging
+import math
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+from lhotse.dataset.sampling.base import TimeConstraint
+
+
+@dataclass(frozen=True)
+class BatchShape:
+    """The shape of a padded batch."""
+
+    batch_size: int
+
+    # Duration in seconds of each utterance
+    duration: float
+
+    # Number of tokens of each utterance
+    num_tokens: int
+
+
+class MemoryCostModel:
+    """Model the peak memory of a training step as::
+
+        c0 + B * (c1 * T + c2 * T**2 + c3 * T * U)
+
+    where B is the batch size, T is the duration in seconds and U is the
+    number of tokens of each utterance. c0 accounts for the parameters,
+    gradients and optimizer states, c1 for the activations of the
+    encoder, c2 for self-attention and c3 for the transducer loss.
+    """
+
+    def __init__(self, coefficients: Sequence[float]):
+        assert len(coefficients) == 4, len(coefficients)
+        self.coefficients = [float(c) for c in coefficients]
+
+    @staticmethod
+    def _features(shape: BatchShape) -> List[float]:
+        B, T, U = shape.batch_size, shape.duration, shape.num_tokens
+        return [1.0, B * T, B * T * T, B * T * U]
+
+    @classmethod
+    def fit(
+        cls, shapes: Sequence[BatchShape], peaks: Sequence[float]
+    ) -> "MemoryCostModel":
+        """Fit the coefficients with non-negative least squares."""
+        assert len(shapes) == len(peaks) and len(shapes) > 0
+        A = np.array([cls._features(s) for s in shapes], dtype=np.float64)
+        b = np.array(peaks, dtype=np.float64)
+        # Normalize the columns, whose scales differ a lot
+        scale = np.linalg.norm(A, axis=0)
+        scale[scale == 0] = 1
+        A = A / scale
+
+        # A simple active set method. Drop the most negative coefficient
+        # and solve again until all coefficients are non-negative.
+        active = list(range(A.shape[1]))
+        while True:
+            x = np.zeros(A.shape[1])
+            x[active] = np.linalg.lstsq(A[:, active], b, rcond=None)[0]
+            if (x >= 0).all():
+                break
+            active.remove(int(np.argmin(x)))
+
+        return cls(x / scale)
+
+    def predict(self, shape: BatchShape) -> float:
+        return sum(
+            c * f for c, f in zip(self.coefficients, self._features(shape))
+        )
+
+    def max_batch_size(
+        self, duration: float, num_tokens: int, budget: float
+    ) -> int:
+        """Return the largest batch size of utterances with the given
+        duration and number of tokens that fits into `budget` bytes.
+        The return value is 0 if even a single utterance does not fit.
+        """
+        per_utt = self.predict(BatchShape(1, duration, num_tokens))
+        per_utt -= self.coefficients[0]
+        if per_utt <= 0:
+            return 2 ** 31
+        return max(0, int((budget - self.coefficients[0]) // per_utt))
+
+    def __repr__(self) -> str:
+        c = ", ".join(f"{x:.4g}" for x in self.coefficients)
+        return f"MemoryCostModel([{c}])"
+
+
+@dataclass
+class BatchPlan:
+    """The maximum total duration of a batch for each duration bucket.
+
+    The i-th bucket contains utterances with duration in
+    (duration_bins[i-1], duration_bins[i]], so there are
+    len(duration_bins) + 1 buckets.
+    """
+
+    duration_bins: List[float]
+    max_durations: List[float]
+
+    def __post_init__(self):
+        assert len(self.max_durations) == len(self.duration_bins) + 1
+
+    def max_duration(self, duration: float) -> float:
+        """Return the maximum total duration of a batch whose longest
+        utterance has the given duration."""
+        return self.max_durations[bisect_left(self.duration_bins, duration)]
+
+    def constraint(self) -> "BucketedTimeConstraint":
+        return BucketedTimeConstraint(
+            duration_bins=list(self.duration_bins),
+            max_durations=list(self.max_durations),
+        )
+
+    def __str__(self) -> str:
+        edges = [f"{d:.1f}" for d in self.duration_bins] + ["inf"]
+        return ", ".join(
+            f"<={e}s: {m:.0f}s" for e, m in zip(edges, self.max_durations)
+        )
+
+
+@dataclass
+class BucketedTimeConstraint(TimeConstraint):
+    """A TimeConstraint whose max_duration depends on the duration of the
+    longest cut in the batch. See :class:`BatchPlan`.
+
+    It can be passed to `DynamicBucketingSampler` with the argument
+    `constraint`.
+    """
+
+    duration_bins: List[float] = field(default_factory=list)
+    max_durations: List[float] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        assert len(self.max_durations) == len(self.duration_bins) + 1
+        self._update_max_duration()
+        super().__post_init__()
+
+    def _update_max_duration(self) -> None:
+        i = bisect_left(self.duration_bins, self.longest_seen)
+        self.max_duration = self.max_durations[i]
+
+    def add(self, example) -> None:
+        super().add(example)
+        self._update_max_duration()
+
+    def reset(self) -> None:
+        super().reset()
+        self._update_max_duration()
+
+    def load_state_dict(self, state_dict: Dict) -> None:
+        state_dict = dict(state_dict)
+        self.duration_bins = state_dict.pop("duration_bins")
+        self.max_durations = state_dict.pop("max_durations")
+        super().load_state_dict(state_dict)
+        self._update_max_duration()
+
+    def __add__(
+        self, other: "BucketedTimeConstraint"
+    ) -> "BucketedTimeConstraint":
+        assert self == other
+        ans = copy.copy(self)
+        ans.current = self.current + other.current
+        ans.num_cuts = self.num_cuts + other.num_cuts
+        ans.longest_seen = max(self.longest_seen, other.longest_seen)
+        ans._update_max_duration()
+        return ans
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, BucketedTimeConstraint)
+            and self.duration_bins == other.duration_bins
+            and self.max_durations == other.max_durations
+        )
+
+
+class BatchPlanner:
+    def __init__(
+        self,
+        measure: Callable[[BatchShape], Optional[float]],
+        memory_budget: float,
+        safety_margin: float = 0.1,
+    ):
+        """
+        Args:
+          measure:
+            A function running a training step for a batch of the given
+            shape and returning its peak memory in bytes, or None if it
+            ran out of memory.
+          memory_budget:
+            The memory in bytes that a training step may use.
+          safety_margin:
+            Plan for `(1 - safety_margin) * memory_budget` bytes, which
+            leaves room for fragmentation and for the error of the model.
+        """
+        self.measure = measure
+        self.memory_budget = memory_budget
+        self.safety_margin = safety_margin
+
+        self.shapes: List[BatchShape] = []
+        self.peaks: List[float] = []
+        self.cost_model: Optional[MemoryCostModel] = None
+
+    def _measure(self, shape: BatchShape) -> Optional[float]:
+        peak = self.measure(shape)
+        if peak is not None:
+            self.shapes.append(shape)
+            self.peaks.append(peak)
+        logging.info(f"{shape}: peak memory {_format_bytes(peak)}")
+        return peak
+
+    def probe(self, shapes: Sequence[BatchShape]) -> None:
+        """Measure the given shapes. If a shape runs out of memory, its
+        batch size is halved until it fits."""
+        for shape in shapes:
+            while self._measure(shape) is None and shape.batch_size > 1:
+                shape = BatchShape(
+                    shape.batch_size // 2, shape.duration, shape.num_tokens
+                )
+
+    def fit(self) -> MemoryCostModel:
+        self.cost_model = MemoryCostModel.fit(self.shapes, self.peaks)
+        errors = [
+            abs(self.cost_model.predict(s) - p) / p
+            for s, p in zip(self.shapes, self.peaks)
+        ]
+        logging.info(
+            f"{self.cost_model}, max relative error on "
+            f"{len(errors)} shapes: {max(errors):.3f}"
+        )
+        return self.cost_model
+
+    def plan(
+        self,
+        duration_bins: Sequence[float],
+        max_cut_duration: float,
+        tokens_per_second: float,
+        max_batch_duration: Optional[float] = None,
+        verify: bool = True,
+    ) -> BatchPlan:
+        """Compute the maximum total duration of a batch for each bucket.
+
+        Args:
+          duration_bins:
+            The upper duration bounds of the buckets except the last one.
+          max_cut_duration:
+            The upper duration bound of the last bucket.
+          tokens_per_second:
+            An upper bound of the number of tokens per second of audio,
+            used to get the worst case number of tokens of a bucket.
+          max_batch_duration:
+            If not None, no bucket exceeds it.
+          verify:
+            True to run the worst case batch of each bucket and shrink
+            the buckets exceeding the budget.
+        Returns:
+          Return the plan.
+        """
+        if self.cost_model is None:
+            self.fit()
+
+        budget = (1 - self.safety_margin) * self.memory_budget
+        edges = list(duration_bins) + [max_cut_duration]
+        max_durations = []
+        for T in edges:
+            U = math.ceil(tokens_per_second * T)
+            B = self.cost_model.max_batch_size(T, U, budget)
+            if B == 0:
+                raise RuntimeError(
+                    f"A single utterance of {T:.1f} seconds with {U} tokens "
+                    f"does not fit into {_format_bytes(budget)}"
+                )
+            max_duration = B * T
+            if max_batch_duration is not None:
+                max_duration = max(T, min(max_duration, max_batch_duration))
+            max_durations.append(max_duration)
+
+        if verify:
+            for i, T in enumerate(edges):
+                max_durations[i] = self._verify_bucket(
+                    T, math.ceil(tokens_per_second * T), max_durations[i]
+                )
+
+        return BatchPlan(list(duration_bins), max_durations)
+
+    def _verify_bucket(
+        self, duration: float, num_tokens: int, max_duration: float
+    ) -> float:
+        """Run the largest batch of the bucket and shrink it by 10% until
+        it fits into the budget."""
+        while True:
+            batch_size = int(max_duration // duration)
+            peak = self._measure(BatchShape(batch_size, duration, num_tokens))
+            if peak is not None and peak <= self.memory_budget:
+                return max_duration
+            if batch_size <= 1:
+                raise RuntimeError(
+                    f"A single utterance of {duration:.1f} seconds with "
+                    f"{num_tokens} tokens does not fit into "
+                    f"{_format_bytes(self.memory_budget)}"
+                )
+            max_duration = max(duration, 0.9 * batch_size * duration)
+
+
+def default_probe_shapes(
+    max_cut_duration: float,
+    tokens_per_second: float,
+    probe_duration: float = 100.0,
+    num_durations: int = 5,
+) -> List[BatchShape]:
+    """Return shapes for :meth:`BatchPlanner.probe`. They cover durations
+    up to `max_cut_duration` with two token rates, so that all terms of
+    :class:`MemoryCostModel` can be determined. Each batch has about
+    `probe_duration` seconds of audio.
+    """
+    ans = []
+    min_duration = max_cut_duration / num_durations
+    for T in np.linspace(min_duration, max_cut_duration, num_durations):
+        T = float(T)
+        B = max(1, int(probe_duration // T))
+        for rate in (0.5 * tokens_per_second, tokens_per_second):
+            ans.append(BatchShape(B, T, max(1, math.ceil(rate * T))))
+    return ans
+
+
+def make_synthetic_batch(
+    shape: BatchShape,
+    feature_dim: int = 80,
+    vocab_size: int = 500,
+    frame_shift: float = 0.01,
+) -> dict:
+    """Return a batch of random features and token IDs in the format
+    of `K2SpeechRecognitionDataset`, with the token IDs from
+    :class:`icefall.dataset.token_ids.TokenizedDataset`.
+    """
+    B = shape.batch_size
+    num_frames = int(shape.duration / frame_shift)
+    U = shape.num_tokens
+    return {
+        "inputs": torch.randn(B, num_frames, feature_dim),
+        "supervisions": {
+            "sequence_idx": torch.arange(B, dtype=torch.int32),
+            "start_frame": torch.zeros(B, dtype=torch.int32),
+            "num_frames": torch.full((B,), num_frames, dtype=torch.int32),
+            "text": [""] * B,
+            "token_ids": {
+                "row_splits": torch.arange(
+                    0, (B + 1) * U, U, dtype=torch.int32
+                ),
+                # 0 is usually the blank
+                "values": torch.randint(
+                    1, vocab_size, (B * U,), dtype=torch.int32
+                ),
+            },
+        },
+    }
+
+
+def measure_peak_memory(
+    step: Callable[[], None], device: torch.device
+) -> Optional[float]:
+    """Run `step` and return the peak CUDA memory in bytes it allocated,
+    or None if it ran out of memory."""
+    torch.cuda.synchronize(device)
+    torch.cuda.empty_cache()
+    torch.cuda.reset_peak_memory_stats(device)
+    try:
+        step()
+        torch.cuda.synchronize(device)
+    except RuntimeError as e:
+        if "out of memory" not in str(e):
+            raise
+        return None
+    finally:
+        torch.cuda.empty_cache()
+    return float(torch.cuda.max_memory_allocated(device))
+
+
+def _format_bytes(n: Optional[float]) -> str:
+    if n is None:
+        return "OOM"
+    return f"{n / 2**30:.2f} GB"
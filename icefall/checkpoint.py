@@ -16,12 +16,18 @@
 # limitations under the License.
 
 
+import copy
 import glob
+import inspect
+import json
 import logging
 import os
 import re
+import threading
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 import torch
 import torch.nn as nn
@@ -35,6 +41,289 @@ from torch.optim import Optimizer
 # our class LRScheduler.
 LRSchedulerType = object
 
+# torch.load() supports mmap since torch 2.1
+_LOAD_SUPPORTS_MMAP = "mmap" in inspect.signature(torch.load).parameters
+
+
+def get_model_filename(filename: Union[str, Path]) -> Path:
+    """Return the filename of the model-only copy of a checkpoint, e.g.,
+    exp/epoch-10.model for exp/epoch-10.pt.
+
+    It does not end with `.pt` so that it is never taken as a checkpoint
+    by :func:`find_checkpoints`.
+    """
+    return Path(filename).with_suffix(".model")
+
+
+def load_model_state_dict(
+    filename: Union[str, Path],
+    device: torch.device = torch.device("cpu"),
+) -> Dict[str, Tensor]:
+    """Load only the model state dict of a checkpoint saved by
+    :func:`save_checkpoint`.
+
+    If the model-only copy of the checkpoint exists and is not older than
+    the checkpoint, it is loaded instead of the whole checkpoint,
+    memory-mapped if the version of torch supports it. Otherwise, the
+    whole checkpoint is loaded and everything except "model" is discarded.
+
+    Args:
+      filename:
+        The checkpoint filename.
+      device:
+        Move the state dict to this device.
+    Returns:
+      Return the model state dict.
+    """
+    filename = Path(filename)
+    model_filename = get_model_filename(filename)
+    if (
+        model_filename.is_file()
+        and model_filename.stat().st_mtime >= filename.stat().st_mtime
+    ):
+        if _LOAD_SUPPORTS_MMAP and device.type == "cpu":
+            return torch.load(model_filename, map_location=device, mmap=True)
+        return torch.load(model_filename, map_location=device)
+    return torch.load(filename, map_location=device)["model"]
+
+
+def _iter_model_state_dicts(
+    filenames: List[Union[str, Path]], device: torch.device
+) -> Iterator[Dict[str, Tensor]]:
+    """Yield the model state dict of each checkpoint. The next checkpoint
+    is read in a background thread while the caller processes the
+    current one."""
+    if len(filenames) == 0:
+        return
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(load_model_state_dict, filenames[0], device)
+        for i in range(1, len(filenames) + 1):
+            state_dict = future.result()
+            if i < len(filenames):
+                future = executor.submit(
+                    load_model_state_dict, filenames[i], device
+                )
+            yield state_dict
+
+
+def _make_state_dict(
+    tensors: Dict[str, Tensor],
+    owners: Dict[str, str],
+    template: Dict[str, Tensor],
+) -> Dict[str, Tensor]:
+    """Return a state dict with the keys and metadata of `template` and the
+    tensors in `tensors`, which contains only the first name of shared
+    tensors. See :func:`_get_owners`. Shared tensors stay shared."""
+    ans = OrderedDict((k, tensors[v]) for k, v in owners.items())
+    metadata = getattr(template, "_metadata", None)
+    if metadata is not None:
+        ans._metadata = metadata
+    return ans
+
+
+def _get_owners(state_dict: Dict[str, Tensor]) -> Dict[str, str]:
+    """Map the name of each tensor in a state dict to the first name whose
+    tensor shares the same data. Two tensors are said to be shared if they
+    have the same data_ptr."""
+    uniqued: Dict[int, str] = dict()
+    ans = dict()
+    for k, v in state_dict.items():
+        v_data_ptr = v.data_ptr()
+        if v.numel() == 0:
+            # Empty tensors may have the same data_ptr
+            ans[k] = k
+            continue
+        if v_data_ptr not in uniqued:
+            uniqued[v_data_ptr] = k
+        ans[k] = uniqued[v_data_ptr]
+    return ans
+
+
+def _atomic_write(
+    filename: Union[str, Path], write: Callable[[Path], None]
+) -> None:
+    """Call `write` with a temporary filename and rename the written file
+    to `filename`, so that `filename` is either absent or complete, even
+    if the process is killed while writing or another process is reading
+    it."""
+    filename = Path(filename)
+    # It does not end with .pt so that find_checkpoints() ignores it.
+    # It contains the PID so that processes writing the same file at the
+    # same time do not write to the same temporary file.
+    tmp_filename = filename.parent / f"{filename.name}.{os.getpid()}.tmp"
+    write(tmp_filename)
+    os.replace(tmp_filename, filename)
+
+
+def _atomic_save(obj: Any, filename: Union[str, Path]) -> None:
+    """Save `obj` with torch.save() atomically. See :func:`_atomic_write`."""
+    _atomic_write(filename, lambda f: torch.save(obj, f))
+
+
+def _atomic_save_json(obj: Any, filename: Union[str, Path]) -> None:
+    """Save `obj` with json.dump() atomically. See :func:`_atomic_write`."""
+
+    def write(f: Path) -> None:
+        with open(f, "w") as fp:
+            json.dump(obj, fp)
+
+    _atomic_write(filename, write)
+
+
+def _write_checkpoint(
+    checkpoint: Dict[str, Any], filename: Path, save_model_copy: bool
+) -> None:
+    _atomic_save(checkpoint, filename)
+    if save_model_copy:
+        # It is saved after the checkpoint so that it is not older than
+        # the checkpoint. See load_model_state_dict().
+        _atomic_save(checkpoint["model"], get_model_filename(filename))
+
+
+class AsyncCheckpointWriter(object):
+    """Write checkpoints in a background thread.
+
+    :meth:`save` copies all tensors of a checkpoint to CPU memory, which
+    is pinned if CUDA is available so that the copies from the GPU do not
+    block, and returns. The checkpoint is serialized and written in a
+    background thread. Jobs are run in the order they are submitted, so
+    that, e.g., :func:`remove_checkpoints` can be run with :meth:`submit`
+    after the pending writes have finished.
+
+    The pinned buffers are reused across checkpoints. At most
+    `max_pending` checkpoints are kept in memory; :meth:`save` waits for
+    earlier writes if there are more.
+
+    Call :meth:`close` at the end of training to wait for the pending
+    writes. Errors raised in the background thread are re-raised by the
+    next call of :meth:`save`, :meth:`wait` or :meth:`close`.
+    """
+
+    def __init__(self, max_pending: int = 1):
+        assert max_pending >= 1, max_pending
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        # Pending futures of save() and submit(). Only the futures of
+        # save() count towards max_pending.
+        self._futures: deque = deque()
+        self._num_pending_saves = 0
+        self._pin_memory = torch.cuda.is_available()
+        # Free flat CPU buffers, indexed by (numel, dtype)
+        self._buffers: Dict[Tuple[int, torch.dtype], List[Tensor]] = (
+            defaultdict(list)
+        )
+        self._lock = threading.Lock()
+
+    def _get_buffer(self, t: Tensor, used: List[Tensor]) -> Tensor:
+        key = (t.numel(), t.dtype)
+        with self._lock:
+            free = self._buffers[key]
+            buf = free.pop() if free else None
+        if buf is None:
+            buf = torch.empty(
+                t.numel(), dtype=t.dtype, pin_memory=self._pin_memory
+            )
+        used.append(buf)
+        return buf.view(t.shape)
+
+    def _release_buffers(self, used: List[Tensor]) -> None:
+        with self._lock:
+            for buf in used:
+                self._buffers[(buf.numel(), buf.dtype)].append(buf)
+
+    def _snapshot(
+        self, obj: Any, memo: Dict[Tuple, Tensor], used: List[Tensor]
+    ) -> Any:
+        """Return a copy of `obj` whose tensors are in CPU buffers. Tensors
+        sharing the same data stay shared."""
+        if isinstance(obj, Tensor):
+            key = (obj.data_ptr(), obj.dtype, obj.shape, obj.stride())
+            if obj.numel() > 0 and key in memo:
+                return memo[key]
+            buf = self._get_buffer(obj, used)
+            buf.copy_(obj.detach(), non_blocking=self._pin_memory)
+            memo[key] = buf
+            return buf
+        if isinstance(obj, dict):
+            # copy.copy() keeps attributes like the _metadata of state dicts
+            ans = copy.copy(obj)
+            for k, v in obj.items():
+                ans[k] = self._snapshot(v, memo, used)
+            return ans
+        if isinstance(obj, list):
+            return [self._snapshot(v, memo, used) for v in obj]
+        if isinstance(obj, tuple):
+            values = [self._snapshot(v, memo, used) for v in obj]
+            if hasattr(obj, "_fields"):
+                # namedtuple
+                return obj.__class__(*values)
+            return obj.__class__(values)
+        return copy.deepcopy(obj)
+
+    def _pop_done(self) -> None:
+        """Remove finished jobs from the front of the queue, re-raising
+        their errors."""
+        while self._futures and self._futures[0][0].done():
+            self._wait_for_one()
+
+    def _wait_for_one(self) -> None:
+        future, is_save = self._futures.popleft()
+        if is_save:
+            self._num_pending_saves -= 1
+        future.result()
+
+    def save(
+        self,
+        filename: Union[str, Path],
+        checkpoint: Dict[str, Any],
+        save_model_copy: bool = False,
+    ) -> None:
+        """Snapshot `checkpoint` and write it to `filename` in the
+        background. See :func:`save_checkpoint` for `save_model_copy`."""
+        self._pop_done()
+        while self._num_pending_saves >= self.max_pending:
+            self._wait_for_one()
+
+        used: List[Tensor] = []
+        checkpoint = self._snapshot(checkpoint, memo=dict(), used=used)
+        event = None
+        if self._pin_memory:
+            # The copies are asynchronous. The background thread waits for
+            # them before writing.
+            event = torch.cuda.Event()
+            event.record()
+
+        def write():
+            try:
+                if event is not None:
+                    event.synchronize()
+                _write_checkpoint(checkpoint, Path(filename), save_model_copy)
+            finally:
+                self._release_buffers(used)
+
+        self._futures.append((self._executor.submit(write), True))
+        self._num_pending_saves += 1
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Run `fn(*args, **kwargs)` in the background thread after all
+        previously submitted jobs."""
+        self._pop_done()
+        future = self._executor.submit(fn, *args, **kwargs)
+        self._futures.append((future, False))
+        return future
+
+    def wait(self) -> None:
+        """Wait for all submitted jobs to finish."""
+        while self._futures:
+            self._wait_for_one()
+
+    def close(self) -> None:
+        """Wait for all submitted jobs and stop the background thread."""
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown()
+
 
 def save_checkpoint(
     filename: Path,
@@ -46,6 +335,8 @@ def save_checkpoint(
     scaler: Optional[GradScaler] = None,
     sampler: Optional[CutSampler] = None,
     rank: int = 0,
+    save_model_copy: bool = False,
+    writer: Optional[AsyncCheckpointWriter] = None,
 ) -> None:
     """Save training information to a file.
 
@@ -66,6 +357,15 @@ def save_checkpoint(
         The GradScaler to be saved. We only save its `state_dict()`.
       rank:
         Used in DDP. We save checkpoint only for the node whose rank is 0.
+      save_model_copy:
+        If True, also save `model.state_dict()` alone to the file given by
+        :func:`get_model_filename`, so that averaging checkpoints does
+        not need to load the optimizer state, etc. It takes the size of
+        the model on disk for each checkpoint, so enable it only for the
+        checkpoints that are averaged, e.g., those of each epoch.
+      writer:
+        If not None, the checkpoint is written in the background by it.
+        Otherwise, it is written before this function returns.
     Returns:
       Return None.
     """
@@ -93,7 +393,10 @@ def save_checkpoint(
             assert k not in checkpoint
             checkpoint[k] = v
 
-    torch.save(checkpoint, filename)
+    if writer is not None:
+        writer.save(filename, checkpoint, save_model_copy=save_model_copy)
+    else:
+        _write_checkpoint(checkpoint, Path(filename), save_model_copy)
 
 
 def load_checkpoint(
@@ -160,25 +463,22 @@ def average_checkpoints(
     Returns:
       Return a dict (i.e., state_dict) which is the average of all
       model state dicts contained in the checkpoints.
+
+    Each model is read with :func:`load_model_state_dict`, i.e., from the
+    model-only copy of the checkpoint if it exists. The next file is read
+    in a background thread while the current one is summed.
     """
     n = len(filenames)
 
-    avg = torch.load(filenames[0], map_location=device)["model"]
-
-    # Identify shared parameters. Two parameters are said to be shared
-    # if they have the same data_ptr
-    uniqued: Dict[int, str] = dict()
-
-    for k, v in avg.items():
-        v_data_ptr = v.data_ptr()
-        if v_data_ptr in uniqued:
+    avg = None
+    for state_dict in _iter_model_state_dicts(filenames, device):
+        if avg is None:
+            template = state_dict
+            owners = _get_owners(state_dict)
+            uniqued_names = [k for k, v in owners.items() if k == v]
+            # Clone the tensors since the state dict may be memory-mapped
+            avg = {k: state_dict[k].clone() for k in uniqued_names}
             continue
-        uniqued[v_data_ptr] = k
-
-    uniqued_names = list(uniqued.values())
-
-    for i in range(1, n):
-        state_dict = torch.load(filenames[i], map_location=device)["model"]
         for k in uniqued_names:
             avg[k] += state_dict[k]
 
@@ -188,7 +488,160 @@ def average_checkpoints(
         else:
             avg[k] //= n
 
-    return avg
+    return _make_state_dict(avg, owners, template)
+
+
+def _get_prefix_sum_filename(exp_dir: Path, epoch: int) -> Path:
+    return exp_dir / "prefix-sums" / f"epoch-{epoch}.pt"
+
+
+def _get_sources(exp_dir: Path, epoch: int) -> List[Tuple[str, int, int]]:
+    """Return (name, size, mtime_ns) of the epoch checkpoints up to `epoch`.
+    It is used to tell whether a saved prefix sum is still valid."""
+    ans = []
+    for e in range(epoch + 1):
+        filename = exp_dir / f"epoch-{e}.pt"
+        if filename.is_file():
+            stat = filename.stat()
+            ans.append((filename.name, stat.st_size, stat.st_mtime_ns))
+    return ans
+
+
+def _get_epoch_prefix_sum(
+    exp_dir: Path, epoch: int
+) -> Optional[Dict[str, Tensor]]:
+    """Return the sum of the model state dicts of all epoch checkpoints
+    `exp_dir/epoch-e.pt` with e <= epoch, or None if there is no such
+    checkpoint.
+
+    Floating point tensors are summed in float64 and the others in int64.
+    The sum for each epoch is saved to `exp_dir/prefix-sums/epoch-e.pt`,
+    together with the sizes and modification times of the checkpoints it
+    is computed from in `epoch-e.json`. It is reused as long as these
+    checkpoints are not changed. Only the checkpoints after the last valid
+    saved sum are loaded.
+    """
+    if len(_get_sources(exp_dir, epoch)) == 0:
+        return None
+
+    # Find the last valid saved sum
+    start = -1
+    prefix_sum = None
+    for e in range(epoch, -1, -1):
+        filename = _get_prefix_sum_filename(exp_dir, e)
+        sources_filename = filename.with_suffix(".json")
+        if not (filename.is_file() and sources_filename.is_file()):
+            continue
+        with open(sources_filename) as f:
+            saved_sources = json.load(f)
+        if saved_sources == [list(s) for s in _get_sources(exp_dir, e)]:
+            start = e
+            prefix_sum = torch.load(filename, map_location="cpu")
+            break
+
+    epochs = [
+        e
+        for e in range(start + 1, epoch + 1)
+        if (exp_dir / f"epoch-{e}.pt").is_file()
+    ]
+    filenames = [exp_dir / f"epoch-{e}.pt" for e in epochs]
+    if len(epochs) > 0:
+        logging.info(
+            f"Computing prefix sums of epochs {epochs[0]} to {epochs[-1]}"
+        )
+    for e, state_dict in zip(
+        epochs, _iter_model_state_dicts(filenames, torch.device("cpu"))
+    ):
+        if prefix_sum is None:
+            prefix_sum = {
+                k: torch.zeros_like(
+                    v,
+                    dtype=torch.float64
+                    if v.is_floating_point()
+                    else torch.int64,
+                )
+                for k, v in state_dict.items()
+            }
+        for k, v in _get_owners(state_dict).items():
+            if k == v:
+                prefix_sum[k] += state_dict[k]
+
+        filename = _get_prefix_sum_filename(exp_dir, e)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        # The sources are removed first and written last so that an
+        # interrupted save leaves no valid entry. Both files are written
+        # atomically since parallel decoding jobs may read and write them
+        # at the same time.
+        try:
+            os.remove(filename.with_suffix(".json"))
+        except FileNotFoundError:
+            pass
+        _atomic_save(prefix_sum, filename)
+        _atomic_save_json(
+            _get_sources(exp_dir, e), filename.with_suffix(".json")
+        )
+
+    return prefix_sum
+
+
+def average_epoch_checkpoints(
+    exp_dir: Union[str, Path],
+    epoch: int,
+    avg: int,
+    device: torch.device = torch.device("cpu"),
+) -> Dict[str, Tensor]:
+    """Average the models of `exp_dir/epoch-e.pt` for
+    e in [epoch - avg + 1, epoch].
+
+    It gives the same result as :func:`average_checkpoints` on these
+    files, but it computes the average as
+    (prefix[epoch] - prefix[epoch - avg]) / avg, where prefix[e] is the
+    sum of the models of all epochs up to e. The prefix sums are cached in
+    `exp_dir/prefix-sums`, so trying different `--epoch` and `--avg`
+    loads at most two files once the cache is built. You can delete
+    the cache directory at any time.
+
+    Args:
+      exp_dir:
+        The experiment directory containing the epoch checkpoints.
+      epoch:
+        The last epoch to average.
+      avg:
+        Number of epochs to average.
+      device:
+        Move the result to this device.
+    Returns:
+      Return the averaged state dict.
+    """
+    exp_dir = Path(exp_dir)
+    assert avg >= 1, avg
+    start = epoch - avg + 1
+    for e in range(start, epoch + 1):
+        filename = exp_dir / f"epoch-{e}.pt"
+        if not filename.is_file():
+            raise FileNotFoundError(f"{filename} does not exist")
+
+    # Use the model of the last epoch to get the dtypes and shared tensors
+    template = load_model_state_dict(exp_dir / f"epoch-{epoch}.pt")
+    owners = _get_owners(template)
+
+    end_sum = _get_epoch_prefix_sum(exp_dir, epoch)
+    start_sum = _get_epoch_prefix_sum(exp_dir, start - 1)
+
+    ans = dict()
+    for k in owners:
+        if owners[k] != k:
+            continue
+        v = end_sum[k]
+        if start_sum is not None:
+            v = v - start_sum[k]
+        if template[k].is_floating_point():
+            v = v / avg
+        else:
+            v = v // avg
+        ans[k] = v.to(device=device, dtype=template[k].dtype)
+
+    return _make_state_dict(ans, owners, template)
 
 
 def save_checkpoint_with_global_batch_idx(
@@ -202,6 +655,7 @@ def save_checkpoint_with_global_batch_idx(
     scaler: Optional[GradScaler] = None,
     sampler: Optional[CutSampler] = None,
     rank: int = 0,
+    writer: Optional[AsyncCheckpointWriter] = None,
 ):
     """Save training info after processing given number of batches.
 
@@ -233,6 +687,8 @@ def save_checkpoint_with_global_batch_idx(
       rank:
         The rank ID used in DDP training of the current node. Set it to 0
         if DDP is not used.
+      writer:
+        If not None, the checkpoint is written in the background by it.
     """
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -247,6 +703,7 @@ def save_checkpoint_with_global_batch_idx(
         scaler=scaler,
         sampler=sampler,
         rank=rank,
+        writer=writer,
     )
 
 
@@ -313,6 +770,7 @@ def remove_checkpoints(
     out_dir: Path,
     topk: int,
     rank: int = 0,
+    writer: Optional[AsyncCheckpointWriter] = None,
 ):
     """Remove checkpoints from the given directory.
 
@@ -329,10 +787,16 @@ def remove_checkpoints(
       rank:
         If using DDP for training, it is the rank of the current node.
         Use 0 if no DDP is used for training.
+      writer:
+        If not None, the checkpoints are removed in its background thread
+        after the pending writes have finished.
     """
     assert topk >= 1, topk
     if rank != 0:
         return
+    if writer is not None:
+        writer.submit(remove_checkpoints, out_dir=out_dir, topk=topk)
+        return
     checkpoints = find_checkpoints(out_dir)
 
     if len(checkpoints) == 0:
@@ -345,6 +809,9 @@ def remove_checkpoints(
     to_remove = checkpoints[topk:]
     for c in to_remove:
         os.remove(c)
+        model_filename = get_model_filename(c)
+        if model_filename.is_file():
+            os.remove(model_filename)
 
 
 def update_averaged_model(
@@ -0,0 +1,12 @@
+# Importing it registers the storage backend with lhotse
+from .memmap_features import (
+    MemmapShardsReader,
+    MemmapShardsWriter,
+    copy_features_to_memmap_shards,
+)
+
+__all__ = [
+    "MemmapShardsReader",
+    "MemmapShardsWriter",
+    "copy_features_to_memmap_shards",
+]
@@ -0,0 +1,236 @@
+# Copyright      2026                         (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A lhotse storage backend that saves features uncompressed in large
+shard files, which are read with `np.memmap`.
+
+Reading features from `ChunkedLilcomHdf5Writer` archives needs random
+HDF5 access and lilcom decompression for every cut, which uses up the CPU
+of the dataloader workers. With this backend, reading a cut is a slice
+of a memory mapped file followed by a cast to float32.
+
+Each array is appended to the current shard, ``shard-xxxxx.bin`` in the
+storage directory, starting at an offset that is a multiple of
+`alignment` bytes. A new shard is started when the current one exceeds
+`shard_size` bytes. The storage key of an array records its shard,
+offset, dtype and shape, so no index file is needed.
+
+Since the backend is registered with lhotse when this file is imported,
+`PrecomputedFeatures` and `Cut.load_features()` work as usual. Use
+:func:`copy_features_to_memmap_shards` to convert existing cuts.
+"""
+
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+from lhotse import CutSet, MonoCut
+from lhotse.features.io import (
+    FeaturesReader,
+    FeaturesWriter,
+    register_reader,
+    register_writer,
+)
+from lhotse.utils import fastcopy
+
+
+def _parse_key(key: str) -> Tuple[str, int, np.dtype, Tuple[int, ...]]:
+    """Parse a storage key "shard-xxxxx.bin:offset:dtype:d0xd1x..."."""
+    shard, offset, dtype, shape = key.split(":")
+    shape = tuple(int(i) for i in shape.split("x")) if shape else ()
+    return shard, int(offset), np.dtype(dtype), shape
+
+
+@lru_cache(maxsize=None)
+def _open_shard(filename: str) -> np.memmap:
+    # Cached per process. lhotse creates a new reader for each
+    # call to load the features, so the cache cannot be in the reader.
+    return np.memmap(filename, dtype=np.uint8, mode="r")
+
+
+@register_writer
+class MemmapShardsWriter(FeaturesWriter):
+    """Write arrays into shard files in the directory `storage_path`.
+    Existing shards in it are overwritten, so different writers should
+    use different directories.
+    """
+
+    name = "memmap_shards"
+
+    def __init__(
+        self,
+        storage_path: Union[str, Path],
+        shard_size: int = 2 ** 30,
+        dtype: str = "float16",
+        alignment: int = 4096,
+        *args,
+        **kwargs,
+    ):
+        """
+        Args:
+          storage_path:
+            The directory to save the shards.
+          shard_size:
+            A new shard is started once the current shard has at least
+            this number of bytes.
+          dtype:
+            The arrays are converted to this dtype before saving.
+            float16 halves the size of float32 fbank features, whose
+            values are in a range that float16 represents well.
+          alignment:
+            Each array starts at an offset that is a multiple of it.
+            The default aligns arrays to pages.
+        """
+        super().__init__()
+        self.storage_dir = Path(storage_path)
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+        self.dtype = np.dtype(dtype)
+        self.alignment = alignment
+
+        self.shard_idx = -1
+        self.offset = 0
+        self.f = None
+
+    @property
+    def storage_path(self) -> str:
+        return str(self.storage_dir)
+
+    def _next_shard(self) -> None:
+        self.close()
+        self.shard_idx += 1
+        self.offset = 0
+        self.f = open(self._shard_name(self.shard_idx, full=True), "wb")
+
+    def _shard_name(self, idx: int, full: bool = False) -> str:
+        name = f"shard-{idx:05d}.bin"
+        return str(self.storage_dir / name) if full else name
+
+    def write(self, key: str, value: np.ndarray) -> str:
+        if self.f is None or self.offset >= self.shard_size:
+            self._next_shard()
+
+        padding = -self.offset % self.alignment
+        if padding:
+            self.f.write(b"\0" * padding)
+            self.offset += padding
+
+        data = np.ascontiguousarray(value, dtype=self.dtype)
+        self.f.write(data.tobytes())
+
+        shape = "x".join(str(i) for i in data.shape)
+        storage_key = (
+            f"{self._shard_name(self.shard_idx)}:{self.offset}:"
+            f"{self.dtype.name}:{shape}"
+        )
+        self.offset += data.nbytes
+        return storage_key
+
+    def close(self) -> None:
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+
+@register_reader
+class MemmapShardsReader(FeaturesReader):
+    """Read arrays written by :class:`MemmapShardsWriter`.
+    Arrays are returned as float32.
+    """
+
+    name = "memmap_shards"
+
+    def __init__(self, storage_path: Union[str, Path], *args, **kwargs):
+        super().__init__()
+        self.storage_dir = Path(storage_path)
+
+    def read(
+        self,
+        key: str,
+        left_offset_frames: int = 0,
+        right_offset_frames: Optional[int] = None,
+    ) -> np.ndarray:
+        shard, offset, dtype, shape = _parse_key(key)
+        buf = _open_shard(str(self.storage_dir / shard))
+        arr = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        # Only the selected frames are read from the file
+        return arr[left_offset_frames:right_offset_frames].astype(np.float32)
+
+
+def copy_features_to_memmap_shards(
+    cuts: CutSet,
+    storage_path: Union[str, Path],
+    shard_size: int = 2 ** 30,
+    dtype: str = "float16",
+) -> CutSet:
+    """Copy the precomputed features of the given cuts to memmap shards.
+
+    The features are written in order of duration, so the cuts that a
+    bucketing sampler puts into the same bucket are stored next to each
+    other. Features shared by several cuts are copied only once.
+
+    Args:
+      cuts:
+        The cuts with precomputed features. Only MonoCut is supported.
+      storage_path:
+        The directory to save the shards.
+      shard_size:
+        See :class:`MemmapShardsWriter`.
+      dtype:
+        See :class:`MemmapShardsWriter`.
+    Returns:
+      Return the cuts, in the same order, with the features pointing
+      to the shards.
+    """
+    # Map (storage_type, storage_path, storage_key) to the new storage key
+    copied: Dict[Tuple[str, str, str], str] = {}
+    new_cuts: Dict[str, MonoCut] = {}
+    with MemmapShardsWriter(
+        storage_path, shard_size=shard_size, dtype=dtype
+    ) as writer:
+        for i, cut in enumerate(sorted(cuts, key=lambda c: c.duration)):
+            if not isinstance(cut, MonoCut) or not cut.has_features:
+                raise ValueError(
+                    f"Expect a MonoCut with features. Given: {cut}"
+                )
+            features = cut.features
+            src = (
+                features.storage_type,
+                features.storage_path,
+                features.storage_key,
+            )
+            if src not in copied:
+                copied[src] = writer.write(cut.id, features.load())
+
+            new_cuts[cut.id] = fastcopy(
+                cut,
+                features=fastcopy(
+                    features,
+                    storage_type=writer.name,
+                    storage_path=writer.storage_path,
+                    storage_key=copied[src],
+                ),
+            )
+            if i % 10000 == 0:
+                logging.info(f"Processed {i} cuts")
+
+    return CutSet.from_cuts(new_cuts[cut.id] for cut in cuts)
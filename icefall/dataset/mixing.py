@@ -0,0 +1,195 @@
+# Copyright      2026                         (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Mix batches from several datasets in a single DataLoader.
+
+Training on several datasets, e.g., LibriSpeech and GigaSpeech, used to
+create one DataLoader per dataset and to pick one of them for each
+batch. Every DataLoader has its own pool of workers, most of which are
+idle. Instead, :class:`WeightedMixingSampler` picks the source of each
+batch and :class:`SourceTaggedDataset` tells the training loop which
+source a batch comes from, so that one DataLoader, with one pool of
+workers, serves all datasets.
+
+Usage::
+
+    sampler = WeightedMixingSampler(
+        samplers={
+            "libri": BucketingSampler(libri_cuts, ...),
+            "giga": DynamicBucketingSampler(giga_cuts, ...),
+        },
+        weights={"libri": 0.5, "giga": 0.5},
+    )
+    dataset = SourceTaggedDataset(K2SpeechRecognitionDataset(...))
+    dl = DataLoader(dataset, sampler=sampler, batch_size=None)
+
+    for batch in dl:
+        is_libri = batch["source"] == "libri"
+"""
+
+import copy
+import logging
+import random
+from typing import Any, Dict, Iterator, Tuple, Union
+
+import torch
+from lhotse import CutSet
+from lhotse.dataset.sampling.base import CutSampler
+
+
+class WeightedMixingSampler(torch.utils.data.Sampler):
+    """Interleave the batches of several samplers.
+
+    For each batch, a source is chosen randomly according to its weight,
+    and the next batch of the sampler of that source is yielded together
+    with the name of the source, i.e., it yields tuples
+    ``(name, cuts)``. Use it together with :class:`SourceTaggedDataset`.
+
+    An epoch ends as soon as the chosen source has no batches left.
+    Use ``CutSet.repeat()`` for the sources that should never end.
+
+    The choices are reproducible: they depend only on `seed` and the
+    epoch. The state of the sampler, including the states of all
+    underlying samplers, can be saved with :meth:`state_dict` and
+    restored with :meth:`load_state_dict` to resume training within
+    an epoch.
+    """
+
+    def __init__(
+        self,
+        samplers: Dict[str, CutSampler],
+        weights: Dict[str, float],
+        seed: int = 0,
+    ):
+        """
+        Args:
+          samplers:
+            A dict mapping the name of a source to its sampler.
+          weights:
+            A dict mapping the name of a source to its weight. They are
+            normalized to sum to 1. Every source must have a weight.
+          seed:
+            The seed for choosing the sources. It should be the same
+            for all nodes in DDP training so that they pick the same
+            source for each batch.
+        """
+        assert len(samplers) > 0
+        assert set(samplers.keys()) == set(weights.keys()), (
+            list(samplers.keys()),
+            list(weights.keys()),
+        )
+        assert all(w >= 0 for w in weights.values()), weights
+        assert sum(weights.values()) > 0, weights
+
+        self.samplers = samplers
+        self.names = list(samplers.keys())
+        self.weights = [weights[n] for n in self.names]
+        self.seed = seed
+        self.epoch = 0
+
+        # Number of batches yielded from each source in this epoch
+        self.num_batches = {n: 0 for n in self.names}
+
+        self._rng = random.Random(self.seed)
+        self._just_restored_state = False
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set the epoch for this sampler and all underlying samplers.
+        If it is different from the epoch of a restored state, the
+        restored state is discarded."""
+        if self.epoch != epoch:
+            self._just_restored_state = False
+        self.epoch = epoch
+        for s in self.samplers.values():
+            s.set_epoch(epoch)
+
+    def state_dict(self) -> Dict[str, Any]:
+        """Return the current state of the sampler."""
+        return {
+            "epoch": self.epoch,
+            "seed": self.seed,
+            "names": self.names,
+            "weights": self.weights,
+            "num_batches": dict(self.num_batches),
+            "rng_state": self._rng.getstate(),
+            "samplers": {
+                n: s.state_dict() for n, s in self.samplers.items()
+            },
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        """Restore the state of the sampler from a state dict returned
+        by :meth:`state_dict`. The next iteration continues from where
+        it was saved."""
+        assert sorted(state_dict["names"]) == sorted(self.names), (
+            state_dict["names"],
+            self.names,
+        )
+        weights = dict(zip(state_dict["names"], state_dict["weights"]))
+        if [weights[n] for n in self.names] != self.weights:
+            logging.warning(
+                f"Mixing weights changed from {weights} to "
+                f"{dict(zip(self.names, self.weights))}"
+            )
+        self.epoch = state_dict["epoch"]
+        self.seed = state_dict["seed"]
+        self.num_batches = dict(state_dict["num_batches"])
+        self._rng.setstate(state_dict["rng_state"])
+        for n, s in self.samplers.items():
+            # load_state_dict() of lhotse samplers consumes its argument
+            s.load_state_dict(copy.deepcopy(state_dict["samplers"][n]))
+        self._just_restored_state = True
+
+    def __iter__(self) -> Iterator[Tuple[str, CutSet]]:
+        if self._just_restored_state:
+            self._just_restored_state = False
+        else:
+            self._rng = random.Random(self.seed + self.epoch)
+            self.num_batches = {n: 0 for n in self.names}
+
+        iters = {n: iter(s) for n, s in self.samplers.items()}
+        while True:
+            name = self._rng.choices(self.names, weights=self.weights)[0]
+            try:
+                cuts = next(iters[name])
+            except StopIteration:
+                logging.info(f"{name} reaches end of its sampler")
+                return
+            self.num_batches[name] += 1
+            yield name, cuts
+
+
+class SourceTaggedDataset(torch.utils.data.Dataset):
+    """Wrap a dataset so that it accepts the items yielded by
+    :class:`WeightedMixingSampler`, i.e., tuples ``(name, cuts)``.
+    The name of the source is saved in ``batch["source"]``.
+
+    It also accepts a CutSet, in which case ``batch["source"]`` is not
+    set, e.g., when the batches are from an underlying sampler.
+    """
+
+    def __init__(self, dataset: torch.utils.data.Dataset):
+        self.dataset = dataset
+
+    def __getitem__(self, item: Union[CutSet, Tuple[str, CutSet]]) -> dict:
+        if isinstance(item, CutSet):
+            return self.dataset[item]
+
+        name, cuts = item
+        batch = self.dataset[cuts]
+        batch["source"] = name
+        return batch
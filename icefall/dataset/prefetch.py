@@ -0,0 +1,185 @@
+# Copyright      2026                      (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Prefetch the batches of a DataLoader to the device in the background.
+
+Without it, the training loop waits for the dataloader to deliver the
+next batch and then for the host-to-device copy of its tensors before
+the forward pass can start. :class:`DevicePrefetcher` takes the batches
+from the DataLoader in a background thread and copies their tensors with
+a separate CUDA stream, so that both overlap with the current step. The
+copies are asynchronous only if the DataLoader uses `pin_memory=True`.
+
+It also measures how long the training loop waits for data:
+
+  - `epoch_start_latency`, the seconds until the first batch of the
+    epoch is available. It includes forking the dataloader workers,
+    unless they are persistent.
+  - `data_wait_time`, the total seconds the training loop waited for
+    the other batches. If it is a significant part of the training time,
+    the dataloader is the bottleneck.
+"""
+
+import queue
+import threading
+import time
+from typing import Any, Iterable, Iterator, Optional
+
+import torch
+
+
+def move_to_device(obj: Any, device: torch.device) -> Any:
+    """Move the tensors in `obj`, which may be nested in dicts, lists and
+    tuples, to `device`. Other objects are returned unchanged."""
+    if isinstance(obj, torch.Tensor):
+        return obj.to(device, non_blocking=True)
+    elif isinstance(obj, dict):
+        return {k: move_to_device(v, device) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(move_to_device(v, device) for v in obj)
+    return obj
+
+
+def _record_stream(obj: Any, stream: torch.cuda.Stream) -> None:
+    """Tell the caching allocator that the CUDA tensors in `obj`, which
+    were allocated on another stream, are used on `stream`."""
+    if isinstance(obj, torch.Tensor):
+        if obj.is_cuda:
+            obj.record_stream(stream)
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            _record_stream(v, stream)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            _record_stream(v, stream)
+
+
+class _End:
+    pass
+
+
+class _Error:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+class DevicePrefetcher:
+    def __init__(
+        self,
+        dataloader: Iterable,
+        device: Optional[torch.device] = None,
+        num_prefetch: int = 2,
+    ):
+        """
+        Args:
+          dataloader:
+            The DataLoader to take the batches from.
+          device:
+            The device to move the tensors of the batches to. If None,
+            the batches are only prefetched.
+          num_prefetch:
+            The maximum number of batches prefetched.
+        """
+        self.dataloader = dataloader
+        self.device = torch.device(device) if device is not None else None
+        self.num_prefetch = num_prefetch
+
+        self.epoch_start_latency = 0.0
+        self.data_wait_time = 0.0
+        self.num_batches = 0
+
+    def __len__(self) -> int:
+        return len(self.dataloader)
+
+    def _prefetch(
+        self,
+        iterator: Iterator,
+        q: queue.Queue,
+        stop: threading.Event,
+    ) -> None:
+        """The body of the background thread."""
+        stream = None
+        if self.device is not None and self.device.type == "cuda":
+            stream = torch.cuda.Stream(self.device)
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for batch in iterator:
+                event = None
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        batch = move_to_device(batch, self.device)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                elif self.device is not None:
+                    batch = move_to_device(batch, self.device)
+                if not put((batch, event)):
+                    return
+            put(_End())
+        except BaseException as e:
+            put(_Error(e))
+
+    def __iter__(self) -> Iterator:
+        self.epoch_start_latency = 0.0
+        self.data_wait_time = 0.0
+        self.num_batches = 0
+
+        start = time.perf_counter()
+        # Create the iterator in this thread, so that the dataloader
+        # workers are started from it
+        iterator = iter(self.dataloader)
+
+        q = queue.Queue(maxsize=self.num_prefetch)
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._prefetch, args=(iterator, q, stop), daemon=True
+        )
+        thread.start()
+
+        try:
+            while True:
+                wait_start = time.perf_counter()
+                item = q.get()
+                now = time.perf_counter()
+                if isinstance(item, _End):
+                    break
+                if isinstance(item, _Error):
+                    raise item.exception
+
+                if self.num_batches == 0:
+                    self.epoch_start_latency = now - start
+                else:
+                    self.data_wait_time += now - wait_start
+                self.num_batches += 1
+
+                batch, event = item
+                if event is not None:
+                    current_stream = torch.cuda.current_stream(self.device)
+                    current_stream.wait_event(event)
+                    _record_stream(batch, current_stream)
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
@@ -0,0 +1,334 @@
+# Copyright      2026                         (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Pre-tokenized supervisions.
+
+Encoding the transcripts of a batch with SentencePiece in the main
+training process costs time on every batch of every epoch, though
+the transcripts never change. This file provides:
+
+  - :class:`TokenIdTable`, which maps a transcript to its token IDs.
+    It is computed once during data preparation
+    (see ``egs/librispeech/ASR/local/compute_token_ids.py``) and saved
+    next to ``bpe.model``.
+
+  - :class:`TokenizedDataset`, which wraps a lhotse dataset and adds
+    the collated token IDs of each batch to
+    ``batch["supervisions"]["token_ids"]``. It runs inside the
+    dataloader workers.
+
+  - :func:`get_token_ids`, which converts the collated token IDs of a
+    batch into a :class:`k2.RaggedTensor` in the main process without
+    touching the individual transcripts.
+
+The table is keyed by the transcript instead of the cut ID, so it stays
+valid for transformed cuts, e.g., speed perturbed, concatenated or
+mixed cuts.
+"""
+
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import k2
+import numpy as np
+import torch
+from lhotse import CutSet
+
+
+def bpe_model_checksum(bpe_model: Union[str, Path]) -> str:
+    """Return the MD5 checksum of the given BPE model. It is saved
+    in the token ID table so that a stale table is detected when the
+    BPE model is re-trained."""
+    with open(bpe_model, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+class TokenIdTable:
+    """A table mapping transcripts to their token IDs.
+
+    It is stored in a ragged layout, i.e., the token IDs of the i-th
+    transcript are ``values[row_splits[i]:row_splits[i+1]]``.
+    """
+
+    def __init__(
+        self,
+        texts: List[str],
+        row_splits: np.ndarray,
+        values: np.ndarray,
+        checksum: str = "",
+    ):
+        """
+        Args:
+          texts:
+            The transcripts.
+          row_splits:
+            A 1-D array of shape (len(texts) + 1,).
+          values:
+            A 1-D int32 array containing the token IDs of all transcripts.
+          checksum:
+            Checksum of the BPE model used to compute the token IDs.
+            See :func:`bpe_model_checksum`.
+        """
+        assert len(row_splits) == len(texts) + 1, (
+            len(row_splits),
+            len(texts),
+        )
+        assert row_splits[-1] == len(values), (row_splits[-1], len(values))
+        self.texts = texts
+        self.row_splits = row_splits
+        self.values = values
+        self.checksum = checksum
+
+        self._index = {t: i for i, t in enumerate(texts)}
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __contains__(self, text: str) -> bool:
+        return text in self._index
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Return the token IDs of the given transcript, or None if it
+        is not in the table."""
+        i = self._index.get(text)
+        if i is None:
+            return None
+        start, end = self.row_splits[i], self.row_splits[i + 1]
+        return self.values[start:end]
+
+    @classmethod
+    def build(
+        cls,
+        texts: Iterable[str],
+        sp: "spm.SentencePieceProcessor",  # noqa: F821
+        checksum: str = "",
+        batch_size: int = 10000,
+    ) -> "TokenIdTable":
+        """Tokenize the given transcripts. Duplicates are encoded only once.
+
+        Args:
+          texts:
+            The transcripts to tokenize.
+          sp:
+            The BPE model.
+          checksum:
+            Checksum of the BPE model.
+          batch_size:
+            Number of transcripts passed to `sp.encode()` at a time.
+        """
+        texts = list(dict.fromkeys(texts))
+        token_ids = []
+        for i in range(0, len(texts), batch_size):
+            batch = texts[i : i + batch_size]  # noqa: E203
+            token_ids += sp.encode(batch, out_type=int)
+        row_splits = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in token_ids], out=row_splits[1:])
+        values = np.fromiter(
+            (i for t in token_ids for i in t),
+            dtype=np.int32,
+            count=int(row_splits[-1]),
+        )
+        return cls(texts, row_splits, values, checksum=checksum)
+
+    def save(self, filename: Union[str, Path]) -> None:
+        """Save the table to a .npz file."""
+        encoded = [t.encode("utf-8") for t in self.texts]
+        text_splits = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in encoded], out=text_splits[1:])
+        np.savez(
+            filename,
+            text_bytes=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            text_splits=text_splits,
+            row_splits=self.row_splits,
+            values=self.values,
+            checksum=np.array(self.checksum),
+        )
+
+    @classmethod
+    def load(cls, filename: Union[str, Path]) -> "TokenIdTable":
+        """Load a table saved by :meth:`save`."""
+        with np.load(filename) as f:
+            text_bytes = f["text_bytes"].tobytes()
+            text_splits = f["text_splits"].tolist()
+            texts = [
+                text_bytes[b:e].decode("utf-8")
+                for b, e in zip(text_splits[:-1], text_splits[1:])
+            ]
+            return cls(
+                texts,
+                row_splits=f["row_splits"],
+                values=f["values"],
+                checksum=str(f["checksum"]),
+            )
+
+
+def compute_token_id_table(
+    cuts: Iterable[CutSet],
+    bpe_model: Union[str, Path],
+) -> TokenIdTable:
+    """Tokenize the transcripts of all supervisions in the given cuts.
+
+    Args:
+      cuts:
+        A list of CutSet's.
+      bpe_model:
+        Path to the BPE model.
+    """
+    import sentencepiece as spm
+
+    sp = spm.SentencePieceProcessor()
+    sp.load(str(bpe_model))
+
+    def texts():
+        for cut_set in cuts:
+            for cut in cut_set:
+                for s in cut.supervisions:
+                    yield s.text
+
+    return TokenIdTable.build(
+        texts(), sp=sp, checksum=bpe_model_checksum(bpe_model)
+    )
+
+
+class TokenizedDataset(torch.utils.data.Dataset):
+    """Wrap a dataset returning batches in the format of
+    `lhotse.dataset.K2SpeechRecognitionDataset`, adding
+    ``batch["supervisions"]["token_ids"]`` to each batch.
+
+    It is a dict with the following tensors of dtype torch.int32,
+    which represent the token IDs of ``batch["supervisions"]["text"]``
+    in a ragged layout:
+
+      - ``row_splits``, of shape (num_supervisions + 1,)
+      - ``values``, of shape (row_splits[-1],)
+
+    Use :func:`get_token_ids` to convert them into a k2.RaggedTensor.
+
+    Transcripts that are not in the table are encoded with the BPE
+    model within the dataloader worker and memorized, so each of them
+    is encoded at most once per worker.
+    """
+
+    def __init__(
+        self,
+        dataset: torch.utils.data.Dataset,
+        bpe_model: Union[str, Path],
+        token_ids: Optional[Union[str, Path]] = None,
+    ):
+        """
+        Args:
+          dataset:
+            The dataset to wrap.
+          bpe_model:
+            Path to the BPE model.
+          token_ids:
+            If not None, it is the table saved by
+            ``local/compute_token_ids.py``. It is ignored, with a warning,
+            if it was computed with a different BPE model.
+        """
+        self.dataset = dataset
+        self.bpe_model = str(bpe_model)
+        self.table = None
+        if token_ids is not None:
+            table = TokenIdTable.load(token_ids)
+            if table.checksum != bpe_model_checksum(bpe_model):
+                logging.warning(
+                    f"{token_ids} was not computed with {bpe_model}. "
+                    "Ignore it."
+                )
+            else:
+                logging.info(
+                    f"Loaded {len(table)} transcripts from {token_ids}"
+                )
+                self.table = table
+
+        # Token IDs of transcripts that are not in the table
+        self._cache: Dict[str, List[int]] = {}
+        # Loaded lazily in the worker process
+        self._sp = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_sp"] = None
+        return state
+
+    def _encode(self, texts: List[str]) -> List[List[int]]:
+        if self._sp is None:
+            import sentencepiece as spm
+
+            self._sp = spm.SentencePieceProcessor()
+            self._sp.load(self.bpe_model)
+        return self._sp.encode(texts, out_type=int)
+
+    def tokenize(self, texts: List[str]) -> Dict[str, torch.Tensor]:
+        """Return the collated token IDs of the given transcripts."""
+        token_ids = [None] * len(texts)
+        missing = []
+        for i, text in enumerate(texts):
+            ids = self.table.get(text) if self.table is not None else None
+            if ids is None:
+                ids = self._cache.get(text)
+            if ids is None:
+                missing.append(i)
+            token_ids[i] = ids
+
+        if missing:
+            encoded = self._encode([texts[i] for i in missing])
+            for i, ids in zip(missing, encoded):
+                self._cache[texts[i]] = ids
+                token_ids[i] = ids
+
+        row_splits = np.zeros(len(texts) + 1, dtype=np.int32)
+        np.cumsum([len(ids) for ids in token_ids], out=row_splits[1:])
+        values = np.zeros(row_splits[-1], dtype=np.int32)
+        for i, ids in enumerate(token_ids):
+            values[row_splits[i] : row_splits[i + 1]] = ids  # noqa: E203
+        return {
+            "row_splits": torch.from_numpy(row_splits),
+            "values": torch.from_numpy(values),
+        }
+
+    def __getitem__(self, cuts: CutSet) -> dict:
+        batch = self.dataset[cuts]
+        supervisions = batch["supervisions"]
+        supervisions["token_ids"] = self.tokenize(supervisions["text"])
+        return batch
+
+
+def get_token_ids(
+    supervisions: dict,
+    device: Union[str, torch.device] = "cpu",
+) -> k2.RaggedTensor:
+    """Return the token IDs added by :class:`TokenizedDataset`.
+
+    Args:
+      supervisions:
+        It is ``batch["supervisions"]``.
+      device:
+        The device of the returned tensor.
+    Returns:
+      Return a ragged tensor with 2 axes [utt][token_id].
+    """
+    token_ids = supervisions["token_ids"]
+    row_splits = token_ids["row_splits"].to(device)
+    values = token_ids["values"].to(device)
+    shape = k2.ragged.create_ragged_shape2(
+        row_splits=row_splits, cached_tot_size=values.numel()
+    )
+    return k2.RaggedTensor(shape, values)
@@ -14,41 +14,96 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import itertools
 import logging
-from typing import Dict, List, Optional, Union
+import weakref
+from collections import deque
+from typing import Dict, List, Optional, Tuple, Union
 
 import k2
 import torch
 
+from icefall import attention_rescoring
 from icefall.utils import get_texts
 
 
+def _get_num_arcs(fsas: k2.Fsa) -> torch.Tensor:
+    """Return a 1-D tensor containing the number of arcs of each FSA
+    in an FsaVec."""
+    arc_splits = fsas.arcs.row_splits(2)[fsas.arcs.row_splits(1).long()]
+    return arc_splits[1:] - arc_splits[:-1]
+
+
+def _split_by_cost(
+    costs: List[float], max_cost: float
+) -> List[Tuple[int, int]]:
+    """Split a sequence into consecutive chunks whose total cost does not
+    exceed `max_cost`. A single item with a larger cost forms a chunk
+    of its own.
+
+    Returns:
+      Return a list of [start, end) pairs.
+    """
+    ans = []
+    start = 0
+    tot = 0
+    for i, c in enumerate(costs):
+        if tot + c > max_cost and i > start:
+            ans.append((start, i))
+            start = i
+            tot = 0
+        tot += c
+    ans.append((start, len(costs)))
+    return ans
+
+
 def _intersect_device(
     a_fsas: k2.Fsa,
     b_fsas: k2.Fsa,
     b_to_a_map: torch.Tensor,
     sorted_match_a: bool,
     batch_size: int = 50,
+    max_arcs: Optional[int] = None,
 ) -> k2.Fsa:
     """This is a wrapper of k2.intersect_device and its purpose is to split
     b_fsas into several batches and process each batch separately to avoid
     CUDA OOM error.
 
-    The arguments and return value of this function are the same as
+    If `max_arcs` is None, each batch contains `batch_size` FSAs.
+    Otherwise, the batches are chosen such that the FSAs in `a_fsas` that
+    a batch is intersected with contain at most `max_arcs` arcs in total,
+    counting an FSA in `a_fsas` once for each FSA in `b_fsas` mapped to it.
+
+    The other arguments and return value of this function are the same as
     :func:`k2.intersect_device`.
     """
     num_fsas = b_fsas.shape[0]
-    if num_fsas <= batch_size:
-        return k2.intersect_device(
-            a_fsas, b_fsas, b_to_a_map=b_to_a_map, sorted_match_a=sorted_match_a
-        )
+    if max_arcs is None:
+        if num_fsas <= batch_size:
+            return k2.intersect_device(
+                a_fsas,
+                b_fsas,
+                b_to_a_map=b_to_a_map,
+                sorted_match_a=sorted_match_a,
+            )
 
-    num_batches = (num_fsas + batch_size - 1) // batch_size
-    splits = []
-    for i in range(num_batches):
-        start = i * batch_size
-        end = min(start + batch_size, num_fsas)
-        splits.append((start, end))
+        num_batches = (num_fsas + batch_size - 1) // batch_size
+        splits = []
+        for i in range(num_batches):
+            start = i * batch_size
+            end = min(start + batch_size, num_fsas)
+            splits.append((start, end))
+    else:
+        a_num_arcs = _get_num_arcs(a_fsas)
+        costs = a_num_arcs[b_to_a_map.long()].tolist()
+        splits = _split_by_cost(costs, max_arcs)
+        if len(splits) == 1:
+            return k2.intersect_device(
+                a_fsas,
+                b_fsas,
+                b_to_a_map=b_to_a_map,
+                sorted_match_a=sorted_match_a,
+            )
 
     ans = []
     for start, end in splits:
@@ -182,6 +237,7 @@ class Nbest(object):
         num_paths: int,
         use_double_scores: bool = True,
         nbest_scale: float = 0.5,
+        max_arcs: Optional[int] = None,
     ) -> "Nbest":
         """Construct an Nbest object by **sampling** `num_paths` from a lattice.
 
@@ -203,9 +259,35 @@ class Nbest(object):
             Scale `lattice.score` before passing it to :func:`k2.random_paths`.
             A smaller value leads to more unique paths at the risk of being not
             to sample the path with the best score.
+          max_arcs:
+            If not None, the utterances are split into chunks that are
+            sampled separately. For each chunk, the number of arcs of the
+            lattices plus `num_paths` times their number of states, which
+            bounds the number of arcs of the sampled paths, does not exceed
+            `max_arcs`.
         Returns:
           Return an Nbest instance.
         """
+        if max_arcs is not None and lattice.shape[0] > 1:
+            state_splits = lattice.arcs.row_splits(1)
+            num_states = state_splits[1:] - state_splits[:-1]
+            costs = _get_num_arcs(lattice) + num_paths * num_states
+            splits = _split_by_cost(costs.tolist(), max_arcs)
+            if len(splits) > 1:
+                nbests = []
+                for start, end in splits:
+                    indexes = torch.arange(
+                        start, end, dtype=torch.int32, device=lattice.device
+                    )
+                    nbest = Nbest.from_lattice(
+                        lattice=k2.index_fsa(lattice, indexes),
+                        num_paths=num_paths,
+                        use_double_scores=use_double_scores,
+                        nbest_scale=nbest_scale,
+                    )
+                    nbests.append(nbest)
+                return Nbest.cat(nbests)
+
         saved_scores = lattice.scores.clone()
         lattice.scores *= nbest_scale
         # path is a ragged tensor with dtype torch.int32.
@@ -273,7 +355,37 @@ class Nbest(object):
         # `fsa` has only one extra attribute: aux_labels.
         return Nbest(fsa=fsa, shape=utt_to_path_shape)
 
-    def intersect(self, lattice: k2.Fsa, use_double_scores=True) -> "Nbest":
+    @staticmethod
+    def cat(nbests: List["Nbest"]) -> "Nbest":
+        """Concatenate a list of Nbest objects along the utterance axis.
+
+        Args:
+          nbests:
+            A list of Nbest objects. Their `fsa` must have the same
+            attributes.
+        Returns:
+          Return a new Nbest containing the utterances of all the given
+          Nbest objects in order.
+        """
+        fsa = k2.cat([nbest.fsa for nbest in nbests])
+
+        row_splits = [nbests[0].shape.row_splits(1)]
+        for nbest in nbests[1:]:
+            offset = row_splits[-1][-1]
+            row_splits.append(nbest.shape.row_splits(1)[1:] + offset)
+
+        shape = k2.ragged.create_ragged_shape2(
+            row_splits=torch.cat(row_splits),
+            cached_tot_size=fsa.shape[0],
+        )
+        return Nbest(fsa=fsa, shape=shape)
+
+    def intersect(
+        self,
+        lattice: k2.Fsa,
+        use_double_scores=True,
+        max_arcs: Optional[int] = None,
+    ) -> "Nbest":
         """Intersect this Nbest object with a lattice, get 1-best
         path from the resulting FsaVec, and return a new Nbest object.
 
@@ -287,6 +399,11 @@ class Nbest(object):
           use_double_scores:
             True to use double precision when computing shortest path.
             False to use single precision.
+          max_arcs:
+            If not None, the paths are intersected with the lattice in
+            batches. In each batch, the lattices the paths are intersected
+            with contain at most `max_arcs` arcs in total, counting a lattice
+            once for each of its paths. See :func:`_intersect_device`.
         Returns:
           Return a new Nbest. This new Nbest shares the same shape with `self`,
           while its `fsa` is the 1-best path from intersecting `self.fsa` and
@@ -328,6 +445,7 @@ class Nbest(object):
                 word_fsa_with_epsilon_loops,
                 b_to_a_map=torch.zeros_like(path_to_utt_map),
                 sorted_match_a=True,
+                max_arcs=max_arcs,
             )
         else:
             path_lattice = _intersect_device(
@@ -335,6 +453,7 @@ class Nbest(object):
                 word_fsa_with_epsilon_loops,
                 b_to_a_map=path_to_utt_map,
                 sorted_match_a=True,
+                max_arcs=max_arcs,
             )
 
         # path_lattice has word IDs as labels and token IDs as aux_labels
@@ -595,6 +714,7 @@ def rescore_with_n_best_list(
     lm_scale_list: List[float],
     nbest_scale: float = 1.0,
     use_double_scores: bool = True,
+    max_arcs: int = 10000000,
 ) -> Dict[str, k2.Fsa]:
     """Rescore an n-best list with an n-gram LM.
     The path with the maximum score is used as the decoding output.
@@ -616,6 +736,10 @@ def rescore_with_n_best_list(
       use_double_scores:
         True to use double precision during computation. False to use
         single precision.
+      max_arcs:
+        It bounds the memory used to sample the paths and to intersect them
+        with the lattice by splitting the batch. All `num_paths` paths are
+        kept. See :meth:`Nbest.from_lattice` and :meth:`Nbest.intersect`.
     Returns:
       A dict of FsaVec, whose key is an lm_scale and the value is the
       best decoding path for each utterance in the lattice.
@@ -630,36 +754,15 @@ def rescore_with_n_best_list(
     assert G.device == device
     assert hasattr(G, "aux_labels") is False
 
-    max_loop_count = 10
-    loop_count = 0
-    while loop_count <= max_loop_count:
-        try:
-            nbest = Nbest.from_lattice(
-                lattice=lattice,
-                num_paths=num_paths,
-                use_double_scores=use_double_scores,
-                nbest_scale=nbest_scale,
-            )
-            # nbest.fsa.scores are all 0s at this point
-            nbest = nbest.intersect(lattice)
-            break
-        except RuntimeError as e:
-            logging.info(f"Caught exception:\n{e}\n")
-            logging.info(f"num_paths before decreasing: {num_paths}")
-            num_paths = int(num_paths / 2)
-            if loop_count >= max_loop_count or num_paths <= 0:
-                logging.info(
-                    "Return None as the resulting lattice is too large."
-                )
-                return None
-            logging.info(
-                "This OOM is not an error. You can ignore it. "
-                "If your model does not converge well, or --max-duration "
-                "is too large, or the input sound file is difficult to "
-                "decode, you will meet this exception."
-            )
-            logging.info(f"num_paths after decreasing: {num_paths}")
-        loop_count += 1
+    nbest = Nbest.from_lattice(
+        lattice=lattice,
+        num_paths=num_paths,
+        use_double_scores=use_double_scores,
+        nbest_scale=nbest_scale,
+        max_arcs=max_arcs,
+    )
+    # nbest.fsa.scores are all 0s at this point
+    nbest = nbest.intersect(lattice, max_arcs=max_arcs)
 
     # Now nbest.fsa has its scores set
     assert hasattr(nbest.fsa, "lm_scores")
@@ -670,22 +773,351 @@ def rescore_with_n_best_list(
     # Now nbest contains only lm scores
     lm_scores = nbest.tot_scores()
 
+    return sweep_scales(
+        nbest,
+        scores={"am": am_scores.values, "lm": lm_scores.values},
+        # am_scores / lm_scale + lm_scores has the same best path
+        # as am_scores + lm_scale * lm_scores
+        scale_lists={"lm": lm_scale_list},
+    )
+
+
+def _get_best_path_indexes(
+    row_splits: torch.Tensor, scores: torch.Tensor, scales: torch.Tensor
+) -> torch.Tensor:
+    """Select the path with the highest weighted score of each utterance
+    for all combinations of scales at once.
+
+    Args:
+      row_splits:
+        The row splits of the [utt][path] shape of an Nbest.
+      scores:
+        A 2-D tensor of shape (num_paths, num_components) containing the
+        score components of each path.
+      scales:
+        A 2-D tensor of shape (num_combinations, num_components). Each row
+        contains the scales of one combination.
+    Returns:
+      Return a 2-D tensor of shape (num_combinations, num_utterances)
+      containing the index of the best path of each utterance. It is -1
+      for utterances without paths, like :meth:`k2.RaggedTensor.argmax`.
+    """
+    # tot_scores: (num_combinations, num_paths)
+    tot_scores = torch.matmul(scales, scores.t())
+
+    num_paths = row_splits[1:] - row_splits[:-1]
+    num_utts = num_paths.numel()
+    row_ids = torch.repeat_interleave(
+        torch.arange(num_utts, device=row_splits.device), num_paths
+    )
+    path_pos = (
+        torch.arange(row_ids.numel(), device=row_splits.device)
+        - row_splits[row_ids]
+    )
+    max_num_paths = max(int(num_paths.max().item()), 1) if num_utts else 1
+
+    padded = tot_scores.new_full(
+        (scales.size(0), num_utts, max_num_paths), float("-inf")
+    )
+    padded[:, row_ids, path_pos] = tot_scores
+    ans = padded.argmax(dim=-1) + row_splits[:-1]
+    ans[:, num_paths == 0] = -1
+    return ans
+
+
+def sweep_scales(
+    nbest: Nbest,
+    scores: Dict[str, torch.Tensor],
+    scale_lists: Dict[str, List[float]],
+) -> Dict[str, k2.Fsa]:
+    """Select the best path of each utterance in an Nbest for every
+    combination of scales in one pass.
+
+    The total score of a path is the weighted sum of its score components.
+    Components not in `scale_lists` have a scale of 1. The best paths of
+    all combinations are found with a single argmax, so tuning the scales
+    on a dev set costs no more than decoding with a single combination.
+
+    Args:
+      nbest:
+        The Nbest object.
+      scores:
+        A dict mapping the name of a score component, e.g., "am", "lm" or
+        "attention", to a 1-D tensor containing that score of each path in
+        `nbest`.
+      scale_lists:
+        A dict mapping the name of a score component to the list of scales
+        to try for it.
+    Returns:
+      A dict of FsaVec whose key contains the scale of each component in
+      `scale_lists`, e.g., "lm_scale_0.5" for `scale_lists={"lm": [0.5]}`,
+      and whose value is the best path of each utterance.
+    """
+    names = list(scores.keys())
+    for name in scale_lists:
+        assert name in scores, f"No scores for {name}"
+
+    # Use the precision of the most precise component
+    dtype = torch.float32
+    for v in scores.values():
+        if v.dtype == torch.float64:
+            dtype = torch.float64
+    # stacked_scores: (num_paths, num_components)
+    stacked_scores = torch.stack([scores[n].to(dtype) for n in names], dim=1)
+
+    combinations = list(itertools.product(*scale_lists.values()))
+    scales = torch.ones(len(combinations), len(names), dtype=dtype)
+    for i, name in enumerate(scale_lists):
+        scales[:, names.index(name)] = torch.tensor(
+            [c[i] for c in combinations], dtype=dtype
+        )
+
+    row_splits = nbest.shape.row_splits(1).to(torch.int64)
+    max_indexes = _get_best_path_indexes(
+        row_splits, stacked_scores, scales.to(stacked_scores.device)
+    )
+
     ans = dict()
-    for lm_scale in lm_scale_list:
-        tot_scores = am_scores.values / lm_scale + lm_scores.values
-        tot_scores = k2.RaggedTensor(nbest.shape, tot_scores)
-        max_indexes = tot_scores.argmax()
-        best_path = k2.index_fsa(nbest.fsa, max_indexes)
-        key = f"lm_scale_{lm_scale}"
-        ans[key] = best_path
+    for c, indexes in zip(combinations, max_indexes):
+        key = "_".join(
+            f"{name}_scale_{scale}" for name, scale in zip(scale_lists, c)
+        )
+        ans[key] = k2.index_fsa(nbest.fsa, indexes.to(torch.int32))
     return ans
 
 
+# NOTE: The choice of the threshold list is arbitrary here to avoid OOM.
+# You may need to fine tune it.
+_PRUNE_TH_LIST = [1e-10, 1e-9, 1e-8, 1e-7, 1e-6]
+_PRUNE_TH_LIST += [1e-5, 1e-4, 1e-3, 1e-2, 1e-1]
+
+
+class WholeLatticeRescoringStats(object):
+    """Statistics of :func:`rescore_with_whole_lattice`.
+
+    Besides counting how often pruning, splitting and the fallback after
+    a failed intersection are used, it keeps the ratios between the
+    number of arcs of the recent intersection results and that of their
+    input lattices. A high percentile of them is used to predict the size
+    of the next intersection results. It goes down again once an unusual
+    ratio leaves the window, so that a single outlier does not cause all
+    later lattices to be pruned. Intersections that fail despite the
+    prediction are handled by the fallback.
+
+    Pass the same object to all calls of :func:`rescore_with_whole_lattice`
+    so that the prediction improves over batches. If no object is passed,
+    a default one kept for each `G_with_epsilon_loops` is used.
+    """
+
+    def __init__(
+        self,
+        expansion: float = 1.0,
+        window_size: int = 100,
+        percentile: float = 0.9,
+    ):
+        """
+        Args:
+          expansion:
+            The initial ratio between the number of arcs of an intersection
+            result and that of its input lattice. It is used until the
+            first ratio is observed.
+          window_size:
+            Number of recent ratios kept.
+          percentile:
+            The percentile of the recent ratios used as the prediction.
+        """
+        assert 0 <= percentile <= 1, percentile
+        self.expansion = expansion
+        self.percentile = percentile
+        self.ratios = deque(maxlen=window_size)
+        # Number of utterances rescored
+        self.num_utterances = 0
+        # Number of utterances pruned before intersecting with G
+        self.num_pruned = 0
+        # Number of calls to k2.intersect_device()
+        self.num_intersections = 0
+        # Number of batches split into several intersections
+        self.num_splits = 0
+        # Number of intersections failed despite the prediction
+        self.num_fallbacks = 0
+
+    def update(self, ratio: float) -> None:
+        """Add the ratio of an intersection result and update the
+        prediction `expansion`."""
+        self.ratios.append(ratio)
+        ratios = sorted(self.ratios)
+        i = min(int(self.percentile * len(ratios)), len(ratios) - 1)
+        self.expansion = ratios[i]
+
+    def __str__(self) -> str:
+        return (
+            f"WholeLatticeRescoringStats("
+            f"num_utterances={self.num_utterances}, "
+            f"num_pruned={self.num_pruned}, "
+            f"num_intersections={self.num_intersections}, "
+            f"num_splits={self.num_splits}, "
+            f"num_fallbacks={self.num_fallbacks}, "
+            f"expansion={self.expansion:.2f})"
+        )
+
+
+# The default statistics of each G_with_epsilon_loops, keyed by its id.
+# An entry is removed when its G is garbage collected.
+_default_rescoring_stats: Dict[int, WholeLatticeRescoringStats] = {}
+
+
+def _get_default_rescoring_stats(G: k2.Fsa) -> WholeLatticeRescoringStats:
+    """Return the statistics used by :func:`rescore_with_whole_lattice`
+    for `G` when no statistics are passed, so that the predicted size of
+    the intersection results improves over calls with the same `G`."""
+    key = id(G)
+    stats = _default_rescoring_stats.get(key)
+    if stats is None:
+        stats = WholeLatticeRescoringStats()
+        _default_rescoring_stats[key] = stats
+        weakref.finalize(G, _default_rescoring_stats.pop, key, None)
+    return stats
+
+
+def _prune_to_budget(
+    fsas: k2.Fsa,
+    max_arcs: float,
+) -> k2.Fsa:
+    """Prune an FsaVec containing a single FSA with increasing thresholds
+    from `_PRUNE_TH_LIST` until it has no more than `max_arcs` arcs.
+
+    If it has still too many arcs after pruning with the largest
+    threshold, the result of the largest threshold is returned.
+    """
+    for th in _PRUNE_TH_LIST:
+        pruned = k2.prune_on_arc_post(fsas, th, True)
+        if pruned.arcs.num_elements() <= max_arcs:
+            break
+    return pruned
+
+
+def _intersect_with_budget(
+    G_with_epsilon_loops: k2.Fsa,
+    inv_lattice: k2.Fsa,
+    max_arcs: int,
+    stats: WholeLatticeRescoringStats,
+) -> k2.Fsa:
+    """Intersect G_with_epsilon_loops with each FSA in inv_lattice.
+
+    Utterances whose predicted intersection result is larger than
+    `max_arcs` are pruned individually, and the utterances are split into
+    groups whose predicted results together are no larger than `max_arcs`.
+    If an intersection still fails, the group is split into halves, or the
+    utterance is pruned further if it is the only one in the group.
+
+    Returns:
+      Return the connected intersection results in the order of the
+      utterances in `inv_lattice`.
+    """
+    device = inv_lattice.device
+    num_arcs = _get_num_arcs(inv_lattice).tolist()
+
+    # Prune the utterances predicted to be too large on their own
+    pieces = []
+    start = 0
+    for i, n in enumerate(num_arcs):
+        if n * stats.expansion <= max_arcs:
+            continue
+        if start < i:
+            indexes = torch.arange(start, i, dtype=torch.int32, device=device)
+            pieces.append(k2.index_fsa(inv_lattice, indexes))
+        indexes = torch.tensor([i], dtype=torch.int32, device=device)
+        pruned = _prune_to_budget(
+            k2.index_fsa(inv_lattice, indexes),
+            max_arcs=max_arcs / stats.expansion,
+        )
+        pieces.append(pruned)
+        num_arcs[i] = pruned.arcs.num_elements()
+        stats.num_pruned += 1
+        start = i + 1
+
+    if len(pieces) > 0:
+        if start < len(num_arcs):
+            indexes = torch.arange(
+                start, len(num_arcs), dtype=torch.int32, device=device
+            )
+            pieces.append(k2.index_fsa(inv_lattice, indexes))
+        inv_lattice = k2.cat(pieces)
+
+    # Split the utterances into groups
+    groups = _split_by_cost([n * stats.expansion for n in num_arcs], max_arcs)
+    groups = [list(g) for g in groups]
+
+    if len(groups) > 1:
+        stats.num_splits += 1
+
+    ans = []
+    while len(groups) > 0:
+        start, end = groups.pop(0)
+        if start == 0 and end == len(num_arcs):
+            fsas = inv_lattice
+        else:
+            indexes = torch.arange(start, end, dtype=torch.int32, device=device)
+            fsas = k2.index_fsa(inv_lattice, indexes)
+        b_to_a_map = torch.zeros(end - start, device=device, dtype=torch.int32)
+
+        stats.num_intersections += 1
+        try:
+            rescoring_lattice = k2.intersect_device(
+                G_with_epsilon_loops,
+                fsas,
+                b_to_a_map,
+                sorted_match_a=True,
+            )
+        except RuntimeError as e:
+            stats.num_fallbacks += 1
+            num_input_arcs = fsas.arcs.num_elements()
+            logging.info(
+                f"Caught exception:\n{e}\n"
+                f"num_arcs: {num_input_arcs}, num utterances: {end - start}"
+            )
+            if end - start > 1:
+                mid = (start + end) // 2
+                groups[:0] = [[start, mid], [mid, end]]
+                continue
+            pruned = _prune_to_budget(fsas, max_arcs=num_input_arcs / 10)
+            if pruned.arcs.num_elements() >= num_input_arcs:
+                # It cannot be pruned any further
+                raise
+            pieces = [pruned]
+            if start > 0:
+                indexes = torch.arange(start, dtype=torch.int32, device=device)
+                pieces.insert(0, k2.index_fsa(inv_lattice, indexes))
+            if end < len(num_arcs):
+                indexes = torch.arange(
+                    end, len(num_arcs), dtype=torch.int32, device=device
+                )
+                pieces.append(k2.index_fsa(inv_lattice, indexes))
+            inv_lattice = k2.cat(pieces)
+            stats.num_pruned += 1
+            groups.insert(0, [start, end])
+            continue
+
+        ratio = rescoring_lattice.arcs.num_elements() / max(
+            fsas.arcs.num_elements(), 1
+        )
+        stats.update(ratio)
+        ans.append(k2.connect(rescoring_lattice))
+
+    if len(ans) == 1:
+        return ans[0]
+    return k2.cat(ans)
+
+
 def rescore_with_whole_lattice(
     lattice: k2.Fsa,
     G_with_epsilon_loops: k2.Fsa,
     lm_scale_list: Optional[List[float]] = None,
     use_double_scores: bool = True,
+    max_arcs: int = 50000000,
+    stats: Optional[WholeLatticeRescoringStats] = None,
+    sweep_num_paths: Optional[int] = None,
+    nbest_scale: float = 1.0,
 ) -> Union[k2.Fsa, Dict[str, k2.Fsa]]:
     """Intersect the lattice with an n-gram LM and use shortest path
     to decode.
@@ -696,6 +1128,12 @@ def rescore_with_whole_lattice(
     this function as a second pass decoding. In the first pass decoding, we
     use a small G, while we use a larger G in the second pass decoding.
 
+    To avoid OOM, the size of the intersection result is predicted from
+    the number of arcs of each utterance before intersecting. Utterances
+    that are too large on their own are pruned with
+    :func:`k2.prune_on_arc_post` and the batch is split into several
+    intersections if needed. See :class:`WholeLatticeRescoringStats`.
+
     Args:
       lattice:
         An FsaVec with axes [utt][state][arc]. Its `aux_lables` are word IDs.
@@ -712,6 +1150,25 @@ def rescore_with_whole_lattice(
       use_double_scores:
         True to use double precision in the computation.
         False to use single precision.
+      max_arcs:
+        The maximum number of arcs of the result of a single
+        intersection. You may need to tune it for the memory of your
+        device.
+      stats:
+        It is updated with the statistics of this call and its `expansion`
+        is used to predict the size of the intersection results. If None,
+        the statistics kept for `G_with_epsilon_loops` across calls are
+        used.
+      sweep_num_paths:
+        Used only when `lm_scale_list` is not None. If None, run
+        :func:`k2.shortest_path` on the rescored lattice once for each
+        scale. Otherwise, sample this number of paths from the rescored
+        lattice once and select the best of them for all scales with
+        :func:`sweep_scales`. It is much faster for long scale lists, but
+        only the sampled paths are considered.
+      nbest_scale:
+        Used only when `sweep_num_paths` is not None. It is the scale
+        applied to the scores of the rescored lattice when sampling paths.
     Returns:
       If `lm_scale_list` is None, return a new lattice which is the intersection
       result of `lattice` and `G_with_epsilon_loops`.
@@ -722,7 +1179,9 @@ def rescore_with_whole_lattice(
     assert hasattr(lattice, "lm_scores")
     assert G_with_epsilon_loops.shape == (1, None, None)
 
-    device = lattice.device
+    if stats is None:
+        stats = _get_default_rescoring_stats(G_with_epsilon_loops)
+
     lattice.scores = lattice.scores - lattice.lm_scores
     # We will use lm_scores from G, so remove lats.lm_scores here
     del lattice.lm_scores
@@ -734,51 +1193,15 @@ def rescore_with_whole_lattice(
     # inv_lattice has word IDs as labels.
     # Its `aux_labels` is token IDs
     inv_lattice = k2.invert(lattice)
-    num_seqs = lattice.shape[0]
-
-    b_to_a_map = torch.zeros(num_seqs, device=device, dtype=torch.int32)
+    stats.num_utterances += lattice.shape[0]
 
-    # NOTE: The choice of the threshold list is arbitrary here to avoid OOM.
-    # You may need to fine tune it.
-    prune_th_list = [1e-10, 1e-9, 1e-8, 1e-7, 1e-6]
-    prune_th_list += [1e-5, 1e-4, 1e-3, 1e-2, 1e-1]
-    max_loop_count = 10
-    loop_count = 0
-    while loop_count <= max_loop_count:
-        try:
-            rescoring_lattice = k2.intersect_device(
-                G_with_epsilon_loops,
-                inv_lattice,
-                b_to_a_map,
-                sorted_match_a=True,
-            )
-            rescoring_lattice = k2.top_sort(k2.connect(rescoring_lattice))
-            break
-        except RuntimeError as e:
-            logging.info(f"Caught exception:\n{e}\n")
-            if loop_count >= max_loop_count:
-                logging.info(
-                    "Return None as the resulting lattice is too large."
-                )
-                return None
-            logging.info(
-                f"num_arcs before pruning: {inv_lattice.arcs.num_elements()}"
-            )
-            logging.info(
-                "This OOM is not an error. You can ignore it. "
-                "If your model does not converge well, or --max-duration "
-                "is too large, or the input sound file is difficult to "
-                "decode, you will meet this exception."
-            )
-            inv_lattice = k2.prune_on_arc_post(
-                inv_lattice,
-                prune_th_list[loop_count],
-                True,
-            )
-            logging.info(
-                f"num_arcs after pruning: {inv_lattice.arcs.num_elements()}"
-            )
-        loop_count += 1
+    rescoring_lattice = _intersect_with_budget(
+        G_with_epsilon_loops,
+        inv_lattice,
+        max_arcs=max_arcs,
+        stats=stats,
+    )
+    rescoring_lattice = k2.top_sort(rescoring_lattice)
 
     # lat has token IDs as labels
     # and word IDs as aux_labels.
@@ -787,6 +1210,25 @@ def rescore_with_whole_lattice(
     if lm_scale_list is None:
         return lat
 
+    if sweep_num_paths is not None:
+        nbest = Nbest.from_lattice(
+            lattice=lat,
+            num_paths=sweep_num_paths,
+            use_double_scores=use_double_scores,
+            nbest_scale=nbest_scale,
+        )
+        nbest = nbest.intersect(lat, use_double_scores=use_double_scores)
+        return sweep_scales(
+            nbest,
+            scores={
+                "am": nbest.compute_am_scores().values,
+                "lm": nbest.compute_lm_scores().values,
+            },
+            # am_scores / lm_scale + lm_scores has the same best path
+            # as am_scores + lm_scale * lm_scores
+            scale_lists={"lm": lm_scale_list},
+        )
+
     ans = dict()
     saved_am_scores = lat.scores - lat.lm_scores
     for lm_scale in lm_scale_list:
@@ -811,6 +1253,8 @@ def rescore_with_attention_decoder(
     ngram_lm_scale: Optional[float] = None,
     attention_scale: Optional[float] = None,
     use_double_scores: bool = True,
+    max_arcs: int = 10000000,
+    use_prefix_cache: bool = True,
 ) -> Dict[str, k2.Fsa]:
     """This function extracts `num_paths` paths from the given lattice and uses
     an attention decoder to rescore them. The path with the highest score is
@@ -841,41 +1285,30 @@ def rescore_with_attention_decoder(
         Optional. It specifies the scale for n-gram LM scores.
       attention_scale:
         Optional. It specifies the scale for attention decoder scores.
+      max_arcs:
+        It bounds the memory used to sample the paths and to intersect them
+        with the lattice by splitting the batch. All `num_paths` paths are
+        kept. See :meth:`Nbest.from_lattice` and :meth:`Nbest.intersect`.
+      use_prefix_cache:
+        If True and the attention decoder of the model is supported by
+        :func:`icefall.attention_rescoring.attention_decoder_nll`, the
+        common prefixes of the paths are computed only once and `memory`
+        is not expanded to each path. Otherwise, `model.decoder_nll()`
+        is called on the padded paths.
     Returns:
       A dict of FsaVec, whose key contains a string
       ngram_lm_scale_attention_scale and the value is the
       best decoding path for each utterance in the lattice.
     """
-    max_loop_count = 10
-    loop_count = 0
-    while loop_count <= max_loop_count:
-        try:
-            nbest = Nbest.from_lattice(
-                lattice=lattice,
-                num_paths=num_paths,
-                use_double_scores=use_double_scores,
-                nbest_scale=nbest_scale,
-            )
-            # nbest.fsa.scores are all 0s at this point
-            nbest = nbest.intersect(lattice)
-            break
-        except RuntimeError as e:
-            logging.info(f"Caught exception:\n{e}\n")
-            logging.info(f"num_paths before decreasing: {num_paths}")
-            num_paths = int(num_paths / 2)
-            if loop_count >= max_loop_count or num_paths <= 0:
-                logging.info(
-                    "Return None as the resulting lattice is too large."
-                )
-                return None
-            logging.info(
-                "This OOM is not an error. You can ignore it. "
-                "If your model does not converge well, or --max-duration "
-                "is too large, or the input sound file is difficult to "
-                "decode, you will meet this exception."
-            )
-            logging.info(f"num_paths after decreasing: {num_paths}")
-        loop_count += 1
+    nbest = Nbest.from_lattice(
+        lattice=lattice,
+        num_paths=num_paths,
+        use_double_scores=use_double_scores,
+        nbest_scale=nbest_scale,
+        max_arcs=max_arcs,
+    )
+    # nbest.fsa.scores are all 0s at this point
+    nbest = nbest.intersect(lattice, max_arcs=max_arcs)
 
     # Now nbest.fsa has its scores set.
     # Also, nbest.fsa inherits the attributes from `lattice`.
@@ -889,17 +1322,6 @@ def rescore_with_attention_decoder(
     assert isinstance(nbest.fsa.tokens, torch.Tensor)
 
     path_to_utt_map = nbest.shape.row_ids(1).to(torch.long)
-    # the shape of memory is (T, N, C), so we use axis=1 here
-    expanded_memory = memory.index_select(1, path_to_utt_map)
-
-    if memory_key_padding_mask is not None:
-        # The shape of memory_key_padding_mask is (N, T), so we
-        # use axis=0 here.
-        expanded_memory_key_padding_mask = memory_key_padding_mask.index_select(
-            0, path_to_utt_map
-        )
-    else:
-        expanded_memory_key_padding_mask = None
 
     # remove axis corresponding to states.
     tokens_shape = nbest.fsa.arcs.shape().remove_axis(1)
@@ -911,17 +1333,44 @@ def rescore_with_attention_decoder(
         print("Warning: rescore_with_attention_decoder(): empty token-ids")
         return None
 
-    nll = model.decoder_nll(
-        memory=expanded_memory,
-        memory_key_padding_mask=expanded_memory_key_padding_mask,
-        token_ids=token_ids,
-        sos_id=sos_id,
-        eos_id=eos_id,
-    )
-    assert nll.ndim == 2
-    assert nll.shape[0] == len(token_ids)
+    if (
+        use_prefix_cache
+        and not model.training
+        and attention_rescoring.is_supported(model)
+    ):
+        attention_scores = -attention_rescoring.attention_decoder_nll(
+            model=model,
+            memory=memory,
+            memory_key_padding_mask=memory_key_padding_mask,
+            token_ids=token_ids,
+            path_to_utt_map=path_to_utt_map,
+            sos_id=sos_id,
+            eos_id=eos_id,
+        )
+    else:
+        # the shape of memory is (T, N, C), so we use axis=1 here
+        expanded_memory = memory.index_select(1, path_to_utt_map)
+
+        if memory_key_padding_mask is not None:
+            # The shape of memory_key_padding_mask is (N, T), so we
+            # use axis=0 here.
+            expanded_memory_key_padding_mask = (
+                memory_key_padding_mask.index_select(0, path_to_utt_map)
+            )
+        else:
+            expanded_memory_key_padding_mask = None
+
+        nll = model.decoder_nll(
+            memory=expanded_memory,
+            memory_key_padding_mask=expanded_memory_key_padding_mask,
+            token_ids=token_ids,
+            sos_id=sos_id,
+            eos_id=eos_id,
+        )
+        assert nll.ndim == 2
+        assert nll.shape[0] == len(token_ids)
 
-    attention_scores = -nll.sum(dim=1)
+        attention_scores = -nll.sum(dim=1)
 
     if ngram_lm_scale is None:
         ngram_lm_scale_list = [0.01, 0.05, 0.08]
@@ -939,18 +1388,15 @@ def rescore_with_attention_decoder(
     else:
         attention_scale_list = [attention_scale]
 
-    ans = dict()
-    for n_scale in ngram_lm_scale_list:
-        for a_scale in attention_scale_list:
-            tot_scores = (
-                am_scores.values
-                + n_scale * ngram_lm_scores.values
-                + a_scale * attention_scores
-            )
-            ragged_tot_scores = k2.RaggedTensor(nbest.shape, tot_scores)
-            max_indexes = ragged_tot_scores.argmax()
-            best_path = k2.index_fsa(nbest.fsa, max_indexes)
-
-            key = f"ngram_lm_scale_{n_scale}_attention_scale_{a_scale}"
-            ans[key] = best_path
-    return ans
+    return sweep_scales(
+        nbest,
+        scores={
+            "am": am_scores.values,
+            "ngram_lm": ngram_lm_scores.values,
+            "attention": attention_scores,
+        },
+        scale_lists={
+            "ngram_lm": ngram_lm_scale_list,
+            "attention": attention_scale_list,
+        },
+    )
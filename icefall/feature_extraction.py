@@ -0,0 +1,364 @@
+# Copyright      2026                      (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Resumable feature extraction shared by the local/compute_fbank_*.py
+scripts of all recipes.
+
+The cuts are processed in shards. Each shard saves its features and its
+cuts manifest separately and, once done, appends a line with a
+fingerprint of its input to a progress file. When the extraction is
+restarted, e.g., after a crash, the finished shards are skipped unless
+their inputs have changed. Shards are processed by a local process pool,
+or by the given executor, and the cuts of all shards are merged at the
+end.
+
+Usage::
+
+    cuts = compute_and_store_features(
+        cuts,
+        extractor=Fbank(FbankConfig(num_mel_bins=80)),
+        storage_dir="data/fbank/feats_train-clean-100",
+        manifest_path="data/fbank/cuts_train-clean-100.json.gz",
+        num_jobs=15,
+    )
+"""
+
+import concurrent.futures
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Type, Union
+
+from lhotse import CutSet
+from lhotse.features import FeatureExtractor
+from lhotse.features.io import FeaturesWriter
+
+Pathlike = Union[str, Path]
+
+
+class FeatureShard:
+    """A piece of work for :func:`compute_features_for_shards`."""
+
+    def __init__(
+        self,
+        cuts: Union[CutSet, Pathlike],
+        manifest_path: Pathlike,
+        storage_path: Pathlike,
+    ):
+        """
+        Args:
+          cuts:
+            The cuts of this shard, or the path to their manifest, which
+            is loaded lazily by the job processing this shard.
+          manifest_path:
+            The path to save the cuts with features.
+          storage_path:
+            The path to save the features.
+        """
+        self.cuts = cuts if isinstance(cuts, CutSet) else Path(cuts)
+        self.manifest_path = Path(manifest_path)
+        self.storage_path = Path(storage_path)
+
+    def fingerprint(self) -> str:
+        """Identify the input of this shard, so that a finished shard is
+        computed again if its input changed."""
+        if isinstance(self.cuts, Path):
+            stat = self.cuts.stat()
+            return f"{stat.st_size}-{stat.st_mtime_ns}"
+        md5 = hashlib.md5()
+        for cut_id in self.cuts.ids:
+            md5.update(cut_id.encode("utf-8"))
+            md5.update(b"\n")
+        return md5.hexdigest()
+
+    def __repr__(self) -> str:
+        return str(self.manifest_path)
+
+
+def read_progress(progress_path: Pathlike) -> Dict[str, str]:
+    """Return a dict mapping the manifest path of each finished shard
+    to the fingerprint of its input."""
+    ans = {}
+    if not Path(progress_path).is_file():
+        return ans
+    with open(progress_path) as f:
+        for line in f:
+            try:
+                d = json.loads(line)
+            except json.JSONDecodeError:
+                # A line being written when the process was killed
+                continue
+            ans[d["manifest_path"]] = d["fingerprint"]
+    return ans
+
+
+def _remove_storage(storage_path: Path) -> None:
+    """Remove the features written by an unfinished job. Depending on
+    the storage type, lhotse may add a suffix to storage_path."""
+    if not storage_path.parent.is_dir():
+        return
+    for p in storage_path.parent.glob(f"{storage_path.name}*"):
+        if p.name != storage_path.name and not p.name.startswith(
+            storage_path.name + "."
+        ):
+            continue
+        logging.info(f"Removing {p}")
+        if p.is_dir():
+            shutil.rmtree(p)
+        else:
+            p.unlink()
+
+
+def _save_manifest(cuts: CutSet, manifest_path: Path) -> None:
+    """Write to a temporary file first so that a manifest that exists
+    is always complete. Keep the suffix for lhotse to detect the format.
+    """
+    tmp_path = manifest_path.with_name(".tmp-" + manifest_path.name)
+    cuts.to_file(tmp_path)
+    os.replace(tmp_path, manifest_path)
+
+
+def _process_shard(
+    shard: FeatureShard,
+    fingerprint: str,
+    extractor: FeatureExtractor,
+    progress_path: Path,
+    storage_type: Optional[Type[FeaturesWriter]],
+    batch_duration: Optional[float],
+    num_workers: int,
+    post_process: Optional[Callable[[CutSet], CutSet]],
+) -> Path:
+    cuts = shard.cuts
+    if isinstance(cuts, Path):
+        cuts = CutSet.from_file(cuts)
+
+    _remove_storage(shard.storage_path)
+    shard.storage_path.parent.mkdir(parents=True, exist_ok=True)
+
+    kwargs = {}
+    if storage_type is not None:
+        kwargs["storage_type"] = storage_type
+
+    if batch_duration is None:
+        cuts = cuts.compute_and_store_features(
+            extractor=extractor,
+            storage_path=str(shard.storage_path),
+            num_jobs=1,
+            **kwargs,
+        )
+    else:
+        cuts = cuts.compute_and_store_features_batch(
+            extractor=extractor,
+            storage_path=str(shard.storage_path),
+            batch_duration=batch_duration,
+            num_workers=num_workers,
+            **kwargs,
+        )
+
+    if post_process is not None:
+        cuts = post_process(cuts)
+
+    _save_manifest(cuts, shard.manifest_path)
+
+    # The file is shared by all jobs, which may run on different machines
+    # with an executor, so append to it under a lock. fcntl.lockf() also
+    # works on NFS.
+    line = json.dumps(
+        {"manifest_path": str(shard.manifest_path), "fingerprint": fingerprint}
+    )
+    with open(progress_path, "a") as f:
+        fcntl.lockf(f, fcntl.LOCK_EX)
+        f.write(line + "\n")
+        f.flush()
+
+    return shard.manifest_path
+
+
+def compute_features_for_shards(
+    shards: List[FeatureShard],
+    extractor: FeatureExtractor,
+    progress_path: Pathlike,
+    num_jobs: int = 1,
+    executor: Optional[concurrent.futures.Executor] = None,
+    storage_type: Optional[Type[FeaturesWriter]] = None,
+    batch_duration: Optional[float] = None,
+    num_workers: int = 4,
+    post_process: Optional[Callable[[CutSet], CutSet]] = None,
+) -> List[Path]:
+    """Compute and store the features of the given shards, skipping the
+    shards that have already been finished.
+
+    Args:
+      shards:
+        The shards to process.
+      extractor:
+        The feature extractor.
+      progress_path:
+        The file recording the finished shards.
+      num_jobs:
+        Number of local processes. Used only when executor is None and
+        batch_duration is None.
+      executor:
+        If not None, shards are submitted to it, e.g., a dask client
+        from :func:`icefall.utils.get_executor`.
+      storage_type:
+        The writer for the features. If None, use the default of lhotse.
+      batch_duration:
+        If not None, use `CutSet.compute_and_store_features_batch()` in
+        the current process with batches of this number of seconds,
+        which suits extractors running on the GPU, e.g., KaldifeatFbank.
+        Otherwise, use `CutSet.compute_and_store_features()`.
+      num_workers:
+        Number of dataloader workers for reading audio. Used only when
+        batch_duration is not None.
+      post_process:
+        If not None, it is applied to the cuts of each shard after
+        computing the features, e.g., to trim them to supervisions.
+        It has to be picklable to run in other processes.
+    Returns:
+      Return the manifest paths of all shards.
+    """
+    progress_path = Path(progress_path)
+    progress_path.parent.mkdir(parents=True, exist_ok=True)
+    finished = read_progress(progress_path)
+
+    todo = []
+    for shard in shards:
+        fingerprint = shard.fingerprint()
+        # A shard without a record was finished before the progress file
+        # was introduced. Manifests are written only when shards finish.
+        recorded = finished.get(str(shard.manifest_path), fingerprint)
+        if recorded == fingerprint and shard.manifest_path.is_file():
+            continue
+        todo.append((shard, fingerprint))
+
+    logging.info(
+        f"{len(shards) - len(todo)} of {len(shards)} shards are finished. "
+        f"Processing the remaining {len(todo)} shards"
+    )
+    if not todo:
+        return [s.manifest_path for s in shards]
+
+    kwargs = dict(
+        extractor=extractor,
+        progress_path=progress_path,
+        storage_type=storage_type,
+        batch_duration=batch_duration,
+        num_workers=num_workers,
+        post_process=post_process,
+    )
+
+    if batch_duration is not None or (executor is None and num_jobs <= 1):
+        for i, (shard, fingerprint) in enumerate(todo):
+            _process_shard(shard, fingerprint, **kwargs)
+            logging.info(f"Finished {shard} ({i + 1}/{len(todo)})")
+        return [s.manifest_path for s in shards]
+
+    pool = None
+    if executor is None:
+        pool = concurrent.futures.ProcessPoolExecutor(num_jobs)
+        executor = pool
+
+    try:
+        futures = [
+            executor.submit(_process_shard, shard, fingerprint, **kwargs)
+            for shard, fingerprint in todo
+        ]
+        for i, f in enumerate(futures):
+            logging.info(f"Finished {f.result()} ({i + 1}/{len(todo)})")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return [s.manifest_path for s in shards]
+
+
+def compute_and_store_features(
+    cuts: CutSet,
+    extractor: FeatureExtractor,
+    storage_dir: Pathlike,
+    manifest_path: Pathlike,
+    shard_size: int = 2000,
+    **kwargs,
+) -> CutSet:
+    """Compute and store the features of the given cuts in a resumable way.
+
+    The cuts are split into shards of `shard_size` cuts. The features and
+    the cuts of the i-th shard are saved to `storage_dir/feats-{i}` and
+    `storage_dir/cuts-{i}.jsonl.gz`, and the finished shards are recorded
+    in `storage_dir/progress.jsonl`. At the end, the cuts of all shards
+    are merged and saved to `manifest_path`.
+
+    Args:
+      cuts:
+        The cuts to process. It can be lazy.
+      extractor:
+        The feature extractor.
+      storage_dir:
+        The directory to save the features.
+      manifest_path:
+        The path to save the cuts with features. If it exists, it is
+        loaded and returned without computing anything.
+      shard_size:
+        Number of cuts in a shard.
+      kwargs:
+        Passed to :func:`compute_features_for_shards`.
+    Returns:
+      Return the cuts with features.
+    """
+    manifest_path = Path(manifest_path)
+    if manifest_path.is_file():
+        logging.info(f"{manifest_path} already exists - skipping.")
+        return CutSet.from_file(manifest_path)
+
+    storage_dir = Path(storage_dir)
+    shards = []
+    chunk = []
+
+    def add_shard():
+        i = len(shards)
+        shards.append(
+            FeatureShard(
+                cuts=CutSet.from_cuts(chunk),
+                manifest_path=storage_dir / f"cuts-{i:05d}.jsonl.gz",
+                storage_path=storage_dir / f"feats-{i:05d}",
+            )
+        )
+
+    for cut in cuts:
+        chunk.append(cut)
+        if len(chunk) == shard_size:
+            add_shard()
+            chunk = []
+    if chunk:
+        add_shard()
+
+    manifests = compute_features_for_shards(
+        shards,
+        extractor=extractor,
+        progress_path=storage_dir / "progress.jsonl",
+        **kwargs,
+    )
+
+    logging.info(f"Merging {len(manifests)} shards into {manifest_path}")
+    ans = CutSet.from_cuts(c for m in manifests for c in CutSet.from_file(m))
+    _save_manifest(ans, manifest_path)
+    return ans
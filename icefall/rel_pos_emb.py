@@ -0,0 +1,149 @@
+# Copyright      2026                      (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A cache of the tables of relative positional encodings used by
+`RelPositionalEncoding` in the conformer recipes.
+
+The table for relative positions -(L-1), ..., L-1 has the shape
+(1, 2 * L - 1, d_model), where the entry at index L - 1 - p is the
+encoding of position p, see :func:`compute_rel_pos_emb`. A window of
+it is therefore a view that needs no allocation.
+
+There is one table per (d_model, device, dtype), which is shared by
+all `RelPositionalEncoding` modules. When a longer input arrives, the
+table grows to at least twice its length, so that a sequence of growing
+inputs recomputes it only a logarithmic number of times. Switching
+between dtypes, e.g., inside and outside of `torch.cuda.amp.autocast()`,
+and between devices reuses the existing tables instead of converting
+the table back and forth.
+
+The returned tables are shared and must not be modified in place.
+"""
+
+import math
+from typing import Dict, Tuple
+
+import torch
+
+
+def compute_rel_pos_emb(length: int, d_model: int) -> torch.Tensor:
+    """Compute the relative positional encodings of positions
+    -(length-1), ..., length-1 as in Appendix B of "Transformer-XL:
+    Attentive Language Models Beyond a Fixed-Length Context".
+
+    Args:
+      length:
+        The maximum length of the input.
+      d_model:
+        The embedding dimension.
+    Returns:
+      Return a float32 tensor on the CPU of shape
+      (1, 2 * length - 1, d_model). Its entry at index length - 1 - p
+      is the encoding of the relative position p, i.e., the positive
+      positions come first in reversed order.
+    """
+    # Suppose `i` means to the position of query vecotr and `j` means the
+    # position of key vector. We use position relative positions when keys
+    # are to the left (i>j) and negative relative positions otherwise (i<j).
+    pe_positive = torch.zeros(length, d_model)
+    pe_negative = torch.zeros(length, d_model)
+    position = torch.arange(0, length, dtype=torch.float32).unsqueeze(1)
+    div_term = torch.exp(
+        torch.arange(0, d_model, 2, dtype=torch.float32)
+        * -(math.log(10000.0) / d_model)
+    )
+    pe_positive[:, 0::2] = torch.sin(position * div_term)
+    pe_positive[:, 1::2] = torch.cos(position * div_term)
+    pe_negative[:, 0::2] = torch.sin(-1 * position * div_term)
+    pe_negative[:, 1::2] = torch.cos(-1 * position * div_term)
+
+    # Reserve the order of positive indices and concat both positive and
+    # negative indices. This is used to support the shifting trick
+    # as in "Transformer-XL: Attentive Language Models Beyond a
+    # Fixed-Length Context"
+    pe_positive = torch.flip(pe_positive, [0]).unsqueeze(0)
+    pe_negative = pe_negative[1:].unsqueeze(0)
+    return torch.cat([pe_positive, pe_negative], dim=1)
+
+
+class RelPosEmbCache(object):
+    """Tables of relative positional encodings keyed by
+    (d_model, device, dtype)."""
+
+    def __init__(self) -> None:
+        self._tables: Dict[
+            Tuple[int, torch.device, torch.dtype], torch.Tensor
+        ] = {}
+
+    def get(
+        self,
+        length: int,
+        d_model: int,
+        device: torch.device,
+        dtype: torch.dtype,
+    ) -> torch.Tensor:
+        """Return the table for an input of the given length.
+
+        Args:
+          length:
+            The length of the input, including any cached frames it
+            attends to.
+          d_model:
+            The embedding dimension.
+          device:
+            The device of the table.
+          dtype:
+            The dtype of the table.
+        Returns:
+          Return a tensor of shape (1, 2 * L - 1, d_model) with
+          L >= length. See :func:`compute_rel_pos_emb` for its layout.
+        """
+        key = (d_model, device, dtype)
+        table = self._tables.get(key)
+        if table is not None:
+            cur_length = (table.size(1) + 1) // 2
+            if cur_length >= length:
+                return table
+            length = max(length, 2 * cur_length)
+
+        table = compute_rel_pos_emb(length, d_model)
+        table = table.to(device=device, dtype=dtype)
+        self._tables[key] = table
+        return table
+
+    def clear(self) -> None:
+        """Free all tables."""
+        self._tables.clear()
+
+
+_rel_pos_emb_cache = RelPosEmbCache()
+
+
+def get_rel_pos_emb(
+    length: int, d_model: int, device: torch.device, dtype: torch.dtype
+) -> torch.Tensor:
+    """Return the table of the cache shared by all modules.
+    See :meth:`RelPosEmbCache.get`."""
+    return _rel_pos_emb_cache.get(
+        length=length, d_model=d_model, device=device, dtype=dtype
+    )
+
+
+def clear_rel_pos_emb_cache() -> None:
+    """Free the tables of the cache shared by all modules, e.g., after
+    moving a model from the GPU to the CPU."""
+    _rel_pos_emb_cache.clear()
@@ -25,7 +25,7 @@ from collections import defaultdict
 from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Iterable, List, TextIO, Tuple, Union
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple, Union
 
 import k2
 import k2.version
@@ -516,6 +516,14 @@ def write_error_stats(
 
 
 class MetricsTracker(collections.defaultdict):
+    """
+    Values can be Python numbers or scalar tensors. Tensor values, e.g.,
+    losses on the GPU, are kept on their device so that accumulating them
+    with `+` and `*` does not synchronize with the device. They are
+    transferred to the CPU, all at once, only when the values are
+    printed, written to TensorBoard, reduced or :meth:`sync` is called.
+    """
+
     def __init__(self):
         # Passing the type 'int' to the base-class constructor
         # makes undefined items default to int() which is zero.
@@ -538,24 +546,55 @@ class MetricsTracker(collections.defaultdict):
         return ans
 
     def __str__(self) -> str:
+        values = self.float_items()
         ans = ""
-        for k, v in self.norm_items():
+        for k, v in self.norm_items(values):
             norm_value = "%.4g" % v
             ans += str(k) + "=" + str(norm_value) + ", "
-        frames = "%.2f" % self["frames"]
+        frames = "%.2f" % values.get("frames", 0)
         ans += "over " + str(frames) + " frames."
         return ans
 
-    def norm_items(self) -> List[Tuple[str, float]]:
+    def float_items(self) -> Dict[str, float]:
+        """
+        Returns a dict with the values converted to Python floats.
+        All tensor values are copied to the CPU with a single transfer.
+        """
+        ans = {k: v for k, v in self.items()}
+        keys = [k for k, v in ans.items() if isinstance(v, torch.Tensor)]
+        if keys:
+            values = torch.stack(
+                [ans[k].detach().to(torch.float64).reshape(()) for k in keys]
+            )
+            for k, v in zip(keys, values.cpu().tolist()):
+                ans[k] = v
+        return {k: float(v) for k, v in ans.items()}
+
+    def sync(self) -> "MetricsTracker":
+        """
+        Replace tensor values with Python floats in place. Returns self.
+        """
+        self.update(self.float_items())
+        return self
+
+    def norm_items(
+        self, values: Optional[Dict[str, float]] = None
+    ) -> List[Tuple[str, float]]:
         """
         Returns a list of pairs, like:
           [('ctc_loss', 0.1), ('att_loss', 0.07)]
+
+        Args:
+          values:
+            If not None, it is the return value of :meth:`float_items`.
         """
-        num_frames = self["frames"] if "frames" in self else 1
+        if values is None:
+            values = self.float_items()
+        num_frames = values["frames"] if "frames" in values else 1
         ans = []
-        for k, v in self.items():
+        for k, v in values.items():
             if k != "frames":
-                norm_value = float(v) / num_frames
+                norm_value = v / num_frames
                 ans.append((k, norm_value))
         return ans
 
@@ -565,7 +604,15 @@ class MetricsTracker(collections.defaultdict):
         all processes get the total.
         """
         keys = sorted(self.keys())
-        s = torch.tensor([float(self[k]) for k in keys], device=device)
+        s = torch.stack(
+            [
+                torch.as_tensor(self[k], device=device)
+                .detach()
+                .to(torch.float32)
+                .reshape(())
+                for k in keys
+            ]
+        )
         dist.all_reduce(s, op=dist.ReduceOp.SUM)
         for k, v in zip(keys, s.cpu().tolist()):
             self[k] = v
@@ -713,6 +760,51 @@ def make_pad_mask(lengths: torch.Tensor) -> torch.Tensor:
     return expaned_lengths >= lengths.unsqueeze(1)
 
 
+def subsequent_chunk_mask(
+    size: int,
+    chunk_size: int,
+    num_left_chunks: int = -1,
+    device: torch.device = torch.device("cpu"),
+) -> torch.Tensor:
+    """Create a mask for chunk-wise attention.
+
+    The frames are split into chunks of `chunk_size` frames. A frame can
+    attend to all frames of its own chunk and of the previous chunks.
+
+    Args:
+      size:
+        Number of frames.
+      chunk_size:
+        Number of frames per chunk.
+      num_left_chunks:
+        Number of previous chunks that can be attended to. -1 means all
+        of them.
+      device:
+        The device of the returned mask.
+    Returns:
+      Return a 2-D bool tensor of shape (size, size), where positions that
+      can be attended to are filled with `True`.
+
+    >>> subsequent_chunk_mask(4, 2)
+    tensor([[ True,  True, False, False],
+            [ True,  True, False, False],
+            [ True,  True,  True,  True],
+            [ True,  True,  True,  True]])
+    """
+    assert chunk_size > 0, chunk_size
+    num_chunks = (size + chunk_size - 1) // chunk_size
+    chunk_index = torch.arange(num_chunks, device=device).repeat_interleave(
+        chunk_size
+    )[:size]
+
+    ans = chunk_index.unsqueeze(0) <= chunk_index.unsqueeze(1)
+    if num_left_chunks >= 0:
+        ans &= chunk_index.unsqueeze(0) >= (
+            chunk_index.unsqueeze(1) - num_left_chunks
+        )
+    return ans
+
+
 def l1_norm(x):
     return torch.sum(torch.abs(x))
 
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# Copyright      2026                      (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+import pytest
+from lhotse import CutSet
+from lhotse.dataset import DynamicBucketingSampler
+from lhotse.testing.dummies import dummy_cut
+
+from icefall.batch_planner import (
+    BatchPlan,
+    BatchPlanner,
+    BatchShape,
+    MemoryCostModel,
+    default_probe_shapes,
+    make_synthetic_batch,
+)
+
+GB = 2 ** 30
+
+
+class MemoryStub:
+    """Account the memory of a training step like a transducer model,
+    and run out of memory above the capacity."""
+
+    def __init__(self, capacity: float, unmodeled: float = 0.0):
+        self.capacity = capacity
+        # A term that MemoryCostModel cannot represent
+        self.unmodeled = unmodeled
+        self.num_calls = 0
+
+    def peak(self, shape: BatchShape) -> float:
+        B, T, U = shape.batch_size, shape.duration, shape.num_tokens
+        params = 0.5 * GB
+        encoder = 20e6 * B * T
+        attention = 0.5e6 * B * T * T
+        loss = 0.2e6 * B * T * U
+        unmodeled = self.unmodeled * B * T ** 3
+        return params + encoder + attention + loss + unmodeled
+
+    def __call__(self, shape: BatchShape):
+        self.num_calls += 1
+        peak = self.peak(shape)
+        return peak if peak <= self.capacity else None
+
+
+def test_memory_cost_model_fit():
+    stub = MemoryStub(capacity=float("inf"))
+    shapes = default_probe_shapes(max_cut_duration=20, tokens_per_second=4)
+    model = MemoryCostModel.fit(shapes, [stub(s) for s in shapes])
+    for expected, actual in zip(
+        [0.5 * GB, 20e6, 0.5e6, 0.2e6], model.coefficients
+    ):
+        assert math.isclose(actual, expected, rel_tol=1e-6)
+
+    budget = 8 * GB
+    B = model.max_batch_size(duration=10, num_tokens=40, budget=budget)
+    assert stub.peak(BatchShape(B, 10, 40)) <= budget
+    assert stub.peak(BatchShape(B + 1, 10, 40)) > budget
+
+
+@pytest.mark.parametrize(
+    "unmodeled, budget",
+    [
+        (0.0, 16 * GB),
+        (0.05e6, 16 * GB),
+        # The budget is larger than the available memory, so the planned
+        # batches run out of memory and are shrunk
+        (0.0, 20 * GB),
+    ],
+)
+def test_batch_planner(unmodeled, budget):
+    capacity = 16 * GB
+    stub = MemoryStub(capacity=capacity, unmodeled=unmodeled)
+    planner = BatchPlanner(measure=stub, memory_budget=budget)
+    planner.probe(
+        default_probe_shapes(
+            max_cut_duration=20, tokens_per_second=4, probe_duration=1000
+        )
+    )
+    plan = planner.plan(
+        duration_bins=[5, 10, 15], max_cut_duration=20, tokens_per_second=4
+    )
+
+    # Longer utterances need smaller batches
+    assert plan.max_durations == sorted(plan.max_durations, reverse=True)
+    for T, max_duration in zip([5, 10, 15, 20], plan.max_durations):
+        B = int(max_duration // T)
+        assert stub.peak(BatchShape(B, T, 4 * T)) <= capacity
+        if unmodeled == 0:
+            # It uses at least 80% of the memory
+            assert stub.peak(BatchShape(B, T, 4 * T)) > 0.8 * capacity
+
+
+def test_bucketed_time_constraint():
+    plan = BatchPlan(duration_bins=[5.0], max_durations=[40.0, 20.0])
+    cuts = CutSet.from_cuts(
+        dummy_cut(i, duration=4.0 if i % 2 else 8.0) for i in range(40)
+    )
+    sampler = DynamicBucketingSampler(
+        cuts,
+        constraint=plan.constraint(),
+        duration_bins=plan.duration_bins,
+        shuffle=True,
+    )
+    num_cuts = 0
+    for batch in sampler:
+        longest = max(c.duration for c in batch)
+        assert len(batch) * longest <= plan.max_duration(longest)
+        num_cuts += len(batch)
+    assert num_cuts == len(cuts)
+
+
+def test_make_synthetic_batch():
+    batch = make_synthetic_batch(BatchShape(3, 2.0, 5))
+    assert batch["inputs"].shape == (3, 200, 80)
+    token_ids = batch["supervisions"]["token_ids"]
+    assert token_ids["row_splits"].tolist() == [0, 5, 10, 15]
+    assert token_ids["values"].shape == (15,)
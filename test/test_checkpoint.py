@@ -15,15 +15,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 
 import pytest
 import torch
 import torch.nn as nn
 
 from icefall.checkpoint import (
+    AsyncCheckpointWriter,
     average_checkpoints,
+    average_epoch_checkpoints,
+    find_checkpoints,
+    get_model_filename,
     load_checkpoint,
+    load_model_state_dict,
+    remove_checkpoints,
     save_checkpoint,
+    save_checkpoint_with_global_batch_idx,
 )
 
 
@@ -35,7 +43,7 @@ def checkpoints1(tmp_path):
     m.register_buffer("p2", torch.tensor([10, 100]))
 
     params = {"a": 10, "b": 20}
-    save_checkpoint(f, m, params=params)
+    save_checkpoint(f, m, params=params, save_model_copy=True)
     return f
 
 
@@ -64,4 +72,100 @@ def test_load_checkpoints(checkpoints1):
 def test_average_checkpoints(checkpoints1, checkpoints2):
     state_dict = average_checkpoints([checkpoints1, checkpoints2])
     assert torch.allclose(state_dict["p1"], torch.Tensor([30, 25.0]))
+    # Only checkpoints1 has a model-only copy
+    assert not get_model_filename(checkpoints2).exists()
     assert torch.allclose(state_dict["p2"], torch.tensor([5, 51]))
+
+
+def test_average_checkpoints_with_model_copy(tmp_path, checkpoints1):
+    # The model-only copy is used instead of the checkpoint
+    model_filename = get_model_filename(checkpoints1)
+    assert model_filename.is_file()
+    torch.save({"p1": torch.tensor([1.0, 2.0])}, model_filename)
+    state_dict = average_checkpoints([checkpoints1])
+    assert torch.allclose(state_dict["p1"], torch.tensor([1.0, 2.0]))
+
+    # It is ignored if it is older than the checkpoint
+    os.utime(model_filename, (0, 0))
+    state_dict = average_checkpoints([checkpoints1])
+    assert torch.allclose(state_dict["p1"], torch.tensor([10.0, 20.0]))
+
+
+def test_average_epoch_checkpoints(tmp_path):
+    m = nn.Module()
+    m.p1 = nn.Parameter(torch.zeros(3))
+    m.register_buffer("p2", torch.zeros(2, dtype=torch.int64))
+    for epoch in range(1, 6):
+        with torch.no_grad():
+            m.p1.copy_(torch.rand(3))
+            m.p2.copy_(torch.randint(0, 100, (2,)))
+        save_checkpoint(tmp_path / f"epoch-{epoch}.pt", m, save_model_copy=True)
+
+    for epoch, avg in [(5, 1), (5, 3), (4, 2), (5, 5), (3, 3), (5, 2)]:
+        start = epoch - avg + 1
+        filenames = [
+            tmp_path / f"epoch-{i}.pt" for i in range(start, epoch + 1)
+        ]
+        expected = average_checkpoints(filenames)
+        state_dict = average_epoch_checkpoints(tmp_path, epoch=epoch, avg=avg)
+        assert torch.allclose(state_dict["p1"], expected["p1"])
+        assert torch.equal(state_dict["p2"], expected["p2"])
+        assert state_dict["p2"].dtype == torch.int64
+
+    prefix_sum_dir = tmp_path / "prefix-sums"
+    assert len(list(prefix_sum_dir.glob("*.json"))) == 5
+    assert len(list(prefix_sum_dir.glob("*.tmp"))) == 0
+
+    # Saved prefix sums are recomputed if a checkpoint is changed
+    with torch.no_grad():
+        m.p1.fill_(10)
+    save_checkpoint(tmp_path / "epoch-2.pt", m)
+    state_dict = average_epoch_checkpoints(tmp_path, epoch=2, avg=1)
+    assert torch.allclose(state_dict["p1"], torch.full((3,), 10.0))
+
+    with pytest.raises(FileNotFoundError):
+        average_epoch_checkpoints(tmp_path, epoch=6, avg=2)
+
+
+def test_async_checkpoint_writer(tmp_path):
+    m = nn.Module()
+    m.p1 = nn.Parameter(torch.tensor([1.0, 2.0]))
+    m.p2 = m.p1  # shared
+    optimizer = torch.optim.SGD(m.parameters(), lr=0.1, momentum=0.9)
+    m.p1.grad = torch.ones(2)
+    optimizer.step()
+
+    writer = AsyncCheckpointWriter(max_pending=2)
+    for i in range(1, 5):
+        save_checkpoint_with_global_batch_idx(
+            tmp_path,
+            global_batch_idx=i,
+            model=m,
+            params={"i": i},
+            optimizer=optimizer,
+            writer=writer,
+        )
+        expected = m.p1.detach().clone()
+        # Changes after save() are not in the checkpoint
+        with torch.no_grad():
+            m.p1.add_(1)
+        remove_checkpoints(tmp_path, topk=2, writer=writer)
+    writer.close()
+
+    assert find_checkpoints(tmp_path) == [
+        f"{tmp_path}/checkpoint-4.pt",
+        f"{tmp_path}/checkpoint-3.pt",
+    ]
+    assert not get_model_filename(tmp_path / "checkpoint-2.pt").exists()
+    assert len(list(tmp_path.glob("*.tmp"))) == 0
+
+    checkpoint = torch.load(tmp_path / "checkpoint-4.pt")
+    assert checkpoint["i"] == 4
+    assert torch.equal(checkpoint["model"]["p1"], expected)
+    assert (
+        checkpoint["model"]["p1"].data_ptr()
+        == checkpoint["model"]["p2"].data_ptr()
+    )
+    assert "momentum_buffer" in checkpoint["optimizer"]["state"][0]
+    state_dict = load_model_state_dict(tmp_path / "checkpoint-4.pt")
+    assert torch.equal(state_dict["p1"], expected)
@@ -22,8 +22,17 @@ You can run this file in one of the two ways:
     (2) cd icefall; ./test/test_decode.py
 """
 
+import gc
+
 import k2
-from icefall.decode import Nbest
+import torch
+from icefall.decode import (
+    Nbest,
+    WholeLatticeRescoringStats,
+    _default_rescoring_stats,
+    _get_default_rescoring_stats,
+    sweep_scales,
+)
 
 
 def test_nbest_from_lattice():
@@ -60,3 +69,129 @@ def test_nbest_from_lattice():
     argmax = tot_scores.argmax()
     best_path = k2.index_fsa(nbest2.fsa, argmax)
     print(best_path[0])
+
+
+def test_nbest_with_max_arcs():
+    s = """
+        0 1 1 10 0.1
+        0 1 5 10 0.11
+        0 1 2 20 0.2
+        1 2 3 30 0.3
+        1 2 4 40 0.4
+        2 3 -1 -1 0.5
+        3
+    """
+    lattice = k2.Fsa.from_str(s, acceptor=False)
+    lattice = k2.Fsa.from_fsas([lattice, lattice, lattice])
+
+    # Each utterance costs 6 arcs + 10 * 4 states, so every utterance
+    # is sampled separately
+    nbest = Nbest.from_lattice(
+        lattice=lattice,
+        num_paths=10,
+        use_double_scores=True,
+        nbest_scale=0.5,
+        max_arcs=50,
+    )
+    assert nbest.fsa.shape[0] == 4 * 3
+    assert nbest.shape.row_splits(1).tolist() == [0, 4, 8, 12]
+
+    # Each batch contains at most 2 paths
+    nbest2 = nbest.intersect(lattice, max_arcs=12)
+    expected = Nbest.from_lattice(
+        lattice=lattice,
+        num_paths=10,
+        use_double_scores=True,
+        nbest_scale=0.5,
+    ).intersect(lattice)
+    assert nbest2.shape.row_splits(1).tolist() == [0, 4, 8, 12]
+    assert sorted(nbest2.tot_scores().values.tolist()) == sorted(
+        expected.tot_scores().values.tolist()
+    )
+
+
+def test_sweep_scales():
+    s = """
+        0 1 1 10 0.1
+        0 1 5 10 0.11
+        0 1 2 20 0.2
+        1 2 3 30 0.3
+        1 2 4 40 0.4
+        2 3 -1 -1 0.5
+        3
+    """
+    lattice = k2.Fsa.from_str(s, acceptor=False)
+    lattice = k2.Fsa.from_fsas([lattice, lattice])
+    nbest = Nbest.from_lattice(
+        lattice=lattice,
+        num_paths=10,
+        use_double_scores=True,
+        nbest_scale=0.5,
+    )
+    num_paths = nbest.fsa.shape[0]
+    am_scores = torch.rand(num_paths, dtype=torch.float64)
+    lm_scores = torch.rand(num_paths, dtype=torch.float64)
+    attention_scores = torch.rand(num_paths)
+
+    lm_scale_list = [0.1, 0.5, 2.0]
+    attention_scale_list = [0.3, 1.0]
+    ans = sweep_scales(
+        nbest,
+        scores={
+            "am": am_scores,
+            "lm": lm_scores,
+            "attention": attention_scores,
+        },
+        scale_lists={"lm": lm_scale_list, "attention": attention_scale_list},
+    )
+    assert len(ans) == len(lm_scale_list) * len(attention_scale_list)
+
+    for lm_scale in lm_scale_list:
+        for attention_scale in attention_scale_list:
+            tot_scores = (
+                am_scores
+                + lm_scale * lm_scores
+                + attention_scale * attention_scores.double()
+            )
+            max_indexes = k2.RaggedTensor(nbest.shape, tot_scores).argmax()
+            expected = k2.index_fsa(nbest.fsa, max_indexes)
+            key = f"lm_scale_{lm_scale}_attention_scale_{attention_scale}"
+            assert str(ans[key]) == str(expected)
+
+
+def test_default_rescoring_stats():
+    s = """
+        0 1 1 0.1
+        1 2 -1 0.2
+        2
+    """
+    G1 = k2.Fsa.from_str(s, acceptor=True)
+    G2 = k2.Fsa.from_str(s, acceptor=True)
+
+    stats = _get_default_rescoring_stats(G1)
+    stats.expansion = 2.5
+    assert _get_default_rescoring_stats(G1) is stats
+    assert _get_default_rescoring_stats(G2) is not stats
+    assert _get_default_rescoring_stats(G2).expansion == 1.0
+
+    num_entries = len(_default_rescoring_stats)
+    del G1
+    gc.collect()
+    assert len(_default_rescoring_stats) == num_entries - 1
+
+
+def test_rescoring_stats_expansion():
+    stats = WholeLatticeRescoringStats(
+        expansion=3.0, window_size=10, percentile=0.9
+    )
+    stats.update(2.0)
+    assert stats.expansion == 2.0
+
+    # An outlier raises the prediction only while it is in the window
+    stats.update(50.0)
+    assert stats.expansion == 50.0
+    for _ in range(9):
+        stats.update(2.0)
+    assert stats.expansion == 50.0
+    stats.update(2.0)
+    assert stats.expansion == 2.0
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Copyright      2026                      (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import numpy as np
+import pytest
+import soundfile as sf
+from lhotse import CutSet, Fbank, FbankConfig, Recording, RecordingSet
+
+from icefall.feature_extraction import compute_and_store_features, read_progress
+
+
+def get_cuts(tmp_path, num_cuts):
+    rng = np.random.default_rng(0)
+    recordings = []
+    for i in range(num_cuts):
+        filename = tmp_path / f"{i}.wav"
+        samples = rng.standard_normal(8000 + 800 * i) * 0.1
+        sf.write(filename, samples.astype(np.float32), 8000)
+        recordings.append(Recording.from_file(filename))
+    return CutSet.from_manifests(
+        recordings=RecordingSet.from_recordings(recordings)
+    )
+
+
+@pytest.mark.parametrize("num_jobs", [1, 2])
+def test_compute_and_store_features(tmp_path, num_jobs):
+    cuts = get_cuts(tmp_path, num_cuts=5)
+    extractor = Fbank(FbankConfig(sampling_rate=8000, num_mel_bins=23))
+    kwargs = dict(
+        extractor=extractor,
+        storage_dir=tmp_path / "feats",
+        shard_size=2,
+        num_jobs=num_jobs,
+    )
+
+    ans = compute_and_store_features(
+        cuts, manifest_path=tmp_path / "cuts.jsonl.gz", **kwargs
+    )
+    assert list(ans.ids) == list(cuts.ids)
+    assert len(list(tmp_path.glob("**/.tmp-*"))) == 0
+    for cut in ans:
+        assert cut.load_features().shape == (cut.num_frames, 23)
+
+    progress_path = tmp_path / "feats" / "progress.jsonl"
+    assert len(read_progress(progress_path)) == 3
+
+    expected = ans[cuts[4].id].load_features()
+
+    # Simulate a crash while processing the last shard: its manifest is
+    # missing and the progress file ends with a partial line.
+    (tmp_path / "feats" / "cuts-00002.jsonl.gz").unlink()
+    with open(progress_path) as f:
+        lines = f.readlines()
+    mtimes = {
+        i: (tmp_path / "feats" / f"cuts-{i:05d}.jsonl.gz").stat().st_mtime_ns
+        for i in range(2)
+    }
+    with open(progress_path, "w") as f:
+        f.writelines(
+            line
+            for line in lines
+            if not json.loads(line)["manifest_path"].endswith("02.jsonl.gz")
+        )
+        f.write('{"manifest_path": "')
+
+    ans2 = compute_and_store_features(
+        cuts, manifest_path=tmp_path / "cuts2.jsonl.gz", **kwargs
+    )
+    assert list(ans2.ids) == list(cuts.ids)
+    np.testing.assert_array_equal(
+        ans2[cuts[4].id].load_features(), expected
+    )
+    # The finished shards are not computed again
+    for i, mtime in mtimes.items():
+        path = tmp_path / "feats" / f"cuts-{i:05d}.jsonl.gz"
+        assert path.stat().st_mtime_ns == mtime
+
+    # A shard whose input changed is computed again
+    ans3 = compute_and_store_features(
+        cuts.subset(first=3),
+        manifest_path=tmp_path / "cuts3.jsonl.gz",
+        **kwargs,
+    )
+    assert list(ans3.ids) == list(cuts.ids)[:3]
+    path = tmp_path / "feats" / "cuts-00000.jsonl.gz"
+    assert path.stat().st_mtime_ns == mtimes[0]
+    path = tmp_path / "feats" / "cuts-00001.jsonl.gz"
+    assert list(CutSet.from_file(path).ids) == [cuts[2].id]
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Copyright      2026                      (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from lhotse import CutSet, Features, MonoCut, NumpyFilesWriter
+from lhotse.features.io import get_reader
+
+from icefall.dataset.memmap_features import (
+    MemmapShardsWriter,
+    copy_features_to_memmap_shards,
+)
+
+
+def test_memmap_shards_writer(tmp_path):
+    rng = np.random.default_rng(0)
+    arrays = [
+        rng.standard_normal((n, 80)).astype(np.float32) * 10
+        for n in (5, 1000, 1, 300)
+    ]
+    with MemmapShardsWriter(tmp_path, shard_size=100000) as writer:
+        keys = [writer.write(f"a{i}", a) for i, a in enumerate(arrays)]
+
+    # The second array fills up the first shard
+    assert [k.split(":")[0] for k in keys] == [
+        "shard-00000.bin",
+        "shard-00000.bin",
+        "shard-00001.bin",
+        "shard-00001.bin",
+    ]
+    assert all(int(k.split(":")[1]) % 4096 == 0 for k in keys)
+
+    reader = get_reader(writer.name)(writer.storage_path)
+    for key, a in zip(keys, arrays):
+        b = reader.read(key)
+        assert b.dtype == np.float32
+        np.testing.assert_allclose(b, a, rtol=1e-3, atol=1e-2)
+        np.testing.assert_array_equal(
+            reader.read(key, left_offset_frames=1, right_offset_frames=3),
+            b[1:3],
+        )
+
+    with MemmapShardsWriter(tmp_path / "f32", dtype="float32") as writer:
+        key = writer.write("a", arrays[1])
+    reader = get_reader(writer.name)(writer.storage_path)
+    np.testing.assert_array_equal(reader.read(key), arrays[1])
+
+
+def test_copy_features_to_memmap_shards(tmp_path):
+    rng = np.random.default_rng(0)
+    writer = NumpyFilesWriter(tmp_path / "npy")
+    cuts = []
+    for i, num_frames in enumerate([300, 100, 200]):
+        key = writer.write(
+            f"cut-{i}", rng.standard_normal((num_frames, 80)).astype("f")
+        )
+        features = Features(
+            type="fbank",
+            num_frames=num_frames,
+            num_features=80,
+            frame_shift=0.01,
+            sampling_rate=16000,
+            start=0,
+            duration=num_frames * 0.01,
+            storage_type=writer.name,
+            storage_path=writer.storage_path,
+            storage_key=key,
+        )
+        cuts.append(
+            MonoCut(
+                id=f"cut-{i}",
+                start=0,
+                duration=num_frames * 0.01,
+                channel=0,
+                features=features,
+            )
+        )
+    # A part of cut-0, sharing its features
+    cuts.append(
+        MonoCut(
+            id="cut-3",
+            start=0.5,
+            duration=1.0,
+            channel=0,
+            features=cuts[0].features,
+        )
+    )
+    cuts = CutSet.from_cuts(cuts)
+
+    new_cuts = copy_features_to_memmap_shards(cuts, tmp_path / "memmap")
+    assert list(new_cuts.ids) == list(cuts.ids)
+
+    keys = set()
+    for cut, new_cut in zip(cuts, new_cuts):
+        assert new_cut.features.storage_type == "memmap_shards"
+        keys.add(new_cut.features.storage_key)
+        np.testing.assert_allclose(
+            new_cut.load_features(), cut.load_features(), atol=1e-2
+        )
+    assert len(keys) == 3
+
+    # Written in order of the durations of the cuts. The features of
+    # cut-0 are written when cut-3 is processed.
+    offsets = [
+        int(new_cuts[f"cut-{i}"].features.storage_key.split(":")[1])
+        for i in (1, 3, 2)
+    ]
+    assert offsets == sorted(offsets)
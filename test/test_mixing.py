@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# Copyright      2026                      (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from lhotse import CutSet
+from lhotse.dataset import SimpleCutSampler
+from lhotse.testing.dummies import DummyManifest
+
+from icefall.dataset.mixing import SourceTaggedDataset, WeightedMixingSampler
+
+
+def get_sampler(seed=0):
+    cuts_a = DummyManifest(CutSet, begin_id=0, end_id=100)
+    cuts_b = DummyManifest(CutSet, begin_id=100, end_id=200)
+    return WeightedMixingSampler(
+        samplers={
+            "a": SimpleCutSampler(cuts_a, max_cuts=2),
+            # "b" never ends
+            "b": SimpleCutSampler(cuts_b.repeat(), max_cuts=2),
+        },
+        weights={"a": 0.25, "b": 0.75},
+        seed=seed,
+    )
+
+
+def to_list(sampler):
+    return [(name, [c.id for c in cuts]) for name, cuts in sampler]
+
+
+def test_weighted_mixing_sampler():
+    sampler = get_sampler()
+    batches = to_list(sampler)
+
+    num_a = sum(name == "a" for name, _ in batches)
+    num_b = len(batches) - num_a
+    # "a" has 50 batches and the epoch ends when it is exhausted
+    assert num_a == 50
+    assert 100 < num_b < 200
+
+    ids_a = [i for name, ids in batches if name == "a" for i in ids]
+    assert ids_a == [f"dummy-mono-cut-{i:04d}" for i in range(100)]
+
+    # It is reproducible
+    assert to_list(get_sampler()) == batches
+    assert to_list(get_sampler(seed=1)) != batches
+
+    # Different epochs choose different sources
+    sampler.set_epoch(1)
+    assert [n for n, _ in to_list(sampler)] != [n for n, _ in batches]
+
+
+def test_weighted_mixing_sampler_resume():
+    sampler = get_sampler()
+    sampler.set_epoch(2)
+    expected = to_list(sampler)
+
+    sampler = get_sampler()
+    sampler.set_epoch(2)
+    it = iter(sampler)
+    for _ in range(30):
+        next(it)
+    state_dict = sampler.state_dict()
+    assert sum(state_dict["num_batches"].values()) == 30
+
+    sampler = get_sampler()
+    sampler.load_state_dict(state_dict)
+    sampler.set_epoch(2)
+    assert to_list(sampler) == expected[30:]
+
+
+def test_source_tagged_dataset():
+    class Dataset:
+        def __getitem__(self, cuts):
+            return {"num_cuts": len(cuts)}
+
+    dataset = SourceTaggedDataset(Dataset())
+    cuts = DummyManifest(CutSet, begin_id=0, end_id=3)
+    assert dataset[("a", cuts)] == {"num_cuts": 3, "source": "a"}
+    assert dataset[cuts] == {"num_cuts": 3}
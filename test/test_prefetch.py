@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Copyright      2026                      (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import pytest
+import torch
+
+from icefall.dataset.prefetch import DevicePrefetcher
+
+
+def make_batches(n: int):
+    return [
+        {
+            "inputs": torch.full((2, 3), float(i)),
+            "supervisions": {"num_frames": torch.tensor([3, 2]), "text": ["a"]},
+        }
+        for i in range(n)
+    ]
+
+
+class SlowLoader:
+    def __init__(self, batches, delay: float):
+        self.batches = batches
+        self.delay = delay
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        for b in self.batches:
+            time.sleep(self.delay)
+            yield b
+
+
+@pytest.mark.parametrize(
+    "device",
+    [None, "cpu"]
+    + (["cuda:0"] if torch.cuda.is_available() else []),
+)
+def test_prefetcher(device):
+    prefetcher = DevicePrefetcher(make_batches(5), device=device)
+    assert len(prefetcher) == 5
+    for epoch in range(2):
+        batches = list(prefetcher)
+        assert len(batches) == 5
+        assert prefetcher.num_batches == 5
+        for i, b in enumerate(batches):
+            if device is not None:
+                assert b["inputs"].device == torch.device(device)
+            assert b["inputs"].cpu().eq(i).all()
+            assert b["supervisions"]["text"] == ["a"]
+
+
+def test_prefetcher_timing():
+    prefetcher = DevicePrefetcher(SlowLoader(make_batches(4), delay=0.05))
+    for _ in prefetcher:
+        pass
+    assert prefetcher.epoch_start_latency >= 0.04
+    # It waits for each of the other 3 batches
+    assert prefetcher.data_wait_time >= 3 * 0.04
+
+    prefetcher = DevicePrefetcher(SlowLoader(make_batches(4), delay=0.05))
+    for _ in prefetcher:
+        # A step that is slower than the loader
+        time.sleep(0.1)
+    assert prefetcher.data_wait_time < 0.1
+
+
+def test_prefetcher_early_exit():
+    num_threads = threading.active_count()
+    prefetcher = DevicePrefetcher(make_batches(10), num_prefetch=1)
+    for i, _ in enumerate(prefetcher):
+        if i == 2:
+            break
+    assert threading.active_count() == num_threads
+
+
+def test_prefetcher_exception():
+    def loader():
+        yield make_batches(1)[0]
+        raise ValueError("bad batch")
+
+    prefetcher = DevicePrefetcher(loader())
+    with pytest.raises(ValueError, match="bad batch"):
+        for _ in prefetcher:
+            pass
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Copyright      2026                      (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+import torch
+
+from icefall.rel_pos_emb import RelPosEmbCache, compute_rel_pos_emb
+
+
+def test_compute_rel_pos_emb():
+    pe = compute_rel_pos_emb(length=5, d_model=4)
+    assert pe.shape == (1, 9, 4)
+    for p in range(-4, 5):
+        # The encoding of the relative position p is at index 4 - p
+        expected = torch.tensor(
+            [
+                math.sin(p),
+                math.cos(p),
+                math.sin(p * 0.01),
+                math.cos(p * 0.01),
+            ]
+        )
+        assert torch.allclose(pe[0, 4 - p], expected, atol=1e-6)
+
+
+def test_rel_pos_emb_cache():
+    cache = RelPosEmbCache()
+    device = torch.device("cpu")
+
+    pe = cache.get(length=10, d_model=8, device=device, dtype=torch.float32)
+    assert pe.shape == (1, 19, 8)
+
+    # Shorter inputs reuse the table
+    assert cache.get(3, 8, device, torch.float32) is pe
+
+    # The table grows to at least twice its length
+    pe = cache.get(11, 8, device, torch.float32)
+    assert pe.shape == (1, 39, 8)
+    assert cache.get(20, 8, device, torch.float32) is pe
+    assert torch.equal(pe, compute_rel_pos_emb(20, 8))
+
+    # Each dtype has its own table, and switching back and forth
+    # reuses them
+    pe_half = cache.get(20, 8, device, torch.float16)
+    assert pe_half.dtype == torch.float16
+    assert pe_half.shape == (1, 39, 8)
+    assert cache.get(20, 8, device, torch.float32) is pe
+    assert cache.get(20, 8, device, torch.float16) is pe_half
+
+    assert cache.get(20, 4, device, torch.float32).shape == (1, 39, 4)
+
+    cache.clear()
+    assert cache.get(20, 8, device, torch.float32) is not pe
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Copyright      2026                      (authors: agent)
+#
+# See ../../LICENSE for clarification regarding multiple authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+import sentencepiece as spm
+
+from icefall.dataset.token_ids import (
+    TokenIdTable,
+    TokenizedDataset,
+    bpe_model_checksum,
+    get_token_ids,
+)
+
+TEXTS = [
+    "HELLO WORLD",
+    "THE QUICK BROWN FOX",
+    "JUMPS OVER THE LAZY DOG",
+    "HELLO THE WORLD",
+    "",
+]
+
+
+@pytest.fixture
+def bpe_model(tmp_path):
+    transcript = tmp_path / "transcript.txt"
+    transcript.write_text("\n".join(TEXTS * 10))
+    spm.SentencePieceTrainer.train(
+        input=str(transcript),
+        model_prefix=str(tmp_path / "bpe"),
+        model_type="bpe",
+        vocab_size=30,
+        character_coverage=1.0,
+    )
+    return tmp_path / "bpe.model"
+
+
+class _Dataset:
+    def __getitem__(self, texts):
+        return {"supervisions": {"text": list(texts)}}
+
+
+def _encode(bpe_model, texts):
+    sp = spm.SentencePieceProcessor()
+    sp.load(str(bpe_model))
+    return sp.encode(texts, out_type=int)
+
+
+def test_token_id_table(bpe_model, tmp_path):
+    sp = spm.SentencePieceProcessor()
+    sp.load(str(bpe_model))
+    checksum = bpe_model_checksum(bpe_model)
+
+    table = TokenIdTable.build(TEXTS + TEXTS, sp=sp, checksum=checksum)
+    assert len(table) == len(TEXTS)
+
+    filename = tmp_path / "token_ids.npz"
+    table.save(filename)
+    loaded = TokenIdTable.load(filename)
+    assert loaded.checksum == checksum
+    assert loaded.texts == TEXTS
+    for text, expected in zip(TEXTS, sp.encode(TEXTS, out_type=int)):
+        assert loaded.get(text).tolist() == expected
+    assert loaded.get("NOT IN TABLE") is None
+
+
+@pytest.mark.parametrize("use_table", [True, False])
+def test_tokenized_dataset(bpe_model, tmp_path, use_table):
+    token_ids = None
+    if use_table:
+        token_ids = tmp_path / "token_ids.npz"
+        sp = spm.SentencePieceProcessor()
+        sp.load(str(bpe_model))
+        TokenIdTable.build(
+            TEXTS[:2], sp=sp, checksum=bpe_model_checksum(bpe_model)
+        ).save(token_ids)
+
+    dataset = TokenizedDataset(
+        _Dataset(), bpe_model=bpe_model, token_ids=token_ids
+    )
+    assert (dataset.table is not None) == use_table
+
+    texts = TEXTS[::-1]
+    supervisions = dataset[texts]["supervisions"]
+    expected = _encode(bpe_model, texts)
+
+    row_splits = supervisions["token_ids"]["row_splits"].tolist()
+    values = supervisions["token_ids"]["values"].tolist()
+    assert row_splits[-1] == len(values)
+    assert [
+        values[b:e] for b, e in zip(row_splits[:-1], row_splits[1:])
+    ] == expected
+
+    y = get_token_ids(supervisions)
+    assert y.tolist() == expected
+
+
+def test_tokenized_dataset_stale_table(bpe_model, tmp_path):
+    token_ids = tmp_path / "token_ids.npz"
+    TokenIdTable(
+        ["HELLO WORLD"],
+        row_splits=np.array([0, 1]),
+        values=np.array([0], dtype=np.int32),
+        checksum="stale",
+    ).save(token_ids)
+
+    dataset = TokenizedDataset(
+        _Dataset(), bpe_model=bpe_model, token_ids=token_ids
+    )
+    assert dataset.table is None
+    supervisions = dataset[["HELLO WORLD"]]["supervisions"]
+    assert supervisions["token_ids"]["values"].tolist() == _encode(
+        bpe_model, ["HELLO WORLD"]
+    )[0]
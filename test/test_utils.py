@@ -23,11 +23,13 @@ import torch
 from icefall.env import get_env_info
 from icefall.utils import (
     AttributeDict,
+    MetricsTracker,
     add_eos,
     add_sos,
     encode_supervisions,
     get_texts,
     make_pad_mask,
+    subsequent_chunk_mask,
 )
 
 
@@ -149,6 +151,32 @@ def test_makd_pad_mask():
     assert (~expected).sum() == lengths.sum()
 
 
+def test_subsequent_chunk_mask():
+    mask = subsequent_chunk_mask(size=5, chunk_size=2)
+    expected = torch.tensor(
+        [
+            [True, True, False, False, False],
+            [True, True, False, False, False],
+            [True, True, True, True, False],
+            [True, True, True, True, False],
+            [True, True, True, True, True],
+        ]
+    )
+    assert torch.all(torch.eq(mask, expected))
+
+    mask = subsequent_chunk_mask(size=5, chunk_size=2, num_left_chunks=0)
+    expected = torch.tensor(
+        [
+            [True, True, False, False, False],
+            [True, True, False, False, False],
+            [False, False, True, True, False],
+            [False, False, True, True, False],
+            [False, False, False, False, True],
+        ]
+    )
+    assert torch.all(torch.eq(mask, expected))
+
+
 def test_add_sos():
     sos_id = 100
     ragged = k2.RaggedTensor([[1, 2], [3], [0]])
@@ -165,3 +193,29 @@ def test_add_eos():
         [[1, 2, eos_id], [3, eos_id], [eos_id], [5, 8, 9, eos_id]]
     )
     assert str(ragged_eos) == str(expected)
+
+
+def test_metrics_tracker():
+    def get_info(i, to_tensor):
+        info = MetricsTracker()
+        info["frames"] = 100 + i
+        info["loss"] = 2.5 * i + 1
+        info["utterances"] = 3
+        if to_tensor:
+            info["frames"] = torch.tensor(info["frames"])
+            info["loss"] = torch.tensor(info["loss"])
+        return info
+
+    expected = MetricsTracker()
+    tot = MetricsTracker()
+    for i in range(5):
+        expected = expected * 0.5 + get_info(i, to_tensor=False)
+        tot = tot * 0.5 + get_info(i, to_tensor=True)
+
+    assert isinstance(tot["loss"], torch.Tensor)
+    assert str(tot) == str(expected)
+    assert tot.norm_items() == pytest.approx(expected.norm_items())
+
+    tot.sync()
+    assert all(isinstance(v, float) for v in tot.values())
+    assert dict(tot) == pytest.approx(dict(expected))